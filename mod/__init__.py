@@ -1,3 +1,11 @@
+import os as _os
+import sys as _sys
+if _os.path.basename(getattr(_sys, 'argv', [''])[0]) in ['m', 'c']:
+    # the cli front end runs the call in the daemon when one is running (m daemon start)
+    from .core.cli.client import forward as _forward
+    _code = _forward()
+    if _code is not None:
+        _sys.exit(_code)
 from .core.mod import Mod
 _mod = Mod()
 for _fn in dir(_mod):
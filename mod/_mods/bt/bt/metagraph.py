@@ -0,0 +1,283 @@
+import os
+import glob
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# the per neuron fields of MetagraphInfo and their column dtype ('rao' for Balance lists)
+COLUMNS = {
+    'hotkeys': 'U48',
+    'coldkeys': 'U48',
+    'active': 'bool',
+    'validator_permit': 'bool',
+    'last_update': 'int64',
+    'block_at_registration': 'int64',
+    'pruning_score': 'float64',
+    'rank': 'float64',
+    'trust': 'float64',
+    'consensus': 'float64',
+    'incentives': 'float64',
+    'dividends': 'float64',
+    'emission': 'rao',
+    'alpha_stake': 'rao',
+    'tao_stake': 'rao',
+    'total_stake': 'rao',
+}
+WEIGHTS = ('weights_indptr', 'weights_indices', 'weights_data')
+
+
+def to_column(values: Iterable[Any], dtype: str) -> np.ndarray:
+    values = list(values)
+    if dtype == 'rao':
+        # balances are kept in rao, exact in uint64
+        return np.array([int(getattr(v, 'rao', v) or 0) for v in values], dtype='uint64')
+    return np.array(values, dtype=dtype)
+
+
+def weights_to_csr(weights: Iterable[Tuple[int, List[Tuple[int, int]]]], n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The (indptr, indices, data) CSR arrays of the weights of a subnet, rows are the uids that set the weights
+    """
+    rows = dict(weights)
+    counts = np.zeros(n + 1, dtype='int64')
+    for uid, row in rows.items():
+        if uid < n:
+            counts[uid + 1] = len(row or [])
+    indptr = np.cumsum(counts)
+    indices = np.zeros(indptr[-1], dtype='uint16')
+    data = np.zeros(indptr[-1], dtype='uint16')
+    for uid, row in rows.items():
+        if uid < n and row:
+            start = indptr[uid]
+            indices[start:start + len(row)] = [dest for dest, _ in row]
+            data[start:start + len(row)] = [weight for _, weight in row]
+    return indptr, indices, data
+
+
+class MetagraphSnapshot:
+    """
+    The metagraph of a subnet at a block as NumPy columns (one row per uid) and the weights as CSR arrays.
+
+    Analysis over stakes, weights and incentives works on whole columns instead of lists of neuron objects,
+    the object views (neurons, weights) are built from the columns on demand.
+    """
+
+    def __init__(self, netuid: int, block: int = None, columns: Dict[str, np.ndarray] = None,
+                 weights: Tuple[np.ndarray, np.ndarray, np.ndarray] = None):
+        self.netuid = netuid
+        self.block = block
+        self.columns = columns or {name: to_column([], dtype) for name, dtype in COLUMNS.items()}
+        n = len(self)
+        self.weights_indptr, self.weights_indices, self.weights_data = weights or weights_to_csr([], n)
+
+    def __len__(self):
+        return len(self.columns['hotkeys'])
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        columns = self.__dict__.get('columns') or {}
+        if name in columns:
+            return columns[name]
+        raise AttributeError(name)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MetagraphSnapshot) and self.netuid == other.netuid and self.block == other.block \
+            and all(np.array_equal(a, b) for a, b in zip(self.arrays().values(), other.arrays().values())) \
+            and self.arrays().keys() == other.arrays().keys()
+
+    @property
+    def uids(self) -> np.ndarray:
+        return np.arange(len(self), dtype='uint16')
+
+    @classmethod
+    def from_info(cls, info: Any, weights: Iterable[Tuple[int, list]] = None, block: int = None) -> 'MetagraphSnapshot':
+        """
+        The snapshot of a MetagraphInfo (or its dict) and the weights of the subnet (Subtensor.weights)
+        """
+        get = (lambda k: info.get(k)) if isinstance(info, dict) else (lambda k: getattr(info, k, None))
+        n = len(get('hotkeys') or [])
+        columns = {name: to_column(get(name) if get(name) is not None else [0] * n, dtype) for name, dtype in COLUMNS.items()}
+        return cls(get('netuid'), block if block is not None else get('block'), columns, weights_to_csr(weights or [], n))
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        arrays = dict(self.columns)
+        arrays.update(zip(WEIGHTS, (self.weights_indptr, self.weights_indices, self.weights_data)))
+        return arrays
+
+    def row_weights(self, uid: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The (dest uids, raw weights) set by the uid
+        """
+        start, end = self.weights_indptr[uid], self.weights_indptr[uid + 1]
+        return self.weights_indices[start:end], self.weights_data[start:end]
+
+    def weights_matrix(self, normalize: bool = True) -> np.ndarray:
+        """
+        The dense n x n weights, rows normalized to sum to 1 (the raw u16 weights otherwise)
+        """
+        n = len(self)
+        matrix = np.zeros((n, n), dtype='float32')
+        rows = np.repeat(np.arange(n), np.diff(self.weights_indptr))
+        matrix[rows, self.weights_indices] = self.weights_data
+        if normalize:
+            sums = matrix.sum(axis=1, keepdims=True)
+            matrix = np.divide(matrix, sums, out=np.zeros_like(matrix), where=sums > 0)
+        return matrix
+
+    def weights(self) -> List[Tuple[int, List[Tuple[int, int]]]]:
+        """
+        The weights in the format of Subtensor.weights
+        """
+        result = []
+        for uid in range(len(self)):
+            dests, values = self.row_weights(uid)
+            if len(dests):
+                result.append((uid, [(int(d), int(v)) for d, v in zip(dests, values)]))
+        return result
+
+    def neurons(self) -> List[Dict[str, Any]]:
+        """
+        A dict per neuron (balances in rao)
+        """
+        names = list(self.columns)
+        rows = zip(*[self.columns[name].tolist() for name in names])
+        return [dict(zip(names, row), uid=uid) for uid, row in enumerate(rows)]
+
+    def diff(self, other: 'MetagraphSnapshot') -> Dict[str, np.ndarray]:
+        """
+        The changes from other (an older snapshot) to this one, as arrays: the uids whose row changed in a
+        column with their new values, and the rows of the weights that changed
+        """
+        n = len(self)
+        m = min(n, len(other))
+        changes = {'n': np.array([n]), 'block': np.array([-1 if self.block is None else self.block])}
+        for name, column in self.columns.items():
+            changed = np.flatnonzero(column[:m] != other.columns[name][:m])
+            uids = np.concatenate([changed, np.arange(m, n)]).astype('uint16')
+            if len(uids):
+                changes[f'{name}.uids'] = uids
+                changes[f'{name}.values'] = column[uids]
+        # the weight rows that changed, re-sent whole
+        rows = [uid for uid in range(n) if uid >= m or not all(
+            np.array_equal(a, b) for a, b in zip(self.row_weights(uid), other.row_weights(uid)))]
+        if rows:
+            changes['weights.uids'] = np.array(rows, dtype='uint16')
+            changes['weights.counts'] = np.array([len(self.row_weights(uid)[0]) for uid in rows], dtype='int64')
+            changes['weights.indices'] = np.concatenate([self.row_weights(uid)[0] for uid in rows])
+            changes['weights.data'] = np.concatenate([self.row_weights(uid)[1] for uid in rows])
+        return changes
+
+    def apply(self, changes: Dict[str, np.ndarray]) -> 'MetagraphSnapshot':
+        """
+        The snapshot with the changes of diff applied
+        """
+        n = int(changes['n'][0])
+        block = int(changes['block'][0])
+        columns = {}
+        for name, column in self.columns.items():
+            column = np.resize(column, n) if n != len(column) else column.copy()
+            if f'{name}.uids' in changes:
+                column[changes[f'{name}.uids']] = changes[f'{name}.values']
+            columns[name] = column
+        rows = {uid: self.row_weights(uid) for uid in range(min(n, len(self)))}
+        if 'weights.uids' in changes:
+            offsets = np.concatenate([[0], np.cumsum(changes['weights.counts'])])
+            for i, uid in enumerate(changes['weights.uids'].tolist()):
+                start, end = offsets[i], offsets[i + 1]
+                rows[uid] = (changes['weights.indices'][start:end], changes['weights.data'][start:end])
+        counts = np.zeros(n + 1, dtype='int64')
+        for uid, (dests, _) in rows.items():
+            counts[uid + 1] = len(dests)
+        indptr = np.cumsum(counts)
+        indices = np.concatenate([rows[uid][0] for uid in sorted(rows)] or [np.zeros(0)]).astype('uint16')
+        data = np.concatenate([rows[uid][1] for uid in sorted(rows)] or [np.zeros(0)]).astype('uint16')
+        return MetagraphSnapshot(self.netuid, None if block < 0 else block, columns, (indptr, indices, data))
+
+    def save(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, netuid=np.array([self.netuid]), block=np.array([-1 if self.block is None else self.block]), **self.arrays())
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> 'MetagraphSnapshot':
+        with np.load(path, allow_pickle=False) as data:
+            block = int(data['block'][0])
+            columns = {name: data[name] for name in COLUMNS}
+            weights = tuple(data[name] for name in WEIGHTS)
+            return cls(int(data['netuid'][0]), None if block < 0 else block, columns, weights)
+
+
+class MetagraphStore:
+    """
+    The snapshots of the subnets persisted per block.
+
+    A subnet keeps a full snapshot every `keyframe` blocks and only the diff with the previous snapshot for the
+    blocks in between, so following a subnet block by block stores what changed instead of the whole metagraph.
+    """
+
+    def __init__(self, path: str, keyframe: int = 100):
+        self.path = os.path.expanduser(path)
+        self.keyframe = keyframe
+        self.cache: Dict[int, MetagraphSnapshot] = {}  # netuid -> latest snapshot
+
+    def subnet_path(self, netuid: int) -> str:
+        return os.path.join(self.path, str(netuid))
+
+    def blocks(self, netuid: int) -> List[int]:
+        paths = glob.glob(os.path.join(self.subnet_path(netuid), '*.npz'))
+        return sorted(int(os.path.basename(p).split('.')[0]) for p in paths)
+
+    def file(self, netuid: int, block: int, diff: bool) -> str:
+        return os.path.join(self.subnet_path(netuid), f'{block}.diff.npz' if diff else f'{block}.npz')
+
+    def save(self, snapshot: MetagraphSnapshot) -> str:
+        previous = self.latest(snapshot.netuid)
+        if previous is not None and previous.block is not None and previous.block < snapshot.block:
+            base = self.keyframe_block(snapshot.netuid, previous.block)
+            if base is not None and snapshot.block - base < self.keyframe:
+                path = self.file(snapshot.netuid, snapshot.block, diff=True)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    np.savez_compressed(f, **snapshot.diff(previous))
+                self.cache[snapshot.netuid] = snapshot
+                return path
+        path = snapshot.save(self.file(snapshot.netuid, snapshot.block, diff=False))
+        self.cache[snapshot.netuid] = snapshot
+        return path
+
+    def keyframe_block(self, netuid: int, block: int) -> Optional[int]:
+        keyframes = [b for b in self.blocks(netuid) if b <= block and os.path.exists(self.file(netuid, b, diff=False))]
+        return keyframes[-1] if keyframes else None
+
+    def load(self, netuid: int, block: int = None) -> Optional[MetagraphSnapshot]:
+        """
+        The snapshot of the subnet at the block (the latest one by default): the keyframe before it with the
+        diffs of the blocks in between applied
+        """
+        blocks = self.blocks(netuid)
+        if block is None:
+            if not blocks:
+                return None
+            block = blocks[-1]
+        if block not in blocks:
+            return None
+        cached = self.cache.get(netuid)
+        if cached is not None and cached.block == block:
+            return cached
+        base = self.keyframe_block(netuid, block)
+        if base is None:
+            return None
+        snapshot = MetagraphSnapshot.load(self.file(netuid, base, diff=False))
+        for b in blocks:
+            if base < b <= block:
+                with np.load(self.file(netuid, b, diff=True), allow_pickle=False) as data:
+                    snapshot = snapshot.apply(dict(data))
+        return snapshot
+
+    def latest(self, netuid: int) -> Optional[MetagraphSnapshot]:
+        if netuid not in self.cache:
+            snapshot = self.load(netuid)
+            if snapshot is None:
+                return None
+            self.cache[netuid] = snapshot
+        return self.cache[netuid]
@@ -89,6 +89,7 @@ from bittensor.utils.balance import (
 from bittensor.utils.btlogging import logging
 from bittensor.utils.delegates_details import DelegatesDetails
 from bittensor.utils.weight_utils import generate_weight_hash
+from .metagraph import MetagraphSnapshot, MetagraphStore
 
 if TYPE_CHECKING:
     from bittensor_wallet import Wallet
@@ -143,6 +144,7 @@ class Subtensor(SubtensorMixin):
             logging.info(
                 f"Connected to {self.network} network and {self.chain_endpoint}."
             )
+        self.metagraph_store = MetagraphStore(f"~/.bittensor/metagraphs/{self.network}")
 
     def __enter__(self):
         return self
@@ -1065,6 +1067,67 @@ class Subtensor(SubtensorMixin):
         )
         return MetagraphInfo.list_from_dicts(query.value)
 
+    def metagraph_snapshot(
+        self, netuid: int, block: Optional[int] = None, weights: bool = True, save: bool = True
+    ) -> Optional[MetagraphSnapshot]:
+        """
+        Retrieves the metagraph of a subnet as NumPy columns (uids, hotkeys, stakes, trust, incentives, ...) with
+            the weights as CSR arrays. Snapshots are persisted per block, a block that was already fetched is loaded
+            from disk.
+
+        Arguments:
+            netuid: The NetUID of the subnet.
+            block: the block number of the snapshot, the current block by default.
+            weights: Whether to fetch the weights of the subnet.
+            save: Whether to persist the snapshot.
+
+        Returns:
+            MetagraphSnapshot, or None if the subnet does not exist.
+        """
+        block = block if block is not None else self.get_current_block()
+        snapshot = self.metagraph_store.load(netuid, block)
+        if snapshot is not None:
+            return snapshot
+        info = self.get_metagraph_info(netuid, block=block)
+        if info is None:
+            return None
+        snapshot = MetagraphSnapshot.from_info(
+            info, weights=self.weights(netuid, block=block) if weights else None, block=block
+        )
+        if save:
+            self.metagraph_store.save(snapshot)
+        return snapshot
+
+    def metagraph_snapshots(
+        self, block: Optional[int] = None, weights: bool = True, save: bool = True
+    ) -> dict[int, MetagraphSnapshot]:
+        """
+        Retrieves the metagraph snapshots of all subnets at a block with one runtime call (plus one weights map
+            per subnet).
+
+        Arguments:
+            block: the block number of the snapshots, the current block by default.
+            weights: Whether to fetch the weights of the subnets.
+            save: Whether to persist the snapshots.
+
+        Returns:
+            dict of netuid -> MetagraphSnapshot
+        """
+        block = block if block is not None else self.get_current_block()
+        snapshots = {}
+        for info in self.get_all_metagraphs_info(block=block):
+            snapshot = self.metagraph_store.load(info.netuid, block)
+            if snapshot is None:
+                snapshot = MetagraphSnapshot.from_info(
+                    info,
+                    weights=self.weights(info.netuid, block=block) if weights else None,
+                    block=block,
+                )
+                if save:
+                    self.metagraph_store.save(snapshot)
+            snapshots[info.netuid] = snapshot
+        return snapshots
+
     def get_netuids_for_hotkey(
         self, hotkey_ss58: str, block: Optional[int] = None
     ) -> list[int]:
@@ -91,5 +91,58 @@ class TestBittensor(unittest.TestCase):
         # Assert result is correct
         self.assertTrue(result)
 
+class TestMetagraphSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        import json
+        import tempfile
+        with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'metagraph.json')) as f:
+            self.blocks = json.load(f)
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.path)
+
+    def snapshot(self, i):
+        from metagraph import MetagraphSnapshot
+        block = self.blocks[i]
+        return MetagraphSnapshot.from_info(block['info'], weights=[tuple(w) for w in block['weights']])
+
+    def test_columns(self):
+        block = self.blocks[0]
+        snapshot = self.snapshot(0)
+        self.assertEqual(len(snapshot), len(block['info']['hotkeys']))
+        self.assertEqual(snapshot.hotkeys.tolist(), block['info']['hotkeys'])
+        self.assertEqual(snapshot.total_stake.tolist(), block['info']['total_stake'])
+        self.assertEqual(snapshot.uids.tolist(), list(range(len(snapshot))))
+        # the CSR weights give back the weights of Subtensor.weights
+        self.assertEqual(snapshot.weights(), [(uid, [tuple(w) for w in row]) for uid, row in block['weights']])
+        matrix = snapshot.weights_matrix()
+        self.assertAlmostEqual(float(matrix[0].sum()), 1.0, places=5)
+        self.assertEqual(float(matrix[-1].sum()), 0.0)
+
+    def test_save_load(self):
+        from metagraph import MetagraphSnapshot
+        snapshot = self.snapshot(0)
+        path = snapshot.save(os.path.join(self.path, 'snapshot.npz'))
+        self.assertEqual(MetagraphSnapshot.load(path), snapshot)
+
+    def test_diff(self):
+        from metagraph import MetagraphStore
+        snapshots = [self.snapshot(i) for i in range(len(self.blocks))]
+        for old, new in zip(snapshots, snapshots[1:]):
+            self.assertEqual(old.apply(new.diff(old)), new)
+
+        # one full snapshot and then the diffs of the next blocks
+        store = MetagraphStore(self.path, keyframe=100)
+        paths = [store.save(snapshot) for snapshot in snapshots]
+        self.assertEqual([p.endswith('.diff.npz') for p in paths], [False, True, True])
+        self.assertLess(os.path.getsize(paths[1]), os.path.getsize(paths[0]) / 4)
+        store = MetagraphStore(self.path, keyframe=100)
+        for snapshot in snapshots:
+            self.assertEqual(store.load(snapshot.netuid, snapshot.block), snapshot)
+        self.assertEqual(store.latest(snapshots[-1].netuid), snapshots[-1])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
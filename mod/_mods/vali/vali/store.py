@@ -0,0 +1,200 @@
+import os
+import json
+import glob
+import sqlite3
+import threading
+import time
+from typing import *
+
+class ResultStore:
+    """
+    epoch partitioned results of the vali, stored in a single sqlite file
+    the per module aggregates (latest score, moving average) are updated on insert
+    so reading the scoreboard does not need to scan the history
+    """
+
+    columns = ['epoch', 'key', 'name', 'url', 'cid', 'score', 'duration', 'time']
+    aggregate_columns = ['key', 'name', 'url', 'cid', 'score', 'ema', 'count', 'duration', 'time', 'epoch']
+
+    def __init__(self,
+                 path:str,
+                 alpha:float = 0.3, # the weight of the newest score in the moving average
+                 max_epochs:int = 100, # the number of epochs to keep (None keeps all)
+                 migrate:bool = True, # migrate the legacy json results in the directory
+                 ):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.dirpath = os.path.dirname(self.path)
+        os.makedirs(self.dirpath, exist_ok=True)
+        self.alpha = alpha
+        self.max_epochs = max_epochs
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.create_tables()
+        self.epoch = self.last_epoch() + 1
+        if migrate:
+            self.migrate()
+
+    def create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS results (
+                epoch INTEGER NOT NULL, key TEXT NOT NULL, name TEXT, url TEXT, cid TEXT,
+                score REAL, duration REAL, time REAL, data TEXT,
+                PRIMARY KEY (epoch, key))''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS results_key ON results (key, epoch)')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS aggregates (
+                key TEXT PRIMARY KEY, name TEXT, url TEXT, cid TEXT, score REAL,
+                ema REAL, count INTEGER, duration REAL, time REAL, epoch INTEGER)''')
+
+    def last_epoch(self) -> int:
+        row = self.conn.execute('SELECT MAX(epoch) FROM results').fetchone()
+        return -1 if row[0] is None else int(row[0])
+
+    def row(self, module:dict, epoch:int=None) -> tuple:
+        epoch = self.epoch if epoch is None else epoch
+        return (epoch, module['key'], module.get('name'), module.get('url'), module.get('cid'),
+                float(module.get('score', 0) or 0), module.get('duration'), module.get('time', time.time()),
+                json.dumps(module, default=str))
+
+    def add(self, module:Union[dict, List[dict]], epoch:int=None) -> int:
+        """
+        append the results of the modules to the epoch and update their aggregates
+        a result that is added again to its epoch replaces the previous one, the aggregate only changes
+        if the score changed and the epoch is the latest of the module (count stays, the ema swaps the score)
+        """
+        modules = module if isinstance(module, list) else [module]
+        rows = [self.row(m, epoch=epoch) for m in modules if isinstance(m, dict) and 'key' in m]
+        alpha = self.alpha
+        with self.lock, self.conn:
+            previous = self.previous_scores(rows)
+            new, changed = [], []
+            for r in rows:
+                old_score = previous.get((r[0], r[1]))
+                if (r[0], r[1]) not in previous:
+                    new.append((r[1], r[2], r[3], r[4], r[5], r[5], r[6], r[7], r[0], alpha, alpha))
+                elif old_score != r[5]:
+                    changed.append((r[2], r[3], r[4], r[5], r[5], alpha, r[5], old_score, r[6], r[7], r[1], r[0]))
+                previous[(r[0], r[1])] = r[5]
+            self.conn.executemany('INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?,?,?,?)', rows)
+            self.conn.executemany('''INSERT INTO aggregates VALUES (?,?,?,?,?,?,1,?,?,?)
+                ON CONFLICT(key) DO UPDATE SET
+                    name=excluded.name, url=excluded.url, cid=excluded.cid, score=excluded.score,
+                    ema=? * excluded.score + (1 - ?) * aggregates.ema, count=aggregates.count + 1,
+                    duration=excluded.duration, time=excluded.time, epoch=excluded.epoch
+                WHERE excluded.time >= aggregates.time''', new)
+            self.conn.executemany('''UPDATE aggregates SET
+                    name=?, url=?, cid=?, score=?, ema=CASE WHEN count = 1 THEN ? ELSE ema + ? * (? - ?) END,
+                    duration=?, time=?
+                WHERE key = ? AND epoch = ?''', changed)
+        return len(rows)
+
+    def previous_scores(self, rows:List[tuple], chunk:int=500) -> Dict[tuple, float]:
+        """
+        the (epoch, key) -> score of the results that are already stored for the rows
+        """
+        previous = {}
+        keys = [(r[0], r[1]) for r in rows]
+        for i in range(0, len(keys), chunk):
+            batch = keys[i:i + chunk]
+            query = 'SELECT epoch, key, score FROM results WHERE ' + ' OR '.join(['(epoch = ? AND key = ?)'] * len(batch))
+            for e, k, score in self.conn.execute(query, [v for ek in batch for v in ek]):
+                previous[(e, k)] = score
+        return previous
+
+    put = add
+
+    def next_epoch(self) -> int:
+        """
+        close the current epoch and apply the retention policy
+        """
+        self.epoch += 1
+        self.prune()
+        return self.epoch
+
+    def prune(self, max_epochs:int=None) -> int:
+        """
+        remove the epochs that are older than max_epochs
+        """
+        max_epochs = max_epochs or self.max_epochs
+        if max_epochs is None:
+            return 0
+        min_epoch = self.epoch - max_epochs
+        with self.lock, self.conn:
+            cursor = self.conn.execute('DELETE FROM results WHERE epoch < ?', (min_epoch,))
+            self.conn.execute('DELETE FROM aggregates WHERE epoch < ?', (min_epoch,))
+        return cursor.rowcount
+
+    def scores(self, max_age:float=None, min_score:float=None, ema:bool=False) -> List[dict]:
+        """
+        the latest (or moving average) score per module
+        """
+        query = f'SELECT {", ".join(self.aggregate_columns)} FROM aggregates WHERE 1=1'
+        params = []
+        if max_age is not None:
+            query += ' AND time >= ?'
+            params.append(time.time() - max_age)
+        if min_score is not None:
+            query += f' AND {"ema" if ema else "score"} > ?'
+            params.append(min_score)
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        return [dict(zip(self.aggregate_columns, r)) for r in rows]
+
+    def history(self, key:str=None, epochs:int=None, data:bool=False) -> List[dict]:
+        """
+        the raw results per epoch, optionally for a single module
+        """
+        columns = self.columns + (['data'] if data else [])
+        query = f'SELECT {", ".join(columns)} FROM results WHERE 1=1'
+        params = []
+        if key is not None:
+            query += ' AND key = ?'
+            params.append(key)
+        if epochs is not None:
+            query += ' AND epoch > ?'
+            params.append(self.epoch - epochs - 1)
+        with self.lock:
+            rows = self.conn.execute(query + ' ORDER BY epoch', params).fetchall()
+        results = [dict(zip(columns, r)) for r in rows]
+        if data:
+            for r in results:
+                r['data'] = json.loads(r['data'])
+        return results
+
+    def migrate(self, path:str=None, rm:bool=True) -> int:
+        """
+        import the legacy per module json results in the directory (rm removes the imported files)
+        """
+        path = path or self.dirpath
+        modules, imported = [], []
+        for p in glob.glob(os.path.join(path, '*.json')):
+            try:
+                with open(p) as f:
+                    module = json.load(f)
+            except Exception:
+                continue
+            if isinstance(module, dict) and 'data' in module and 'timestamp' in module:
+                module = module['data']
+            if isinstance(module, dict) and 'key' in module:
+                modules.append(module)
+                imported.append(p)
+        modules = sorted(modules, key=lambda m: m.get('time', 0))
+        n = self.add(modules)
+        if n > 0:
+            self.epoch = self.last_epoch() + 1
+        if rm:
+            # only the files that were imported, the others are left as they are
+            for p in imported:
+                os.remove(p)
+        return n
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM results')
+            self.conn.execute('DELETE FROM aggregates')
+        self.epoch = 0
+        return {'success': True, 'msg': 'Results cleared', 'path': self.path}
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM aggregates').fetchone()[0]
@@ -0,0 +1,111 @@
+import os
+import json
+import tempfile
+import mod as c
+from ..store import ResultStore
+
+class Test:
+
+    def store(self, **kwargs) -> ResultStore:
+        return ResultStore(tempfile.mkdtemp() + '/results.sqlite', **kwargs)
+
+    def test_ema(self, alpha=0.5):
+        store = self.store(alpha=alpha)
+        for epoch, score in enumerate([1.0, 0.0, 0.5]):
+            store.add({'key': 'a', 'score': score, 'time': epoch}, epoch=epoch)
+        a = store.scores()[0]
+        assert a['count'] == 3 and a['score'] == 0.5 and a['epoch'] == 2, a
+        assert abs(a['ema'] - 0.5) < 1e-9, a # 0.5 * 0.5 + 0.5 * (0.5 * 0 + 0.5 * 1)
+        assert [r['score'] for r in store.history(key='a')] == [1.0, 0.0, 0.5]
+        return {'success': True, 'ema': a['ema']}
+
+    def test_readd(self, alpha=0.5):
+        store = self.store(alpha=alpha)
+        store.add({'key': 'a', 'score': 1.0, 'time': 0}, epoch=0)
+        # the same result again changes nothing
+        store.add({'key': 'a', 'score': 1.0, 'time': 1}, epoch=0)
+        store.add([{'key': 'a', 'score': 1.0, 'time': 2}] * 3, epoch=0)
+        a = store.scores()[0]
+        assert a['count'] == 1 and a['ema'] == 1.0, a
+        # a changed score of the only epoch replaces it
+        store.add({'key': 'a', 'score': 0.0, 'time': 3}, epoch=0)
+        a = store.scores()[0]
+        assert a['count'] == 1 and a['ema'] == 0.0 and a['score'] == 0.0, a
+        # a changed score of the latest epoch swaps its weight in the ema
+        store.add({'key': 'a', 'score': 1.0, 'time': 4}, epoch=1)
+        store.add({'key': 'a', 'score': 1.0, 'time': 5}, epoch=1)
+        store.add({'key': 'a', 'score': 0.5, 'time': 6}, epoch=1)
+        a = store.scores()[0]
+        assert a['count'] == 2 and a['score'] == 0.5 and abs(a['ema'] - 0.25) < 1e-9, a
+        assert len(store.history(key='a')) == 2
+        return {'success': True}
+
+    def test_prune(self, max_epochs=3, epochs=10):
+        store = self.store(max_epochs=max_epochs)
+        for _ in range(epochs):
+            store.add([{'key': 'a', 'score': 1.0}, {'key': 'b', 'score': 0.5}])
+            store.next_epoch()
+        # b stops scoring, its aggregate goes once its last epoch is out of the window
+        for _ in range(max_epochs + 1):
+            store.add({'key': 'a', 'score': 1.0})
+            store.next_epoch()
+        epochs = sorted(set(r['epoch'] for r in store.history()))
+        assert len(epochs) == max_epochs and epochs[0] == store.epoch - max_epochs, epochs
+        assert [s['key'] for s in store.scores()] == ['a']
+        return {'success': True, 'epochs': epochs}
+
+    def test_migrate(self, n=4):
+        folder = tempfile.mkdtemp()
+        for i in range(n):
+            module = {'key': f'key{i}', 'name': f'mod{i}', 'score': i / n, 'time': i}
+            # the legacy results are stored either as they are or wrapped with a timestamp
+            with open(f'{folder}/mod{i}.json', 'w') as f:
+                json.dump({'data': module, 'timestamp': i} if i % 2 else module, f)
+        with open(folder + '/other.json', 'w') as f:
+            json.dump({'not': 'a result'}, f)
+        store = ResultStore(folder + '/results.sqlite')
+        assert len(store) == n and store.epoch == 1, len(store)
+        assert sorted(s['name'] for s in store.scores()) == [f'mod{i}' for i in range(n)]
+        # only the imported files are removed
+        assert sorted(os.listdir(folder))[0] == 'other.json' and not any(f.startswith('mod') for f in os.listdir(folder))
+        # and a restart continues after the stored epochs
+        assert ResultStore(folder + '/results.sqlite').epoch == 1
+        return {'success': True}
+
+    def test_network_diff(self):
+        from ..vali import Vali
+        key = c.get_key('test')
+        def registered(name, url, cid):
+            return {'id': name, 'name': f'{key.key_address}/{name}', 'url': url, 'data': cid, 'owner': key.key_address}
+        class FakeNet:
+            mod_index = None # a chain, the registry has the key and cid of the modules
+            mods_ = [registered('a', 'url_a', 'cid_a'), registered('b', 'url_b', 'cid_b')]
+            def mods(self, search=None):
+                return self.mods_
+        fetched = []
+        def get_info(url):
+            fetched.append(url)
+            mod = next(m for m in FakeNet.mods_ if m['url'] == url)
+            state = vali.registry_state(mod)
+            return {**state, 'info_time': c.time()}
+        vali = Vali.__new__(Vali)
+        vali.net, vali.search, vali.key, vali.url2module, vali.pending = FakeNet(), None, key, {}, {}
+        vali.get_info = get_info
+        vali.refresh_network()
+        vali.sync_network()
+        assert sorted(fetched) == ['url_a', 'url_b'] and len(vali.mods) == 2, fetched
+        assert vali.network_state()['url_a'] == {'name': 'a', 'url': 'url_a', 'key': key.key_address, 'cid': 'cid_a'}
+        # the next epoch: a is updated to a new cid, b is unchanged, c is new
+        fetched.clear()
+        FakeNet.mods_ = [registered('a', 'url_a', 'cid_a2'), FakeNet.mods_[1], registered('c', 'url_c', 'cid_c')]
+        stats = vali.refresh_network()
+        assert stats['carried'] == 1 and stats['pending'] == 2, stats
+        vali.sync_network()
+        assert sorted(fetched) == ['url_a', 'url_c'], fetched
+        assert vali.url2module['url_a']['cid'] == 'cid_a2' and len(vali.mods) == 3
+        # and a module that leaves the network is dropped without a call
+        fetched.clear()
+        FakeNet.mods_ = FakeNet.mods_[1:]
+        stats = vali.refresh_network()
+        assert fetched == [] and stats['removed'] == 1 and sorted(vali.url2module) == ['url_b', 'url_c'], stats
+        return {'success': True}
@@ -5,6 +5,7 @@ from typing import *
 import inspect
 from copy import deepcopy
 import mod as c
+from .store import ResultStore
 print = c.print
 
 class Vali:
@@ -48,29 +49,117 @@ class Vali:
 
     def set_network(self, 
                     network:Optional[str] = None, 
-                    tempo:int= 10, 
+                    tempo:int= None, 
                     search:str=None, 
                     path:str=None, 
                     subnet=None,
-                    update = True) -> str:
+                    update = False, # refetch the info of every module instead of carrying it forward
+                    wait = True, # wait for the info of the new modules (otherwise call sync_network)
+                    ) -> str:
         if not hasattr(self, 'network'):
             self.network = 'local'
-        self.network = network or self.network
-        if '/' in self.network:
-            self.subnet = self.network.split('/')[0]
-            self.network = self.network.split('/')[1]
+        network = network or self.network
+        if '/' in network:
+            self.subnet = network.split('/')[0]
+            network = network.split('/')[1]
         else:
-            self.subnet = subnet or 0
-
-        self.tempo = tempo
+            self.subnet = subnet or getattr(self, 'subnet', 0)
+        if network != getattr(self, 'net_name', None):
+            # a new network does not share any state with the previous one
+            self.net = c.mod(network)() 
+            self.net_name = network
+            self.url2module = {}
+            self.pending = {}
+        self.network = network
+        self.tempo = tempo or getattr(self, 'tempo', 10)
         self.storage_path = self.get_path(self.network + '/' + self.network)
+        if getattr(self, 'store', None) is None or self.store.dirpath != self.storage_path:
+            self.store = ResultStore(self.storage_path + '/results.sqlite')
         self.search = search or self.search
-        self.net = c.mod(self.network)() 
-        self.mods = [m for m in c.wait([ c.submit(c.call, {'fn': url}, timeout=10) for url in self.net.urls()]) if 'error' not in m]
+        self.refresh_network(update=update)
+        if wait:
+            self.sync_network()
+        return self.network
+
+    def network_state(self) -> Dict[str, dict]:
+        """
+        the url -> {url, name, key, cid} of the modules in the network, without calling them
+        (the key and cid come from the module registry of a chain, a namespace only has the name)
+        """
+        if hasattr(self.net, 'mod_index'):
+            state = [self.registry_state(mod) for mod in self.net.mods(search=self.search)]
+        elif hasattr(self.net, 'namespace'):
+            state = [{'name': k, 'url': v} for k,v in self.net.namespace(search=self.search).items()]
+        else:
+            state = [{'url': url} for url in self.net.urls()]
+        return {s['url']: s for s in state if s.get('url')}
+
+    def registry_state(self, mod:dict) -> dict:
+        """
+        the state of a registered module, its name is either key/name or name/key and its data is the cid
+        """
+        key, name = None, mod['name']
+        if '/' in name:
+            a, b = name.split('/', 1)
+            key, name = (a, b) if self.key.valid_ss58_address(a) else (b, a)
+        return {'name': name, 'url': mod.get('url'), 'key': key, 'cid': mod.get('data') or None}
+
+    def module_changed(self, module:dict, state:dict, max_age:int=None) -> bool:
+        """
+        whether the info of the module needs to be fetched again
+        """
+        for k in ['key', 'cid', 'name']:
+            if state.get(k) is not None and module.get(k) != state[k]:
+                return True
+        max_age = max_age or self.info_max_age
+        return c.time() - module.get('info_time', 0) > max_age
+
+    info_max_age = 3600 # refetch the info of unchanged modules after this many seconds
+
+    def refresh_network(self, update=False) -> dict:
+        """
+        diff the network against the previous epoch, carry forward the unchanged modules
+        and submit the info calls for the new or changed ones (collected in sync_network)
+        """
+        state = self.network_state()
+        url2module = {}
+        for url, s in state.items():
+            module = self.url2module.get(url)
+            if module is not None and not update and not self.module_changed(module, s):
+                url2module[url] = module
+            elif url not in self.pending:
+                self.pending[url] = c.submit(self.get_info, {'url': url}, timeout=10)
+        self.pending = {url: f for url, f in self.pending.items() if url in state}
+        removed = set(self.url2module) - set(state)
+        self.set_mods(url2module)
+        return {'carried': len(url2module), 'pending': len(self.pending), 'removed': len(removed)}
+
+    def get_info(self, url:str) -> dict:
+        info = c.call(fn=url)
+        if isinstance(info, dict):
+            info['url'] = info.get('url', url)
+            info['info_time'] = c.time()
+        return info
+
+    def sync_network(self, timeout=10) -> List[dict]:
+        """
+        wait for the pending info calls and return the modules they added
+        """
+        if len(self.pending) == 0:
+            return []
+        urls = list(self.pending.keys())
+        infos = c.wait([self.pending[url] for url in urls], timeout=timeout)
+        self.pending = {}
+        new_mods = {url: info for url, info in zip(urls, infos) if isinstance(info, dict) and 'error' not in info}
+        self.set_mods({**self.url2module, **new_mods})
+        return list(new_mods.values())
+
+    def set_mods(self, url2module:Dict[str, dict]):
+        self.url2module = url2module
+        self.mods = list(url2module.values())
         self.key2module = {m['key']: m for m in self.mods if 'key' in m}
         self.name2module = {m['name']: m for m in self.mods if 'name' in m}
-        self.url2module = {m['url']: m for m in self.mods if 'url' in m}
-        return self.network
+        return self.mods
 
     def get_path(self, path):
         return os.path.expanduser(f'~/.commune/vali/{path}')
@@ -105,31 +194,19 @@ class Vali:
         module['proof'] = self.auth.headers(proof_data, key=self.key)
         proof = module.get('proof', None)
         assert self.auth.verify(proof), f'Invalid Proof {proof}'
-        path = self.get_module_path(module['key'])
-        c.put_json(path, module)
+        self.store.add(module)
         return module
 
-    def get_module_path(self, module:str):
-        return self.storage_path + '/' + module + '.json'
-
     def epoch(self, search=None, result_features=['score',  'name', 'cid'], key=None, debug=False, df=True, **kwargs):
-        self.set_network(search=search, **kwargs)
-        n = len(self.mods)
         if key:
             self.set_key(key)
-        batches = [self.mods[i:i+self.batch_size] for i in range(0, n, self.batch_size)]
-        num_batches = len(batches)
-        results = []
-        for i, batch in enumerate(batches):
-            futures = []
-            print(f'Starting batch {i+1}/{num_batches} with {len(batch)} modules...')
-            names = []
-            for m in batch:
-                future = c.submit(self.forward, {"module": m} , timeout=self.timeout)
-                futures.append(future)
-            results.extend(c.wait(futures, timeout=self.timeout))
+        # score the modules carried forward while the info of the new ones is fetched
+        self.set_network(search=search, wait=False, **kwargs)
+        results = self.score_mods(self.mods)
+        results += self.score_mods(self.sync_network())
         self.epochs += 1
         self.epoch_time = c.time()
+        self.store.next_epoch()
         self.vote(results)
         if debug: 
             results =  [r for r in results if 'error' in r]
@@ -139,23 +216,36 @@ class Vali:
             return c.df(results)[result_features]
         return results
 
+    def score_mods(self, mods:List[dict]) -> List[dict]:
+        n = len(mods)
+        batches = [mods[i:i+self.batch_size] for i in range(0, n, self.batch_size)]
+        num_batches = len(batches)
+        results = []
+        for i, batch in enumerate(batches):
+            print(f'Starting batch {i+1}/{num_batches} with {len(batch)} modules...')
+            futures = [c.submit(self.forward, {"module": dict(m)} , timeout=self.timeout) for m in batch]
+            results.extend(c.wait(futures, timeout=self.timeout))
+        return results
+
     @property
     def vote_staleness(self):
         return c.time() - self.vote_time
 
-    def vote(self, results):
+    def vote(self, results=None):
         if not bool(hasattr(self.net, 'vote')) :
             return {'success': False, 'msg': f'NOT VOTING NETWORK({self.network})'}
         if self.vote_staleness < self.tempo:
             return {'success': False, 'msg': f'Vote is too soon {self.vote_staleness}'}
+        if results is None:
+            results = self.store.scores(min_score=0)
         if len(results) == 0:
             return {'success': False, 'msg': 'No results to vote on'}
         # get the top modules
         assert all('score' in r for r in results), f'No score in results {results}'
         assert all('key' in r for r in results), f'No key in results {results}'
         return self.net.vote(
-                    modules=[m['key'] for m in modules], 
-                    weights=[m['score'] for m in modules],  
+                    modules=[m['key'] for m in results], 
+                    weights=[m['score'] for m in results],  
                     key=self.key, 
                     subnet=self.subnet
                     )
@@ -168,19 +258,17 @@ class Vali:
                     page = None,
                     max_age = 10000,
                     update= False,
+                    ema = False, # use the moving average score instead of the latest score
                     **kwargs
                     ) -> Union[pd.DataFrame, List[dict]]:
         page_size = 1000
-        df = []
-        # chunk the jobs into batches
-        for path in c.ls(self.storage_path):
-            r = c.get(path, {},  max_age=max_age, update=update)
-            if isinstance(r, dict) and 'key' and  r.get('score', 0) > 0  :
-                df += [{k: r.get(k, None) for k in keys}]
-            else :
-                c.print(f'REMOVING({path})', color='red')
-                c.rm(path)
-        df = c.df(df) 
+        df = self.store.scores(max_age=max_age, min_score=0, ema=ema)
+        if ema:
+            for r in df:
+                r['score'] = r['ema']
+        df = c.df(df, columns=self.store.aggregate_columns)
+        df['age'] = c.time() - df['time']
+        df = df[[k for k in keys if k in df.columns]]
         if len(df) > 0:
             if isinstance(by, str):
                 by = [by]
@@ -189,7 +277,6 @@ class Vali:
             pages = len(df)//page_size
             page = page or 0
             df = df[page*page_size:(page+1)*page_size]
-        df['age'] = c.time() - df['time']
         if to_dict:
             return df.to_dict(orient='records')
         return df
@@ -200,9 +287,8 @@ class Vali:
         return  cls(network=network,**kwargs).epoch()
     
     def refresh_results(self):
-        path = self.storage_path
-        c.rm(path)
-        return {'success': True, 'msg': 'Leaderboard removed', 'path': path}
+        self.store.clear()
+        return {'success': True, 'msg': 'Leaderboard removed', 'path': self.store.path}
 
 
     def task(self,  mod,  fn='info', params={}) -> float:
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+from typing import *
+import mod as m
+
+class Bench:
+    """
+    Benchmarks of the mods (m bench <mod> [search], e.g. m bench key aes).
+
+    A mod declares bench_* functions (in its test mod or in the mod itself) that set up what they measure
+    and return the callable to time, or a (callable, teardown) tuple. Every callable is warmed up, calibrated
+    to run for at least min_time per repetition and timed over reps repetitions. The results are stored per
+    version of the repo (the git commit, plus the content hash of the mod if the tree is dirty) and compared
+    with an earlier version: a median slower by more than threshold is a regression.
+    The bench_* functions of this mod are the baseline suite of the core hot paths.
+    """
+
+    def __init__(self, path:str = '~/.mod/bench'):
+        self.path = os.path.expanduser(path)
+
+    def forward(self,
+                mod:str = 'bench',
+                search:Optional[str] = None,
+                warmup:int = 3,
+                reps:int = 10,
+                min_time:float = 0.05,
+                base:Optional[str] = None,
+                threshold:float = 0.2,
+                save:bool = True,
+                gate:bool = False,
+                verbose:bool = True) -> dict:
+        """
+        Runs the benchmarks of the mod (the ones containing search), compares them with the base version
+        (the last other stored version by default) and stores them. gate raises if there is a regression.
+        """
+        fns = self.benches(mod, search=search)
+        assert len(fns) > 0, f'No bench_* functions in {mod}'
+        results = {}
+        for name, fn in fns.items():
+            try:
+                results[name] = self.run(fn, warmup=warmup, reps=reps, min_time=min_time)
+            except Exception as e:
+                results[name] = m.detailed_error(e)
+            if verbose:
+                r = results[name]
+                if 'median' in r:
+                    m.print(f'Bench({mod}/{name} median={self.format_time(r["median"])} stdev={self.format_time(r["stdev"])} ops/s={r["ops"]:.1f} n={r["number"]}x{r["reps"]})', color='green')
+                else:
+                    m.print(f'BenchError({mod}/{name} {r.get("error")})', color='red')
+        version = self.version(mod)
+        run = {'mod': mod, **version, 'time': time.time(),
+               'params': {'warmup': warmup, 'reps': reps, 'min_time': min_time}, 'results': results}
+        base_run = self.get_run(mod, base) if base else self.last_run(mod, exclude=version['version'])
+        report = self.compare(run, base_run, threshold=threshold)
+        if save:
+            self.save(run)
+        if verbose and report['regressions']:
+            m.print(f'Regressions({mod} vs {report["base"]}): {report["regressions"]}', color='red')
+        assert not (gate and report['regressions']), f'Bench regressions in {mod} vs {report["base"]}: {report["regressions"]}'
+        return {'success': not report['regressions'], **run, 'compare': report}
+
+    def benches(self, mod:str = 'bench', search:Optional[str] = None) -> Dict[str, Callable]:
+        """
+        The bench_* functions of the test mod of the mod, or of the mod itself
+        """
+        names = [mod]
+        if mod != 'bench' and m.mod_exists(mod + '.test'):
+            names.insert(0, mod + '.test')
+        for name in names:
+            obj = m.mod(name)()
+            fns = {fn: getattr(obj, fn) for fn in dir(obj) if fn.startswith('bench_') and callable(getattr(obj, fn))}
+            if fns:
+                return {k: v for k, v in sorted(fns.items()) if search is None or search in k}
+        return {}
+
+    def run(self, bench_fn:Callable, warmup:int = 3, reps:int = 10, min_time:float = 0.05) -> dict:
+        """
+        The stats of the time per call of the callable returned by bench_fn
+        """
+        fn = bench_fn()
+        teardown = None
+        if isinstance(fn, tuple):
+            fn, teardown = fn
+        assert callable(fn), f'{bench_fn.__name__} should return the callable to time, not {type(fn)}'
+        try:
+            for _ in range(warmup):
+                fn()
+            # calibrate the calls per repetition from one call
+            t0 = time.perf_counter()
+            fn()
+            number = max(1, min(int(min_time / max(time.perf_counter() - t0, 1e-9)), 10**6))
+            times = []
+            for _ in range(reps):
+                t0 = time.perf_counter()
+                for _ in range(number):
+                    fn()
+                times.append((time.perf_counter() - t0) / number)
+        finally:
+            if teardown is not None:
+                teardown()
+        return {**self.stats(times), 'number': number, 'reps': reps}
+
+    def stats(self, times:List[float]) -> dict:
+        times = sorted(times)
+        median = statistics.median(times)
+        return {'mean': statistics.mean(times),
+                'median': median,
+                'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+                'min': times[0],
+                'max': times[-1],
+                'p90': times[min(len(times) - 1, int(len(times) * 0.9))],
+                'ops': 1 / median if median > 0 else float('inf')}
+
+    def format_time(self, t:float) -> str:
+        for unit, scale in [('s', 1), ('ms', 1e-3), ('us', 1e-6)]:
+            if t >= scale:
+                return f'{t / scale:.3f}{unit}'
+        return f'{t / 1e-9:.1f}ns'
+
+    # ---- VERSIONS ----
+
+    def version(self, mod:str) -> dict:
+        """
+        The version the results are stored under: the commit of the repo, with the hash of the uncommitted
+        changes if there are any (the content hash of the mod outside of git)
+        """
+        import hashlib
+        cid = m.mod('tester')().mod_hash(mod)
+        try:
+            git = lambda *args: subprocess.run(['git', *args], cwd=m.lib_path, capture_output=True, timeout=30).stdout
+            commit = git('rev-parse', '--short', 'HEAD').decode().strip()
+            diff = git('diff', 'HEAD') if commit else b''
+        except (OSError, subprocess.SubprocessError):
+            commit, diff = '', b''
+        if not commit:
+            version = cid[:12]
+        else:
+            version = f'{commit}+{hashlib.sha256(diff).hexdigest()[:12]}' if diff else commit
+        return {'version': version, 'commit': commit or None, 'cid': cid}
+
+    def mod_path(self, mod:str) -> str:
+        return os.path.join(self.path, mod)
+
+    def save(self, run:dict) -> str:
+        """
+        Stores the run under its version, merged with the benchmarks of an earlier run of the version that it did not run
+        """
+        path = os.path.join(self.mod_path(run['mod']), run['version'] + '.json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            with open(path) as f:
+                run = {**run, 'results': {**json.load(f)['results'], **run['results']}}
+        with open(path, 'w') as f:
+            json.dump(run, f, default=str)
+        return path
+
+    def runs(self, mod:str = 'bench') -> List[dict]:
+        """
+        The stored runs of the mod, oldest first
+        """
+        path = self.mod_path(mod)
+        runs = []
+        for filename in os.listdir(path) if os.path.isdir(path) else []:
+            if filename.endswith('.json'):
+                with open(os.path.join(path, filename)) as f:
+                    runs.append(json.load(f))
+        return sorted(runs, key=lambda r: r['time'])
+
+    def versions(self, mod:str = 'bench') -> List[str]:
+        return [r['version'] for r in self.runs(mod)]
+
+    def get_run(self, mod:str, version:str) -> Optional[dict]:
+        """
+        The stored run of the version (a commit, a version or a prefix of either)
+        """
+        for run in reversed(self.runs(mod)):
+            if run['version'].startswith(version) or (run.get('commit') or '').startswith(version):
+                return run
+        return None
+
+    def last_run(self, mod:str, exclude:Optional[str] = None) -> Optional[dict]:
+        runs = [r for r in self.runs(mod) if r['version'] != exclude]
+        return runs[-1] if runs else None
+
+    def compare(self, run:dict, base:Optional[dict], threshold:float = 0.2) -> dict:
+        """
+        The change of the median of every benchmark of run against base, those slower by more than threshold are regressions
+        """
+        report = {'base': base['version'] if base else None, 'threshold': threshold, 'changes': {}, 'regressions': []}
+        if base is None:
+            return report
+        for name, result in run['results'].items():
+            base_result = base['results'].get(name, {})
+            if 'median' not in result or 'median' not in base_result:
+                continue
+            change = result['median'] / base_result['median'] - 1
+            report['changes'][name] = {'base': base_result['median'], 'current': result['median'], 'change': change}
+            if change > threshold:
+                report['regressions'].append(name)
+        return report
+
+    # ---- BASELINE SUITE ----
+
+    def bench_mod(self, mod:str = 'key'):
+        """
+        m.mod resolution of a mod that is not cached yet
+        """
+        def fn():
+            m._mod_cache.pop(mod, None)
+            return m.mod(mod)
+        return fn
+
+    def bench_serialize(self):
+        serializer = m.mod('serializer')()
+        data = {'fn': 'info', 'params': {'a': 1, 'b': [1.5, 'x', None], 'c': {'d': True}}, 'bytes': b'\x00' * 64, 'text': 'fam' * 100}
+        return lambda: serializer.serialize(data)
+
+    def bench_auth_verify(self):
+        auth = m.mod('auth')()
+        headers = auth.headers({'fn': 'info', 'params': {'a': 1}})
+        return lambda: auth.verify(headers)
+
+    def bench_store_put(self):
+        path = tempfile.mkdtemp()
+        store = m.mod('store')(path)
+        data = {'a': 1, 'b': list(range(100))}
+        return (lambda: store.put('bench/item', data)), (lambda: shutil.rmtree(path, ignore_errors=True))
+
+    def bench_store_get(self):
+        path = tempfile.mkdtemp()
+        store = m.mod('store')(path)
+        store.put('bench/item', {'a': 1, 'b': list(range(100))})
+        return (lambda: store.get('bench/item')), (lambda: shutil.rmtree(path, ignore_errors=True))
+
+    def bench_executor(self, n:int = 100):
+        """
+        n tasks through the executor, per batch
+        """
+        executor = m.mod('executor')(max_workers=8)
+        def fn():
+            futures = [executor.submit(fn=abs, params={'x': -i}) for i in range(n)]
+            return [f.result() for f in futures]
+        return fn
+
+    def bench_metrics(self):
+        """
+        The metrics the gate records for a request (the timers of its stages, the payload sizes and the in flight gauge)
+        """
+        metrics = m.mod('metrics')()
+        def fn():
+            with metrics.track('fn'):
+                for stage in ['auth', 'deserialize', 'execute', 'serialize']:
+                    with metrics.timer('fn', stage):
+                        pass
+                metrics.observe_size('fn', 'request', 100)
+                metrics.observe_size('fn', 'response', 100)
+        return fn
+
+    def bench_stream(self, n:int = 10000):
+        """
+        n tokens of a sync generator through the framed stream of the gate (worker thread, coalescing, encoding) and
+        the decoding of the client, per batch
+        """
+        import asyncio
+        stream = m.mod('stream')()
+        async def chunks():
+            return [chunk async for chunk in stream.body(f'token{i} ' for i in range(n))]
+        return lambda: list(stream.read(asyncio.run(chunks())))
+
+    def bench_client_server(self, mod:str = 'bench', timeout:float = 60):
+        """
+        A signed call from the client to a served mod (a server process that verifies it and answers through the gate)
+        """
+        import sys
+        port = m.free_port()
+        url = f'127.0.0.1:{port}'
+        cmd = f'import mod as m; m.mod("server")().serve({mod!r}, port={port}, remote=False, run_mode="uvicorn")'
+        process = subprocess.Popen([sys.executable, '-c', cmd], cwd=m.lib_path,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        client = m.mod('client')()
+        fn = lambda: client.call(f'{url}/info', stream=False)
+        t0 = time.time()
+        while True:
+            try:
+                fn()
+                break
+            except Exception:
+                if process.poll() is not None or time.time() - t0 > timeout:
+                    process.kill()
+                    raise Exception(f'the server of {mod} did not start: {process.communicate()[1][-2000:]}')
+                time.sleep(0.1)
+        def teardown():
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        return fn, teardown
@@ -0,0 +1,41 @@
+import time
+import json
+import shutil
+import tempfile
+import mod as m
+
+class Test:
+
+    def test_run(self):
+        bench = m.mod('bench')()
+        stats = bench.run(lambda: (lambda: time.sleep(0.001)), warmup=1, reps=5, min_time=0.01)
+        assert 0.001 <= stats['median'] < 0.01 and stats['reps'] == 5 and stats['number'] >= 1, stats
+        assert stats['min'] <= stats['median'] <= stats['max']
+        torn_down = []
+        bench.run(lambda: ((lambda: None), (lambda: torn_down.append(True))), warmup=1, reps=2)
+        assert torn_down == [True]
+        return {'success': True, **stats}
+
+    def test_compare(self):
+        folder = tempfile.mkdtemp()
+        bench = m.mod('bench')(folder)
+        run = bench.forward(mod='bench', search='serialize', reps=3, verbose=False)
+        assert 'median' in run['results']['bench_serialize'], run['results']
+        assert run['compare']['base'] is None
+        assert bench.get_run('bench', run['version'])['results'].keys() == run['results'].keys()
+        # an earlier version that was 10x faster makes this one a regression
+        base = {**run, 'version': 'base', 'commit': 'base', 'time': run['time'] - 1}
+        base['results'] = {'bench_serialize': {**run['results']['bench_serialize'], 'median': run['results']['bench_serialize']['median'] / 10}}
+        bench.save(base)
+        run = bench.forward(mod='bench', search='serialize', reps=3, base='base', save=False, verbose=False)
+        assert not run['success'] and run['compare']['regressions'] == ['bench_serialize'], run['compare']
+        try:
+            bench.forward(mod='bench', search='serialize', reps=3, base='base', gate=True, verbose=False)
+            raise AssertionError('the gate did not fail')
+        except AssertionError as e:
+            assert 'regressions' in str(e), e
+        # a generous threshold passes
+        assert bench.forward(mod='bench', search='serialize', reps=3, base='base', threshold=100, verbose=False)['success']
+        assert set(bench.versions('bench')) == {'base', run['version']}
+        shutil.rmtree(folder)
+        return {'success': True, 'compare': run['compare']}
@@ -11,6 +11,7 @@ from collections import defaultdict
 from typing import Any, Callable, Optional, Union, Mapping
 import pandas as pd
 import mod as m
+from .registry import ModRegistry
 
 Substrate = m.mod('chain.substrate')
 class ModChain(Substrate):
@@ -23,18 +24,25 @@ class ModChain(Substrate):
         mod_info['collateral'] = self.format_amount(mod_info.get('collateral', 0), fmt='j')
         return mod_info
 
-    cached_mods = None
+    _mod_index = None
+
+    def mod_index(self, update=False) -> ModRegistry:
+        """
+        The registry of the modules by id, name, owner and cid, refreshed with the entries of
+        the Modules snapshot that changed
+        """
+        if self._mod_index is None:
+            self._mod_index = ModRegistry(format=self.format_mod_info)
+        if update or self._mod_index.block_hash is None:
+            self._mod_index.refresh(self.query_snapshot('Modules', module='Modules', update=update))
+        return self._mod_index
 
     def mods(self, search=None, key=None, update=False):
-        if not update and self.cached_mods is not None:
-            mods = self.cached_mods
-        else:
-            mods =  list(self.storage(feature='Modules', module='Modules', update=update).values())
-            mods = [self.format_mod_info(mod) for mod in mods]
-            self.cached_mods = mods
+        index = self.mod_index(update=update)
         if key:
-            key_address = self.key_address(key)
-            mods = [mod for mod in mods if mod.get('owner') == key_address]
+            mods = index.owner_mods(self.key_address(key))
+        else:
+            mods = index.mods()
         if search:
             mods = [mod for mod in mods if search in mod['name']]
     
@@ -63,14 +71,9 @@ class ModChain(Substrate):
 
     def modid(self, name='api', key=None, update=False):
         key = self.key_address(key)
-        mods = self.mymods(key=key, update=update)
-        module_id = None
-        for mod in mods:
-            if mod['name'] == f'{key}/{name}' or mod['name'] == f'{name}/{key}':
-                module_id = mod['id']
-                break
-        assert module_id is not None, f"Module {name} not found for key {key}"
-        return module_id
+        mod = self.mod_index(update=update).get(key, name)
+        assert mod is not None, f"Module {name} not found for key {key}"
+        return mod['id']
 
     def update(self, name='api', take=0, key=None, update=False):
         modstruct = self.modstruct(name=name, key=key, update=update)
@@ -78,25 +81,20 @@ class ModChain(Substrate):
         return self.call( module="Modules", fn="update_module", params=modstruct, key=key)
 
     def key2mods(self, key=None, update=False):
-        key_address = self.key_address(key)
-        mods = self.mods(update=update)
-        key2mods = {}
-        for mod in mods:
-            mod_name = mod['name'].replace(f'{key_address}/', '').replace(f'/{key_address}', '')
-            key_address = mod['owner']
-            key2mods[key_address] = key2mods.get(key_address, []) + [mod]
-        return key2mods
+        return self.mod_index(update=update).key2mods()
         
     def exists(self, name='api', key=None, update=False):
         """
         whether the module exists
         """
         key_address = self.key_address(key)
-        mods = self.mymods(key=key_address, update=update)
-        for mod in mods:
-            if mod['name'] in [f'{key_address}/{name}' , f'{name}/{key_address}' ] :
-                return True
-        return False
+        return self.mod_index(update=update).get(key_address, name) is not None
+
+    def cid2mod(self, cid: str, update=False) -> Optional[dict]:
+        """
+        the module registered with the cid
+        """
+        return self.mod_index(update=update).cid2mod.get(cid)
 
     def key2address(self):
         return  m.key2address()
@@ -112,8 +110,6 @@ class ModChain(Substrate):
                 my_balances[key] = balances[addr]
         return my_balances
     
-    _registry = None
-
     def name2id(self, name:str, key=None, update=False) -> Optional[str]:
         """
         Get the module ID for a given module name.
@@ -124,8 +120,9 @@ class ModChain(Substrate):
         Returns:
             The module ID if found, otherwise None.
         """
-        registry = self.registry(key=key, update=update).get(key, {})
-        return registry
+        mod = self.mod_index(update=update).get(self.key_address(key), name)
+        return mod['id'] if mod is not None else None
+
     def registry(self, key=None, update=False, **kwargs) -> Dict[str, Dict[str, str]]:
         """
         Get the chain registry mapping keys and module names to chain IDs.
@@ -136,37 +133,22 @@ class ModChain(Substrate):
         Returns:
             A dictionary mapping keys to module names and their corresponding chain IDs.
         """
-
-        net = self.net()
-        result = {}
-        if self._registry is None or update:
-            mods = self.mods(update=update, **kwargs)
-            for mod in mods:
-                if '/' not in mod['name']:
-                    continue
-                key, name = mod['name'].split('/')
-                if not self.valid_ss58_address(key):
-                    name, key = mod['name'].split('/')
-                result[key] = result.get(key, {})
-                result[key][name] = self.get_chainid(mod)
-            self._registry = result
-        result = self._registry
+        key2names = self.mod_index(update=update).key2names
         if key is not None:
-            result = result.get(key, {})
-        return result
+            return {name: self.get_chainid(mod) for name, mod in key2names.get(key, {}).items()}
+        return {k: {name: self.get_chainid(mod) for name, mod in names.items()}
+                for k, names in key2names.items() if k is not None}
 
     def get_chainid(self, mod:dict) -> str:
         mod['chainid'] = mod["id"]
         return mod['chainid']
     def mymods(self, key=None, update=False):
         key = self.key_address(key)
-        mods = self.mods(key=key, update=update)
-        return mods
+        return self.mod_index(update=update).owner_mods(key)
 
     def mod(self, name='api', key=None, update=False):
         mod_id = self.modid(name=name, key=key, update=update)
-        mods = self.mods(update=update)
-        mod = mods[mod_id]
+        mod = self.mod_index().id2mod[mod_id]
         info = m.fn('api/mod')(name, key=key)
         info['id'] = mod_id
         info['collateral'] = mod.get('collateral', 0)
@@ -0,0 +1,92 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .substrate.substrate.ss58 import is_valid_ss58_address
+
+
+def split_name(name: str) -> Tuple[Optional[str], str]:
+    """
+    The (key, name) of a registered module name, which is either key/name or name/key
+    """
+    if '/' not in name:
+        return None, name
+    a, b = name.split('/', 1)
+    return (a, b) if is_valid_ss58_address(a) else (b, a)
+
+
+class ModRegistry:
+    """
+    The Modules storage map indexed by id, full name, key and name, owner and cid.
+
+    The registry follows the storage snapshot of the map: a refresh only re-indexes the entries
+    whose raw value changed since the last one, so a new block costs O(changes) and every
+    lookup is a dict access instead of a scan of all the modules.
+    """
+
+    def __init__(self, format: Callable[[dict], dict] = None):
+        self.format = format or (lambda mod: mod)
+        self.block_hash = None
+        self.entries: Dict[str, tuple] = {}  # raw key -> (raw value, mod)
+        self.id2mod: Dict[Any, dict] = {}
+        self.name2mod: Dict[str, dict] = {}
+        self.key2names: Dict[str, Dict[str, dict]] = {}  # key -> name -> mod
+        self.owner2mods: Dict[str, Dict[Any, dict]] = {}  # owner -> id -> mod
+        self.cid2mod: Dict[str, dict] = {}
+
+    def __len__(self):
+        return len(self.id2mod)
+
+    def add(self, mod: dict):
+        key, name = split_name(mod['name'])
+        self.id2mod[mod['id']] = mod
+        self.name2mod[mod['name']] = mod
+        self.key2names.setdefault(key, {})[name] = mod
+        self.owner2mods.setdefault(mod.get('owner'), {})[mod['id']] = mod
+        if mod.get('data'):
+            self.cid2mod[mod['data']] = mod
+
+    def remove(self, mod: dict):
+        key, name = split_name(mod['name'])
+        # another module may have taken the name or cid since, only drop the entries of this one
+        for index, k in [(self.id2mod, mod['id']), (self.name2mod, mod['name']), (self.key2names.get(key, {}), name),
+                         (self.owner2mods.get(mod.get('owner'), {}), mod['id']), (self.cid2mod, mod.get('data'))]:
+            if index.get(k) is mod:
+                del index[k]
+        for index, k in [(self.key2names, key), (self.owner2mods, mod.get('owner'))]:
+            if k in index and not index[k]:
+                del index[k]
+
+    def refresh(self, snapshot) -> int:
+        """
+        Brings the registry to the snapshot and returns the number of modules that were re-indexed
+        """
+        n = 0
+        for raw_key in [k for k in self.entries if k not in snapshot.entries]:
+            self.remove(self.entries.pop(raw_key)[1])
+            n += 1
+        for raw_key, (raw_value, decoded_key, value) in snapshot.entries.items():
+            if raw_key in self.entries:
+                if self.entries[raw_key][0] == raw_value:
+                    continue
+                self.remove(self.entries[raw_key][1])
+            mod = self.format(dict(value))
+            mod.setdefault('id', decoded_key)
+            self.entries[raw_key] = (raw_value, mod)
+            self.add(mod)
+            n += 1
+        self.block_hash = snapshot.block_hash
+        return n
+
+    def mods(self) -> List[dict]:
+        return list(self.id2mod.values())
+
+    def get(self, key: str, name: str) -> Optional[dict]:
+        """
+        The module registered as key/name or name/key
+        """
+        return self.key2names.get(key, {}).get(name)
+
+    def owner_mods(self, owner: str) -> List[dict]:
+        return list(self.owner2mods.get(owner, {}).values())
+
+    def key2mods(self) -> Dict[str, List[dict]]:
+        return {owner: list(mods.values()) for owner, mods in self.owner2mods.items()}
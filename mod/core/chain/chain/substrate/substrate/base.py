@@ -22,11 +22,13 @@ from hashlib import blake2b
 
 import json
 import logging
+import queue
+import time
 
 import requests
 from typing import Optional, Union, List
 
-from websocket import create_connection, WebSocketConnectionClosedException
+from websocket import create_connection, WebSocketConnectionClosedException, WebSocketTimeoutException
 
 from scalecodec.base import ScaleBytes, RuntimeConfigurationObject, ScaleType
 from scalecodec.types import GenericCall, GenericExtrinsic, Extrinsic, MultiAccountId, GenericRuntimeCallDefinition
@@ -36,6 +38,8 @@ from .extensions import Extension
 from .interfaces import ExtensionInterface
 
 from .storage import StorageKey
+from .caching import MetadataCache
+from .mux import Multiplexer
 
 from .exceptions import SubstrateRequestException, ConfigurationError, StorageFunctionNotFound, BlockNotFound, \
     ExtrinsicNotFound, ExtensionCallNotFound
@@ -88,9 +92,13 @@ def list_remove_iter(xs: list):
 
 class SubstrateInterface:
 
+    # type registries built by init_runtime, keyed by genesis hash, spec version and the type registry options and
+    # shared by the connections of the process, as building one for a large runtime takes a while
+    registry_cache = {}
+
     def __init__(self, url=None, websocket=None, ss58_format=None, type_registry=None, type_registry_preset=None,
                  cache_region=None, runtime_config=None, use_remote_preset=False, ws_options=None,
-                 auto_discover=True, auto_reconnect=True, config=None):
+                 auto_discover=True, auto_reconnect=True, config=None, metadata_cache=None, multiplex=False):
         """
         A specialized class in interfacing with a Substrate node.
 
@@ -104,6 +112,8 @@ class SubstrateInterface:
         use_remote_preset: When True preset is downloaded from GitHub master, otherwise use files from local installed scalecodec package
         ws_options: dict of options to pass to the websocket-client create_connection function
         config: dict of config flags to overwrite default configuration
+        metadata_cache: a MetadataCache (or the path of one) to persist the decoded metadata across processes
+        multiplex: share the websocket between threads, a reader thread dispatches the responses by request id
         """
 
         if (not url and not websocket) or (url and websocket):
@@ -126,6 +136,11 @@ class SubstrateInterface:
 
         self.cache_region = cache_region
 
+        if isinstance(metadata_cache, str):
+            metadata_cache = MetadataCache(metadata_cache)
+
+        self.metadata_cache = metadata_cache
+
         if ss58_format is not None:
             self.ss58_format = ss58_format
 
@@ -133,8 +148,13 @@ class SubstrateInterface:
         self.type_registry = type_registry
 
         self.request_id = 1
+        # the number and total seconds of the rpc requests answered on this connection (for pool health scores)
+        self.rpc_count = 0
+        self.rpc_time = 0.0
         self.url = url
         self.websocket = None
+        self.multiplex = multiplex
+        self.multiplexer = None
 
         # Websocket connection options
         self.ws_options = ws_options or {}
@@ -155,6 +175,8 @@ class SubstrateInterface:
 
         elif websocket:
             self.websocket = websocket
+            if self.multiplex:
+                self.multiplexer = Multiplexer(self.websocket)
 
         self.mock_extrinsics = None
         self.default_headers = {
@@ -167,10 +189,16 @@ class SubstrateInterface:
         self.runtime_version = None
         self.transaction_version = None
 
+        # Callable returning the latest spec version of the chain (e.g. RuntimeWatcher.spec_version), when set
+        # the runtime of the chain head is only re-initialised after a runtime upgrade
+        self.spec_version_source = None
+        self.runtime_head = False
+
         self.block_hash = None
         self.block_id = None
 
         self.__metadata_cache = {}
+        self.__genesis_hash = None
 
         self.config = {
             'use_remote_preset': use_remote_preset,
@@ -205,6 +233,8 @@ class SubstrateInterface:
                 self.url,
                 **self.ws_options
             )
+            if self.multiplex:
+                self.multiplexer = Multiplexer(self.websocket)
 
     def close(self):
         """
@@ -216,7 +246,11 @@ class SubstrateInterface:
         """
         if self.websocket:
             self.debug_message("Closing websocket connection")
-            self.websocket.close()
+            if self.multiplexer is not None:
+                # the reader thread owns recv, do not wait for the close frame of the node
+                self.websocket.close(timeout=0)
+            else:
+                self.websocket.close()
 
         self.extensions.unregister_all()
 
@@ -278,6 +312,7 @@ class SubstrateInterface:
 
         request_id = self.request_id
         self.request_id += 1
+        t0 = time.time()
 
         payload = {
             "jsonrpc": "2.0",
@@ -288,7 +323,13 @@ class SubstrateInterface:
 
         self.debug_message('RPC request #{}: "{}"'.format(request_id, method))
 
-        if self.websocket:
+        if self.multiplexer is not None:
+            # concurrent callers share the socket, a closed socket is not reconnected
+            if callable(result_handler):
+                return self.multiplexer.subscribe(method, params, result_handler, timeout=self.websocket.gettimeout())
+            json_body = self.multiplexer.request(method, params, timeout=self.websocket.gettimeout())
+
+        elif self.websocket:
             try:
                 self.websocket.send(json.dumps(payload))
             except WebSocketConnectionClosedException:
@@ -366,8 +407,19 @@ class SubstrateInterface:
             if 'error' in json_body:
                 raise SubstrateRequestException(json_body['error'])
 
+        if result_handler is None:
+            self.record_rpc(time.time() - t0)
         return json_body
 
+    def record_rpc(self, seconds: float, count: int = 1):
+        if self.multiplexer is not None:
+            with self.multiplexer.lock:
+                self.rpc_count += count
+                self.rpc_time += seconds
+        else:
+            self.rpc_count += count
+            self.rpc_time += seconds
+
     @property
     def name(self):
         if self.__name is None:
@@ -504,6 +556,18 @@ class SubstrateInterface:
         else:
             return response.get('result')
 
+    def get_genesis_hash(self) -> str:
+        """
+        The hash of block 0, retrieved once per connection
+
+        Returns
+        -------
+        str
+        """
+        if self.__genesis_hash is None:
+            self.__genesis_hash = self.get_block_hash(0)
+        return self.__genesis_hash
+
     def get_block_number(self, block_hash: str) -> int:
         """
         A convenience method to get the block number for given block_hash
@@ -649,7 +713,8 @@ class SubstrateInterface:
         block_hash. Also it applies all the versioned types at the time of the block_hash.
 
         Because parsing of metadata and type registry is quite heavy, the result will be cached per runtime id.
-        In the future there could be support for caching backends like Redis to make this cache more persistent.
+        When a `metadata_cache` is set the decoded metadata is also persisted on disk, keyed by genesis hash and
+        runtime id, so new processes don't have to download and decode it again.
 
         Parameters
         ----------
@@ -668,6 +733,16 @@ class SubstrateInterface:
         if (block_hash and block_hash == self.block_hash) or (block_id and block_id == self.block_id):
             return
 
+        # Check if the runtime of the chain head is loaded and no runtime upgrade happened since
+        if block_hash is None and block_id is None and self.runtime_head and self.spec_version_source is not None:
+            try:
+                if self.spec_version_source() == self.runtime_version:
+                    return
+            except Exception as e:
+                logger.debug(f'Spec version unavailable, re-initialising the runtime: {e}')
+
+        self.runtime_head = block_hash is None and block_id is None
+
         if block_id is not None:
             block_hash = self.get_block_hash(block_id)
 
@@ -710,31 +785,61 @@ class SubstrateInterface:
                 self.debug_message('Retrieved metadata for {} from Redis'.format(self.runtime_version))
                 self.__metadata_cache[self.runtime_version] = cached_metadata
 
+        if self.metadata_cache and self.runtime_version not in self.__metadata_cache:
+            # Try to retrieve metadata from disk
+            cached_metadata = self.metadata_cache.get(
+                self.get_genesis_hash(), self.runtime_version, runtime_config=self.runtime_config
+            )
+            if cached_metadata:
+                self.debug_message('Retrieved metadata for {} from disk'.format(self.runtime_version))
+                self.__metadata_cache[self.runtime_version] = cached_metadata
+
         if self.runtime_version in self.__metadata_cache:
             # Get metadata from cache
             self.debug_message('Retrieved metadata for {} from memory'.format(self.runtime_version))
             self.metadata = self.__metadata_cache[self.runtime_version]
         else:
-            self.metadata = self.get_block_metadata(block_hash=runtime_block_hash, decode=True)
+            response = self.get_block_metadata(block_hash=runtime_block_hash, decode=False)
+            self.metadata = self.runtime_config.create_scale_object(
+                'MetadataVersioned', data=ScaleBytes(response.get('result'))
+            )
+            self.metadata.decode()
             self.debug_message('Retrieved metadata for {} from Substrate node'.format(self.runtime_version))
 
             # Update metadata cache
             self.__metadata_cache[self.runtime_version] = self.metadata
 
+            if self.metadata_cache:
+                self.debug_message('Stored metadata for {} on disk'.format(self.runtime_version))
+                self.metadata_cache.put(
+                    self.get_genesis_hash(), self.runtime_version, self.metadata, raw=response.get('result')
+                )
+
             if self.cache_region:
                 self.debug_message('Stored metadata for {} in Redis'.format(self.runtime_version))
                 self.cache_region.set('METADATA_{}'.format(self.runtime_version), self.metadata)
 
         # Update type registry
-        self.reload_type_registry(
-            use_remote_preset=self.config.get('use_remote_preset'),
-            auto_discover=self.config.get('auto_discover')
+        registry_key = (
+            self.get_genesis_hash(), self.runtime_version, self.type_registry_preset,
+            json.dumps(self.type_registry, sort_keys=True, default=str) if self.type_registry else None,
+            self.config.get('use_remote_preset'), self.config.get('auto_discover')
         )
+        if registry_key in self.registry_cache:
+            self.debug_message('Retrieved type registry for {} from memory'.format(self.runtime_version))
+            self.set_registry(self.registry_cache[registry_key])
+        else:
+            self.reload_type_registry(
+                use_remote_preset=self.config.get('use_remote_preset'),
+                auto_discover=self.config.get('auto_discover')
+            )
+
+            # Check if PortableRegistry is present in metadata (V14+), otherwise fall back on legacy type registry (<V14)
+            if self.implements_scaleinfo():
+                self.debug_message('Add PortableRegistry from metadata to type registry')
+                self.runtime_config.add_portable_registry(self.metadata)
 
-        # Check if PortableRegistry is present in metadata (V14+), otherwise fall back on legacy type registry (<V14)
-        if self.implements_scaleinfo():
-            self.debug_message('Add PortableRegistry from metadata to type registry')
-            self.runtime_config.add_portable_registry(self.metadata)
+            self.registry_cache[registry_key] = self.get_registry()
 
         # Set active runtime version
         self.runtime_config.set_active_spec_version_id(self.runtime_version)
@@ -1860,6 +1965,125 @@ class SubstrateInterface:
 
         return result
 
+    def rpc_request_many(self, requests: List[tuple]) -> List[dict]:
+        """
+        Sends (method, params) requests back to back and returns the responses in request order. Responses with
+        an error are returned as is instead of raising, so one rejected request does not lose the others
+
+        Parameters
+        ----------
+        requests: list of (method, params)
+
+        Returns
+        -------
+        list of json-rpc responses
+        """
+        if not self.websocket:
+            responses = []
+            for method, params in requests:
+                try:
+                    responses.append(self.rpc_request(method, params))
+                except SubstrateRequestException as e:
+                    responses.append({'error': e.args[0] if e.args else str(e)})
+            return responses
+
+        t0 = time.time()
+        if self.multiplexer is not None:
+            responses = self.multiplexer.request_many(requests, timeout=self.websocket.gettimeout())
+            self.record_rpc(time.time() - t0)
+            return responses
+
+        request_ids = list(range(self.request_id, self.request_id + len(requests)))
+        self.request_id += len(requests)
+        for request_id, (method, params) in zip(request_ids, requests):
+            self.debug_message('RPC request #{}: "{}"'.format(request_id, method))
+            self.websocket.send(json.dumps({"jsonrpc": "2.0", "method": method, "params": params, "id": request_id}))
+
+        responses = {}
+        while len(responses) < len(request_ids):
+            for message, remove_message in list_remove_iter(self.__rpc_message_queue):
+                if message.get('id') in request_ids:
+                    remove_message()
+                    responses[message['id']] = message
+            if len(responses) < len(request_ids):
+                self.__rpc_message_queue.append(json.loads(self.websocket.recv()))
+        self.record_rpc(time.time() - t0)
+        return [responses[request_id] for request_id in request_ids]
+
+    def watch_extrinsics(self, subscriptions: dict, wait_for_finalization: bool = False, timeout: float = None) -> dict:
+        """
+        Follows several author_submitAndWatchExtrinsic subscriptions at once, until every extrinsic is included
+        (or finalized) or dropped by the pool
+
+        Parameters
+        ----------
+        subscriptions: dict of subscription id -> extrinsic hash
+        wait_for_finalization: wait for the finalized status instead of the inBlock status
+        timeout: seconds to wait for the statuses, the extrinsics that are still pending have status 'timeout'
+
+        Returns
+        -------
+        dict of subscription id -> {'extrinsic_hash', 'block_hash', 'finalized', 'status'}
+        """
+        done = {'finalized'} if wait_for_finalization else {'inblock', 'finalized'}
+        failed = {'invalid', 'dropped', 'usurped', 'finalitytimeout'}
+        statuses = {s: {'extrinsic_hash': h, 'block_hash': None, 'finalized': False, 'status': 'pending'}
+                    for s, h in subscriptions.items()}
+        pending = set(subscriptions)
+        deadline = time.time() + timeout if timeout is not None else None
+
+        def update(message):
+            subscription_id = (message.get('params') or {}).get('subscription')
+            if subscription_id not in pending:
+                return False
+            result = message['params']['result']
+            status, value = (next(iter(result.items())) if isinstance(result, dict) else (result, None))
+            status = status.lower()
+            if status in done:
+                statuses[subscription_id].update(block_hash=value, finalized=status == 'finalized', status=status)
+                pending.discard(subscription_id)
+            elif status in failed:
+                statuses[subscription_id]['status'] = status
+                pending.discard(subscription_id)
+            return True
+
+        if self.multiplexer is not None:
+            listener = self.multiplexer.listen(subscriptions)
+            try:
+                while pending:
+                    try:
+                        update(self.multiplexer.next(listener, None if deadline is None else max(deadline - time.time(), 0)))
+                    except queue.Empty:
+                        break
+            finally:
+                self.multiplexer.unlisten(subscriptions)
+        else:
+            socket_timeout = self.websocket.gettimeout()
+            try:
+                while pending:
+                    for message, remove_message in list_remove_iter(self.__rpc_message_queue):
+                        if update(message):
+                            remove_message()
+                    if not pending:
+                        break
+                    if deadline is not None:
+                        if time.time() >= deadline:
+                            break
+                        self.websocket.settimeout(deadline - time.time())
+                    try:
+                        self.__rpc_message_queue.append(json.loads(self.websocket.recv()))
+                    except WebSocketTimeoutException:
+                        break
+            finally:
+                self.websocket.settimeout(socket_timeout)
+
+        for subscription_id in pending:
+            statuses[subscription_id]['status'] = 'timeout'
+        # the node keeps following an extrinsic until it is finalized
+        self.rpc_request_many([('author_unwatchExtrinsic', [s]) for s, status in statuses.items()
+                               if status['status'] in ['inblock', 'timeout']])
+        return statuses
+
     def get_payment_info(self, call: GenericCall, keypair: Keypair):
         """
         Retrieves fee estimation via RPC for given extrinsic
@@ -2987,6 +3211,32 @@ class SubstrateInterface:
         except Exception:
             return False
 
+    def get_registry(self) -> dict:
+        """
+        Returns a copy of the state of the type registry of the runtime configuration, to restore with set_registry
+        """
+        return {
+            'type_registry': {k: v.copy() if isinstance(v, dict) else v for k, v in self.runtime_config.type_registry.items()},
+            'active_spec_version_id': self.runtime_config.active_spec_version_id,
+            'chain_id': self.runtime_config.chain_id,
+            'implements_scale_info': self.runtime_config.implements_scale_info,
+            'type_registry_preset': self.type_registry_preset
+        }
+
+    def set_registry(self, registry: dict):
+        """
+        Restores a type registry state returned by get_registry
+        """
+        self.runtime_config.type_registry = {
+            k: v.copy() if isinstance(v, dict) else v for k, v in registry['type_registry'].items()
+        }
+        # the registry is no longer the initial one, so a later reload_type_registry clears it
+        self.runtime_config.update_type_registry_types({})
+        self.runtime_config.active_spec_version_id = registry['active_spec_version_id']
+        self.runtime_config.chain_id = registry['chain_id']
+        self.runtime_config.implements_scale_info = registry['implements_scale_info']
+        self.type_registry_preset = registry['type_registry_preset']
+
     def reload_type_registry(self, use_remote_preset: bool = True, auto_discover: bool = True):
         """
         Reload type registry and preset used to instantiate the SubtrateInterface object. Useful to periodically apply
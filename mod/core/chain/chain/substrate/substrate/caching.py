@@ -14,7 +14,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gc
+import io
+import os
+import abc
+import sys
+import zlib
+import pickle
+import shutil
+import copyreg
+import logging
+import tempfile
+from contextlib import contextmanager
 from functools import lru_cache
+from typing import List, Optional, Union
+
+from importlib.metadata import version, PackageNotFoundError
+
+from scalecodec.base import RuntimeConfigurationObject, ScaleBytes, ScaleType
+
+logger = logging.getLogger(__name__)
+
+try:
+    scalecodec_version = version('scalecodec')
+except PackageNotFoundError:
+    scalecodec_version = 'unknown'
 
 
 def block_dependent_lru_cache(maxsize=10, typed=False, block_arg_index=None):
@@ -39,3 +63,174 @@ def block_dependent_lru_cache(maxsize=10, typed=False, block_arg_index=None):
 
         return wrapper
     return decorator
+
+
+def atomic_write(path: str, data: bytes):
+    """
+    Writes to a temporary file next to the path and renames it into place, so readers never see a partial file
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class MetadataCache:
+    """
+    On-disk cache of the runtime metadata, keyed by genesis hash and spec version.
+
+    Both the raw metadata bytes and a pickled copy of the decoded metadata are stored. The decoder classes
+    scalecodec generates on the fly are pickled by type string and resolved once per type string against the
+    runtime configuration of the connection when loading, which is several times faster than decoding the metadata.
+
+    Entries are written to a temporary file and renamed into place, so concurrent processes never read a partial
+    entry. A corrupt or incompatible entry (e.g. another scalecodec version) is treated as a miss.
+    """
+
+    version = 1
+
+    def __init__(self, path: str = '~/.mod/chain/metadata', compress_level: int = 1):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.compress_level = compress_level
+
+    def dirpath(self, genesis_hash: str) -> str:
+        return os.path.join(self.path, genesis_hash)
+
+    def raw_path(self, genesis_hash: str, spec_version: int) -> str:
+        return os.path.join(self.dirpath(genesis_hash), f'{spec_version}.scale')
+
+    def decoded_path(self, genesis_hash: str, spec_version: int) -> str:
+        return os.path.join(self.dirpath(genesis_hash), f'{spec_version}.scalecodec-{scalecodec_version}.v{self.version}.pkl.z')
+
+    def read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get_raw(self, genesis_hash: str, spec_version: int) -> Optional[bytes]:
+        return self.read(self.raw_path(genesis_hash, spec_version))
+
+    def get(self, genesis_hash: str, spec_version: int, runtime_config: RuntimeConfigurationObject) -> Optional[ScaleType]:
+        """
+        Returns the decoded metadata, decoding (and caching) the raw bytes if only those are stored
+        """
+        data = self.read(self.decoded_path(genesis_hash, spec_version))
+        if data is not None:
+            try:
+                return self.loads(data, runtime_config)
+            except Exception as e:
+                logger.warning(f'Ignoring corrupt metadata cache entry {genesis_hash}/{spec_version}: {e}')
+
+        raw = self.get_raw(genesis_hash, spec_version)
+        if raw is None:
+            return None
+        metadata = runtime_config.create_scale_object('MetadataVersioned', data=ScaleBytes(bytearray(raw)))
+        metadata.decode()
+        self.put(genesis_hash, spec_version, metadata)
+        return metadata
+
+    def put(self, genesis_hash: str, spec_version: int, metadata: ScaleType, raw: Union[str, bytes] = None):
+        """
+        Stores the decoded metadata and, when given, the raw metadata bytes (hex or bytes)
+        """
+        if raw is not None:
+            if isinstance(raw, str):
+                raw = bytes.fromhex(raw[2:] if raw.startswith('0x') else raw)
+            atomic_write(self.raw_path(genesis_hash, spec_version), raw)
+        try:
+            atomic_write(self.decoded_path(genesis_hash, spec_version), self.dumps(metadata))
+        except Exception as e:
+            logger.warning(f'Could not cache decoded metadata {genesis_hash}/{spec_version}: {e}')
+
+    def dumps(self, metadata: ScaleType) -> bytes:
+        f = io.BytesIO()
+        with recursion_limit(100_000):
+            ScaleTypePickler(f, protocol=pickle.HIGHEST_PROTOCOL).dump(metadata)
+        return zlib.compress(f.getvalue(), self.compress_level)
+
+    def loads(self, data: bytes, runtime_config: RuntimeConfigurationObject) -> ScaleType:
+        # the metadata is a large tree of new objects, the garbage collector would scan it over and over while loading
+        with recursion_limit(100_000), gc_paused():
+            return ScaleTypeUnpickler(io.BytesIO(zlib.decompress(data)), runtime_config).load()
+
+    def ls(self, genesis_hash: str = None) -> List[str]:
+        paths = []
+        for root, _, files in os.walk(self.dirpath(genesis_hash) if genesis_hash else self.path):
+            paths += [os.path.join(root, f) for f in files if not f.startswith('.tmp-')]
+        return sorted(paths)
+
+    def clear(self, genesis_hash: str = None):
+        path = self.dirpath(genesis_hash) if genesis_hash else self.path
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+
+def _scale_type(type_string: str):
+    raise pickle.UnpicklingError(f'Decoder class {type_string} can only be loaded with a ScaleTypeUnpickler')
+
+
+def _reduce_scale_type(cls):
+    # Classes scalecodec generates at runtime cannot be imported, they are stored by type string instead
+    if getattr(sys.modules.get(cls.__module__), cls.__qualname__, None) is cls:
+        return cls.__qualname__
+    return _scale_type, (cls.__name__,)
+
+
+class ScaleTypePickler(pickle.Pickler):
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[abc.ABCMeta] = _reduce_scale_type
+
+
+class ScaleTypeUnpickler(pickle.Unpickler):
+    """
+    Only loads the classes of scalecodec and a few builtin containers, the cache files can't run other code
+    """
+
+    safe_builtins = {('builtins', 'set'), ('builtins', 'frozenset'), ('builtins', 'bytearray'),
+                     ('collections', 'OrderedDict')}
+
+    def __init__(self, file, runtime_config: RuntimeConfigurationObject):
+        super().__init__(file)
+        # scalecodec creates a new class for every generic type string lookup, resolve each type string once
+        self.get_decoder_class = lru_cache(maxsize=None)(runtime_config.get_decoder_class)
+
+    def find_class(self, module, name):
+        if module == __name__ and name == '_scale_type':
+            return self.get_decoder_class
+        if (module, name) in self.safe_builtins:
+            return super().find_class(module, name)
+        if module.split('.')[0] == 'scalecodec' and module in sys.modules:
+            obj = getattr(sys.modules[module], name, None)
+            # ScaleType is an ABC, issubclass would walk all of its (generated) subclasses for the other classes
+            if isinstance(obj, type) and (ScaleType in obj.__mro__ or obj is ScaleBytes):
+                return obj
+        raise pickle.UnpicklingError(f'{module}.{name} is not allowed in the metadata cache')
+
+
+@contextmanager
+def gc_paused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+@contextmanager
+def recursion_limit(limit: int):
+    previous = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, previous))
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(previous)
@@ -0,0 +1,204 @@
+from typing import Any, Callable, Optional, Tuple
+
+from scalecodec import types as scale_types
+from scalecodec.utils.ss58 import ss58_encode
+
+# a compiled decoder reads a value from the bytes at an offset and returns (value, next offset)
+Decoder = Callable[[bytes, int], Tuple[Any, int]]
+
+INTS = {
+    scale_types.U8: (1, False), scale_types.U16: (2, False), scale_types.U32: (4, False),
+    scale_types.U64: (8, False), scale_types.U128: (16, False), scale_types.U256: (32, False),
+    scale_types.I8: (1, True), scale_types.I16: (2, True), scale_types.I32: (4, True),
+    scale_types.I64: (8, True), scale_types.I128: (16, True), scale_types.I256: (32, True),
+}
+HASHES = {scale_types.H160: 20, scale_types.H256: 32, scale_types.H512: 64}
+
+
+def is_type(cls, base) -> bool:
+    """
+    Whether cls decodes exactly like base (a subclass with its own process is not)
+    """
+    return isinstance(cls, type) and issubclass(cls, base) and cls.process is base.process
+
+
+def decode_compact(data: bytes, o: int) -> Tuple[int, int]:
+    b = data[o]
+    mode = b & 3
+    if mode == 0:
+        return b >> 2, o + 1
+    if mode == 1:
+        return int.from_bytes(data[o:o + 2], 'little') >> 2, o + 2
+    if mode == 2:
+        return int.from_bytes(data[o:o + 4], 'little') >> 2, o + 4
+    n = (b >> 2) + 4
+    return int.from_bytes(data[o + 1:o + 1 + n], 'little'), o + 1 + n
+
+
+def decode_bytes(data: bytes, o: int) -> Tuple[str, int]:
+    n, o = decode_compact(data, o)
+    value = data[o:o + n]
+    try:
+        return value.decode(), o + n
+    except UnicodeDecodeError:
+        return '0x' + value.hex(), o + n
+
+
+def compile_decoder(runtime_config, type_string: str, compiling: set = None) -> Optional[Decoder]:
+    """
+    Compiles the scalecodec type of type_string into a plain function with the same output, or None
+    when the type (or one of its members) has no fast path (enums, calls, custom process methods)
+    """
+    if type_string is None:
+        type_string = 'Null'
+    cls = runtime_config.get_decoder_class(type_string)
+    if cls is None:
+        return None
+    compiling = compiling or set()
+    if cls in compiling:
+        # a recursive type
+        return None
+    compiling = compiling | {cls}
+    sub = lambda t: compile_decoder(runtime_config, t, compiling)
+
+    for base, (size, signed) in INTS.items():
+        if is_type(cls, base):
+            if size == 1 and not signed:
+                return lambda data, o: (data[o], o + 1)
+            return lambda data, o: (int.from_bytes(data[o:o + size], 'little', signed=signed), o + size)
+
+    if is_type(cls, scale_types.Bool):
+        def decode_bool(data, o):
+            b = data[o]
+            if b > 1:
+                raise ValueError('Invalid value for datatype "bool"')
+            return b == 1, o + 1
+        return decode_bool
+
+    if is_type(cls, scale_types.Null):
+        return lambda data, o: (None, o)
+
+    if is_type(cls, scale_types.Compact):
+        return decode_compact
+
+    if is_type(cls, scale_types.GenericAccountId):
+        def decode_account(data, o):
+            value = '0x' + data[o:o + 32].hex()
+            if runtime_config.ss58_format is not None:
+                try:
+                    value = ss58_encode(value, ss58_format=runtime_config.ss58_format)
+                except ValueError:
+                    pass
+            return value, o + 32
+        return decode_account
+
+    for base, size in HASHES.items():
+        if is_type(cls, base):
+            return lambda data, o: ('0x' + data[o:o + size].hex(), o + size)
+
+    if is_type(cls, scale_types.Bytes):
+        return decode_bytes
+
+    if is_type(cls, scale_types.FixedLengthArray):
+        count = cls.element_count
+        if not count:
+            return lambda data, o: ([], o)
+        if runtime_config.get_decoder_class(cls.sub_type) is scale_types.U8:
+            return lambda data, o: ('0x' + data[o:o + count].hex(), o + count)
+        element = sub(cls.sub_type)
+        if element is None:
+            return None
+        def decode_array(data, o):
+            result = []
+            for _ in range(count):
+                value, o = element(data, o)
+                result.append(value)
+            return result, o
+        return decode_array
+
+    if is_type(cls, scale_types.Vec):
+        if runtime_config.get_decoder_class(cls.sub_type) is scale_types.U8:
+            return decode_bytes
+        element = sub(cls.sub_type)
+        if element is None:
+            return None
+        def decode_vec(data, o):
+            n, o = decode_compact(data, o)
+            result = []
+            for _ in range(n):
+                value, o = element(data, o)
+                result.append(value)
+            return result, o
+        return decode_vec
+
+    if is_type(cls, scale_types.Option):
+        element = sub(cls.sub_type) if cls.sub_type else None
+        if cls.sub_type and element is None:
+            return None
+        def decode_option(data, o):
+            if data[o] == 0 or element is None:
+                return None, o + 1
+            return element(data, o + 1)
+        return decode_option
+
+    if is_type(cls, scale_types.Struct) and cls.type_mapping is not None:
+        fields = [(key, sub(data_type)) for key, data_type in cls.type_mapping]
+        if any(decoder is None for _, decoder in fields):
+            return None
+        def decode_struct(data, o):
+            result = {}
+            for key, decoder in fields:
+                result[key], o = decoder(data, o)
+            return result, o
+        return decode_struct
+
+    if is_type(cls, scale_types.Tuple) and cls.type_mapping is not None:
+        members = [sub(member) for member in cls.type_mapping]
+        if any(decoder is None for decoder in members):
+            return None
+        if len(members) == 1:
+            return members[0]
+        def decode_tuple(data, o):
+            result = []
+            for decoder in members:
+                value, o = decoder(data, o)
+                result.append(value)
+            return tuple(result), o
+        return decode_tuple
+
+    return None
+
+
+class StorageDecoder:
+    """
+    Decodes the raw keys and values of a storage map with decoders compiled once per runtime.
+
+    The values are identical to the ones of scalecodec (decode_scale). decode returns None for an entry
+    that has to go through scalecodec instead: a type without a fast path, or bytes that the compiled
+    decoder can't read exactly (invalid or remaining bytes), so errors are still raised by scalecodec.
+    """
+
+    def __init__(self, runtime_config, value_type: str, key_type: str, key_index: Callable[[tuple], Any]):
+        self.key_index = key_index  # the item key from the decoded members of the key (hashes included)
+        self.key_decoder = compile_decoder(runtime_config, key_type)
+        self.value_decoder = compile_decoder(runtime_config, value_type)
+        self.compiled = self.key_decoder is not None and self.value_decoder is not None
+
+    def decode(self, key: str, value: str) -> Optional[Tuple[Any, Any]]:
+        """
+        The (key, value) of an entry, key is the hex of the storage key after the prefix of the map
+        """
+        if not self.compiled:
+            return None
+        try:
+            data = bytes.fromhex(key)
+            members, o = self.key_decoder(data, 0)
+            if o != len(data):
+                return None
+            data = bytes.fromhex(value[2:])
+            decoded_value, o = self.value_decoder(data, 0)
+            if o != len(data):
+                return None
+            return self.key_index(members), decoded_value
+        except (IndexError, ValueError, TypeError):
+            return None
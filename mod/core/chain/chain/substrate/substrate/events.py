@@ -0,0 +1,152 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Any, Iterable, List, Optional
+
+from .ss58 import ss58_decode, is_valid_ss58_address
+
+
+def account_id(value: Any) -> Optional[str]:
+    """
+    The public key (0x hex) of an ss58 address or public key, None if the value is not an account
+    """
+    if not isinstance(value, str):
+        return None
+    if value.startswith('0x') and len(value) == 66:
+        return value.lower()
+    if 46 <= len(value) <= 48 and is_valid_ss58_address(value):
+        return '0x' + ss58_decode(value)
+    return None
+
+
+def event_accounts(value: Any) -> set:
+    """
+    The accounts referenced anywhere in the attributes of an event
+    """
+    if isinstance(value, dict):
+        return set().union(*[event_accounts(v) for v in value.values()])
+    if isinstance(value, (list, tuple)):
+        return set().union(*[event_accounts(v) for v in value])
+    account = account_id(value)
+    return {account} if account else set()
+
+
+class EventIndex:
+    """
+    An append-only index of the decoded events of a chain, partitioned by block.
+
+    Events are clustered on (block, idx) and blocks are only ever inserted whole, together with the
+    spec version they were decoded with, so a block range is either fully indexed or missing.
+    Events can be looked up by module, event id and any account in their attributes.
+    """
+
+    max_variables = 500
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.lock, self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS blocks (
+                block INTEGER PRIMARY KEY, block_hash TEXT, spec_version INTEGER, events INTEGER)''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS events (
+                block INTEGER NOT NULL, idx INTEGER NOT NULL, extrinsic_idx INTEGER,
+                module_id TEXT, event_id TEXT, data TEXT,
+                PRIMARY KEY (block, idx)) WITHOUT ROWID''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS events_name ON events (module_id, event_id, block)')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS accounts (
+                account TEXT NOT NULL, block INTEGER NOT NULL, idx INTEGER NOT NULL,
+                PRIMARY KEY (account, block, idx)) WITHOUT ROWID''')
+
+    def missing(self, from_block: int, to_block: int) -> List[int]:
+        """
+        The blocks of the range (inclusive) that are not indexed yet
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT block FROM blocks WHERE block BETWEEN ? AND ?', (from_block, to_block)).fetchall()
+        indexed = {r[0] for r in rows}
+        return [b for b in range(from_block, to_block + 1) if b not in indexed]
+
+    def add(self, blocks: Iterable[tuple]) -> int:
+        """
+        Appends (block, block_hash, spec_version, events) tuples, blocks that are already indexed are ignored
+        """
+        blocks = list(blocks)
+        if not blocks:
+            return 0
+        with self.lock, self.conn:
+            indexed = set()
+            # in chunks, sqlite bounds the number of variables of a statement
+            for i in range(0, len(blocks), self.max_variables):
+                chunk = [b[0] for b in blocks[i:i + self.max_variables]]
+                indexed.update(r[0] for r in self.conn.execute(
+                    f'SELECT block FROM blocks WHERE block IN ({",".join("?" * len(chunk))})', chunk))
+            blocks = [b for b in blocks if b[0] not in indexed]
+            event_rows, account_rows = [], []
+            for block, _, _, events in blocks:
+                for idx, event in enumerate(events):
+                    event_rows.append((block, idx, event.get('extrinsic_idx'), event.get('module_id'),
+                                       event.get('event_id'), json.dumps(event, default=str)))
+                    account_rows += [(account, block, idx) for account in event_accounts(event.get('attributes'))]
+            self.conn.executemany('INSERT INTO blocks VALUES (?,?,?,?)', [(b, h, s, len(e)) for b, h, s, e in blocks])
+            self.conn.executemany('INSERT INTO events VALUES (?,?,?,?,?,?)', event_rows)
+            self.conn.executemany('INSERT OR IGNORE INTO accounts VALUES (?,?,?)', account_rows)
+        return len(event_rows)
+
+    def query(self, module_id: str = None, event_id: str = None, account: str = None,
+              from_block: int = None, to_block: int = None, limit: int = None) -> List[dict]:
+        """
+        The events matching all the given filters, ordered by block and index
+        """
+        query = 'SELECT e.block, e.idx, e.data FROM events e'
+        where, params = [], []
+        if account is not None:
+            query += ' JOIN accounts a ON a.block = e.block AND a.idx = e.idx'
+            where.append('a.account = ?')
+            params.append(account_id(account) or account)
+        for column, value in [('module_id', module_id), ('event_id', event_id)]:
+            if value is not None:
+                where.append(f'e.{column} = ?')
+                params.append(value)
+        if from_block is not None:
+            where.append('e.block >= ?')
+            params.append(from_block)
+        if to_block is not None:
+            where.append('e.block <= ?')
+            params.append(to_block)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY e.block, e.idx'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        return [dict(json.loads(data), block=block, idx=idx) for block, idx, data in rows]
+
+    def block_events(self, from_block: int, to_block: int = None) -> dict:
+        """
+        The events per block of the range, including the indexed blocks without events
+        """
+        to_block = from_block if to_block is None else to_block
+        with self.lock:
+            blocks = self.conn.execute('SELECT block FROM blocks WHERE block BETWEEN ? AND ? ORDER BY block',
+                                       (from_block, to_block)).fetchall()
+        block2events = {b[0]: [] for b in blocks}
+        for event in self.query(from_block=from_block, to_block=to_block):
+            block2events[event['block']].append(event)
+        return block2events
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM blocks').fetchone()[0]
+
+    def clear(self):
+        with self.lock, self.conn:
+            for table in ['blocks', 'events', 'accounts']:
+                self.conn.execute(f'DELETE FROM {table}')
+        return {'success': True, 'path': self.path}
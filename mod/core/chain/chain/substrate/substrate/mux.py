@@ -0,0 +1,193 @@
+import json
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from websocket import WebSocketConnectionClosedException, WebSocketException, WebSocketTimeoutException
+
+from .exceptions import SubstrateRequestException
+
+logger = logging.getLogger(__name__)
+
+
+class Multiplexer:
+    """
+    Shares one websocket between many concurrent callers.
+
+    A reader thread owns `recv`: responses are dispatched by id to the future of their request and
+    subscription notifications to the queue that listens to their subscription id (notifications that
+    arrive before anyone listens are buffered). Sends are serialised with a lock, so any number of
+    requests can be in flight on the socket at once.
+
+    When the socket closes every pending request fails with the error, the connection is not
+    reconnected (a pool replaces it).
+    """
+
+    def __init__(self, websocket, buffer: int = 1000):
+        self.websocket = websocket
+        self.buffer = buffer  # notifications kept for subscriptions nobody listens to yet
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.request_id = 1
+        self.futures: Dict[int, Future] = {}
+        self.listeners: Dict[str, queue.Queue] = {}
+        self.unrouted: OrderedDict = OrderedDict()  # subscription id -> notifications
+        self.error: Optional[Exception] = None
+        self.thread = threading.Thread(target=self.read_loop, daemon=True)
+        self.thread.start()
+
+    @property
+    def closed(self) -> bool:
+        return self.error is not None
+
+    def read_loop(self):
+        while True:
+            try:
+                message = json.loads(self.websocket.recv())
+            except WebSocketTimeoutException:
+                # the socket timeout bounds the requests (see request), not the idle time
+                continue
+            except (OSError, WebSocketException) as e:
+                self.fail(e)
+                return
+            except Exception as e:
+                logger.debug(f'Multiplexer reader stopped: {e}')
+                self.fail(WebSocketConnectionClosedException(str(e)))
+                return
+            if not message:
+                self.fail(WebSocketConnectionClosedException('Connection is already closed.'))
+                return
+            self.dispatch(message)
+
+    def dispatch(self, message: Union[dict, list]):
+        if isinstance(message, list):
+            # the responses of a json-rpc batch
+            for item in message:
+                self.dispatch(item)
+            return
+        if 'id' in message:
+            with self.lock:
+                future = self.futures.pop(message['id'], None)
+            if future is not None:
+                future.set_result(message)
+            return
+        subscription_id = (message.get('params') or {}).get('subscription')
+        if subscription_id is None:
+            return
+        with self.lock:
+            listener = self.listeners.get(subscription_id)
+            if listener is None:
+                self.unrouted.setdefault(subscription_id, []).append(message)
+                while sum(len(v) for v in self.unrouted.values()) > self.buffer:
+                    self.unrouted.popitem(last=False)
+                return
+        listener.put(message)
+
+    def fail(self, error: Exception):
+        with self.lock:
+            self.error = error
+            futures, self.futures = self.futures, {}
+            listeners = set(self.listeners.values())
+        for future in futures.values():
+            future.set_exception(error)
+        for listener in listeners:
+            listener.put(error)
+
+    def send(self, method: str, params: list) -> Future:
+        """
+        Sends a request and returns the future of its response message
+        """
+        future = Future()
+        with self.lock:
+            if self.error is not None:
+                raise self.error
+            request_id = self.request_id
+            self.request_id += 1
+            self.futures[request_id] = future
+        future.request_id = request_id
+        payload = json.dumps({"jsonrpc": "2.0", "method": method, "params": params, "id": request_id})
+        try:
+            with self.send_lock:
+                self.websocket.send(payload)
+        except Exception:
+            with self.lock:
+                self.futures.pop(request_id, None)
+            raise
+        return future
+
+    def wait(self, future: Future, timeout: float = None) -> dict:
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            with self.lock:
+                self.futures.pop(future.request_id, None)
+            raise TimeoutError(f'No response within {timeout}s') from None
+
+    def request(self, method: str, params: list, timeout: float = None) -> dict:
+        """
+        The response message of the request, an error response raises
+        """
+        message = self.wait(self.send(method, params), timeout)
+        if 'error' in message:
+            raise SubstrateRequestException(message['error'])
+        return message
+
+    def listen(self, subscription_ids: Iterable[str], listener: queue.Queue = None) -> queue.Queue:
+        """
+        Routes the notifications of the subscriptions (including the buffered ones) to the listener queue,
+        a closed socket puts its error on the queue
+        """
+        listener = listener or queue.Queue()
+        with self.lock:
+            for subscription_id in subscription_ids:
+                self.listeners[subscription_id] = listener
+                for message in self.unrouted.pop(subscription_id, []):
+                    listener.put(message)
+            if self.error is not None:
+                listener.put(self.error)
+        return listener
+
+    def unlisten(self, subscription_ids: Iterable[str]):
+        with self.lock:
+            for subscription_id in subscription_ids:
+                self.listeners.pop(subscription_id, None)
+                self.unrouted.pop(subscription_id, None)
+
+    def next(self, listener: queue.Queue, timeout: float = None) -> dict:
+        """
+        The next notification of the listener, raises the error of a closed socket or queue.Empty on timeout
+        """
+        message = listener.get(timeout=timeout)
+        if isinstance(message, Exception):
+            listener.put(message)
+            raise message
+        return message
+
+    def subscribe(self, method: str, params: list, result_handler: Callable, timeout: float = None) -> Any:
+        """
+        Subscribes and passes every notification to result_handler(message, update_nr, subscription_id) until
+        it returns a value
+        """
+        subscription_id = self.request(method, params, timeout)['result']
+        listener = self.listen([subscription_id])
+        try:
+            update_nr = 0
+            while True:
+                # a subscription can wait indefinitely for its next update
+                result = result_handler(self.next(listener), update_nr, subscription_id)
+                if result is not None:
+                    return result
+                update_nr += 1
+        finally:
+            self.unlisten([subscription_id])
+
+    def request_many(self, requests: List[tuple], timeout: float = None) -> List[dict]:
+        """
+        Sends the (method, params) requests back to back and returns the response messages in order,
+        error responses included
+        """
+        futures = [self.send(method, params) for method, params in requests]
+        return [self.wait(future, timeout) for future in futures]
@@ -0,0 +1,65 @@
+import threading
+from typing import Callable, Dict, List
+
+# the transaction pool errors of a nonce that was already used or is behind the account nonce
+# (1014 "Priority is too low" for a nonce that is in the pool, 1010 "Transaction is outdated" for a stale one)
+NONCE_ERRORS = ['priority is too low', 'transaction is outdated', 'stale', 'invalid transaction nonce']
+
+
+def is_nonce_error(error) -> bool:
+    """
+    Whether a submission error means that the nonce of the extrinsic is already used
+    """
+    message = str(error).lower()
+    return any(e in message for e in NONCE_ERRORS)
+
+
+class NonceManager:
+    """
+    The next nonce of every account that submits through this client.
+
+    The nonce of an account is fetched once (with a pool aware rpc like system_accountNextIndex) and then
+    handed out locally, so extrinsics can be signed and submitted back to back without waiting for the
+    previous ones to be included. When the node rejects a nonce as used or outdated the account is
+    resynced, and when a submission fails otherwise the account is invalidated so the gap is not kept.
+    """
+
+    def __init__(self):
+        self.nonces: Dict[str, int] = {}
+        self.locks: Dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+    def account_lock(self, address: str) -> threading.Lock:
+        with self.lock:
+            if address not in self.locks:
+                self.locks[address] = threading.Lock()
+            return self.locks[address]
+
+    def next(self, address: str, fetch: Callable[[str], int], n: int = 1) -> List[int]:
+        """
+        Reserves the next n nonces of the account
+        """
+        with self.account_lock(address):
+            if address not in self.nonces:
+                self.nonces[address] = fetch(address) or 0
+            nonce = self.nonces[address]
+            self.nonces[address] = nonce + n
+        return list(range(nonce, nonce + n))
+
+    def resync(self, address: str, fetch: Callable[[str], int]) -> int:
+        """
+        Refetches the nonce of the account, it never goes back on the nonces that were handed out since
+        """
+        with self.account_lock(address):
+            self.nonces[address] = max(fetch(address) or 0, self.nonces.get(address, 0))
+            return self.nonces[address]
+
+    def invalidate(self, address: str = None):
+        with self.lock:
+            if address is None:
+                self.nonces.clear()
+            else:
+                self.nonces.pop(address, None)
+
+    def get(self, address: str) -> int:
+        return self.nonces.get(address)
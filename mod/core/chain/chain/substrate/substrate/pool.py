@@ -0,0 +1,322 @@
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from websocket import WebSocketException
+
+logger = logging.getLogger(__name__)
+
+# the errors of an endpoint (not of the request), a request that fails with one can be retried elsewhere
+ENDPOINT_ERRORS = (OSError, ConnectionError, TimeoutError, WebSocketException)
+
+
+def is_dead(conn) -> bool:
+    if is_shared(conn) and conn.multiplexer.closed:
+        return True
+    return getattr(conn, 'websocket', None) is not None and not conn.websocket.connected
+
+
+def is_shared(conn) -> bool:
+    """
+    A multiplexed connection serves any number of callers at once, it stays idle while it is checked out
+    """
+    return getattr(conn, 'multiplexer', None) is not None
+
+
+class Endpoint:
+    """
+    The idle connections of one url with its rolling latency and error rate
+    """
+
+    def __init__(self, url: str, window: int = 50):
+        self.url = url
+        self.idle: List[Any] = []
+        self.size = 0  # the open connections, idle or in use
+        self.latencies = deque(maxlen=window)
+        self.errors = deque(maxlen=window)
+        self.failures = 0  # consecutive errors
+        self.down_until = 0.0
+        self.requests = 0
+
+    def record(self, latency: float = None, error: bool = False, max_failures: int = 3):
+        self.requests += 1
+        self.errors.append(error)
+        if latency is not None:
+            self.latencies.append(latency)
+        if error:
+            self.failures += 1
+            if self.failures >= max_failures:
+                # back off exponentially while the endpoint keeps failing
+                self.down_until = time.time() + min(2 ** (self.failures - max_failures), 60)
+        else:
+            self.failures = 0
+            self.down_until = 0.0
+
+    @property
+    def down(self) -> bool:
+        return time.time() < self.down_until
+
+    def latency(self) -> float:
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    def error_rate(self) -> float:
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+    def score(self) -> float:
+        """
+        The expected cost of a request, lower is healthier (an endpoint without samples is tried first)
+        """
+        if self.down:
+            return float('inf')
+        return (self.latency() + 0.001) * (1 + 10 * self.error_rate())
+
+    def stats(self) -> dict:
+        return {'url': self.url, 'connections': self.size, 'idle': len(self.idle), 'requests': self.requests,
+                'latency': round(self.latency(), 4), 'error_rate': round(self.error_rate(), 3),
+                'down': self.down, 'score': round(self.score(), 4)}
+
+
+class ConnectionPool:
+    """
+    Connections to several endpoints of the same chain.
+
+    Each checkout goes to the endpoint with the best score (rolling latency of the rpc requests
+    weighted by the rolling error rate), endpoints that keep failing are left out for a backoff
+    period, and the connections that die or fail are replaced in the background. `run` retries a
+    request on another endpoint when the endpoint fails, for the idempotent queries.
+    The pool also has the get/put interface of the queue it replaces.
+    """
+
+    def __init__(self,
+                 urls: Iterable[str],
+                 new_conn: Callable[[str], Any],
+                 size: int = 1, # connections per endpoint
+                 window: int = 50, # requests in the rolling stats
+                 max_failures: int = 3, # consecutive errors before an endpoint is left out
+                 interval: float = None): # seconds between background health checks
+        self.new_conn = new_conn
+        self.size = size
+        self.max_failures = max_failures
+        self.endpoints: Dict[str, Endpoint] = {url: Endpoint(url, window) for url in urls}
+        self.cond = threading.Condition()
+        self.closed = False
+        for endpoint in self.endpoints.values():
+            for _ in range(size):
+                if not self.open(endpoint):
+                    self.reopen(endpoint)
+        if not self.qsize():
+            self.close()
+            raise ConnectionError(f'Could not connect to any of {self.urls}')
+        self.monitor = None
+        if interval:
+            self.monitor = threading.Thread(target=self.monitor_loop, args=(interval,), daemon=True)
+            self.monitor.start()
+
+    @property
+    def urls(self) -> List[str]:
+        return list(self.endpoints)
+
+    def open(self, endpoint: Endpoint) -> bool:
+        """
+        Opens a connection to the endpoint, an endpoint that can't be reached counts as failed
+        """
+        try:
+            conn = self.new_conn(endpoint.url)
+        except Exception as e:
+            logger.debug(f'Could not connect to {endpoint.url}: {e}')
+            with self.cond:
+                endpoint.record(error=True, max_failures=1)
+            return False
+        if self.closed:
+            conn.close()
+            return True
+        with self.cond:
+            endpoint.size += 1
+            endpoint.idle.append(conn)
+            self.cond.notify_all()
+        return True
+
+    def replace(self, endpoint: Endpoint, conn: Any = None, wait: bool = False):
+        """
+        Closes the connection and opens another one (in the background unless wait), retrying while the
+        endpoint is down
+        """
+        with self.cond:
+            if conn is not None and is_shared(conn):
+                if conn not in endpoint.idle:
+                    return  # already replaced by another of its callers
+                endpoint.idle.remove(conn)
+            endpoint.size -= 1
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        if self.closed or (wait and self.open(endpoint)):
+            return
+        self.reopen(endpoint)
+
+    def reopen(self, endpoint: Endpoint):
+        """
+        Opens a connection to the endpoint in the background, backing off while it can't be reached
+        """
+        def loop():
+            delay = 0.1
+            while not self.closed and not self.open(endpoint):
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def best(self, exclude: Iterable[str] = ()) -> Optional[Endpoint]:
+        candidates = [e for e in self.endpoints.values() if e.url not in exclude]
+        ready = [e for e in candidates if e.idle]
+        if not ready:
+            return None
+        # an endpoint that is down is only used when no other one has an idle connection
+        return min(ready, key=lambda e: (e.down, e.score()))
+
+    def get(self, timeout: float = None, exclude: Iterable[str] = ()) -> Any:
+        """
+        Checks out a connection of the healthiest endpoint with an idle connection
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self.cond:
+                while True:
+                    endpoint = self.best(exclude)
+                    if endpoint is None and exclude and not any(e.size for e in self.endpoints.values() if e.url not in exclude):
+                        # every other endpoint is gone, better the excluded ones than nothing
+                        endpoint = self.best()
+                    if endpoint is not None:
+                        conn = endpoint.idle.pop()
+                        if is_shared(conn):
+                            # round robin over the shared connections of the endpoint
+                            endpoint.idle.insert(0, conn)
+                        break
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Empty()
+                    self.cond.wait(remaining)
+            if not is_dead(conn):
+                return conn
+            # a socket that died while idle is replaced instead of handed out
+            self.replace(endpoint, conn)
+
+    def put(self, conn: Any, latency: float = None, error: bool = False):
+        """
+        Returns a connection, with the latency and error of its requests, a failed connection is replaced
+        """
+        endpoint = self.endpoints.get(conn.url)
+        if endpoint is None:
+            conn.close()
+            return
+        with self.cond:
+            if latency is not None or error:
+                endpoint.record(latency, error, max_failures=self.max_failures)
+        if is_shared(conn):
+            if error or self.closed:
+                self.replace(endpoint, conn)
+            return
+        if error or self.closed:
+            self.replace(endpoint, conn)
+            return
+        with self.cond:
+            endpoint.idle.append(conn)
+            self.cond.notify_all()
+
+    def qsize(self) -> int:
+        return sum(len(e.idle) for e in self.endpoints.values())
+
+    @contextmanager
+    def connection(self, timeout: float = None, exclude: Iterable[str] = ()):
+        """
+        Checks out a connection and scores its endpoint with the requests made while it is out
+        """
+        conn = self.get(timeout=timeout, exclude=exclude)
+        count, seconds = getattr(conn, 'rpc_count', 0), getattr(conn, 'rpc_time', 0.0)
+        error = False
+        try:
+            yield conn
+        except ENDPOINT_ERRORS:
+            error = True
+            raise
+        finally:
+            n = getattr(conn, 'rpc_count', 0) - count
+            latency = (getattr(conn, 'rpc_time', 0.0) - seconds) / n if n else None
+            self.put(conn, latency=latency, error=error)
+
+    def run(self, fn: Callable[[Any], Any], retries: int = 2, timeout: float = None) -> Any:
+        """
+        Runs fn(conn) on the healthiest endpoint and retries it on the other endpoints when the endpoint
+        fails, only for requests that can be repeated safely
+        """
+        tried = []
+        for attempt in range(retries + 1):
+            conn_url = None
+            try:
+                with self.connection(timeout=timeout, exclude=tried) as conn:
+                    conn_url = conn.url
+                    return fn(conn)
+            except ENDPOINT_ERRORS as e:
+                if attempt == retries:
+                    raise
+                logger.debug(f'Request failed on {conn_url}, retrying on another endpoint: {e}')
+                tried.append(conn_url)
+
+    def check(self, replace: bool = True, method: str = 'system_health') -> List[dict]:
+        """
+        Pings every idle connection with a cheap rpc request, the dead ones are replaced
+        """
+        with self.cond:
+            conns = [(e, c) for e in self.endpoints.values() for c in e.idle]
+            for endpoint in self.endpoints.values():
+                # the shared connections keep serving while they are checked
+                endpoint.idle = [c for c in endpoint.idle if is_shared(c)]
+        health = []
+        for i, (endpoint, conn) in enumerate(conns):
+            t0 = time.time()
+            try:
+                assert not is_dead(conn), 'websocket closed'
+                conn.rpc_request(method, [])
+                latency = time.time() - t0
+                health.append({'idx': i, 'url': endpoint.url, 'healthy': True, 'latency': round(latency, 4),
+                               'runtime_version': getattr(conn, 'runtime_version', None)})
+                self.put(conn, latency=latency)
+            except Exception as e:
+                health.append({'idx': i, 'url': endpoint.url, 'healthy': False, 'error': str(e), 'replaced': replace})
+                with self.cond:
+                    endpoint.record(error=True, max_failures=self.max_failures)
+                if replace:
+                    self.replace(endpoint, conn, wait=True)
+                else:
+                    self.put(conn)
+        return health
+
+    def monitor_loop(self, interval: float):
+        while not self.closed:
+            time.sleep(interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.debug(f'Health check failed: {e}')
+
+    def stats(self) -> List[dict]:
+        with self.cond:
+            return sorted([e.stats() for e in self.endpoints.values()], key=lambda s: s['score'])
+
+    def close(self):
+        self.closed = True
+        with self.cond:
+            conns = [c for e in self.endpoints.values() for c in e.idle]
+            for endpoint in self.endpoints.values():
+                endpoint.idle = []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
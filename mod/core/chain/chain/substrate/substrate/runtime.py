@@ -0,0 +1,123 @@
+import json
+import time
+import logging
+import threading
+from typing import Optional
+
+import requests
+from websocket import create_connection
+
+from .exceptions import SubstrateRequestException
+
+logger = logging.getLogger(__name__)
+
+
+class RuntimeWatcher:
+    """
+    Tracks the spec version of the chain head, so pooled connections only have to re-initialise their runtime
+    after a runtime upgrade.
+
+    The version is pushed by a `state_subscribeRuntimeVersion` subscription on a dedicated websocket. If the
+    subscription is not available (http url, dropped socket) it falls back on polling `state_getRuntimeVersion`
+    at most once per `interval` seconds (one block by default).
+    """
+
+    def __init__(self, url: str, ws_options: dict = None, interval: float = 6, subscribe: bool = True,
+                 timeout: float = 10):
+        self.url = url
+        self.ws_options = ws_options or {}
+        self.interval = interval
+        self.timeout = timeout
+        self.version = None
+        self.checked = 0
+        self.upgrades = 0
+        self.subscribed = False
+        self.lock = threading.Lock()
+        self.ws = None
+        self.thread = None
+        if subscribe and self.url[0:2] == 'ws':
+            self.subscribe()
+
+    def update(self, runtime_info: dict):
+        version = (runtime_info or {}).get('specVersion')
+        if version is None:
+            return self.version
+        if self.version is not None and version != self.version:
+            logger.debug(f'Runtime upgrade detected {self.version} -> {version}')
+            self.upgrades += 1
+        self.version = version
+        self.checked = time.time()
+        return self.version
+
+    def request(self, ws, method: str, params: list, request_id: int = 1):
+        ws.send(json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}))
+        while True:
+            message = json.loads(ws.recv())
+            if message.get('id') == request_id:
+                if 'error' in message:
+                    raise SubstrateRequestException(message['error'])
+                return message.get('result')
+
+    def subscribe(self):
+        """
+        Starts a background thread listening to runtime version updates
+        """
+        def listen():
+            ws = None
+            try:
+                ws = create_connection(self.url, timeout=self.timeout, **self.ws_options)
+                subscription_id = self.request(ws, 'state_subscribeRuntimeVersion', [])
+                ws.settimeout(None)
+                self.subscribed = True
+                while True:
+                    message = json.loads(ws.recv())
+                    params = message.get('params') or {}
+                    if params.get('subscription') == subscription_id:
+                        self.update(params.get('result'))
+            except Exception as e:
+                logger.debug(f'Runtime version subscription closed: {e}')
+            finally:
+                self.subscribed = False
+                if ws is not None:
+                    try:
+                        ws.close()
+                    except Exception:
+                        pass
+
+        self.thread = threading.Thread(target=listen, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def poll(self) -> Optional[int]:
+        payload = {'jsonrpc': '2.0', 'id': 1, 'method': 'state_getRuntimeVersion', 'params': []}
+        if self.url[0:2] == 'ws':
+            try:
+                if self.ws is None or not self.ws.connected:
+                    self.ws = create_connection(self.url, timeout=self.timeout, **self.ws_options)
+                result = self.request(self.ws, payload['method'], payload['params'])
+            except Exception:
+                self.ws = None
+                raise
+        else:
+            response = requests.post(self.url, json=payload, timeout=self.timeout).json()
+            if 'error' in response:
+                raise SubstrateRequestException(response['error'])
+            result = response.get('result')
+        return self.update(result)
+
+    def spec_version(self) -> Optional[int]:
+        """
+        The latest known spec version, at most `interval` seconds old when not subscribed
+        """
+        if self.subscribed and self.version is not None:
+            return self.version
+        if time.time() - self.checked >= self.interval:
+            with self.lock:
+                if time.time() - self.checked >= self.interval:
+                    self.poll()
+        return self.version
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+            self.ws = None
@@ -0,0 +1,111 @@
+import time
+from typing import Any, Dict, Iterable, Optional
+
+import msgpack
+
+from .caching import atomic_write
+
+# msgpack ints are limited to 64 bits, larger ones (u128 balances) are stored as decimal strings
+BIG_INT = 1
+
+
+def _pack(obj: Any) -> Any:
+    if isinstance(obj, int) and not isinstance(obj, bool) and not -2 ** 63 <= obj < 2 ** 64:
+        return msgpack.ExtType(BIG_INT, str(obj).encode())
+    if isinstance(obj, dict):
+        return {k: _pack(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_pack(v) for v in obj]
+    return obj
+
+
+def _ext_hook(code: int, data: bytes) -> Any:
+    if code == BIG_INT:
+        return int(data)
+    return msgpack.ExtType(code, data)
+
+
+class StorageSnapshot:
+    """
+    The raw and decoded entries of a storage map at a block hash.
+
+    Entries are keyed by the raw storage key, so a newer block only needs the keys that changed to be fetched and
+    decoded. Snapshots are stored with msgpack (raw keys and values as bytes), which is several times smaller and
+    faster to load than the decoded JSON maps.
+    """
+
+    version = 1
+
+    def __init__(self, prefix: str, block_hash: str = None, spec_version: int = None,
+                 entries: Dict[str, tuple] = None, timestamp: float = None):
+        self.prefix = prefix
+        self.block_hash = block_hash
+        self.spec_version = spec_version
+        self.entries = entries or {}  # raw key -> (raw value, decoded key, decoded value)
+        self.timestamp = timestamp or 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self) -> set:
+        return set(self.entries)
+
+    def apply(self, changes: Iterable[tuple], block_hash: str = None):
+        """
+        Applies (raw key, raw value, decoded key, decoded value) changes, a raw value of None removes the key
+        """
+        n = 0
+        for key, value, decoded_key, decoded_value in changes:
+            if value is None:
+                n += self.entries.pop(key, None) is not None
+            else:
+                self.entries[key] = (value, decoded_key, decoded_value)
+                n += 1
+        if block_hash is not None:
+            self.block_hash = block_hash
+        self.timestamp = time.time()
+        return n
+
+    def result(self) -> dict:
+        return {decoded_key: decoded_value for _, decoded_key, decoded_value in self.entries.values()}
+
+    def age(self) -> float:
+        return time.time() - self.timestamp
+
+    def dumps(self) -> bytes:
+        keys = list(self.entries)
+        return msgpack.packb({
+            'version': self.version,
+            'prefix': self.prefix,
+            'block_hash': self.block_hash,
+            'spec_version': self.spec_version,
+            'timestamp': self.timestamp,
+            'keys': [bytes.fromhex(k[2:]) for k in keys],
+            'values': [bytes.fromhex(self.entries[k][0][2:]) for k in keys],
+            'decoded': _pack([self.entries[k][1:] for k in keys]),
+        }, use_bin_type=True)
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'StorageSnapshot':
+        state = msgpack.unpackb(data, raw=False, ext_hook=_ext_hook, strict_map_key=False)
+        if state.get('version') != cls.version:
+            raise ValueError(f'Unsupported snapshot version {state.get("version")}')
+        entries = {}
+        for key, value, (decoded_key, decoded_value) in zip(state['keys'], state['values'], state['decoded']):
+            if isinstance(decoded_key, list):
+                decoded_key = tuple(decoded_key)
+            entries['0x' + key.hex()] = ('0x' + value.hex(), decoded_key, decoded_value)
+        return cls(state['prefix'], state['block_hash'], state['spec_version'], entries, state['timestamp'])
+
+    def save(self, path: str) -> str:
+        atomic_write(path, self.dumps())
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> Optional['StorageSnapshot']:
+        try:
+            with open(path, 'rb') as f:
+                return cls.loads(f.read())
+        except Exception:
+            # a missing, corrupt or outdated snapshot is rebuilt from scratch
+            return None
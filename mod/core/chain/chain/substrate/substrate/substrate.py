@@ -13,6 +13,14 @@ from .storage import StorageKey
 from .key import  Keypair# type: ignore
 from scalecodec.base import ScaleBytes
 from .base import ExtrinsicReceipt, SubstrateInterface
+from .runtime import RuntimeWatcher
+from .pool import ConnectionPool
+from .caching import MetadataCache
+from .snapshot import StorageSnapshot
+from .codec import StorageDecoder
+from .events import EventIndex
+from .nonce import NonceManager, is_nonce_error
+from .exceptions import SubstrateRequestException
 from .types import (ChainTransactionError,
                     NetworkQueryError, 
                     SubnetParamsMaps, 
@@ -54,11 +62,24 @@ class Substrate:
         test = True,
         archive = False,
         ws_options = {},
-        path = os.path.expanduser(f'~/.mod/chain') 
+        path = os.path.expanduser(f'~/.mod/chain'),
+        timeout: float = 60,
+        health_interval: float = 30,
+        multiplex: bool = False,
 
     ):
         self.path = path
         self.store = m.mod('store')(path)
+        # the decoded runtime metadata, shared by every connection and process
+        self.metadata_cache = MetadataCache(os.path.join(path, 'metadata'))
+        # the next nonce of the keys that submit through this client
+        self.nonces = NonceManager()
+        # the compiled storage decoders, per runtime version and storage type
+        self.storage_decoders = {}
+        self.timeout = timeout
+        self.health_interval = health_interval
+        # share each connection between concurrent callers instead of checking it out to one at a time
+        self.multiplex = multiplex
         self.set_network(network=network, # add a little shortcut,
                          mode=mode,
                          url=url,  
@@ -68,14 +89,50 @@ class Substrate:
                          wait_for_finalization=wait_for_finalization)
 
     def set_connections(self, num_connections: int = 1):
+        """
+        Opens num_connections connections to every endpoint of the network
+        """
         t0 = m.time()
         self.num_connections = num_connections
-        self.connections_queue = queue.Queue(self.num_connections)
-        for _ in range(self.num_connections):
-            self.connections_queue.put(SubstrateInterface(self.url, ws_options=self.ws_options, use_remote_preset=True ))
+        if getattr(self, 'runtime', None) is None or self.runtime.url != self.url:
+            self.runtime = RuntimeWatcher(self.url, ws_options=self.ws_options, interval=self.blocktime)
+        if getattr(self, 'pool', None) is not None:
+            self.pool.close()
+        self.pool = ConnectionPool(self.endpoints, self.new_conn, size=num_connections, interval=self.health_interval)
+        # the pool keeps the get/put interface of the queue it replaced
+        self.connections_queue = self.pool
         self.connection_latency = round(m.time() - t0, 2)
-        m.print(f'Chain (network={self.network} url={self.url} connections={self.num_connections} latency={self.connection_latency}s)', color='blue') 
-        return {'num_connections': self.num_connections, 'connection_latency': self.connection_latency}
+        m.print(f'Chain (network={self.network} url={self.url} endpoints={len(self.endpoints)} connections={self.num_connections} latency={self.connection_latency}s)', color='blue', logger='chain') 
+        return {'num_connections': self.num_connections, 'endpoints': self.endpoints, 'connection_latency': self.connection_latency}
+
+    def new_conn(self, url: str = None) -> SubstrateInterface:
+        conn = SubstrateInterface(url or self.url, ws_options=self.ws_options, use_remote_preset=True, metadata_cache=self.metadata_cache, multiplex=self.multiplex)
+        if conn.websocket is not None and self.timeout:
+            # a stalled endpoint fails the request instead of blocking its connection forever
+            conn.websocket.settimeout(self.timeout)
+        # only re-initialise the runtime of the connection when the spec version changes
+        conn.spec_version_source = self.runtime.spec_version
+        return conn
+
+    def check_connections(self, replace: bool = True, timeout: float = 10) -> dict:
+        """
+        Checks every idle connection of the pool with a cheap rpc call and replaces the dead ones
+
+        Returns:
+            A dict with the health, latency and runtime version of each connection and the score of each endpoint
+        """
+        health = self.pool.check(replace=replace)
+        return {
+            'url': self.url,
+            'healthy': sum(h['healthy'] for h in health),
+            'connections': health,
+            'endpoints': self.pool.stats(),
+            'spec_version': self.runtime.version,
+            'subscribed': self.runtime.subscribed,
+            'upgrades': self.runtime.upgrades,
+        }
+
+    health = check_connections
 
     def net(self):
         return self.chain + ':' + self.network
@@ -92,16 +149,18 @@ class Substrate:
         self.ws_options = ws_options
         self.mode = mode
         if url == None:
-            url_options = self.urls[self.network].get('archive' if archive else 'rpc', [])
-            url = m.choice(url_options)
-            if not url.startswith(mode):
-                url = mode + '://' + url
-            self.url = url
+            # every endpoint of the network, the pool routes to the healthiest one
+            url = self.urls[self.network].get('archive' if archive else 'rpc', [])
+        if isinstance(url, str):
+            url = url.split(',')
+        self.endpoints = [u if u.startswith(mode) or '://' in u else mode + '://' + u for u in url]
+        self.url = self.endpoints[0]
         self.set_connections(num_connections)
         self.wait_for_finalization = wait_for_finalization
         return {
                 'network': self.network, 
                 'url': self.url, 
+                'endpoints': self.endpoints,
                 'mode': self.mode, 
                 'num_connections': self.num_connections, 
                 'wait_for_finalization': self.wait_for_finalization
@@ -127,19 +186,24 @@ class Substrate:
               period.
         """
 
-        if not hasattr(self, 'connections_queue'):
+        if getattr(self, 'pool', None) is None:
             self.set_connections(self.num_connections)
-        conn = self.connections_queue.get(timeout=timeout)
-        if init:
-            conn.init_runtime()  # type: ignore
-        try:
-            if conn.websocket and conn.websocket.connected:  # type: ignore
-                yield conn
-            else:
-                conn = SubstrateInterface(self.url, ws_options=self.ws_options)
-                yield conn
-        finally:
-            self.connections_queue.put(conn)
+        with self.pool.connection(timeout=timeout) as conn:
+            if init:
+                # cheap unless the spec version changed since the connection was initialised
+                conn.init_runtime()  # type: ignore
+            yield conn
+
+    def run(self, fn: Callable[[SubstrateInterface], Any], init: bool = False, retries: int = 2, timeout: float = None) -> Any:
+        """
+        Runs fn(conn) on the healthiest endpoint and retries it on another endpoint when that one fails,
+        only for requests that can be repeated (queries, not extrinsics)
+        """
+        def request(conn):
+            if init:
+                conn.init_runtime()
+            return fn(conn)
+        return self.pool.run(request, retries=retries, timeout=timeout)
 
     def get_storage_keys(
         self,
@@ -512,38 +576,6 @@ class Substrate:
             {'storage_function_name': {decoded_key: decoded_value, ...}, ...}
         """
 
-        def get_item_key_value(item_key: tuple[Any, ...]) -> tuple[Any, ...]:
-            if isinstance(item_key, tuple):
-                return tuple(k.value for k in item_key)
-            return item_key.value
-
-        def concat_hash_len(key_hasher: str) -> int:
-            """
-            Determines the length of the hash based on the given key hasher type.
-
-            Args:
-                key_hasher: The type of key hasher.
-
-            Returns:
-                The length of the hash corresponding to the given key hasher type.
-
-            Raises:
-                ValueError: If the key hasher type is not supported.
-
-            Example:
-                >>> concat_hash_len("Blake2_128Concat")
-                16
-            """
-
-            if key_hasher == "Blake2_128Concat":
-                return 16
-            elif key_hasher == "Twox64Concat":
-                return 8
-            elif key_hasher == "Identity":
-                return 0
-            else:
-                raise ValueError("Unsupported hash type")
-
         assert len(response) == len(function_parameters) == len(prefix_list)
         result_dict: dict[str, dict[Any, Any]] = {}
         for res, fun_params_tuple, prefix in zip(
@@ -553,47 +585,111 @@ class Substrate:
                 continue
             res = res[0]
             changes = res["changes"]  # type: ignore
-            value_type, param_types, key_hashers, params, storage_function = (
-                fun_params_tuple
-            )
+            storage_function = fun_params_tuple[4]
             with self.get_conn(init=True) as substrate:
-                for item in changes:
-                    # Determine type string
-                    key_type_string: list[Any] = []
-                    for n in range(len(params), len(param_types)):
-                        key_type_string.append(
-                            f"[u8; {concat_hash_len(key_hashers[n])}]"
-                        )
-                        key_type_string.append(param_types[n])
+                items = self._decode_storage_items(substrate, [(item[0], item[1]) for item in changes], prefix, fun_params_tuple, block_hash)
+            for key, value in items:
+                result_dict.setdefault(storage_function, {})
+                result_dict[storage_function][key] = value  # type: ignore
 
-                    item_key_obj = substrate.decode_scale(  # type: ignore
-                        type_string=f"({', '.join(key_type_string)})",
-                        scale_bytes="0x" + item[0][len(prefix):],
-                        return_scale_obj=True,
-                        block_hash=block_hash,
-                    )
-                    # strip key_hashers to use as item key
-                    if len(param_types) - len(params) == 1:
-                        item_key = item_key_obj.value_object[1]  # type: ignore
-                    else:
-                        item_key = tuple(  # type: ignore
-                            item_key_obj.value_object[key + 1]  # type: ignore
-                            for key in range(  # type: ignore
-                                len(params), len(param_types) + 1, 2
-                            )
-                        )
+        return result_dict
 
-                    item_value = substrate.decode_scale(  # type: ignore
-                        type_string=value_type,
-                        scale_bytes=item[1],
-                        return_scale_obj=True,
-                        block_hash=block_hash,
-                    )
-                    result_dict.setdefault(storage_function, {})
-                    key = get_item_key_value(item_key)  # type: ignore
-                    result_dict[storage_function][key] = item_value.value  # type: ignore
+    @staticmethod
+    def concat_hash_len(key_hasher: str) -> int:
+        """
+        Determines the length of the hash based on the given key hasher type.
 
-        return result_dict
+        Example:
+            >>> concat_hash_len("Blake2_128Concat")
+            16
+        """
+        if key_hasher == "Blake2_128Concat":
+            return 16
+        elif key_hasher == "Twox64Concat":
+            return 8
+        elif key_hasher == "Identity":
+            return 0
+        else:
+            raise ValueError("Unsupported hash type")
+
+    def _decode_storage_item(
+        self,
+        substrate: SubstrateInterface,
+        storage_key: str,
+        storage_value: str,
+        prefix: str,
+        fun_params_tuple: tuple[Any, Any, Any, Any, str],
+        block_hash: str,
+    ) -> tuple[Any, Any]:
+        """
+        Decodes the raw storage key and value of a map entry into its (key, value)
+        """
+        value_type, param_types, key_hashers, params, storage_function = fun_params_tuple
+        item_key_obj = substrate.decode_scale(  # type: ignore
+            type_string=self._storage_key_type(fun_params_tuple),
+            scale_bytes="0x" + storage_key[len(prefix):],
+            return_scale_obj=True,
+            block_hash=block_hash,
+        )
+        item_key = self._item_key([member.value for member in item_key_obj.value_object], len(params), len(param_types))
+
+        item_value = substrate.decode_scale(  # type: ignore
+            type_string=value_type,
+            scale_bytes=storage_value,
+            return_scale_obj=True,
+            block_hash=block_hash,
+        )
+        return item_key, item_value.value
+
+    def _storage_key_type(self, fun_params_tuple: tuple[Any, Any, Any, Any, str]) -> str:
+        """
+        The type string of the storage keys after the prefix: the hash and the value of every param left out
+        """
+        value_type, param_types, key_hashers, params, storage_function = fun_params_tuple
+        key_type_string: list[Any] = []
+        for n in range(len(params), len(param_types)):
+            key_type_string.append(f"[u8; {self.concat_hash_len(key_hashers[n])}]")
+            key_type_string.append(param_types[n])
+        return f"({', '.join(key_type_string)})"
+
+    @staticmethod
+    def _item_key(members: list, num_params: int, num_param_types: int) -> Any:
+        # strip key_hashers to use as item key
+        if num_param_types - num_params == 1:
+            return members[1]
+        return tuple(members[key + 1] for key in range(num_params, num_param_types + 1, 2))
+
+    def _decode_storage_items(
+        self,
+        substrate: SubstrateInterface,
+        items: list[tuple[str, str]],
+        prefix: str,
+        fun_params_tuple: tuple[Any, Any, Any, Any, str],
+        block_hash: str,
+    ) -> list[tuple[Any, Any]]:
+        """
+        Decodes a page of (raw storage key, raw storage value) entries of a map into (key, value) pairs
+
+        The key and value types are compiled once per runtime into plain decoders (fixed width ints,
+        accounts, hashes, bytes and the structs, tuples, vecs and options of these), the entries of other
+        types go through scalecodec item by item.
+        """
+        substrate.init_runtime(block_hash=block_hash)  # type: ignore
+        value_type, param_types, key_hashers, params, storage_function = fun_params_tuple
+        cache_key = (substrate.runtime_version, value_type, tuple(param_types), tuple(key_hashers), len(params))
+        decoder = self.storage_decoders.get(cache_key)
+        if decoder is None:
+            num_params, num_param_types = len(params), len(param_types)
+            decoder = self.storage_decoders[cache_key] = StorageDecoder(
+                substrate.runtime_config, value_type, self._storage_key_type(fun_params_tuple),
+                lambda members: self._item_key(members, num_params, num_param_types))
+        decoded = []
+        for storage_key, storage_value in items:
+            item = decoder.decode(storage_key[len(prefix):], storage_value)
+            if item is None:
+                item = self._decode_storage_item(substrate, storage_key, storage_value, prefix, fun_params_tuple, block_hash)
+            decoded.append(item)
+        return decoded
 
     def query_batch(
         self, functions: dict[str, list[tuple[str, list[Any]]]],
@@ -619,10 +715,10 @@ class Substrate:
         """
 
         m.print(f'QueryBatch({functions})', verbose=verbose)
-        result: dict[str, str] = {}
         if not functions:
             raise Exception("No result")
-        with self.get_conn(init=True) as substrate:
+        def request(substrate):
+            result: dict[str, str] = {}
             for module, queries in functions.items():
                 storage_keys: list[Any] = []
                 for fn, params in queries:
@@ -641,8 +737,9 @@ class Substrate:
                     query = item[1]
                     storage_fun = fun.storage_function
                     result[storage_fun] = query.value
+            return result
 
-        return result
+        return self.run(request, init=True)
 
     def query_batch_map(
         self,
@@ -716,19 +813,15 @@ class Substrate:
 
         results =  self.process_results(multi_result)
         if path != None:
-            print('Saving results to -->', path)
+            m.print('SaveResults', logger='chain', level='debug', fields={'path': path})
             m.put(path, results)
         return results
             
     def block_hash(self, block: Optional[int] = None) -> str:
-        with self.get_conn(init=True) as substrate:
-            block_hash = substrate.get_block_hash(block)
-        return block_hash
+        return self.run(lambda substrate: substrate.get_block_hash(block), init=True)
     
     def block(self, block: Optional[int] = None) -> int:
-        with self.get_conn(init=True) as substrate:
-            block_number = substrate.get_block_number(block)
-        return block_number
+        return self.run(lambda substrate: substrate.get_block_number(block), init=True)
     
     def runtime_spec_version(self):
         # Get the runtime version
@@ -769,14 +862,21 @@ class Substrate:
         update=False,
         block = None,
         block_hash: str = None,
+        full: bool = False,
     ) -> dict[Any, Any]:
         """
         Queries a storage map from a network node.
 
+        The map is kept as a snapshot keyed by block hash, refreshing it (update, max_age or
+        another block) only fetches and decodes the keys that changed since the snapshot.
+
         Args:
             name: The name of the storage map to query.
             params: A list of parameters for the query.
             module: The module in which the storage map is located.
+            max_age: The maximum age of the snapshot in seconds before it is refreshed.
+            update: Refresh the snapshot to the chain head.
+            full: Refetch the whole map instead of the changed keys.
 
         Returns:
             A dictionary representing the key-value pairs
@@ -788,37 +888,161 @@ class Substrate:
 
         if name == 'Weights':
             module = 'SubnetEmissionModule'
-        path =  self.get_path(f'{self.network}/query_map/{module}/{name}_params={params}')
-        result = m.get(path, None, max_age=max_age, update=update)
-        if result == None:
-            result = self.query_batch_map({module: [(name, params)]}, block_hash)
-            if extract_value:
-                if isinstance(result, dict):
-                    result = result
-                else:
-                    result =  {k.value: v.value for k, v in result}  # type: ignore
-            result = result.get(name, {})
-            keys = result.keys()
-            if any([isinstance(k, tuple) for k in keys]):
-                new_result = {}
-                for k,v in result.items():
-                    self.dict_put(new_result, list(k), v )  
-                result = new_result
-            m.put(path, result)
-
+        if block is not None and block_hash is None:
+            block_hash = self.block_hash(block)
+        snapshot = self.query_snapshot(name=name, params=params, module=module, max_age=max_age,
+                                       update=update, block_hash=block_hash, full=full)
+        result = snapshot.result()
+        if any([isinstance(k, tuple) for k in result.keys()]):
+            new_result = {}
+            for k,v in result.items():
+                self.dict_put(new_result, list(k), v )
+            result = new_result
         return self.process_results(result)
 
+    def snapshot_path(self, name: str, params: list[Any] = [], module: str = "Modules", historical: bool = False) -> str:
+        """
+        The file of the head snapshot of the map, or of its last snapshot at an explicit block (historical)
+        """
+        suffix = '_historical' if historical else ''
+        return self.get_path(f'{self.network}/snapshots/{module}/{name}_params={params}{suffix}.msgpack')
+
+    def query_snapshot(
+        self,
+        name: str,
+        params: list[Any] = [],
+        module: str = "Modules",
+        max_age: float = None,
+        update: bool = False,
+        block_hash: str = None,
+        full: bool = False,
+    ) -> StorageSnapshot:
+        """
+        Returns the snapshot of a storage map at the block hash (the chain head by default).
+
+        A cached snapshot is used as is unless it is older than max_age, a refresh is asked
+        (update) or another block is requested. It is then brought to the block with the keys
+        added or removed since (diffing state_getKeysPaged) and the values changed since
+        (state_queryStorage, or diffing the raw values if the node can't serve the range),
+        only the changed entries are decoded. The snapshots at an explicit block are kept apart
+        from the head snapshot (they start from it), so they never stand for the head.
+        """
+        head = block_hash is None
+        path = self.snapshot_path(name, params, module, historical=not head)
+        snapshot = None if full else StorageSnapshot.load(path)
+        if snapshot is not None and not update and block_hash in (None, snapshot.block_hash):
+            if max_age is None or snapshot.age() < max_age:
+                return snapshot
+        if not head and not full and (snapshot is None or snapshot.block_hash != block_hash):
+            snapshot = StorageSnapshot.load(self.snapshot_path(name, params, module)) or snapshot
+
+        with self.get_conn(init=True) as substrate:
+            storage_key = StorageKey.create_from_storage_function(  # type: ignore
+                module, name, params, runtime_config=substrate.runtime_config, metadata=substrate.metadata  # type: ignore
+            )
+            prefix = storage_key.to_hex()
+            fun_params = self.get_lists(module, [(name, params)], substrate)[0]
+            spec_version = substrate.runtime_version
+            block_hash = block_hash or substrate.get_chain_head()
+
+        if snapshot is not None and (snapshot.prefix != prefix or snapshot.spec_version != spec_version):
+            # the value types may have changed with the runtime
+            snapshot = None
+        if snapshot is None:
+            snapshot = StorageSnapshot(prefix, spec_version=spec_version)
+        if snapshot.block_hash == block_hash:
+            snapshot.timestamp = m.time()
+            snapshot.save(path)
+            return snapshot
+
+        keys = self.get_keys_paged(prefix, block_hash)
+        if snapshot.block_hash is None:
+            changes = self.query_storage_at(keys, block_hash)
+        else:
+            old_keys = snapshot.keys()
+            new_keys = [k for k in keys if k not in old_keys]
+            removed_keys = old_keys - set(keys)
+            kept_keys = [k for k in keys if k in old_keys]
+            changes = self.query_storage_at(new_keys, block_hash)
+            try:
+                changes.update(self.query_storage_changes(kept_keys, snapshot.block_hash, block_hash))
+            except Exception as e:
+                m.print(f'QueryStorage({module}/{name}) unavailable, diffing values: {e}', color='yellow')
+                values = self.query_storage_at(kept_keys, block_hash)
+                changes.update({k: v for k, v in values.items() if v != snapshot.entries[k][0]})
+            changes.update({k: None for k in removed_keys})
+
+        decoded_changes = [(key, None, None, None) for key, value in changes.items() if value is None]
+        items = [(key, value) for key, value in changes.items() if value is not None]
+        with self.get_conn(init=True) as substrate:
+            decoded = self._decode_storage_items(substrate, items, prefix, fun_params, block_hash)
+        decoded_changes += [(key, value, decoded_key, decoded_value) for (key, value), (decoded_key, decoded_value) in zip(items, decoded)]
+        snapshot.apply(decoded_changes, block_hash=block_hash)
+        snapshot.save(path)
+        return snapshot
+
+    def get_keys_paged(self, prefix: str, block_hash: str = None, page_size: int = 1000) -> list[str]:
+        """
+        All the storage keys under the prefix, fetched page by page with state_getKeysPaged
+        """
+        keys: list[str] = []
+        start_key = None
+        while True:
+            # every page is retried on its own, a failover does not restart the walk
+            response = self.run(lambda substrate: substrate.rpc_request("state_getKeysPaged", [prefix, page_size, start_key, block_hash]))
+            if 'error' in response:
+                raise NetworkQueryError(response['error'])
+            page = response.get('result') or []
+            keys += page
+            if len(page) < page_size:
+                return keys
+            start_key = page[-1]
+
+    def _request_chunks(self, method: str, keys: list[str], extra_params: list[Any], chunk_size: int) -> list[Any]:
+        requests = [(method, [keys[i:i + chunk_size]] + extra_params) for i in range(0, len(keys), chunk_size)]
+        if not requests:
+            return []
+        messages = self.rpc_request_batch(requests, extract_result=False)[0]
+        return [message.get('result') for message in sorted(messages, key=lambda message: message['id'])]
+
+    def query_storage_at(self, keys: list[str], block_hash: str = None, chunk_size: int = 1000) -> dict[str, Optional[str]]:
+        """
+        The raw values of the storage keys at the block hash, batched with state_queryStorageAt
+        """
+        values: dict[str, Optional[str]] = {}
+        for change_sets in self._request_chunks("state_queryStorageAt", keys, [block_hash], chunk_size):
+            for change_set in change_sets or []:
+                values.update({key: value for key, value in change_set['changes']})
+        return values
+
+    def query_storage_changes(
+        self, keys: list[str], from_block_hash: str, to_block_hash: str, chunk_size: int = 1000
+    ) -> dict[str, Optional[str]]:
+        """
+        The raw values of the storage keys that changed between two blocks (state_queryStorage)
+        """
+        changes: dict[str, Optional[str]] = {}
+        for change_sets in self._request_chunks("state_queryStorage", keys, [from_block_hash, to_block_hash], chunk_size):
+            for change_set in change_sets or []:
+                if change_set['block'] == from_block_hash:
+                    # the first change set holds the values at from_block_hash
+                    continue
+                changes.update({key: value for key, value in change_set['changes']})
+        return changes
+
     def process_results(self, x:dict) -> dict:
         new_x = {}
+        nested = False
         for k in list(x.keys()):
             if type(k) in  [tuple, list]:
                 self.dict_put(new_x, list(k), x[k])
-                new_x = self.process_results(new_x)
+                nested = True
             elif isinstance(x[k], dict):
                 new_x[k] = self.process_results(x[k])
             else:
                 new_x[k] = x[k]
-        return new_x
+        # the nested dicts are processed once, not after every key
+        return self.process_results(new_x) if nested else new_x
                 
     def dict_put(self, input_dict: dict ,keys : list, value: Any ):
         """
@@ -881,7 +1105,6 @@ class Substrate:
             
             future2addresses = {}
             for i in range(0, len(addresses), chunk_size):
-                print(f'Getting balances for addresses {i} to {i + chunk_size}...')
                 chunk = addresses[i:i + chunk_size]
                 params = dict(addresses=chunk, extract_value=extract_value, block_hash=block_hash, threads=1)
                 future2addresses[m.submit(self.get_balances, params)] = chunk
@@ -922,7 +1145,7 @@ class Substrate:
         path = self.get_path(f'{self.network}/balance/{addr}')
         balance = m.get(path, None, update=update)
         if balance == None:
-            print(f'r {addr} from network...')
+            m.print('QueryBalance', logger='chain', level='debug', fields={'address': addr})
             balance = self.query("Account", module="System", params=[addr])['data']['free']
             m.put(path, balance)
         return self.format_amount(balance, fmt=fmt)
@@ -1224,7 +1447,7 @@ class Substrate:
             "network": self.network,
         }
 
-        m.print(f"Call(network={self.network}\nmodule={info_call['module']} \nfn={info_call['fn']} \nkey={key.ss58_address} \nparams={info_call['params']}) \n)", color='cyan')
+        m.print(f"Call(network={self.network}\nmodule={info_call['module']} \nfn={info_call['fn']} \nkey={key.ss58_address} \nparams={info_call['params']}) \n)", color='cyan', logger='chain')
 
         if safety:
             if input('Are you sure you want to send this transaction? (y/n) --> ') != 'y':
@@ -1242,7 +1465,6 @@ class Substrate:
             if sudo:
                 call = substrate.compose_call(call_module="Sudo", call_function="sudo", call_params={"call": call.value})
 
-            nonce=nonce or substrate.get_account_nonce(key.ss58_address)
             if multisig != None:
                 multisig = self.get_multisig(multisig)
                 # send the multisig extrinsic
@@ -1252,15 +1474,24 @@ class Substrate:
                                                                 multisig_account=multisig, 
                                                                 era=None,  # type: ignore
                 )
-            else:
+            elif nonce is not None:
                 extrinsic = substrate.create_signed_extrinsic(call=call, keypair=key, nonce=nonce, tip=tip)  # type: ignore
-
-
-            response = substrate.submit_extrinsic(
-                extrinsic=extrinsic,
-                wait_for_inclusion=wait_for_inclusion,
-                wait_for_finalization=wait_for_finalization,
-            )
+            else:
+                # the nonce comes from the local nonce manager, resynced if the node rejects it
+                result = self.submit_calls(substrate, [call], key, wait_for_inclusion=wait_for_inclusion,
+                                           wait_for_finalization=wait_for_finalization, tip=tip)[0]
+                if 'error' in result:
+                    raise ChainTransactionError(result['error'], result)  # type: ignore
+                response = ExtrinsicReceipt(substrate=substrate, extrinsic_hash=result['tx_hash'],
+                                            block_hash=result['block_hash'], finalized=result['finalized'])
+                extrinsic = None
+
+            if extrinsic is not None:
+                response = substrate.submit_extrinsic(
+                    extrinsic=extrinsic,
+                    wait_for_inclusion=wait_for_inclusion,
+                    wait_for_finalization=wait_for_finalization,
+                )
         if wait_for_inclusion:
             if not response.is_success:
                 raise ChainTransactionError(
@@ -1277,6 +1508,176 @@ class Substrate:
                 response =  {'success': False, 'error': response.error_message, 'module': module, 'fn':fn, 'url': self.url,  'network': self.network, 'key':key.ss58_address }
         return response
 
+    def account_next_index(self, substrate: SubstrateInterface, address: Ss58Address) -> int:
+        """
+        The next nonce of the account, counting the extrinsics that are still in the transaction pool
+        """
+        return substrate.rpc_request('system_accountNextIndex', [address])['result'] or 0
+
+    def submit_calls(
+        self,
+        substrate: SubstrateInterface,
+        calls: list[Any],
+        key: Keypair,
+        wait_for_inclusion: bool = True,
+        wait_for_finalization: bool = False,
+        tip: int = 0,
+        timeout: float = None,
+        retries: int = 3,
+    ) -> list[dict[str, Any]]:
+        """
+        Signs the calls with consecutive nonces from the nonce manager and submits them back to back on one
+        connection, then follows all their statuses at once.
+
+        A call whose nonce is rejected as used or outdated ("Priority is too low", "Transaction is outdated")
+        is signed again after a resync of the nonce and resubmitted after the others.
+
+        Returns:
+            A dict per call with the tx_hash, nonce and status, and the block_hash it was included in
+            (or the error of the node).
+        """
+        address = key.ss58_address
+        fetch = lambda address: self.account_next_index(substrate, address)
+        watch = wait_for_inclusion or wait_for_finalization
+        method = 'author_submitAndWatchExtrinsic' if watch else 'author_submitExtrinsic'
+        results: list[dict[str, Any]] = [{} for _ in calls]
+        todo = list(range(len(calls)))
+        for attempt in range(retries + 1):
+            nonces = self.nonces.next(address, fetch, n=len(todo))
+            extrinsics = [substrate.create_signed_extrinsic(call=calls[i], keypair=key, nonce=nonce, tip=tip)  # type: ignore
+                          for i, nonce in zip(todo, nonces)]
+            responses = substrate.rpc_request_many([(method, [str(extrinsic.data)]) for extrinsic in extrinsics])
+            stale, failed = [], False
+            for i, nonce, extrinsic, response in zip(todo, nonces, extrinsics, responses):
+                results[i] = {'tx_hash': f'0x{extrinsic.extrinsic_hash.hex()}', 'nonce': nonce, 'block_hash': None,
+                              'finalized': False, 'status': 'submitted'}
+                if 'error' in response:
+                    results[i].update(status='rejected', error=response['error'])
+                    if is_nonce_error(response['error']) and attempt < retries:
+                        stale.append(i)
+                    else:
+                        failed = True
+                elif watch:
+                    results[i]['subscription'] = response['result']
+            if failed:
+                # the nonce of a rejected extrinsic is not used, so the following ones would wait behind the gap
+                self.nonces.invalidate(address)
+            elif stale:
+                self.nonces.resync(address, fetch)
+            if not stale:
+                break
+            todo = stale
+
+        if watch:
+            subscriptions = {r['subscription']: r['tx_hash'] for r in results if 'subscription' in r}
+            statuses = substrate.watch_extrinsics(subscriptions, wait_for_finalization=wait_for_finalization, timeout=timeout)
+            for result in results:
+                if 'subscription' not in result:
+                    continue
+                status = statuses[result.pop('subscription')]
+                result.update(block_hash=status['block_hash'], finalized=status['finalized'], status=status['status'])
+                if status['block_hash'] is None:
+                    result['error'] = f'extrinsic {status["status"]}'
+                    if status['status'] != 'timeout':
+                        self.nonces.invalidate(address)
+        return results
+
+    def check_receipts(self, substrate: SubstrateInterface, results: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """
+        Sets the success (and error) of the included extrinsics from their events, reading each block once
+        """
+        block2results = defaultdict(list)
+        for result in results:
+            if result.get('block_hash'):
+                block2results[result['block_hash']].append(result)
+            else:
+                result['success'] = False
+        for block_hash, block_results in block2results.items():
+            extrinsics = substrate.get_block(block_hash=block_hash)['extrinsics']
+            hash2idx = {f'0x{e.extrinsic_hash.hex()}': i for i, e in enumerate(extrinsics) if e.extrinsic_hash}
+            idx2success = {}
+            for event in substrate.get_events(block_hash=block_hash):
+                if event.value['module_id'] == 'System' and event.value['event_id'] in ['ExtrinsicSuccess', 'ExtrinsicFailed']:
+                    idx2success[event.value['extrinsic_idx']] = event.value['event_id'] == 'ExtrinsicSuccess'
+            for result in block_results:
+                idx = hash2idx.get(result['tx_hash'])
+                result['success'] = idx2success.get(idx, False)
+                if idx is None:
+                    result['error'] = 'extrinsic not found in block'
+                elif not result['success']:
+                    result['error'] = ExtrinsicReceipt(substrate=substrate, extrinsic_hash=result['tx_hash'],
+                                                       block_hash=block_hash, extrinsic_idx=idx).error_message
+        return results
+
+    def call_many(
+        self,
+        calls: list[Any],
+        key: Keypair = None,
+        module: str = "Modules",
+        batch: Union[bool, int] = False,
+        wait_for_inclusion: bool = True,
+        wait_for_finalization: bool = False,
+        sudo: bool = False,
+        tip: int = 0,
+        timeout: float = 120,
+        safety: bool = False,
+    ) -> list[dict[str, Any]]:
+        """
+        Composes, signs and submits a sequence of calls without waiting for each one to be included.
+
+        The extrinsics get consecutive nonces from the local nonce manager and are submitted back to back,
+        then their inclusion is tracked at once, so n calls take about one block instead of n blocks.
+        With batch, the calls are packed into utility.batch_all extrinsics (of batch calls each if batch
+        is an int), which succeed or fail as a whole.
+
+        Args:
+            calls: The calls as (fn, params), (fn, params, module) or {'fn', 'params', 'module'}.
+            key: The keypair for signing the extrinsics.
+            module: The module of the calls that do not name one.
+            batch: Pack the calls into utility.batch_all extrinsics.
+            wait_for_inclusion: Wait for the extrinsics to be included in a block.
+            wait_for_finalization: Wait for the extrinsics to be finalized.
+            timeout: Seconds to wait for the inclusion of all the extrinsics.
+
+        Returns:
+            A dict per extrinsic with its success, tx_hash, nonce and block_hash (or error).
+        """
+        key = self.get_key(key)
+        calls = [dict(zip(['fn', 'params', 'module'], c)) if isinstance(c, (list, tuple)) else dict(c) for c in calls]
+        for c in calls:
+            c.setdefault('params', {})
+            c['module'] = c.get('module') or module
+        m.print(f"CallMany(network={self.network} key={key.ss58_address} calls={len(calls)} batch={batch})", color='cyan', logger='chain')
+        if safety:
+            if input(f'Are you sure you want to send {len(calls)} calls? (y/n) --> ') != 'y':
+                raise Exception('Transaction cancelled by user')
+
+        with self.get_conn(init=True) as substrate:
+            composed = []
+            for c in calls:
+                call = substrate.compose_call(call_module=c['module'], call_function=c['fn'], call_params=c['params'])  # type: ignore
+                if sudo:
+                    call = substrate.compose_call(call_module="Sudo", call_function="sudo", call_params={"call": call.value})
+                composed.append(call)
+            infos = [{'module': c['module'], 'fn': c['fn']} for c in calls]
+            if batch:
+                size = len(composed) if batch is True else int(batch)
+                chunks = [range(i, min(i + size, len(composed))) for i in range(0, len(composed), size)]
+                composed = [substrate.compose_call(call_module='Utility', call_function='batch_all',
+                                                   call_params={'calls': [composed[i].value for i in chunk]})
+                            for chunk in chunks]
+                infos = [{'module': 'Utility', 'fn': 'batch_all', 'calls': [calls[i]['fn'] for i in chunk]}
+                         for chunk in chunks]
+            results = self.submit_calls(substrate, composed, key, wait_for_inclusion=wait_for_inclusion,
+                                        wait_for_finalization=wait_for_finalization, tip=tip, timeout=timeout)
+            if wait_for_inclusion or wait_for_finalization:
+                self.check_receipts(substrate, results)
+            else:
+                for result in results:
+                    result['success'] = 'error' not in result
+        return [dict(info, **result, key=key.ss58_address, network=self.network, url=self.url)
+                for info, result in zip(infos, results)]
+
     def call_multisig(
         self,
         fn: str,
@@ -1444,90 +1845,138 @@ class Substrate:
     mss = multisigs
 
 
-    def events(self, block=None, back=None, from_block = None, to_block=None) -> list[dict[str, Any]]:
+    def event_index(self) -> EventIndex:
         """
-        Get events from a specific block or the latest block
+        The index of the events of the network
         """
-        if back != None or from_block != None or to_block != None:
-            if from_block is not None and to_block is not None:
-                block = to_block
-                since = from_block
-            elif back is not None:
-                block = self.block()
-                since = block - back
-            else:
-                raise ValueError("Must specify either 'back' or 'from_block' and 'to_block'")
-            assert since < block, f"Block {block} is not greater than since {since}"
-            block2events  = {}
-            future2block = {}
-            for block in range(since, block + 1):
-                path = self.get_path(f'events/{block}')
-                events = m.get(path, None)
-                if events is not None:
-                    m.print(f"Events for block {block} already cached, returning cached events", color='green')
-                    block2events[block] = events
-                    continue
-                print(f"Getting events for block {block}")
-                f = m.submit(self.events, params=dict(block=block), timeout=60)
-                future2block[f] = block
-            for future in m.as_completed(future2block):
-                block = future2block[future]
-                events = future.result()
-                block2events[block] = events
-                print(f"Got {len(events)} events for block {block}")
-
-            return block2events
-
-        block = block or self.block()
-        path = self.get_path(f'events/{block}')
-        events = m.get(path, None)
-        if events is not None:
-            m.print(f"Events for block {block} already cached, returning cached events", color='green')
-            return events
-        block_hash = self.block_hash(block)
-        with self.get_conn(init=True) as substrate:
-            # Get events from the block
-            events = substrate.get_events(block_hash)
-        
-        events = [e.value for e in events]
-        # include the tx hash
+        path = self.get_path(f'{self.network}/events.sqlite')
+        if getattr(self, '_event_index', None) is None or self._event_index.path != path:
+            self._event_index = EventIndex(path)
+        return self._event_index
+
+    def block_range(self, block=None, back=None, from_block=None, to_block=None) -> tuple[int, int]:
+        if from_block is not None and to_block is not None:
+            since, block = from_block, to_block
+        elif back is not None:
+            block = self.block() if block is None else block
+            since = block - back
+        else:
+            raise ValueError("Must specify either 'back' or 'from_block' and 'to_block'")
+        assert since <= block, f"Block {block} is before since {since}"
+        return since, block
+
+    def _batch(self, requests: list[tuple[str, list[Any]]], chunk_size: int = 500) -> list[Any]:
+        """
+        Sends the requests in chunks with rpc_request_batch_chunked and returns the results in request order
+        """
+        if not requests:
+            return []
+        chunks = [Chunk(requests[i:i + chunk_size], [], []) for i in range(0, len(requests), chunk_size)]
+        chunk_results, _ = self.rpc_request_batch_chunked(chunks, extract_result=False)
+        results = []
+        for messages in chunk_results:
+            results += [message.get('result') for message in sorted(messages, key=lambda message: message['id'])]
+        return results
 
-        m.put(path, events)
-        return events
+    def index_events(self, from_block: int, to_block: int, chunk_size: int = 500) -> dict:
+        """
+        Indexes the events of the blocks in the range (inclusive) that are not indexed yet.
+
+        The block hashes and raw System.Events of the missing blocks are fetched in batches and
+        decoded per runtime: the range is bisected on the spec version of the parent blocks (the
+        runtime that emitted the events), so every segment is decoded with a single runtime.
+        """
+        index = self.event_index()
+        missing = index.missing(from_block, to_block)
+        if not missing:
+            return {'blocks': 0, 'events': 0}
+        with self.get_conn(init=True) as substrate:
+            events_key = StorageKey.create_from_storage_function(  # type: ignore
+                'System', 'Events', [], runtime_config=substrate.runtime_config, metadata=substrate.metadata  # type: ignore
+            ).to_hex()
+
+        hashes = []
+        for chunk_hashes in self._batch([("chain_getBlockHash", [missing[i:i + chunk_size]]) for i in range(0, len(missing), chunk_size)]):
+            hashes += chunk_hashes
+        raw_events = []
+        for change_sets in self._batch([("state_queryStorageAt", [[events_key], h]) for h in hashes], chunk_size):
+            changes = change_sets[0]['changes'] if change_sets else []
+            raw_events.append(changes[0][1] if changes else None)
+
+        # the events of a block are emitted (and decoded) by the runtime of its parent block
+        versions = {}
+        def spec_version(i):
+            if i not in versions:
+                if i > 0 and missing[i - 1] == missing[i] - 1:
+                    parent_hash = hashes[i - 1]
+                elif missing[i] == 0:
+                    parent_hash = hashes[i]
+                else:
+                    parent_hash = self._batch([("chain_getHeader", [hashes[i]])])[0]['parentHash']
+                versions[i] = self._batch([("state_getRuntimeVersion", [parent_hash])])[0]['specVersion']
+            return versions[i]
+        def segments(lo, hi):
+            if spec_version(lo) == spec_version(hi):
+                return [(lo, hi)]
+            mid = (lo + hi) // 2
+            return segments(lo, mid) + segments(mid + 1, hi)
+
+        n = 0
+        for lo, hi in segments(0, len(hashes) - 1):
+            blocks = []
+            with self.get_conn(init=True) as substrate:
+                # init_runtime loads the runtime of the parent block, the one of the whole segment
+                substrate.init_runtime(block_hash=hashes[hi])
+                value_type = substrate.metadata.get_metadata_pallet('System').get_storage_function('Events').get_value_type_string()
+                for i in range(lo, hi + 1):
+                    events = []
+                    if raw_events[i] is not None:
+                        obj = substrate.runtime_config.create_scale_object(
+                            value_type, data=ScaleBytes(raw_events[i]), metadata=substrate.metadata
+                        )
+                        events = obj.decode()
+                    blocks.append((missing[i], hashes[i], spec_version(hi), events))
+            n += index.add(blocks)
+        return {'blocks': len(missing), 'events': n, 'runtimes': len(set(versions.values()))}
 
+    def events(self, block=None, back=None, from_block = None, to_block=None,
+               module: str = None, event: str = None, account: str = None) -> list[dict[str, Any]]:
+        """
+        Get events from a specific block or the latest block, or the events per block of a range.
 
-    def transfer_events(self, block=None, back=None):
+        Missing blocks are indexed first, the events can be filtered by module, event id and account.
+        """
+        if back != None or from_block != None or to_block != None:
+            since, block = self.block_range(block=block, back=back, from_block=from_block, to_block=to_block)
+        else:
+            block = block or self.block()
+            since = block
+        self.index_events(since, block)
+        index = self.event_index()
+        if module is not None or event is not None or account is not None:
+            return index.query(module_id=module, event_id=event, account=account, from_block=since, to_block=block)
+        block2events = index.block_events(since, block)
+        if since == block:
+            return block2events.get(block, [])
+        return block2events
+
+    def transfer_events(self, block=None, back=None, from_block=None, to_block=None, account: str = None):
         """
         Get transfer events from the blockchain
         
         Args:
             block: Specific block number to check (if None, uses latest)
             back: Number of blocks to look back from current block
+            account: Only the transfers from or to this account
         
         Returns:
             List of transfer events
         """
-        # Get all events
-        events = self.events(block=block, back=back)
-        transfer_events = []
-        # If back is specified, we get a dict of block->events
-        if back is not None:
-            for block_num, block_events in events.items():
-                for event in block_events:
-                    # Check if this is a transfer event from Balances module
-                    if (event.get('module_id') == 'Balances' and 
-                        event.get('event_id') == 'Transfer'):
-                        event['block'] = block_num
-                        transfer_events.append(event)
-        else:
-            # Single block events
-            for event in events:
-                if (event.get('module_id') == 'Balances' and 
-                    event.get('event_id') == 'Transfer'):
-                    event['block'] = block
-                    transfer_events.append(event)
-        
-        return transfer_events
+        if back is None and from_block is None and to_block is None:
+            block = block or self.block()
+            from_block, to_block = block, block
+        return self.events(block=block, back=back, from_block=from_block, to_block=to_block,
+                           module='Balances', event='Transfer', account=account)
 
     def pallets(self) -> list[str]:
         """
@@ -1733,13 +2182,11 @@ class Substrate:
         fn: str,
         params: dict[str, Any],
     ):
-        print(f"Composing call: mod={mod}, fn={fn}, params={params}")
         with self.get_conn() as conn:
-            print(f"Got substrate connection: {conn}")
             call = conn.compose_call(  # type: ignore
                 call_module=mod, call_function=fn, call_params=params
             )
-            print(f"Composed call: {call}")
+        m.print('ComposeCall', logger='chain', level='debug', fields={'mod': mod, 'fn': fn, 'params': params})
         return call
 
     def get_signature_payload(
@@ -1760,7 +2207,6 @@ class Substrate:
             kwargs = dict(call=call, era=era or '00', nonce=nonce, tip=tip, tip_asset_id=tip_asset_id)
             signature_payload = substrate.generate_signature_payload(**kwargs)
         # convert scale bytes to bytes
-        print(f"Generated signature payload: {signature_payload.to_hex()}")
         return signature_payload.to_hex()
 
     def nonce(self, address: Ss58Address) -> int:
@@ -1797,7 +2243,6 @@ class Substrate:
             The receipt of the submitted extrinsic.
         """
 
-        m.print(params, 'PARAMS')
         if isinstance(params, dict) and 'value' in params:
             params['value'] = int(params['value'])
 
@@ -1819,14 +2264,8 @@ class Substrate:
             )
         # convert string interger to scale bytes
         # verify signature
-        print(f"Verifying signature for address {address}")
-        print(f"Signature payload: {signature_payload}")
-        print(f"Signature: {signature}")
-
         assert m.verify(signature_payload, signature, address), f"Invalid signature {signature_payload} {signature} {address}"
-        print(f"Signature verified for address {address}")
-
-        print(f"Submitting call: mod={mod}, fn={fn}, params={params}, address={address}, nonce={nonce}")
+        m.print('SubmitCall', logger='chain', level='debug', fields={'mod': mod, 'fn': fn, 'params': params, 'address': address, 'nonce': nonce})
         
         with self.get_conn() as substrate:
             call = substrate.compose_call(  # type: ignore
@@ -0,0 +1,164 @@
+import json
+from typing import *
+
+PRIMITIVES = ['bool', 'u8', 'u16', 'u32', 'u64', 'u128', 'str']
+
+def synth_metadata(pallets: int = 40, storage: int = 12, calls: int = 12, fields: int = 4, path: str = None) -> str:
+    """
+    build a V14 metadata blob shaped like a substrate runtime (a portable registry with composite, variant,
+    sequence and array types referenced by the storage, calls and events of every pallet, plus the System
+    events, the Balances transfers, the Utility batches and a signed extrinsic format)
+    use node.record(url, [('state_getMetadata', [])], path) to replace it with the metadata of a live node
+    """
+    from scalecodec.base import RuntimeConfiguration
+    from scalecodec.type_registry import load_type_registry_preset
+    types = []
+
+    def add(definition: dict, path: list = None, docs: list = None, params: dict = None) -> int:
+        params = [{'name': name, 'type': ty} for name, ty in (params or {}).items()]
+        types.append({'id': len(types), 'type': {'path': path or [], 'params': params, 'def': definition, 'docs': docs or []}})
+        return len(types) - 1
+
+    def variant(path: list, variants: dict, params: dict = None, type_names: dict = {}) -> int:
+        return add({'variant': {'variants': [
+            {'name': name, 'fields': [{'name': n, 'type': t, 'typeName': type_names.get(t), 'docs': []} for n, t in variant_fields], 'index': i, 'docs': []}
+            for i, (name, variant_fields) in variants.items()]}}, path=path, params=params)
+
+    primitive = {p: add({'primitive': p}) for p in PRIMITIVES}
+    account = add({'array': {'len': 32, 'type': primitive['u8']}}, path=['sp_core', 'crypto', 'AccountId32'])
+    bytes_type = add({'sequence': {'type': primitive['u8']}})
+    h256 = add({'array': {'len': 32, 'type': primitive['u8']}}, path=['primitive_types', 'H256'])
+    unit = add({'tuple': []})
+    compact = {p: add({'compact': {'type': primitive[p]}}) for p in ['u32', 'u64', 'u128']}
+    # the RuntimeCall enum is filled in once the calls of every pallet are known
+    runtime_call = add({'variant': {'variants': []}}, path=['modchain_runtime', 'RuntimeCall'])
+    field_types = [(primitive['u64'], 'u64'), (primitive['u128'], 'u128'), (account, 'AccountId'), (bytes_type, 'Vec<u8>'),
+                   (primitive['bool'], 'bool'), (primitive['u16'], 'u16')]
+
+    def field(name: str, i: int) -> dict:
+        ty, type_name = field_types[i % len(field_types)]
+        return {'name': name, 'type': ty, 'typeName': type_name, 'docs': []}
+
+    def variants(name: str, n: int) -> int:
+        return add({'variant': {'variants': [
+            {'name': f'{name}_{i}', 'fields': [field(f'arg_{j}', i + j) for j in range(fields)], 'index': i, 'docs': [f'the {name} {i}']}
+            for i in range(n)]}}, path=[name])
+
+    pallet_metadata = []
+    for p in range(pallets):
+        name = f'Pallet{p}'
+        entries = []
+        for s in range(storage):
+            value = add({'composite': {'fields': [field(f'field_{f}', s + f) for f in range(fields)]}},
+                        path=[name.lower(), f'Value{s}'], docs=[f'the value of {name}.Storage{s}'])
+            if s % 3 == 0:
+                entry_type = {'Plain': value}
+            else:
+                entry_type = {'Map': {'hashers': ['Blake2_128Concat' if s % 2 else 'Identity'], 'key': account if s % 2 else primitive['u16'], 'value': value}}
+            entries.append({'name': f'Storage{s}', 'modifier': 'Default', 'type': entry_type,
+                            'default': '0x' + '00' * 8, 'documentation': [f'{name} storage {s}']})
+        pallet_metadata.append({
+            'name': name,
+            'storage': {'prefix': name, 'entries': entries},
+            'calls': {'ty': variants(f'{name}Call', calls)},
+            'event': {'ty': variants(f'{name}Event', calls)},
+            'constants': [{'name': 'Const', 'type': primitive['u32'], 'value': '0x01000000', 'documentation': []}],
+            'error': {'ty': variants(f'{name}Error', calls // 2 or 1)},
+            'index': p + 2,
+        })
+
+    # System.Events, Balances.Transfer and Utility.batch_all, shaped like frame_system, pallet_balances and pallet_utility
+    def event_type(path: list, events: dict) -> int:
+        return variant(path, dict(enumerate(events.items())))
+    weight = add({'composite': {'fields': [{'name': n, 'type': compact['u64'], 'typeName': None, 'docs': []} for n in ['ref_time', 'proof_size']]}},
+                 path=['sp_weights', 'weight_v2', 'Weight'])
+    dispatch_info = add({'composite': {'fields': [{'name': n, 'type': t, 'typeName': None, 'docs': []} for n, t in [
+        ('weight', weight),
+        ('class', event_type(['frame_support', 'dispatch', 'DispatchClass'], {'Normal': [], 'Operational': [], 'Mandatory': []})),
+        ('pays_fee', event_type(['frame_support', 'dispatch', 'Pays'], {'Yes': [], 'No': []}))]]}},
+        path=['frame_support', 'dispatch', 'DispatchInfo'])
+    module_error = add({'composite': {'fields': [{'name': 'index', 'type': primitive['u8'], 'typeName': None, 'docs': []},
+        {'name': 'error', 'type': add({'array': {'len': 4, 'type': primitive['u8']}}), 'typeName': None, 'docs': []}]}},
+        path=['sp_runtime', 'ModuleError'])
+    dispatch_error = event_type(['sp_runtime', 'DispatchError'], {'Other': [], 'CannotLookup': [], 'BadOrigin': [], 'Module': [(None, module_error)]})
+    system_event = event_type(['frame_system', 'pallet', 'Event'], {
+        'ExtrinsicSuccess': [('dispatch_info', dispatch_info)],
+        'ExtrinsicFailed': [('dispatch_error', dispatch_error), ('dispatch_info', dispatch_info)],
+        'NewAccount': [('account', account)],
+    })
+    balances_event = event_type(['pallet_balances', 'pallet', 'Event'], {
+        'Transfer': [('from', account), ('to', account), ('amount', primitive['u128'])],
+        'Deposit': [('who', account), ('amount', primitive['u128'])],
+    })
+    calls_type = add({'sequence': {'type': runtime_call}})
+    utility_call = variant(['pallet_utility', 'pallet', 'Call'], {0: ('batch', [('calls', calls_type)]), 2: ('batch_all', [('calls', calls_type)])},
+                           type_names={calls_type: 'Vec<<T as Config>::RuntimeCall>'})
+    utility_event = event_type(['pallet_utility', 'pallet', 'Event'], {
+        'BatchInterrupted': [('index', primitive['u32']), ('error', dispatch_error)],
+        'BatchCompleted': [],
+        'ItemCompleted': [],
+    })
+    utility_index = pallets + 2
+    pallet_events = [('System', 0, system_event), ('Balances', 1, balances_event)] + [
+        (pallet['name'], pallet['index'], pallet['event']['ty']) for pallet in pallet_metadata] + [('Utility', utility_index, utility_event)]
+    runtime_event = add({'variant': {'variants': [
+        {'name': name, 'fields': [{'name': None, 'type': ty, 'typeName': None, 'docs': []}], 'index': index, 'docs': []}
+        for name, index, ty in pallet_events]}}, path=['modchain_runtime', 'RuntimeEvent'])
+    pallet_calls = [(pallet['name'], pallet['index'], pallet['calls']['ty']) for pallet in pallet_metadata] + [('Utility', utility_index, utility_call)]
+    types[runtime_call]['type']['def'] = {'variant': {'variants': [
+        {'name': name, 'fields': [{'name': None, 'type': ty, 'typeName': None, 'docs': []}], 'index': index, 'docs': []}
+        for name, index, ty in pallet_calls]}}
+    phase = event_type(['frame_system', 'Phase'], {'ApplyExtrinsic': [(None, primitive['u32'])], 'Finalization': [], 'Initialization': []})
+    event_record = add({'composite': {'fields': [
+        {'name': 'phase', 'type': phase, 'typeName': None, 'docs': []},
+        {'name': 'event', 'type': runtime_event, 'typeName': None, 'docs': []},
+        {'name': 'topics', 'type': add({'sequence': {'type': h256}}), 'typeName': None, 'docs': []},
+    ]}}, path=['frame_system', 'EventRecord'])
+    events = add({'sequence': {'type': event_record}})
+    pallet_metadata = [
+        {'name': 'System', 'storage': {'prefix': 'System', 'entries': [
+            {'name': 'Events', 'modifier': 'Default', 'type': {'Plain': events}, 'default': '0x00', 'documentation': []}]},
+         'calls': None, 'event': {'ty': system_event}, 'constants': [], 'error': None, 'index': 0},
+        {'name': 'Balances', 'storage': None, 'calls': None, 'event': {'ty': balances_event}, 'constants': [], 'error': None, 'index': 1},
+    ] + pallet_metadata + [
+        {'name': 'Utility', 'storage': None, 'calls': {'ty': utility_call}, 'event': {'ty': utility_event}, 'constants': [], 'error': None, 'index': utility_index},
+    ]
+
+    # a v4 signed extrinsic with a MultiAddress, a MultiSignature and the usual signed extensions
+    address = variant(['sp_runtime', 'multiaddress', 'MultiAddress'], {
+        0: ('Id', [(None, account)]), 1: ('Index', [(None, compact['u32'])]), 2: ('Raw', [(None, bytes_type)]),
+        3: ('Address32', [(None, account)]), 4: ('Address20', [(None, add({'array': {'len': 20, 'type': primitive['u8']}}))]),
+    }, params={'AccountId': account, 'AccountIndex': unit})
+    signature = variant(['sp_runtime', 'MultiSignature'], {
+        0: ('Ed25519', [(None, add({'array': {'len': 64, 'type': primitive['u8']}}))]),
+        1: ('Sr25519', [(None, add({'array': {'len': 64, 'type': primitive['u8']}}))]),
+        2: ('Ecdsa', [(None, add({'array': {'len': 65, 'type': primitive['u8']}}))]),
+    })
+    era = variant(['sp_runtime', 'generic', 'era', 'Era'], {0: ('Immortal', [])})
+    signed_extensions = [
+        ('CheckSpecVersion', unit, primitive['u32']),
+        ('CheckTxVersion', unit, primitive['u32']),
+        ('CheckGenesis', unit, h256),
+        ('CheckMortality', era, h256),
+        ('CheckNonce', compact['u32'], unit),
+        ('CheckWeight', unit, unit),
+        ('ChargeTransactionPayment', compact['u128'], unit),
+    ]
+    extra = add({'tuple': [ty for _, ty, _ in signed_extensions]})
+    extrinsic = add({'sequence': {'type': primitive['u8']}}, path=['sp_runtime', 'generic', 'unchecked_extrinsic', 'UncheckedExtrinsic'],
+                    params={'Address': address, 'Call': runtime_call, 'Signature': signature, 'Extra': extra})
+    value = ['0x6d657461', {'V14': {
+        'types': {'types': types},
+        'pallets': pallet_metadata,
+        'extrinsic': {'ty': extrinsic, 'version': 4, 'signed_extensions': [
+            {'identifier': name, 'ty': ty, 'additional_signed': additional} for name, ty, additional in signed_extensions]},
+        'runtime_type': primitive['u8'],
+    }}]
+    runtime_config = RuntimeConfiguration()
+    runtime_config.update_type_registry(load_type_registry_preset('core'))
+    metadata = runtime_config.create_scale_object('MetadataVersioned')
+    data = str(metadata.encode(value))
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(json.dumps({'method': 'state_getMetadata', 'result': data}) + '\n')
+    return data
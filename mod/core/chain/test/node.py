@@ -0,0 +1,409 @@
+import os
+import json
+import time
+import base64
+import socket
+import struct
+import random
+import hashlib
+import threading
+from typing import *
+from scalecodec.base import ScaleBytes
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+# the subscriptions that are not named *_subscribe*, with the methods of their notifications and of their unsubscribe
+WATCH_METHODS = {'author_submitAndWatchExtrinsic': ('author_extrinsicUpdate', 'author_unwatchExtrinsic')}
+
+class RpcError(Exception):
+    """
+    raised by a callable response to answer with a json-rpc error
+    """
+    def __init__(self, code: int, message: str, data: Any = None):
+        super().__init__(message)
+        self.error = {'code': code, 'message': message}
+        if data is not None:
+            self.error['data'] = data
+
+class FakeNode:
+    """
+    a local websocket json-rpc node that replays recorded responses
+    the responses are looked up by (method, params) and then by method, a response can also be a callable(params)
+    latency and faults can be injected per method to test pools and retries
+    """
+
+    def __init__(self,
+                 fixtures: Union[str, List[dict]] = None, # the path to a jsonl fixture or a list of {method, params, result}
+                 host: str = '127.0.0.1',
+                 port: int = 0, # 0 picks a free port
+                 latency: float = 0.0, # seconds added to every response
+                 faults: Dict[str, Any] = None, # method -> error (or '*' for every method)
+                 fault_rate: float = 1.0, # the probability that a fault is injected
+                 start: bool = True):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.faults = faults or {}
+        self.fault_rate = fault_rate
+        self.responses = {}
+        self.requests = []
+        self.subscriptions = {} # subscription id -> (client, method, params)
+        self.clients = []
+        self.lock = threading.Lock()
+        self.subscription_id = 0
+        self.running = False
+        if fixtures is not None:
+            self.load(fixtures)
+        if start:
+            self.start()
+
+    @property
+    def url(self) -> str:
+        return f'ws://{self.host}:{self.port}'
+
+    def load(self, fixtures: Union[str, List[dict]]):
+        if isinstance(fixtures, str):
+            path = os.path.expanduser(fixtures)
+            with open(path) as f:
+                fixtures = [json.loads(line) for line in f if line.strip()]
+        for fixture in fixtures:
+            self.set(fixture['method'], fixture['result'], params=fixture.get('params'))
+        return self.responses
+
+    def set(self, method: str, result: Any, params: list = None):
+        """
+        set the response of a method (for every params if params is None)
+        """
+        key = method if params is None else (method, json.dumps(params))
+        self.responses[key] = result
+        return result
+
+    def count(self, method: str = None) -> int:
+        return len([r for r in self.requests if method is None or r['method'] == method])
+
+    def reset(self):
+        self.requests = []
+
+    def start(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.host, self.port))
+        self.port = self.server.getsockname()[1]
+        self.server.listen(128)
+        self.running = True
+        self.thread = threading.Thread(target=self.accept_loop, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.running = False
+        for client in list(self.clients):
+            try:
+                client.close()
+            except OSError:
+                pass
+        try:
+            self.server.close()
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                break
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.clients.append(client)
+            threading.Thread(target=self.client_loop, args=(client,), daemon=True).start()
+
+    def client_loop(self, client: socket.socket):
+        try:
+            self.handshake(client)
+            while self.running:
+                opcode, payload = self.recv_frame(client)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    self.send_frame(client, payload, opcode=0xA)
+                    continue
+                if opcode not in (0x1, 0x2):
+                    continue
+                message = json.loads(payload)
+                threading.Thread(target=self.handle, args=(client, message), daemon=True).start()
+        except (OSError, ConnectionError, ValueError):
+            pass
+        finally:
+            if client in self.clients:
+                self.clients.remove(client)
+            try:
+                client.close()
+            except OSError:
+                pass
+
+    def handle(self, client: socket.socket, message: Union[dict, list]):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            if isinstance(message, list):
+                response = [self.respond(client, m) for m in message]
+            else:
+                response = self.respond(client, message)
+            self.send(client, response)
+        except OSError:
+            # the request was dropped or the client is gone
+            pass
+
+    def respond(self, client: socket.socket, message: dict) -> dict:
+        method, params = message.get('method'), message.get('params') or []
+        self.requests.append({'method': method, 'params': params, 'time': time.time()})
+        response = {'jsonrpc': '2.0', 'id': message.get('id')}
+        fault = self.faults.get(method, self.faults.get('*'))
+        if fault is not None and random.random() < self.fault_rate:
+            if fault == 'drop':
+                # close the socket without answering (a dead node)
+                client.close()
+                raise ConnectionError(f'dropped {method}')
+            response['error'] = {'code': -32000, 'message': str(fault)}
+            return response
+        try:
+            if '_subscribe' in method or method in WATCH_METHODS:
+                initial = self.result(method, params) if method in self.responses else None
+                with self.lock:
+                    self.subscription_id += 1
+                    subscription_id = f'0x{self.subscription_id:016x}'
+                self.subscriptions[subscription_id] = (client, method, params)
+                response['result'] = subscription_id
+                if initial is not None:
+                    # send the current value as the first notification
+                    threading.Timer(0.01, self.notify, args=(subscription_id, initial)).start()
+                return response
+            if '_unsubscribe' in method or method in [unwatch for _, unwatch in WATCH_METHODS.values()]:
+                response['result'] = self.subscriptions.pop(params[0] if params else None, None) is not None
+                return response
+            key = (method, json.dumps(params))
+            if key not in self.responses and method not in self.responses:
+                response['error'] = {'code': -32601, 'message': f'Method not found: {method}'}
+                return response
+            response['result'] = self.result(method, params)
+        except RpcError as e:
+            response.pop('result', None)
+            response['error'] = e.error
+        return response
+
+    def result(self, method: str, params: list) -> Any:
+        key = (method, json.dumps(params))
+        result = self.responses.get(key, self.responses.get(method))
+        if callable(result):
+            result = result(params)
+        return result
+
+    def push(self, method: str, result: Any):
+        """
+        send a notification to the subscribers of the method (e.g. state_subscribeRuntimeVersion)
+        """
+        return len([s for s, (_, sub_method, _) in list(self.subscriptions.items())
+                    if sub_method == method and self.notify(s, result)])
+
+    def notify(self, subscription_id: str, result: Any) -> bool:
+        """
+        send a notification to one subscription
+        """
+        if subscription_id not in self.subscriptions:
+            return False
+        client, method, _ = self.subscriptions[subscription_id]
+        notification_method = WATCH_METHODS[method][0] if method in WATCH_METHODS else method.replace('_subscribe', '_')
+        message = {'jsonrpc': '2.0', 'method': notification_method, 'params': {'subscription': subscription_id, 'result': result}}
+        try:
+            self.send(client, message)
+            return True
+        except OSError:
+            self.subscriptions.pop(subscription_id, None)
+            return False
+
+    def send(self, client: socket.socket, message: Any):
+        data = json.dumps(message).encode()
+        with self.lock:
+            self.send_frame(client, data)
+
+    def handshake(self, client: socket.socket):
+        data = b''
+        while b'\r\n\r\n' not in data:
+            chunk = client.recv(4096)
+            if not chunk:
+                raise ConnectionError('closed during handshake')
+            data += chunk
+        headers = {}
+        for line in data.decode().split('\r\n')[1:]:
+            if ':' in line:
+                k, v = line.split(':', 1)
+                headers[k.strip().lower()] = v.strip()
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WS_GUID).encode()).digest()).decode()
+        client.sendall(('HTTP/1.1 101 Switching Protocols\r\n'
+                        'Upgrade: websocket\r\n'
+                        'Connection: Upgrade\r\n'
+                        f'Sec-WebSocket-Accept: {accept}\r\n\r\n').encode())
+
+    def recv_exact(self, client: socket.socket, n: int) -> bytes:
+        data = bytearray()
+        while len(data) < n:
+            chunk = client.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError('closed')
+            data += chunk
+        return bytes(data)
+
+    def recv_frame(self, client: socket.socket) -> Tuple[int, bytes]:
+        payload = b''
+        while True:
+            b1, b2 = self.recv_exact(client, 2)
+            fin, opcode, masked, n = b1 & 0x80, b1 & 0x0F, b2 & 0x80, b2 & 0x7F
+            if n == 126:
+                n = struct.unpack('!H', self.recv_exact(client, 2))[0]
+            elif n == 127:
+                n = struct.unpack('!Q', self.recv_exact(client, 8))[0]
+            mask = self.recv_exact(client, 4) if masked else None
+            data = self.recv_exact(client, n)
+            if mask:
+                data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+            payload += data
+            if opcode != 0:
+                first_opcode = opcode
+            if fin:
+                return first_opcode, payload
+
+    def send_frame(self, client: socket.socket, data: bytes, opcode: int = 0x1):
+        n = len(data)
+        if n < 126:
+            header = struct.pack('!BB', 0x80 | opcode, n)
+        elif n < 2 ** 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+        client.sendall(header + data)
+
+def record(url: str, requests: List[Tuple[str, list]], path: str) -> List[dict]:
+    """
+    record the responses of a live node into a jsonl fixture for FakeNode
+    """
+    from websocket import create_connection
+    ws = create_connection(url, timeout=60)
+    fixtures = []
+    for i, (method, params) in enumerate(requests):
+        ws.send(json.dumps({'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params}))
+        response = json.loads(ws.recv())
+        fixtures.append({'method': method, 'params': params, 'result': response.get('result')})
+    ws.close()
+    path = os.path.expanduser(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        for fixture in fixtures:
+            f.write(json.dumps(fixture) + '\n')
+    return fixtures
+
+class FakeChain:
+    """
+    a transaction pool and a block producer on top of a FakeNode
+    extrinsics are checked against the account nonces like a substrate pool (outdated and already used
+    nonces are rejected, future ones wait for the gap), included every block_time with their System events
+    and the watchers of author_submitAndWatchExtrinsic are notified when their block is produced
+    """
+
+    def __init__(self, node: FakeNode, conn, block_time: float = 0.1, failing: List[str] = None):
+        self.node = node
+        self.conn = conn # an initialised SubstrateInterface to decode the extrinsics and encode the events
+        self.block_time = block_time
+        self.failing = set(failing or []) # the call functions that dispatch with an error
+        self.nonces = {} # account -> next nonce on chain
+        self.pool = [] # the submitted extrinsics that are not included yet
+        self.blocks = [{'hash': self.block_hash(0), 'number': 0, 'extrinsics': [], 'events': '0x00'}]
+        self.lock = threading.Lock()
+        self.events_type = conn.metadata.get_metadata_pallet('System').get_storage_function('Events').get_value_type_string()
+        node.set('author_submitExtrinsic', self.submit)
+        node.set('author_submitAndWatchExtrinsic', lambda params: self.submit(params) and 'ready')
+        node.set('system_accountNextIndex', lambda params: self.next_index(self.account(params[0])))
+        node.set('chain_getBlockHash', lambda params: self.blocks[-1 if not params or params[0] is None else params[0]]['hash'])
+        node.set('chain_getHeader', lambda params: self.header(self.get_block(params[0] if params else None)))
+        node.set('chain_getBlock', lambda params: {'block': {'header': self.header(self.get_block(params[0] if params else None)),
+                 'extrinsics': self.get_block(params[0] if params else None)['extrinsics']}, 'justifications': None})
+        node.set('state_getStorage', lambda params: self.get_block(params[1] if len(params) > 1 else None)['events'])
+        self.running = True
+        self.thread = threading.Thread(target=self.produce_loop, daemon=True)
+        self.thread.start()
+
+    def block_hash(self, number: int) -> str:
+        return '0x' + f'{number + 0xb10c0000:064x}'
+
+    def get_block(self, block_hash: str = None) -> dict:
+        if block_hash is None:
+            return self.blocks[-1]
+        return self.blocks[int(block_hash, 16) - 0xb10c0000]
+
+    def header(self, block: dict) -> dict:
+        return {'parentHash': self.block_hash(max(block['number'] - 1, 0)), 'number': hex(block['number']),
+                'stateRoot': '0x' + '00' * 32, 'extrinsicsRoot': '0x' + '00' * 32, 'digest': {'logs': []}}
+
+    def account(self, address: str) -> str:
+        from mod.core.chain.chain.substrate.substrate.ss58 import ss58_decode
+        return address if address.startswith('0x') else '0x' + ss58_decode(address)
+
+    def next_index(self, account: str) -> int:
+        nonce = self.nonces.get(account, 0)
+        with self.lock:
+            pooled = {tx['nonce'] for tx in self.pool if tx['account'] == account}
+        while nonce in pooled:
+            nonce += 1
+        return nonce
+
+    def submit(self, params: list) -> str:
+        extrinsic = self.conn.runtime_config.create_scale_object('Extrinsic', data=ScaleBytes(params[0]), metadata=self.conn.metadata)
+        value = extrinsic.decode()
+        address = value['address'] if isinstance(value['address'], str) else next(iter(value['address'].values()))
+        account = self.account(address)
+        tx = {'data': params[0], 'hash': value['extrinsic_hash'], 'account': account, 'nonce': value['nonce'],
+              'fn': value['call']['call_function']}
+        with self.lock:
+            if tx['nonce'] < self.nonces.get(account, 0):
+                raise RpcError(1010, 'Invalid Transaction', 'Transaction is outdated')
+            if any(t['account'] == account and t['nonce'] == tx['nonce'] for t in self.pool):
+                raise RpcError(1014, 'Priority is too low: (0 vs 0)', 'The transaction has too low priority to replace another transaction already in the pool.')
+            self.pool.append(tx)
+        return tx['hash']
+
+    def produce(self) -> dict:
+        """
+        include the ready extrinsics of the pool in a new block
+        """
+        with self.lock:
+            included = []
+            for tx in sorted(self.pool, key=lambda tx: tx['nonce']):
+                if tx['nonce'] == self.nonces.get(tx['account'], 0):
+                    self.nonces[tx['account']] = tx['nonce'] + 1
+                    included.append(tx)
+            self.pool = [tx for tx in self.pool if tx not in included]
+            dispatch_info = {'weight': {'ref_time': 1000, 'proof_size': 0}, 'class': 'Normal', 'pays_fee': 'Yes'}
+            events = [{'phase': {'ApplyExtrinsic': i}, 'topics': [], 'event': {'System':
+                      {'ExtrinsicFailed': {'dispatch_error': 'BadOrigin', 'dispatch_info': dispatch_info}} if tx['fn'] in self.failing
+                      else {'ExtrinsicSuccess': {'dispatch_info': dispatch_info}}}} for i, tx in enumerate(included)]
+            number = len(self.blocks)
+            block = {'hash': self.block_hash(number), 'number': number, 'extrinsics': [tx['data'] for tx in included],
+                     'events': str(self.conn.runtime_config.create_scale_object(self.events_type).encode(events))}
+            self.blocks.append(block)
+        for subscription_id, (_, method, params) in list(self.node.subscriptions.items()):
+            if method == 'author_submitAndWatchExtrinsic' and params[0] in block['extrinsics']:
+                self.node.notify(subscription_id, {'inBlock': block['hash']})
+        return block
+
+    def produce_loop(self):
+        while self.running and self.node.running:
+            time.sleep(self.block_time)
+            if self.pool:
+                self.produce()
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,505 @@
+import os
+import shutil
+import tempfile
+import threading
+import mod as m
+from .node import FakeNode
+
+FIXTURES = os.path.dirname(__file__) + '/fixtures'
+
+class Test:
+
+    def node(self, fixture='runtime', **kwargs) -> FakeNode:
+        from mod.core.chain.chain.substrate.substrate.base import SubstrateInterface
+        # the fake nodes serve other runtimes under the same genesis hash and spec version
+        SubstrateInterface.registry_cache.clear()
+        return FakeNode(fixtures=f'{FIXTURES}/{fixture}.jsonl', **kwargs)
+
+    def chain(self, node, **kwargs):
+        kwargs.setdefault('url', node.url)
+        return m.mod('chain.substrate')(**kwargs)
+
+    def test_runtime_reuse(self, n=100, spec_version=101):
+        """
+        replays a recorded node and checks that pooled connections only re-init the runtime on upgrades
+        """
+        with self.node() as node:
+            chain = self.chain(node)
+            with chain.get_conn(init=True) as conn:
+                assert conn.runtime_version == 100, conn.runtime_version
+            node.reset()
+            for _ in range(n):
+                with chain.get_conn(init=True) as conn:
+                    pass
+            assert node.count('chain_getHeader') == 0, f'runtime re-initialised {node.count("chain_getHeader")} times'
+            assert node.count('state_getMetadata') == 0
+
+            # a runtime upgrade is pushed through the subscription
+            runtime_version = dict(node.result('state_getRuntimeVersion', []), specVersion=spec_version)
+            node.set('state_getRuntimeVersion', runtime_version)
+            node.push('state_subscribeRuntimeVersion', runtime_version)
+            t0 = m.time()
+            while chain.runtime.version != spec_version and m.time() - t0 < 5:
+                m.sleep(0.01)
+            with chain.get_conn(init=True) as conn:
+                assert conn.runtime_version == spec_version, conn.runtime_version
+            assert node.count('chain_getHeader') == 1
+            assert chain.runtime.upgrades == 1
+        return {'success': True, 'calls': n, 'spec_version': spec_version}
+
+    def test_runtime_poll(self, n=10):
+        """
+        without a subscription the spec version is polled at most once per interval
+        """
+        from mod.core.chain.chain.substrate.substrate.runtime import RuntimeWatcher
+        with self.node() as node:
+            runtime = RuntimeWatcher(node.url, subscribe=False, interval=60)
+            versions = [runtime.spec_version() for _ in range(n)]
+            assert versions == [100] * n, versions
+            assert node.count('state_getRuntimeVersion') == 1
+            runtime.close()
+        return {'success': True}
+
+    def test_health(self, num_connections=2):
+        """
+        the health check replaces dead connections
+        """
+        with self.node() as node:
+            chain = self.chain(node, num_connections=num_connections)
+            health = chain.check_connections()
+            assert health['healthy'] == num_connections, health
+            conn = chain.connections_queue.get()
+            conn.websocket.close()
+            chain.connections_queue.put(conn)
+            health = chain.check_connections()
+            assert health['healthy'] == num_connections - 1, health
+            assert chain.check_connections()['healthy'] == num_connections
+        return {'success': True}
+
+    def test_failover(self, n=30, latency=0.05):
+        """
+        queries go to the fastest endpoint and fail over to the others when it drops or dies
+        """
+        with self.node() as fast, self.node() as slow:
+            slow.latency = latency
+            chain = self.chain(fast, url=[fast.url, slow.url], health_interval=None)
+            # both endpoints are sampled before the routing settles
+            block_hash = [chain.block_hash() for _ in range(5)][-1]
+            fast.reset(); slow.reset()
+            assert all(chain.block_hash() == block_hash for _ in range(n))
+            assert slow.count() * 10 < fast.count(), f"{slow.count()} of {slow.count() + fast.count()} requests routed to the slow endpoint"
+
+            # a dropped request is retried on the other endpoint and its connection replaced in the background
+            fast.faults['chain_getBlockHash'] = 'drop'
+            assert all(chain.block_hash() == block_hash for _ in range(3))
+            fast.faults.clear()
+            stats = {e['url']: e for e in chain.pool.stats()}
+            assert stats[fast.url]['error_rate'] > 0, stats
+            t0 = m.time()
+            while chain.pool.endpoints[fast.url].size < 1 and m.time() - t0 < 5:
+                m.sleep(0.01)
+            assert chain.pool.endpoints[fast.url].size == 1
+
+            # a dead endpoint is left out until it comes back
+            fast.stop()
+            assert all(chain.block_hash() == block_hash for _ in range(n))
+            stats = {e['url']: e for e in chain.check_connections()['endpoints']}
+            assert stats[fast.url]['down'] and not stats[slow.url]['down'], stats
+            chain.pool.close()
+        return {'success': True, 'endpoints': list(stats.values())}
+
+    def test_multiplex(self, n=200, threads=20, latency=0.02):
+        """
+        concurrent requests on one multiplexed socket against one checked out request at a time,
+        with a subscription routed on the same socket
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from mod.core.chain.chain.substrate.substrate.base import SubstrateInterface
+        with self.node() as node:
+            node.set('chain_getBlockHash', lambda params: f'0x{params[0]:064x}')
+            exclusive = SubstrateInterface(node.url)
+            shared = SubstrateInterface(node.url, multiplex=True)
+            node.latency = latency
+            lock = threading.Lock()
+            def exclusive_request(i):
+                with lock:
+                    return exclusive.rpc_request('chain_getBlockHash', [i])['result']
+            def shared_request(i):
+                return shared.rpc_request('chain_getBlockHash', [i])['result']
+
+            # a subscription waits for its update while the other requests go through
+            runtime_version = node.result('state_getRuntimeVersion', [])
+            with ThreadPoolExecutor(threads + 1) as executor:
+                update = executor.submit(shared.rpc_request, 'state_subscribeRuntimeVersion', [],
+                                         lambda message, update_nr, subscription_id: message['params']['result'])
+                results = {}
+                for name, request in [('exclusive', exclusive_request), ('multiplexed', shared_request)]:
+                    t0 = m.time()
+                    hashes = list(executor.map(request, range(n)))
+                    results[name] = round(n / (m.time() - t0), 1)
+                    assert hashes == [f'0x{i:064x}' for i in range(n)], f'{name} responses out of order'
+                node.push('state_subscribeRuntimeVersion', runtime_version)
+                assert update.result(timeout=5) == runtime_version
+            assert results['multiplexed'] > 3 * results['exclusive'], results
+            shared.close()
+            exclusive.close()
+        return {'success': True, 'requests_per_second': results}
+
+    def test_metadata_cache(self):
+        """
+        cold start of a connection with an empty and with a warm metadata cache
+        """
+        from mod.core.chain.chain.substrate.substrate.base import SubstrateInterface
+        path = tempfile.mkdtemp()
+        with self.node() as node:
+            node.load(f'{FIXTURES}/metadata.jsonl')
+            def cold_start(registry_cache=False):
+                node.reset()
+                if not registry_cache:
+                    SubstrateInterface.registry_cache.clear()
+                t0 = m.time()
+                conn = SubstrateInterface(node.url, metadata_cache=path)
+                conn.init_runtime()
+                return conn, m.time() - t0
+            conn, cold = cold_start()
+            assert node.count('state_getMetadata') == 1
+            warm_conn, warm = cold_start()
+            assert node.count('state_getMetadata') == 0, 'the metadata was downloaded again'
+            assert warm_conn.metadata.value == conn.metadata.value
+            assert warm_conn.get_metadata_storage_function('Pallet1', 'Storage1').value == conn.get_metadata_storage_function('Pallet1', 'Storage1').value
+            assert warm < cold, f'the warm start ({warm}s) is not faster than the cold one ({cold}s)'
+            # the type registry built for the same genesis and spec version is reused by the next connection
+            registry_conn, registry = cold_start(registry_cache=True)
+            types = registry_conn.runtime_config.type_registry['types']
+            assert types is not warm_conn.runtime_config.type_registry['types']
+            assert types['scale_info::0'] is warm_conn.runtime_config.type_registry['types']['scale_info::0']
+            assert registry_conn.get_metadata_storage_function('Pallet1', 'Storage1').value == conn.get_metadata_storage_function('Pallet1', 'Storage1').value
+
+            # a decoded entry that loads anything else than scalecodec classes is rejected
+            import pickle, zlib
+            try:
+                conn.metadata_cache.loads(zlib.compress(pickle.dumps(os.system)), conn.runtime_config)
+                assert False, 'os.system was loaded'
+            except pickle.UnpicklingError:
+                pass
+
+            # a corrupt decoded entry falls back on the raw metadata bytes
+            decoded_path = conn.metadata_cache.decoded_path(conn.get_genesis_hash(), conn.runtime_version)
+            with open(decoded_path, 'wb') as f:
+                f.write(b'corrupt')
+            raw_conn, _ = cold_start()
+            assert node.count('state_getMetadata') == 0
+            assert raw_conn.metadata.value == conn.metadata.value
+        shutil.rmtree(path)
+        return {'success': True, 'cold': round(cold, 3), 'warm': round(warm, 3), 'registry': round(registry, 3), 'speedup': round(cold / warm, 1)}
+
+    def test_query_map(self, n=50, changed=5, module='Pallet0', name='Storage1'):
+        """
+        refreshing a query_map snapshot only fetches and decodes the keys that changed
+        """
+        from mod.core.chain.chain.substrate.substrate.storage import StorageKey
+        path = tempfile.mkdtemp()
+        blocks = {}
+        head = ['0x' + 'b1' * 32]
+        with self.node() as node:
+            node.load(f'{FIXTURES}/metadata.jsonl')
+            chain = self.chain(node, path=path)
+            with chain.get_conn(init=True) as conn:
+                value_type = conn.metadata.get_metadata_pallet(module).get_storage_function(name).get_value_type_string()
+                def entry(i, version=0):
+                    key = StorageKey.create_from_storage_function(module, name, ['0x' + f'{i:064x}'],
+                            runtime_config=conn.runtime_config, metadata=conn.metadata).to_hex()
+                    value = {'field_0': 2 ** 100 + i + version, 'field_1': '0x' + f'{i:064x}', 'field_2': '0x01', 'field_3': True}
+                    return key, str(conn.runtime_config.create_scale_object(value_type).encode(value))
+            def keys_paged(params):
+                prefix, count, start_key, at = params
+                keys = sorted(k for k in blocks[at] if k.startswith(prefix) and (start_key is None or k > start_key))
+                return keys[:count]
+            def storage_at(params):
+                keys, at = params
+                return [{'block': at, 'changes': [[k, blocks[at].get(k)] for k in keys]}]
+            def storage_changes(params):
+                keys, start, end = params
+                return [{'block': start, 'changes': [[k, blocks[start].get(k)] for k in keys]},
+                        {'block': end, 'changes': [[k, blocks[end].get(k)] for k in keys if blocks[end].get(k) != blocks[start].get(k)]}]
+            node.set('chain_getBlockHash', lambda params: head[0] if not params or params[0] is None else '0x' + '00' * 32)
+            node.set('state_getKeysPaged', keys_paged)
+            node.set('state_queryStorageAt', storage_at)
+            node.set('state_queryStorage', storage_changes)
+            decoded = []
+            decode = chain._decode_storage_items
+            chain._decode_storage_items = lambda substrate, items, *args: decoded.extend(items) or decode(substrate, items, *args)
+
+            blocks[head[0]] = dict(entry(i) for i in range(n))
+            result = first = chain.query_map(name, module=module, update=True)
+            assert len(result) == n and len(decoded) == n, (len(result), len(decoded))
+            node.reset()
+            assert chain.query_map(name, module=module) == result
+            assert node.count('state_getKeysPaged') == 0, 'the snapshot was not reused'
+
+            # a new block changes a few values, adds two keys and removes one
+            state = dict(blocks[head[0]])
+            state.update(dict(entry(i, version=1) for i in range(changed)))
+            state.update(dict(entry(i) for i in range(n, n + 2)))
+            state.pop(entry(n - 1)[0])
+            head[0] = '0x' + 'b2' * 32
+            blocks[head[0]] = state
+            decoded.clear()
+            result = chain.query_map(name, module=module, update=True)
+            assert len(decoded) == changed + 2, len(decoded)
+            assert len(result) == n + 1
+            assert result == chain.query_map(name, module=module, full=True)
+
+            # without state_queryStorage the raw values are diffed
+            node.faults['state_queryStorage'] = 'Method not found'
+            state = dict(state)
+            state.update(dict([entry(n, version=2)]))
+            head[0] = '0x' + 'b3' * 32
+            blocks[head[0]] = state
+            decoded.clear()
+            result = chain.query_map(name, module=module, update=True)
+            assert len(decoded) == 1, len(decoded)
+            assert result == chain.query_map(name, module=module, full=True)
+            size = os.path.getsize(chain.snapshot_path(name, module=module))
+
+            # a query at an old block does not replace the head snapshot
+            assert chain.query_map(name, module=module, block_hash='0x' + 'b1' * 32) == first
+            node.reset()
+            assert chain.query_map(name, module=module) == result
+            assert node.count('state_getKeysPaged') == 0, 'the head snapshot was replaced'
+            assert chain.query_map(name, module=module, block_hash='0x' + 'b1' * 32) == first
+            assert node.count('state_getKeysPaged') == 0, 'the historical snapshot was not reused'
+        shutil.rmtree(path)
+        return {'success': True, 'entries': len(result), 'snapshot_bytes': size}
+
+    def test_bulk_decode(self, n=500, module='Pallet0', seed=0):
+        """
+        the compiled storage decoders give the same keys and values as scalecodec, item by item
+        """
+        import random
+        from mod.core.chain.chain.substrate.substrate.storage import StorageKey
+        random.seed(seed)
+        path = tempfile.mkdtemp()
+        with self.node() as node:
+            node.load(f'{FIXTURES}/metadata.jsonl')
+            chain = self.chain(node, path=path)
+            block_hash = chain.block_hash()
+            results = {}
+            with chain.get_conn(init=True) as conn:
+                pallet = conn.metadata.get_metadata_pallet(module)
+                for storage in pallet.storage:
+                    name = storage.value['name']
+                    params = storage.get_params_type_string()
+                    if not params:
+                        continue
+                    fun_params = chain.get_lists(module, [(name, [])], conn)[0]
+                    prefix = StorageKey.create_from_storage_function(module, name, [], runtime_config=conn.runtime_config, metadata=conn.metadata).to_hex()
+                    value_type = conn.runtime_config.create_scale_object(fun_params[0])
+                    key_obj = conn.runtime_config.create_scale_object(params[0])
+                    items = []
+                    for i in range(n):
+                        raw = bytes(random.getrandbits(8) for _ in range(32))
+                        key = '0x' + raw.hex() if 'AccountId' in str(key_obj.generate_type_decomposition()) else i
+                        key = StorageKey.create_from_storage_function(module, name, [key], runtime_config=conn.runtime_config, metadata=conn.metadata).to_hex()
+                        value = {}
+                        for field, field_type in value_type.generate_type_decomposition().items():
+                            value[field] = {'u64': random.getrandbits(64), 'u128': random.getrandbits(128), 'u16': random.getrandbits(16),
+                                            'bool': random.random() < 0.5, 'AccountId': '0x' + raw.hex(),
+                                            'Bytes': random.choice([raw[:i % 32], f'name{i}'.encode()])}.get(field_type)
+                        items.append((key, str(conn.runtime_config.create_scale_object(fun_params[0]).encode(value))))
+                    t0 = m.time()
+                    expected = [chain._decode_storage_item(conn, k, v, prefix, fun_params, block_hash) for k, v in items]
+                    scale_time = m.time() - t0
+                    # the decoders are compiled once per runtime
+                    chain._decode_storage_items(conn, items[:1], prefix, fun_params, block_hash)
+                    t0 = m.time()
+                    decoded = chain._decode_storage_items(conn, items, prefix, fun_params, block_hash)
+                    compiled_time = m.time() - t0
+                    assert decoded == expected, f'{name}: compiled decoder differs from scalecodec'
+                    assert [type(v) for _, v in decoded] == [type(v) for _, v in expected]
+                    results[name] = round(scale_time / compiled_time, 1)
+
+                # bytes left over go through scalecodec, which raises as before
+                key, value = items[0]
+                for decode in [lambda: chain._decode_storage_item(conn, key, value + '00', prefix, fun_params, block_hash),
+                               lambda: chain._decode_storage_items(conn, [(key, value + '00')], prefix, fun_params, block_hash)]:
+                    try:
+                        decode()
+                        assert False, 'remaining bytes were decoded'
+                    except Exception as e:
+                        assert 'RemainingScaleBytes' in type(e).__name__, e
+            assert min(results.values()) > 3, results
+        shutil.rmtree(path)
+        return {'success': True, 'speedup': results}
+
+    def test_events(self, n=120, upgrade=80, accounts=5):
+        """
+        indexes a block range with batched requests, one runtime per segment, and queries the index
+        """
+        from mod.core.chain.chain.substrate.substrate.ss58 import ss58_encode
+        path = tempfile.mkdtemp()
+        block_hash = lambda b: '0x' + f'{b:064x}'
+        block_number = lambda h: int(h, 16) if h else n
+        account = lambda i: '0x' + f'{i % accounts + 1:064x}'
+        with self.node() as node:
+            node.load(f'{FIXTURES}/metadata.jsonl')
+            def get_block_hash(params):
+                if not params or params[0] is None:
+                    return block_hash(n)
+                if isinstance(params[0], list):
+                    return [block_hash(b) for b in params[0]]
+                return block_hash(params[0])
+            node.set('chain_getBlockHash', get_block_hash)
+            node.set('chain_getHeader', lambda params: {'parentHash': block_hash(block_number(params[0] if params else None) - 1),
+                     'number': hex(block_number(params[0] if params else None)), 'stateRoot': '0x' + '00' * 32,
+                     'extrinsicsRoot': '0x' + '00' * 32, 'digest': {'logs': []}})
+            runtime_version = node.result('state_getRuntimeVersion', [])
+            node.set('state_getRuntimeVersion', lambda params: dict(runtime_version,
+                     specVersion=100 if params and block_number(params[0]) < upgrade else 101))
+            chain = self.chain(node, path=path)
+            with chain.get_conn(init=True) as conn:
+                value_type = conn.metadata.get_metadata_pallet('System').get_storage_function('Events').get_value_type_string()
+                def block_events(b):
+                    return str(conn.runtime_config.create_scale_object(value_type).encode([
+                        {'phase': {'ApplyExtrinsic': 0}, 'topics': [],
+                         'event': {'Balances': {'Transfer': {'from': account(b), 'to': account(b + 1), 'amount': 2 ** 70 + b}}}},
+                        {'phase': 'Finalization', 'topics': [], 'event': {'System': {'ExtrinsicSuccess': {'dispatch_info':
+                         {'weight': {'ref_time': 0, 'proof_size': 0}, 'class': 'Mandatory', 'pays_fee': 'No'}}}}},
+                    ]))
+                raw_events = {block_hash(b): block_events(b) for b in range(1, n + 1)}
+            node.set('state_queryStorageAt', lambda params: [{'block': params[1], 'changes': [[params[0][0], raw_events[params[1]]]]}])
+            node.reset()
+
+            chain.event_index().max_variables = 16 # the blocks of a segment are looked up in several chunks
+            stats = chain.index_events(1, n)
+            assert stats == {'blocks': n, 'events': 2 * n, 'runtimes': 2}, stats
+            assert node.count('state_getRuntimeVersion') < n // 4, node.count('state_getRuntimeVersion')
+            node.reset()
+            assert chain.index_events(1, n)['blocks'] == 0
+            # the upgrade block was emitted by the runtime before the upgrade
+            spec_versions = dict(chain.event_index().conn.execute('SELECT block, spec_version FROM blocks').fetchall())
+            assert [spec_versions[b] for b in [upgrade - 1, upgrade, upgrade + 1]] == [100, 100, 101], spec_versions
+            assert node.count('state_queryStorageAt') == 0
+
+            block2events = chain.events(from_block=1, to_block=n)
+            assert len(block2events) == n and all(len(events) == 2 for events in block2events.values())
+            assert [e['event_id'] for e in chain.events(block=5)] == ['Transfer', 'ExtrinsicSuccess']
+            transfers = chain.transfer_events(from_block=1, to_block=n)
+            assert len(transfers) == n and transfers[0]['attributes']['amount'] == 2 ** 70 + 1
+            address = ss58_encode(account(0), 42)
+            mine = chain.transfer_events(from_block=1, to_block=n, account=address)
+            expected = [b for b in range(1, n + 1) if b % accounts == 0 or (b + 1) % accounts == 0]
+            assert [e['block'] for e in mine] == expected, [e['block'] for e in mine]
+            # a single block: the head by default, or the given block
+            assert [e['block'] for e in chain.transfer_events()] == [n]
+            assert [e['block'] for e in chain.transfer_events(block=5)] == [5]
+            assert chain.events(from_block=5, to_block=5) == chain.events(block=5)
+            assert len(chain.events(from_block=1, to_block=n, module='System')) == n
+        shutil.rmtree(path)
+        return {'success': True, 'blocks': n, 'transfers': len(transfers)}
+
+    def test_call_many(self, n=20, sequential=3, block_time=0.2):
+        """
+        submits n calls back to back with local nonces, they are included in about one block instead of n,
+        a stale nonce is resynced, the calls can be packed into batch_all and failed calls are reported
+        """
+        from .node import FakeChain
+        key = m.mod('key')()
+        account = '0x' + key.public_key.hex()
+        def params(i, fn=0):
+            args = [i, 2 ** 70 + i, account, '0x01', True, i][fn:fn + 4]
+            return {f'arg_{j}': a for j, a in enumerate(args)}
+        calls = [('Pallet1Call_0', params(i), 'Pallet1') for i in range(n)]
+        with self.node() as node:
+            node.load(f'{FIXTURES}/metadata.jsonl')
+            chain = self.chain(node, path=tempfile.mkdtemp())
+            with chain.get_conn(init=True) as conn:
+                fake = FakeChain(node, conn, block_time=block_time, failing=['Pallet1Call_1'])
+            node.reset()
+            t0 = m.time()
+            results = chain.call_many(calls, key=key, timeout=30)
+            pipelined = m.time() - t0
+            assert all(r['success'] for r in results), results
+            assert [r['nonce'] for r in results] == list(range(n))
+            assert len({r['block_hash'] for r in results}) <= 2, 'the calls were not pipelined'
+            assert node.count('system_accountNextIndex') == 1
+
+            # call reuses the local nonce instead of asking the node
+            t0 = m.time()
+            for i in range(sequential):
+                assert chain.call('Pallet1Call_0', params(i), key=key, module='Pallet1')['success']
+            per_call = (m.time() - t0) / sequential
+            assert node.count('system_accountNextIndex') == 1
+
+            # another client used the key, the calls with outdated nonces are resynced and resubmitted after the others
+            fake.nonces[account] += 3
+            results = chain.call_many(calls[:5], key=key, timeout=30)
+            assert all(r['success'] for r in results), results
+            assert sorted(r['nonce'] for r in results) == list(range(n + sequential + 3, n + sequential + 8))
+            assert node.count('system_accountNextIndex') == 2
+
+            # one utility.batch_all extrinsic for all the calls
+            results = chain.call_many(calls, key=key, batch=True, timeout=30)
+            assert len(results) == 1 and results[0]['success'] and len(results[0]['calls']) == n, results
+            assert len(fake.blocks[-1]['extrinsics']) == 1
+
+            # a failing call is reported without failing the others
+            results = chain.call_many([('Pallet1Call_1', params(0, fn=1), 'Pallet1'), calls[0]], key=key, timeout=30)
+            assert [r['success'] for r in results] == [False, True], results
+            assert results[0]['error'], results[0]
+            fake.stop()
+        return {'success': True, 'calls': n, 'pipelined': round(pipelined, 3), 'sequential': round(per_call * n, 3)}
+
+    def test_registry(self, n=10000, owners=100, changed=10, lookups=1000):
+        """
+        looks up n synthetic modules by name, owner, id and cid through the registry index against
+        a scan of the module list, and refreshes the index with a few changed entries
+        """
+        from mod.core.chain.chain.substrate.substrate.snapshot import StorageSnapshot
+        from mod.core.chain.chain.substrate.substrate.ss58 import ss58_encode
+        addresses = [ss58_encode(f'{i + 1:064x}', 42) for i in range(owners)]
+        def entry(i, version=0):
+            owner = addresses[i % owners]
+            name = f'{owner}/mod{i}' if i % 2 else f'mod{i}/{owner}'
+            mod = {'id': i, 'name': name, 'owner': owner, 'data': f'Qm{i:044d}', 'url': f'0.0.0.0:{i}', 'take': version, 'collateral': 0}
+            return '0x' + f'{i:064x}', ('0x' + f'{i:08x}{version:08x}', i, mod)
+        snapshots = [StorageSnapshot('0x', block_hash='0x01', entries=dict(entry(i) for i in range(n)))]
+        with self.node() as node:
+            chain = m.mod('chain')(url=node.url, path=tempfile.mkdtemp())
+            chain.query_snapshot = lambda *args, **kwargs: snapshots[-1]
+            t0 = m.time()
+            index = chain.mod_index()
+            build = m.time() - t0
+            assert len(index) == n
+
+            queries = [(addresses[i % owners], f'mod{i}') for i in range(0, n, n // lookups)]
+            mods = index.mods()
+            t0 = m.time()
+            scanned = [next(mod['id'] for mod in mods if mod['name'] in [f'{key}/{name}', f'{name}/{key}']) for key, name in queries]
+            scan = m.time() - t0
+            t0 = m.time()
+            ids = [chain.modid(name, key=key) for key, name in queries]
+            lookup = m.time() - t0
+            assert ids == scanned
+            assert all(chain.exists(name, key=key) for key, name in queries[:10])
+            assert not chain.exists('nope', key=addresses[0])
+            assert len(chain.mymods(key=addresses[0])) == n // owners
+            assert len(chain.key2mods()) == owners
+            assert chain.cid2mod(f'Qm{7:044d}')['id'] == 7
+            assert chain.registry(key=addresses[1])['mod1'] == 1
+
+            # a block that changes, adds and removes a few modules
+            entries = dict(snapshots[-1].entries)
+            entries.update(dict(entry(i, version=1) for i in range(changed)))
+            entries.update(dict([entry(n)]))
+            entries.pop(entry(n - 1)[0])
+            snapshots.append(StorageSnapshot('0x', block_hash='0x02', entries=entries))
+            t0 = m.time()
+            reindexed = index.refresh(snapshots[-1])
+            refresh = m.time() - t0
+            assert reindexed == changed + 2, reindexed
+            assert len(index) == n and index.id2mod[0]['take'] == 1
+            assert not chain.exists(f'mod{n - 1}', key=addresses[(n - 1) % owners])
+            assert chain.modid(f'mod{n}', key=addresses[n % owners]) == n
+        return {'success': True, 'mods': n, 'build': round(build, 3), 'refresh': round(refresh, 5),
+                'scan_per_lookup': round(scan / len(queries), 6), 'index_per_lookup': round(lookup / len(queries), 6)}
@@ -1,19 +1,24 @@
+import os
 import sys
 import time
-import sys
 from typing import Any
 import inspect
 import mod as m
 from typing import List
 from copy import deepcopy
 import json
+from .index import CommandIndex
 print = m.print
 class Cli:
+
+    index = CommandIndex()
+
     def __init__(self,  mod='mod',  fn='forward' ):
 
         self.argv = sys.argv[1:] # remove the first argument (the script name)
         self.fn = fn
         self.mod = m.mod(mod)()
+        self.schema = None # the indexed signature of the fn, if any
 
     def forward(self, argv=None, **kwargs):
         """
@@ -67,8 +72,13 @@ class Cli:
             fn = argv.pop(0)
         elif argv[0].endswith('/'):
             # scenario 4: the fn name is of another mod so we will look it up in the fn2mod
-            mod = m.mod(argv.pop(0)[:-1])()
+            mod = argv.pop(0)[:-1]
             fn = self.fn
+            resolved = self.index.resolve(mod, fn)
+            if resolved is not None:
+                fn, self.schema = resolved
+                return fn
+            mod = m.mod(mod)()
         elif argv[0].startswith('/'):
             # scenario 5: the fn name is of another mod so we will look it up in the fn2mod
             fn = argv.pop(0)[1:]
@@ -76,6 +86,11 @@ class Cli:
             # scenario 6: first argument is a path to a function m mod/fn *args **kwargs
             # first mod/submodule/.../fn
             mod , fn = argv.pop(0).split('/')
+            # the command index imports the class of the mod without searching the tree
+            resolved = self.index.resolve(mod, fn)
+            if resolved is not None:
+                fn, self.schema = resolved
+                return fn
             mod = m.mod(mod)()
         elif len(argv[0].split('/')) >= 2:
             # scenario 7: first argument is a path to a function m.mod.submodule...fn
@@ -86,6 +101,8 @@ class Cli:
                 mod = getattr(mod, part)
         else: 
             raise Exception(f'Function was not extracted from {argv} ')
+        if mod is self.mod:
+            self.schema = self.index.schema('mod', fn)
         return getattr(mod, fn, None)
 
     def get_params(self) -> tuple:
@@ -135,15 +152,90 @@ class Cli:
                                 value = json.loads(value)
                             except:
                                 pass
-                    params['kwargs'][key] = self.str2python(value)
+                    params['kwargs'][key] = self.parse_value(value, key)
                 else:
                     assert parsing_kwargs is False, f'Cannot mix positional and keyword arguments {argv}'
-                    params['args'].append(self.str2python(arg))    
+                    params['args'].append(self.parse_value(arg, index=len(params['args'])))    
  
         return  params
 
     _object_cache = {}
 
+    type_parsers = {'int': int, 'float': float, 'str': str}
+
+    def param(self, key:str=None, index:int=None) -> dict:
+        """
+        The {'value', 'type'} of the parameter (by name or position) in the indexed schema of the fn, {} if unknown
+        """
+        if self.schema is None:
+            return {}
+        if key is None:
+            if index >= len(self.schema['args']):
+                return {}
+            key = self.schema['args'][index]
+        return self.schema['input'].get(key, {})
+
+    def parse_value(self, value, key:str=None, index:int=None):
+        """
+        Parses the value against the type of the parameter in the schema, untyped values go through str2python
+        """
+        if not isinstance(value, str):
+            return value
+        param = self.param(key, index)
+        if value in ['null', 'None'] and param.get('value', '_empty') is None:
+            return None
+        type_name = param.get('type', '_empty').replace('typing.', '')
+        if type_name.startswith('Optional[') and type_name.endswith(']'):
+            if value.lower() in ['null', 'none']:
+                return None
+            type_name = type_name[len('Optional['):-1]
+        if type_name in self.type_parsers:
+            try:
+                return self.type_parsers[type_name](value)
+            except ValueError:
+                return self.str2python(value)
+        if type_name == 'bool' and value.lower() in ['true', 'false', '1', '0']:
+            return value.lower() in ['true', '1']
+        if type_name.split('[')[0].lower() in ['list', 'dict', 'tuple']:
+            try:
+                return json.loads(value)
+            except ValueError:
+                pass
+        return self.str2python(value)
+
+    def build_index(self, update:bool=False) -> dict:
+        """
+        Indexes the commands of every mod (m cli/build_index), the files that did not change are skipped
+        """
+        return self.index.build(update=update)
+
+    def complete(self, *args, line:str=None, **kwargs) -> List[str]:
+        """
+        Shell completion from the command index (bash: complete -C 'm cli/complete' m)
+        completes the mod/fn of the first word and the key= of the params after it
+        """
+        shell = line is None and 'COMP_LINE' in os.environ
+        line = os.environ.get('COMP_LINE', '') if line is None else line
+        words = line.split(' ')[1:]
+        word = words[-1] if words else ''
+        if len(words) <= 1:
+            if '/' in word:
+                mod, prefix = word.split('/', 1)
+                options = [f'{mod}/{fn}' for fn in self.index.fn_names(mod or 'mod')]
+            else:
+                options = [f'{name}/' for name in self.index.mod_names()] + self.index.fn_names('mod')
+        else:
+            mod, fn = words[0].split('/', 1) if '/' in words[0] else ('mod', words[0])
+            schema = self.index.schema(mod or 'mod', fn or self.fn) or {'input': {}}
+            options = [f'{key}=' for key in schema['input']]
+        options = sorted(o for o in options if o.startswith(word))
+        if shell:
+            # called by the shell, one option per line and nothing else
+            sys.stdout.write('\n'.join(options) + '\n')
+            sys.stdout.flush()
+            os._exit(0)
+        return options
+
 
     def shorten(self, x:str, n=12):
         if len(x) > n:
@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import socket
+import struct
+from typing import List, Optional
+
+# only the standard library, this runs before mod is imported
+
+socket_path = os.path.expanduser(os.environ.get('MOD_DAEMON_SOCKET', '~/.mod/cli.sock'))
+
+
+def send_frame(conn: socket.socket, kind: bytes, data: bytes):
+    conn.sendall(kind + struct.pack('>I', len(data)) + data)
+
+
+def recv_exact(conn: socket.socket, n: int) -> Optional[bytes]:
+    buf = b''
+    while len(buf) < n:
+        chunk = conn.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+
+def recv_frame(conn: socket.socket):
+    """
+    The (kind, data) of the next frame, None when the connection is closed
+    """
+    head = recv_exact(conn, 5)
+    if head is None:
+        return None
+    data = recv_exact(conn, struct.unpack('>I', head[1:])[0])
+    if data is None:
+        return None
+    return head[:1], data
+
+
+def connect(path: str = None) -> Optional[socket.socket]:
+    path = path or socket_path
+    if not os.path.exists(path):
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        return None
+    return conn
+
+
+def forward(argv: List[str] = None, path: str = None) -> Optional[int]:
+    """
+    Runs the cli call in the daemon and streams its stdout and stderr here, returns its exit code
+    or None when no daemon is running (the call then runs in this process)
+    """
+    if os.environ.get('MOD_DAEMON') == '0':
+        return None
+    conn = connect(path)
+    if conn is None:
+        return None
+    env = dict(os.environ)
+    if sys.stdout.isatty():
+        # the output of the daemon is a pipe, keep the colors of the terminal
+        env.setdefault('FORCE_COLOR', '1')
+    request = {'argv': sys.argv[1:] if argv is None else argv, 'cwd': os.getcwd(), 'env': env}
+    try:
+        # the stdin of the call, so its prompts read this terminal (or pipe)
+        try:
+            stdin = [sys.stdin.fileno()]
+        except (AttributeError, ValueError, OSError):
+            stdin = []
+        socket.send_fds(conn, [b'i'], stdin)
+        send_frame(conn, b'r', json.dumps(request).encode())
+        outputs = {b'o': sys.stdout.buffer, b'e': sys.stderr.buffer}
+        while True:
+            frame = recv_frame(conn)
+            if frame is None:
+                sys.stderr.write('mod daemon closed the connection\n')
+                return 1
+            kind, data = frame
+            if kind == b'x':
+                return json.loads(data)['code']
+            outputs[kind].write(data)
+            outputs[kind].flush()
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        conn.close()
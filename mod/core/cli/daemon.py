@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import threading
+import traceback
+import subprocess
+from typing import Optional, Tuple
+import mod as m
+from .client import socket_path, send_frame, recv_frame, connect
+
+
+class Daemon:
+    """
+    Keeps mod imported and warm for the cli.
+
+    The `m` front end sends its stdin (the fd, so prompts read the terminal of the call) and the argv, cwd
+    and environment of a call over a unix socket, the daemon forks a child for it (the modules, the mod tree
+    and the loaded keys are inherited already imported) and the child reads the request, runs the call in
+    its own cwd and environment and streams its stdout and stderr back.
+    Without a running daemon `m` runs the call itself.
+    """
+
+    def __init__(self, path: str = None, timeout: float = 10):
+        self.path = os.path.expanduser(path or socket_path)
+        self.pid_path = self.path + '.pid'
+        self.timeout = timeout # for the request of a connection
+
+    def warmup(self):
+        """
+        Loads what most calls need before the first one
+        """
+        from .cli import Cli
+        m.mod('mod')()
+        m.key()
+        m.tree()
+
+    def serve(self, warmup: bool = True):
+        if warmup:
+            self.warmup()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # the calls run as the user of the daemon, the socket is never open to the others (not even before a chmod)
+        umask = os.umask(0o177)
+        try:
+            server.bind(self.path)
+        finally:
+            os.umask(umask)
+        server.listen(64)
+        with open(self.pid_path, 'w') as f:
+            f.write(str(os.getpid()))
+        # the children are reaped by the kernel
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            while True:
+                conn, _ = server.accept()
+                try:
+                    # the child reads the request, a client that sends nothing only holds its own child
+                    if os.fork() == 0:
+                        server.close()
+                        self.run(conn)
+                finally:
+                    conn.close()
+        finally:
+            server.close()
+            for path in [self.path, self.pid_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def recv_request(self, conn: socket.socket) -> Tuple[Optional[int], Optional[dict]]:
+        """
+        The stdin fd (None if the front end has none) and the request of the front end, (None, None) if it
+        sends no request within timeout
+        """
+        conn.settimeout(self.timeout)
+        try:
+            data, fds, _, _ = socket.recv_fds(conn, 1, 1)
+            frame = recv_frame(conn) if data == b'i' else None
+        except OSError:
+            return None, None
+        conn.settimeout(None)
+        if frame is None or frame[0] != b'r':
+            return None, None
+        return (fds[0] if fds else None), json.loads(frame[1])
+
+    def run(self, conn: socket.socket):
+        """
+        Runs the call in the forked child, with the stdin of the front end and its fds 1 and 2 relayed to
+        the front end, and exits
+        """
+        code = 1
+        try:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            stdin, request = self.recv_request(conn)
+            if request is None:
+                return
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            sys.argv = ['m'] + request['argv']
+            sys.stdout.reconfigure(line_buffering=True)
+            devnull = os.open(os.devnull, os.O_RDWR)
+            # the prompts (input, getpass) read the stdin of the front end
+            os.dup2(devnull if stdin is None else stdin, 0)
+            lock = threading.Lock()
+            relays = [self.relay(conn, lock, fd, kind) for fd, kind in [(1, b'o'), (2, b'e')]]
+            try:
+                from .cli import Cli
+                Cli().forward()
+                code = 0
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except BaseException:
+                traceback.print_exc()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # closing the write ends ends the relays
+            os.dup2(devnull, 1)
+            os.dup2(devnull, 2)
+            for relay in relays:
+                relay.join()
+            send_frame(conn, b'x', json.dumps({'code': code}).encode())
+        finally:
+            os._exit(code)
+
+    def relay(self, conn: socket.socket, lock: threading.Lock, fd: int, kind: bytes) -> threading.Thread:
+        """
+        Points fd at a pipe and sends what is written to it to the front end
+        """
+        read_fd, write_fd = os.pipe()
+        os.dup2(write_fd, fd)
+        os.close(write_fd)
+
+        def loop():
+            while True:
+                data = os.read(read_fd, 65536)
+                if not data:
+                    break
+                try:
+                    with lock:
+                        send_frame(conn, kind, data)
+                except OSError:
+                    # the front end is gone (ctrl-c)
+                    os._exit(1)
+            os.close(read_fd)
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    def pid(self) -> Optional[int]:
+        try:
+            with open(self.pid_path) as f:
+                pid = int(f.read())
+            os.kill(pid, 0)
+            return pid
+        except (OSError, ValueError):
+            return None
+
+    def status(self) -> dict:
+        pid = self.pid()
+        conn = connect(self.path)
+        if conn is not None:
+            conn.close()
+        return {'running': pid is not None and conn is not None, 'pid': pid, 'socket': self.path}
+
+    def start(self, timeout: float = 30) -> dict:
+        """
+        Starts the daemon in the background
+        """
+        if self.status()['running']:
+            return self.status()
+        cmd = [sys.executable, '-c', f'from mod.core.cli.daemon import Daemon; Daemon({self.path!r}).serve()']
+        env = dict(os.environ, MOD_DAEMON='0')
+        subprocess.Popen(cmd, cwd=m.lib_path, env=env, start_new_session=True,
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        t0 = time.time()
+        while not self.status()['running']:
+            assert time.time() - t0 < timeout, f'mod daemon did not start within {timeout}s'
+            time.sleep(0.05)
+        return self.status()
+
+    def stop(self) -> dict:
+        pid = self.pid()
+        if pid is not None:
+            os.kill(pid, signal.SIGTERM)
+            # the daemon removes its pid file on exit
+            while os.path.exists(self.pid_path):
+                time.sleep(0.05)
+        return self.status()
+
+    def restart(self) -> dict:
+        self.stop()
+        return self.start()
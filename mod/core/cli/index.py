@@ -0,0 +1,260 @@
+import os
+import ast
+import json
+import threading
+from typing import Any, Dict, List, Optional
+import mod as m
+
+
+class CommandIndex:
+    """
+    The persisted index of the cli commands: every mod of the tree with the file and class it resolves
+    to and the signatures of the functions of its class (the input of fnschema), parsed from the source
+    without importing the mod.
+
+    An entry is reparsed when its file changes and the mods that are not indexed yet are added when they
+    are looked up, so `m mod/fn` goes from argv to the imported function without searching the tree.
+    Only the mods of the library are indexed, the local mods of the cwd resolve as before: the index keeps
+    the names of the local mods per cwd with the mtimes of the directories they were found in (adding or
+    removing a mod changes the mtime of its directory), so the shadowing check only stats them.
+    """
+
+    version = 1
+    local_depth = 5
+    max_local = 64  # the number of cwds whose local mods are kept
+
+    def __init__(self, path: str = '~/.mod/cli/index.json'):
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+        self.mods = None  # name -> {'file', 'class', 'mtime', 'bases', 'fns': {fn: schema}}
+        self.local = None  # cwd -> {'mods': [name], 'dirs': {dir: mtime}}
+        self.tree = None
+
+    def load(self):
+        if self.mods is not None:
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.mods = data['mods'] if data.get('version') == self.version else {}
+            self.local = data.get('local', {}) if data.get('version') == self.version else {}
+        except (OSError, ValueError, KeyError):
+            self.mods = {}
+            self.local = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.version, 'mods': self.mods, 'local': self.local}, f)
+        os.replace(tmp_path, self.path)
+
+    def get_tree(self) -> Dict[str, str]:
+        """
+        The mods of the library (core first, as in Mod.tree)
+        """
+        if self.tree is None:
+            tree = {}
+            tree.update(m.exp_tree(depth=1))
+            tree.update(m.mods_tree(depth=5))
+            tree.update(m.core_tree(depth=5))
+            self.tree = tree
+        return self.tree
+
+    def dir_mtimes(self, path: str, depth: int) -> Dict[str, Optional[int]]:
+        """
+        The mtimes of the directories that the local tree lists (the hidden and avoided ones are skipped)
+        """
+        dirs = {path: self.mtime(path)}
+        if depth > 1:
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                return dirs
+            for entry in entries:
+                if entry.name.startswith('.') or entry.name in m.avoid_folders or not entry.is_dir():
+                    continue
+                dirs.update(self.dir_mtimes(entry.path, depth - 1))
+        return dirs
+
+    def local_mods(self) -> List[str]:
+        """
+        The local mods of the cwd, listed again when one of its directories changed
+        """
+        cwd = os.getcwd()
+        with self.lock:
+            self.load()
+            local = self.local.get(cwd)
+            if local is not None and all(self.mtime(d) == t for d, t in local['dirs'].items()):
+                return local['mods']
+            # the mtimes first, a change during the listing is seen on the next lookup
+            dirs = self.dir_mtimes(cwd, self.local_depth)
+            local = {'mods': sorted(m.local_tree(depth=self.local_depth, update=True)), 'dirs': dirs}
+            self.local.pop(cwd, None)
+            self.local[cwd] = local
+            while len(self.local) > self.max_local:
+                self.local.pop(next(iter(self.local)))
+            self.save()
+            return local['mods']
+
+    def shadowed(self, name: str, entry: dict) -> bool:
+        """
+        Whether a local mod of the cwd takes the place of the indexed one (only the core mods come first)
+        """
+        if entry['file'].startswith(os.path.join(m.core_path, '')) or os.getcwd() == m.lib_path:
+            return False
+        return name in self.local_mods()
+
+    @staticmethod
+    def mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def parse_args(node: ast.FunctionDef, avoid_arguments=['self', 'cls']) -> dict:
+        """
+        The fnschema input of a function definition, the type is the annotation or the type of the default
+        """
+        args = node.args
+        positional = args.posonlyargs + args.args
+        defaults = [None] * (len(positional) - len(args.defaults)) + list(args.defaults)
+        params = list(zip(positional, defaults)) + list(zip(args.kwonlyargs, args.kw_defaults))
+        schema = {'input': {}, 'args': [], 'varargs': args.vararg is not None, 'varkw': args.kwarg is not None,
+                  'docs': ast.get_docstring(node), 'name': node.name}
+        for arg, default in params:
+            if arg.arg in avoid_arguments:
+                continue
+            value, type_name = '_empty', '_empty'
+            if default is not None:
+                try:
+                    value = ast.literal_eval(default)
+                    type_name = type(value).__name__
+                except (ValueError, SyntaxError, TypeError):
+                    value = ast.unparse(default)
+            if arg.annotation is not None:
+                type_name = ast.unparse(arg.annotation)
+            if not isinstance(value, (str, int, float, bool, type(None), list, dict)):
+                value = repr(value)
+            schema['input'][arg.arg] = {'value': value, 'type': type_name}
+            if arg in positional:
+                schema['args'].append(arg.arg)
+        return schema
+
+    def parse(self, path: str) -> Optional[dict]:
+        """
+        The entry of the last class of the file (the anchor class of a mod)
+        """
+        with open(path) as f:
+            tree = ast.parse(f.read())
+        classes = [node for node in tree.body if isinstance(node, ast.ClassDef)]
+        if not classes:
+            return None
+        cls = classes[-1]
+        fns = {}
+        for node in cls.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                fns[node.name] = self.parse_args(node)
+            elif isinstance(node, ast.Assign) and isinstance(node.value, ast.Name) and node.value.id in fns:
+                # aliases like fp = filepath
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        fns[target.id] = fns[node.value.id]
+        bases = [ast.unparse(base) for base in cls.bases]
+        return {'file': path, 'class': cls.name, 'mtime': self.mtime(path), 'bases': bases, 'fns': fns}
+
+    def index_mod(self, name: str) -> Optional[dict]:
+        tree = self.get_tree()
+        if name not in tree:
+            return None
+        try:
+            entry = self.parse(m.anchor_file(name))
+        except Exception:
+            return None
+        if entry is not None:
+            self.mods[name] = entry
+            self.save()
+        return entry
+
+    def get(self, name: str) -> Optional[dict]:
+        """
+        The entry of the mod, reparsed when its file changed and added when it is new
+        """
+        name = m.get_name(name)
+        with self.lock:
+            self.load()
+            entry = self.mods.get(name)
+            if entry is not None:
+                mtime = self.mtime(entry['file'])
+                if mtime == entry['mtime']:
+                    return entry
+                self.mods.pop(name)
+                if mtime is None:
+                    # the file is gone, the tree changed
+                    self.tree = None
+                    self.save()
+                    return self.index_mod(name)
+                try:
+                    entry = self.parse(entry['file'])
+                except Exception:
+                    entry = None
+                if entry is not None:
+                    self.mods[name] = entry
+                self.save()
+                return entry
+            return self.index_mod(name)
+
+    def build(self, update: bool = False) -> dict:
+        """
+        Indexes every mod of the tree, only the files that changed are parsed again
+        """
+        with self.lock:
+            self.load()
+            self.tree = None
+            if update:
+                self.mods = {}
+            tree = self.get_tree()
+            for name in list(self.mods):
+                if name not in tree:
+                    self.mods.pop(name)
+            for name in tree:
+                entry = self.mods.get(name)
+                if entry is not None and self.mtime(entry['file']) == entry['mtime']:
+                    continue
+                try:
+                    entry = self.parse(m.anchor_file(name))
+                except Exception:
+                    entry = None
+                if entry is not None:
+                    self.mods[name] = entry
+            self.save()
+            return {'mods': len(self.mods), 'fns': sum(len(e['fns']) for e in self.mods.values()), 'path': self.path}
+
+    def resolve(self, name: str, fn: str, instance: Any = None) -> Optional[tuple]:
+        """
+        The (function, schema) of mod/fn imported straight from the indexed class, None when the index can't
+        resolve it (not indexed, or inherited from another file)
+        """
+        entry = self.get(name)
+        if entry is None or fn not in entry['fns'] or self.shadowed(m.get_name(name), entry):
+            return None
+        if instance is None:
+            obj = m.obj(m.path2objectpath(entry['file']) + '.' + entry['class'])
+            instance = obj()
+        return getattr(instance, fn), entry['fns'][fn]
+
+    def schema(self, name: str, fn: str) -> Optional[dict]:
+        entry = self.get(name)
+        if entry is None:
+            return None
+        return entry['fns'].get(fn)
+
+    def mod_names(self) -> List[str]:
+        return sorted(self.get_tree())
+
+    def fn_names(self, name: str) -> List[str]:
+        entry = self.get(name)
+        if entry is None:
+            return []
+        return sorted(fn for fn in entry['fns'] if not fn.startswith('_'))
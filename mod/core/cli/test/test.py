@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+import mod as m
+
+class Test:
+
+    def run_cli(self, argv, env=None, input=None):
+        """
+        Runs `m *argv` the way the console script does
+        """
+        return subprocess.run([sys.executable, self.script] + argv, capture_output=True, text=True, env=env, cwd=self.cwd, input=input)
+
+    def test_daemon(self, n=100, argv=['pwd']):
+        from ..daemon import Daemon
+        folder = tempfile.mkdtemp()
+        self.cwd = folder + '/cwd'
+        os.makedirs(self.cwd)
+        self.script = folder + '/m'
+        with open(self.script, 'w') as f:
+            f.write('import sys\nfrom mod import main\nsys.exit(main())\n')
+        env = dict(os.environ, MOD_DAEMON_SOCKET=folder + '/cli.sock', PYTHONPATH=m.lib_path)
+        daemon = Daemon(env['MOD_DAEMON_SOCKET'])
+
+        # without a daemon the call runs in its own interpreter
+        assert not daemon.status()['running']
+        t0 = time.time()
+        for _ in range(n):
+            cold = self.run_cli(argv, env=env)
+        cold_time = (time.time() - t0) / n
+        assert cold.returncode == 0 and self.cwd in cold.stdout, cold.stderr
+
+        daemon.start()
+        try:
+            t0 = time.time()
+            for _ in range(n):
+                warm = self.run_cli(argv, env=env)
+            warm_time = (time.time() - t0) / n
+            # the call runs in the cwd of the front end and prints to its stdout
+            assert warm.returncode == 0 and self.cwd in warm.stdout, warm.stderr
+            # errors and exit codes come back too
+            failed = self.run_cli(['fn_that_does_not_exist_', 'x=1'], env=env)
+            assert failed.returncode != 0 and failed.stderr
+            # and the environment of the call
+            env_call = self.run_cli(['env', 'MOD_TEST_VAR'], env=dict(env, MOD_TEST_VAR='fam'))
+            assert 'fam' in env_call.stdout, env_call.stdout
+            # and its stdin, so prompts read the terminal of the call
+            stdin_call = self.run_cli(['cmd', 'cat'], env=env, input='fam-stdin')
+            assert 'fam-stdin' in stdin_call.stdout, stdin_call.stdout
+            # the socket is only open to the user
+            assert os.stat(env['MOD_DAEMON_SOCKET']).st_mode & 0o777 == 0o600
+            # a client that sends nothing does not hold the other calls
+            idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            idle.connect(env['MOD_DAEMON_SOCKET'])
+            try:
+                assert self.run_cli(argv, env=env).returncode == 0
+            finally:
+                idle.close()
+        finally:
+            daemon.stop()
+        assert not daemon.status()['running']
+        # a stale socket falls back to a local call
+        assert self.run_cli(argv, env=env).returncode == 0
+        shutil.rmtree(folder)
+        assert warm_time * 2 < cold_time, f'daemon call {warm_time:.3f}s is not faster than {cold_time:.3f}s'
+        return {'success': True, 'calls': n, 'cold': cold_time, 'warm': warm_time, 'speedup': cold_time / warm_time}
+
+    def test_index(self, n=100):
+        from ..index import CommandIndex
+        from ..cli import Cli
+        folder = tempfile.mkdtemp()
+        index = CommandIndex(folder + '/index.json')
+        t0 = time.time()
+        stats = index.build()
+        build_time = time.time() - t0
+        assert stats['mods'] > 0 and 'key' in index.mods, stats
+
+        # a lookup stats the file of the mod, the trial search walks the tree
+        t0 = time.time()
+        for _ in range(n):
+            schema = index.schema('key', 'sign')
+        index_time = (time.time() - t0) / n
+        t0 = time.time()
+        for _ in range(n):
+            m.anchor_file('key')
+        trial_time = (time.time() - t0) / n
+        assert set(schema['input']) >= {'data', 'mode'}, schema
+        fn, _ = index.resolve('key', 'sign')
+        assert fn.__func__ is m.mod('key').sign, fn
+        # the index is persisted
+        assert CommandIndex(index.path).get('key')['fns'].keys() == index.mods['key']['fns'].keys()
+
+        # a changed file is parsed again on its next lookup
+        path = folder + '/thing.py'
+        with open(path, 'w') as f:
+            f.write('class Thing:\n    def a(self, x:int=1): pass\n')
+        index.mods['thing'] = index.parse(path)
+        index.tree['thing'] = folder
+        with open(path, 'w') as f:
+            f.write('class Thing:\n    def a(self, x:int=1): pass\n    def b(self, y=[1]): pass\n    c = b\n')
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+        entry = index.get('thing')
+        assert set(entry['fns']) == {'a', 'b', 'c'} and entry['fns']['b']['input']['y']['type'] == 'list', entry
+
+        # the params are parsed against the schema
+        cli = Cli()
+        cli.schema = entry['fns']['a']
+        assert cli.parse_value('007', 'x') == 7
+        cli.schema = {'input': {'s': {'value': None, 'type': 'str'}, 'd': {'value': None, 'type': 'Optional[dict]'}},
+                      'args': ['s', 'd']}
+        assert cli.parse_value('123', index=0) == '123'
+        assert cli.parse_value('None', 's') is None
+        assert cli.parse_value('{"a": [1, "x"]}', 'd') == {'a': [1, 'x']}
+        cli.schema = None
+        assert cli.parse_value('123') == 123
+
+        # a local mod of the cwd shadows an indexed mod outside of core, the check only stats the dirs of the cwd
+        cwd = os.getcwd()
+        local_tree = m.local_tree
+        walks = []
+        def counted_local_tree(*args, **kwargs):
+            walks.append(os.getcwd())
+            return local_tree(*args, **kwargs)
+        os.chdir(tempfile.mkdtemp(dir=folder))
+        m.local_tree = counted_local_tree
+        try:
+            vali = index.get('vali')
+            assert vali is not None and not index.shadowed('vali', vali)
+            assert not index.shadowed('key', index.get('key'))
+            for _ in range(n):
+                index.shadowed('vali', vali)
+            assert len(walks) == 1, walks
+            os.makedirs('vali')
+            with open('vali/vali.py', 'w') as f:
+                f.write('class Vali:\n    pass\n')
+            assert index.shadowed('vali', vali) and len(walks) == 2, walks
+            # the local mods are persisted with the index
+            assert CommandIndex(index.path).shadowed('vali', vali) and len(walks) == 2, walks
+            # and a core mod is never shadowed
+            os.makedirs('key')
+            with open('key/key.py', 'w') as f:
+                f.write('class Key:\n    pass\n')
+            assert not index.shadowed('key', index.get('key')) and index.resolve('key', 'sign') is not None
+            shutil.rmtree('vali')
+            assert not index.shadowed('vali', vali)
+        finally:
+            m.local_tree = local_tree
+            os.chdir(cwd)
+
+        # completion
+        cli.index = index
+        assert 'key/sign' in cli.complete(line='m key/si')
+        assert 'key/' in cli.complete(line='m ke')
+        assert 'mode=' in cli.complete(line='m key/sign hey mo')
+        shutil.rmtree(folder)
+        return {'success': True, 'build': build_time, 'index': index_time, 'trial': trial_time, 'mods': stats['mods']}
+
+    def test_cmd(self):
+        # stdout and stderr are merged in order and utf-8 split between chunks stays whole
+        assert m.cmd('bash -c "echo out; echo err >&2; printf é"', chunk_size=1) == 'out\nerr\né'
+        assert list(m.cmd('printf "a\nb\nc"', stream=True, lines=True)) == ['a\n', 'b\n', 'c']
+        chunks = []
+        assert m.cmd('seq 1 100000', max_output=7, callback=chunks.append) == '100000\n'
+        assert ''.join(chunks) == ''.join(f'{i}\n' for i in range(1, 100001))
+        assert sum(len(chunk) for chunk in m.cmd(self.stream_command.format(2**20), stream=True)) == 2**20
+        t0 = time.time()
+        try:
+            m.cmd('sleep 5', timeout=0.2)
+            raise AssertionError('no timeout')
+        except subprocess.TimeoutExpired:
+            assert time.time() - t0 < 2
+        # the asyncio version runs commands concurrently
+        import asyncio
+        async def run():
+            return await asyncio.gather(*[m.acmd('bash -c "sleep 0.5; echo $0"', str(i)) for i in range(5)])
+        t0 = time.time()
+        assert asyncio.run(run()) == [f'{i}\n' for i in range(5)]
+        assert time.time() - t0 < 2
+        return {'success': True}
+
+    stream_command = 'bash -c "head -c {} /dev/zero | tr \'\\\\0\' a"'
+
+    def bench_cmd(self, size=64 * 2**20):
+        """
+        Streams size bytes of a command through the reader (m bench cli)
+        """
+        def fn():
+            n = sum(len(chunk) for chunk in m.cmd(self.stream_command.format(size), stream=True))
+            assert n == size, n
+        return fn
+
+    def bench_cmd_legacy(self, size=2**20):
+        """
+        Reads size bytes of a command one byte at a time, the loop the reader replaced
+        """
+        def fn():
+            process = m.cmd(self.stream_command.format(size), return_process=True)
+            n = 0
+            while True:
+                ch = process.stdout.read(1)
+                if not ch:
+                    break
+                n += len(ch.decode('utf-8'))
+            process.wait()
+            assert n == size, n
+        return fn
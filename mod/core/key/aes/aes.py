@@ -1,38 +1,101 @@
-from Crypto import Random
 import hashlib
 from Crypto.Cipher import AES
-import copy
+import os
 import base64
 import json
+import struct
+import threading
+from collections import OrderedDict
 from typing import *
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 
 class AesKey:
     """
     AES encryption and decryption class.
+
+    Data is encrypted with AES-256-GCM under a key derived from the password with scrypt. Values become
+    'aes1:' tokens, files and streams are encrypted in authenticated chunks (the nonce of a chunk holds
+    its index and whether it is the last one, so chunks can't be reordered, dropped or truncated).
+    The data of the legacy format (AES-CBC under sha256(password)) is still decrypted.
     """
 
+    prefix = 'aes1:' # the prefix of the tokens, legacy tokens are plain base64
+    magic = b'MODAES1\n' # the header of encrypted files and streams
+    chunk_size = 1 << 20
+    salt_size = 16
+    nonce_size = 12
+    tag_size = 16
+    scrypt_params = {'n': 2**14, 'r': 8, 'p': 1}
+
+    # the derived keys of the process: (sha256 of the password, salt) -> key, and the salt each password encrypts with
+    kdf_cache = OrderedDict()
+    kdf_cache_size = 64
+    salts = {}
+    lock = threading.Lock()
+
     def __init__(self, password='fam'):
         self.password = self.get_password(password)
 
+    def derive(self, password: bytes, salt: bytes) -> bytes:
+        """
+        The aes key of the password hash and the salt (scrypt), cached for the process
+        """
+        with self.lock:
+            key = self.kdf_cache.get((password, salt))
+            if key is not None:
+                self.kdf_cache.move_to_end((password, salt))
+                return key
+        key = Scrypt(salt=salt, length=32, **self.scrypt_params).derive(password)
+        with self.lock:
+            self.kdf_cache[(password, salt)] = key
+            while len(self.kdf_cache) > self.kdf_cache_size:
+                self.kdf_cache.popitem(last=False)
+        return key
+
+    def encryption_key(self, password: bytes) -> Tuple[bytes, bytes]:
+        """
+        The (salt, key) to encrypt with, one random salt per password for the process so the key is derived once
+        """
+        with self.lock:
+            salt = self.salts.get(password)
+            if salt is None:
+                salt = self.salts[password] = os.urandom(self.salt_size)
+        return salt, self.derive(password, salt)
+
     def encrypt(self, data, password=None, verify_decryption=False):
-        password = self.get_password(password or self.password)  
-        data = copy.deepcopy(data)
+        password = self.get_password(password or self.password)
         data = json.dumps(data)
-        if not isinstance(data, str):
-            data = str(data)
-        data = data + (AES.block_size - len(data) % AES.block_size) * chr(AES.block_size - len(data) % AES.block_size)
-        iv = Random.new().read(AES.block_size)
-        cipher = AES.new(password, AES.MODE_CBC, iv)
-        encrypted_bytes = base64.b64encode(iv + cipher.encrypt(data.encode()))
-        # test decryption 
+        salt, key = self.encryption_key(password)
+        nonce = os.urandom(self.nonce_size)
+        ciphertext = AESGCM(key).encrypt(nonce, data.encode(), self.prefix.encode())
+        encrypted = self.prefix + base64.b64encode(salt + nonce + ciphertext).decode()
+        # test decryption
         if verify_decryption:
-            decrypted_data = self.decrypt(encrypted_bytes, password)
+            decrypted_data = json.dumps(self.decrypt(encrypted, password))
             assert decrypted_data == data, "Decryption verification failed {}, original data: {}".format(decrypted_data, data)
-        
-        return encrypted_bytes.decode() 
+        return encrypted
+
+    def decrypt(self, data, password:str=None):
+        password = self.get_password(password or self.password)
+        if isinstance(data, bytes):
+            data = data.decode()
+        if not data.startswith(self.prefix):
+            return self.decrypt_legacy(data, password)
+        data = base64.b64decode(data[len(self.prefix):])
+        salt, nonce = data[:self.salt_size], data[self.salt_size:self.salt_size + self.nonce_size]
+        key = self.derive(password, salt)
+        try:
+            data = AESGCM(key).decrypt(nonce, data[self.salt_size + self.nonce_size:], self.prefix.encode())
+        except InvalidTag:
+            raise ValueError('Decryption failed, wrong password or corrupted data')
+        return json.loads(data.decode('utf-8'))
 
-    def decrypt(self, data, password:str=None):  
-        password = self.get_password(password or self.password)  
+    def decrypt_legacy(self, data, password: bytes):
+        """
+        Decrypts the legacy format: base64(iv + AES-CBC(json)) with the password hash as the key
+        """
         data = base64.b64decode(data)
         iv = data[:AES.block_size]
         cipher = AES.new(password, AES.MODE_CBC, iv)
@@ -41,6 +104,92 @@ class AesKey:
         data = json.loads(data)
         return data
 
+    def chunk_nonce(self, prefix: bytes, index: int, last: bool) -> bytes:
+        return prefix + struct.pack('>IB', index, int(last))
+
+    def encrypt_stream(self, src: BinaryIO, dst: BinaryIO, password=None, chunk_size:int=None) -> int:
+        """
+        Encrypts the stream src into dst one chunk at a time, returns the bytes read
+        """
+        password = self.get_password(password or self.password)
+        chunk_size = chunk_size or self.chunk_size
+        salt, key = self.encryption_key(password)
+        aead = AESGCM(key)
+        prefix = os.urandom(self.nonce_size - 5)
+        header = self.magic + salt + prefix + struct.pack('>I', chunk_size)
+        dst.write(header)
+        n, index = 0, 0
+        chunk = src.read(chunk_size)
+        while True:
+            # read ahead to know which chunk is the last one
+            next_chunk = src.read(chunk_size) if len(chunk) == chunk_size else b''
+            last = not next_chunk
+            dst.write(aead.encrypt(self.chunk_nonce(prefix, index, last), chunk, header))
+            n += len(chunk)
+            if last:
+                return n
+            chunk, index = next_chunk, index + 1
+
+    def decrypt_stream(self, src: BinaryIO, dst: BinaryIO, password=None) -> int:
+        """
+        Decrypts the stream src into dst one chunk at a time, returns the bytes written
+        A chunk that fails authentication raises before it is written
+        """
+        password = self.get_password(password or self.password)
+        header = src.read(len(self.magic) + self.salt_size + self.nonce_size - 5 + 4)
+        if not header.startswith(self.magic) or len(header) < len(self.magic) + self.salt_size + self.nonce_size - 1:
+            raise ValueError('Not an encrypted stream')
+        salt = header[len(self.magic):len(self.magic) + self.salt_size]
+        prefix = header[len(self.magic) + self.salt_size:-4]
+        chunk_size = struct.unpack('>I', header[-4:])[0] + self.tag_size
+        aead = AESGCM(self.derive(password, salt))
+        n, index = 0, 0
+        chunk = src.read(chunk_size)
+        while True:
+            next_chunk = src.read(chunk_size) if len(chunk) == chunk_size else b''
+            last = not next_chunk
+            try:
+                data = aead.decrypt(self.chunk_nonce(prefix, index, last), chunk, header)
+            except InvalidTag:
+                raise ValueError(f'Decryption failed at chunk {index}, wrong password or corrupted data')
+            dst.write(data)
+            n += len(data)
+            if last:
+                return n
+            chunk, index = next_chunk, index + 1
+
+    def encrypt_file(self, path:str, target:str=None, password=None, chunk_size:int=None) -> dict:
+        """
+        Encrypts the file into target (path + '.enc' by default) without loading it in memory
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        target = os.path.abspath(os.path.expanduser(target or path + '.enc'))
+        tmp_target = f'{target}.{os.getpid()}.tmp'
+        with open(path, 'rb') as src, open(tmp_target, 'wb') as dst:
+            size = self.encrypt_stream(src, dst, password=password, chunk_size=chunk_size)
+        os.replace(tmp_target, target)
+        return {'path': target, 'size': size}
+
+    def decrypt_file(self, path:str, target:str=None, password=None) -> dict:
+        """
+        Decrypts the file into target (path without '.enc' by default), target is only replaced once every chunk is authenticated
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        target = os.path.abspath(os.path.expanduser(target or (path[:-len('.enc')] if path.endswith('.enc') else path + '.dec')))
+        tmp_target = f'{target}.{os.getpid()}.tmp'
+        try:
+            with open(path, 'rb') as src, open(tmp_target, 'wb') as dst:
+                size = self.decrypt_stream(src, dst, password=password)
+        except Exception:
+            os.remove(tmp_target)
+            raise
+        os.replace(tmp_target, target)
+        return {'path': target, 'size': size}
+
+    def is_encrypted_file(self, path:str) -> bool:
+        with open(os.path.expanduser(path), 'rb') as f:
+            return f.read(len(self.magic)) == self.magic
+
     def test(self,  values = ['10', 'fam', 'hello world'], password='1234'):
         import mod as m
         key= m.key('fam')
@@ -52,6 +201,9 @@ class AesKey:
         return {'encrypted':enc, 'decrypted': dec, 'crypto_type':key.crypto_type}
 
     def get_password(self, password:str):
+        """
+        The sha256 of the password, what the keys are derived from
+        """
         assert password != None, "Password cannot be None"
         if isinstance(password, str):
             password = password.encode()
@@ -34,6 +34,8 @@ import struct
 from eth_keys.datatypes import Signature, PrivateKey
 from .utils import (extract_derive_path, 
                     python2str, 
+                    legacy_signature_data,
+                    canonical_signature_data, 
                     ss58_encode, 
                     ss58_decode, 
                     is_valid_ss58_address,
@@ -42,6 +44,7 @@ from .utils import (extract_derive_path,
                      str2bytes,
                      ecdsa_verify,
                     is_int)
+from .keyring import Keyring
 
 # imoport 
 class Key:
@@ -64,6 +67,10 @@ class Key:
     crypto_type =  'sr25519'
     language_code = 'en'
     storage_path = os.path.expanduser('~/.mod/key')
+    keyrings = {} # storage_path -> the Keyring shared by the keys of the process
+    # how the data is encoded before it is signed: v0 (legacy text), v1 (canonical digest), wrapped (v0 in <Bytes> for polkadot-js)
+    signature_schemes = ['v0', 'v1', 'wrapped']
+    signature_scheme = 'v0'
 
     def __init__(self,
                  private_key: Union[bytes, str] = None, 
@@ -142,6 +149,12 @@ class Key:
             raise ValueError(f'crypto_type {crypto_type} not supported')
         return crypto_type
         
+    @property
+    def keyring(self) -> Keyring:
+        if self.storage_path not in Key.keyrings:
+            Key.keyrings[self.storage_path] = Keyring(self.storage_path)
+        return Key.keyrings[self.storage_path]
+
     def valid_ss58_address(self, address):
         return is_valid_ss58_address(address)
 
@@ -151,8 +164,10 @@ class Key:
             key = self.new_key( private_key=private_key, crypto_type=crypto_type, mnemonic=mnemonic, **kwargs)
             key_json = json.loads(key.to_json())
             assert crypto_type == self.get_crypto_type(key_json['crypto_type']), f'crypto_type mismatch {crypto_type} != {key_json["crypto_type"]}'
+            name = path
             path = self.get_path(path) + '/' + crypto_type+ '/' + key.address + '.json'
             self.put(path, key_json)
+            self.keyring.update(name, crypto_type)
             assert self.key_exists(path, crypto_type=crypto_type), f'key does not exist at {path}'
         return self.get_key(path, crypto_type=crypto_type)
     
@@ -166,6 +181,8 @@ class Key:
         shutil.copytree(old_key_path, new_key_path, dirs_exist_ok=True)
         assert self.key_exists(new_path), f'key does not exist at {new_key_path}'
         shutil.rmtree(old_key_path)
+        self.keyring.update(path, crypto_type)
+        self.keyring.update(new_path, crypto_type)
         assert not self.key_exists(path), f'key still exists at {old_key_path}'
         return {'success': True, 'from': path , 'to': new_path}
         
@@ -207,14 +224,21 @@ class Key:
                 key = self.add_key(path, **kwargs) # create key
             else:
                 raise ValueError(f'key does not exist at --> {path}')
-        key_json = self.get_data(path)
-        if self.is_encrypted(key_json):
-            if prompt_password and password == None:
-                password = input(f'enter password to decrypt {path} ')
-            key_json = self.decrypt(data=key_json, password=password)
-        if isinstance(key_json, str):
-            key_json = json.loads(key_json)
-        return self.from_json(key_json, crypto_type=crypto_type)
+
+        def load_key():
+            nonlocal password
+            key_json = self.get_data(path)
+            encrypted = self.is_encrypted(key_json)
+            if encrypted:
+                if prompt_password and password == None:
+                    password = input(f'enter password to decrypt {path} ')
+                key_json = self.decrypt(data=key_json, password=password)
+            if isinstance(key_json, str):
+                key_json = json.loads(key_json)
+            # decrypted keys are not kept in memory
+            return self.from_json(key_json, crypto_type=crypto_type), not encrypted
+
+        return self.keyring.get(self.get_key_path(path), crypto_type, load_key)
 
     def get_keys(self, search=None, clean_failed_keys=False):
         keys = {}
@@ -235,29 +259,17 @@ class Key:
         defines the path for each key
         """
         crypto_type = self.get_crypto_type(crypto_type)
-        key_names  = os.listdir(self.storage_path)
         key2path = {}
-        for kn in key_names:
+        for kn, address in self.keyring.keys(crypto_type).items():
             if search:
                 if not search in kn:
                     continue
-            key_path = self.storage_path + '/' + kn + '/' + crypto_type + '/'
-            if not os.path.exists(key_path):
-                continue
-            key_address_filenames = os.listdir( key_path)
-            for filename in key_address_filenames:
-                full_path = key_path + filename
-                if os.path.isfile(full_path):
-                    key2path[kn] =  full_path  
+            key2path[kn] = self.storage_path + '/' + kn + '/' + crypto_type + '/' + address + '.json'
         return key2path
     
     def key2address(self, search=None, crypto_type=None,  **kwargs):
         crypto_type = self.get_crypto_type(crypto_type)
-        key2path = self.key2path(crypto_type=crypto_type)
-        key2address = {}
-        for key, path in key2path.items():
-            key2address[key] = path.split('/')[-1].split('.')[0]
-        return key2address
+        return self.keyring.keys(crypto_type)
 
     def key2type(self, search=None, crypto_type=None,  **kwargs):
         crypto_type = self.get_crypto_type(crypto_type)
@@ -289,29 +301,28 @@ class Key:
     
     def key_exists(self, key, crypto_type=None, **kwargs):
         crypto_type = self.get_crypto_type(crypto_type)
-        key2path = self.key2path(crypto_type=crypto_type)
         if f'/{crypto_type}/' in key:
             key = key.split(f'/{crypto_type}/')[0].split(self.storage_path)[-1].strip('/')
-        if key in key2path or key in key2path.values():
-            return True
-        return False
+        if not key or '/' in key:
+            return False
+        return self.keyring.address(key, crypto_type) != None
 
     def get_key_path(self, key, crypto_type=None):
         crypto_type = self.get_crypto_type(crypto_type)
-        key2path = self.key2path(crypto_type=crypto_type)
-        if key in key2path:
-            return key2path[key]
-        elif key in key2path.values():
+        key_path = self.keyring.key_path(key, crypto_type) if key and '/' not in key else None
+        if key_path != None:
+            return key_path
+        elif key.startswith(self.storage_path + '/') and os.path.isfile(key):
             return key
         else:
             return self.get_path(key)
 
     def key_name(self, key, crypto_type=None):
         crypto_type = self.get_crypto_type(crypto_type)
-        address2key = self.address2key(crypto_type=crypto_type)
-        if key in address2key:
-            return address2key[key]
-        elif key in address2key.values():
+        name = self.keyring.name(key, crypto_type)
+        if name != None:
+            return name
+        elif self.key_exists(key, crypto_type=crypto_type):
             return key
         else:
             return None
@@ -355,6 +366,7 @@ class Key:
         key2dirpath = self.key2dirpath(crypto_type=crypto_type)
         assert os.path.exists(key2dirpath[key])
         shutil.rmtree(key2dirpath[key])
+        self.keyring.update(key, self.get_crypto_type(crypto_type))
         assert not self.key_exists(key, crypto_type=crypto_type), f'Failed to delete key {key}'
         return {'deleted':[key]}
 
@@ -463,6 +475,7 @@ class Key:
             self.rm_key(name, crypto_type=crypto_type)
         new_path = self.get_path(name)
         shutil.copytree(path, new_path, dirs_exist_ok=True)
+        self.keyring.update(name)
         assert self.key_exists(name, crypto_type=crypto_type), f'key does not exist at {new_path}'
         key = self.get_key(name, crypto_type=crypto_type)
         assert key.address == address, f'address mismatch {key.address} != {address}'
@@ -486,22 +499,19 @@ class Key:
         """
         return Key(private_key=private_key, crypto_type=crypto_type)
 
-    def encode_signature_data(self, data: Union[ScaleBytes, bytes, str, dict]) -> bytes:
+    def encode_signature_data(self, data: Union[ScaleBytes, bytes, str, dict], scheme:str = None) -> bytes:
         """
-        Encodes data for signing and vefiying,  converting it to bytes if necessary.
+        Encodes data for signing and vefiying with the signature scheme (signature_scheme by default)
         """
-        data = copy.deepcopy(data)
-
-        if not isinstance(data, str):
-            data = python2str(data)
-        if isinstance(data, str):
-            if data[0:2] == '0x': # hex string
-                data = bytes.fromhex(data[2:])
-            elif type(data) is str:
-                data = data.encode()
-        if type(data) is ScaleBytes:
-            data = bytes(data.data)
-        return data
+        scheme = scheme or self.signature_scheme
+        if scheme == 'v0':
+            return legacy_signature_data(data)
+        elif scheme == 'v1':
+            return canonical_signature_data(data)
+        elif scheme == 'wrapped':
+            # as signed by the polkadot-js extension, see https://github.com/polkadot-js/extension/pull/743
+            return b'<Bytes>' + legacy_signature_data(data) + b'</Bytes>'
+        raise ValueError(f'signature scheme {scheme} not supported, use one of {self.signature_schemes}')
 
     def get_sig(self, signature: Union[bytes, str]):
         if isinstance(signature,str) and signature[0:2] == '0x':
@@ -526,26 +536,28 @@ class Key:
             public_key = bytes.fromhex(public_key)
         return public_key
 
-    def sign(self, data: Union[ScaleBytes, bytes, str], mode='bytes') -> bytes:
+    def sign(self, data: Union[ScaleBytes, bytes, str], mode='bytes', scheme:str = None) -> bytes:
         """
         Creates a signature for given data
         Parameters
         ----------
         data: data to sign in `Scalebytes`, bytes or hex string format
+        scheme: the signature scheme (see signature_schemes), the verifier has to use the same one
         Returns
         -------
         signature in bytes
 
         """
-        data = self.encode_signature_data(data)
+        scheme = scheme or self.signature_scheme
+        message = self.encode_signature_data(data, scheme=scheme)
         crypto_type = self.get_crypto_type(self.crypto_type)
 
         if crypto_type == "sr25519":
-            signature = sr25519.sign((self.public_key, self.private_key), data)
+            signature = sr25519.sign((self.public_key, self.private_key), message)
         elif crypto_type == "ed25519":
-            signature = ed25519_zebra.ed_sign(self.private_key, data)
+            signature = ed25519_zebra.ed_sign(self.private_key, message)
         elif crypto_type == "ecdsa":
-            signature = ecdsa_sign(self.private_key, data)
+            signature = ecdsa_sign(self.private_key, message)
         else:
             raise Exception("Crypto type not supported")
 
@@ -553,10 +565,11 @@ class Key:
             signature = '0x' + signature.hex()
         elif mode in ['dict', 'json']:
             signature =  {
-                    'data':data.decode(),
+                    'data': message.decode() if scheme == 'v0' else data,
                     'crypto_type':crypto_type,
                     'signature':signature.hex(),
-                    'address': self.address}
+                    'address': self.address,
+                    'scheme': scheme}
         elif mode == 'bytes':
             signature = signature
         else:
@@ -571,6 +584,7 @@ class Key:
                public_key:Optional[str]= None, 
                max_age = None,
                crypto_type = None,
+               scheme: str = None,
                **kwargs
                ) -> bool:
         """
@@ -580,10 +594,12 @@ class Key:
         data: data to be verified in `Scalebytes`, bytes or hex string format
         signature: signature in bytes or hex string format
         public_key: public key in bytes or hex string format
+        scheme: the signature scheme the data was signed with (the one of a signature dict, or signature_scheme)
         """
         if isinstance(data, dict) and  all(k in data for k in ['data','signature', 'address']):
+            scheme = scheme or data.get('scheme')
             data, signature, address = data['data'], data['signature'], data['address']
-        data = self.encode_signature_data(data)
+        data = self.encode_signature_data(data, scheme=scheme)
         signature = self.get_sig(signature)
         public_key = self.get_public_key(address=address, public_key=public_key)
         crypto_type = self.get_crypto_type(crypto_type)
@@ -596,12 +612,7 @@ class Key:
             crypto_verify_fn = ecdsa_verify
         else:
             raise Exception("Crypto type not supported")
-        verified = crypto_verify_fn(signature, data, public_key)
-        if not verified:
-            # Another attempt with the data wrapped, as discussed in https://github.com/polkadot-js/extension/pull/743
-            # Note: As Python apps are trusted sources on its own, no need to wrap data when signing from this lib
-            verified = crypto_verify_fn(signature, b'<Bytes>' + data + b'</Bytes>', public_key)
-        return verified
+        return crypto_verify_fn(signature, data, public_key)
 
     def encrypt(self, data, password=None, key=None):
         return self.get_encryption_key(password=password, key=key).encrypt(data)
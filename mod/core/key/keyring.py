@@ -0,0 +1,172 @@
+import os
+import json
+import threading
+from typing import Any, Callable, Dict, Optional
+
+
+class Keyring:
+    """
+    The index and cache of the keys stored under a key directory ({path}/{name}/{crypto_type}/{address}.json).
+
+    The name -> address index is persisted next to the key directory ({path}.index.json) with the mtime of
+    every key folder, so a lookup by name stats one folder instead of listing the whole directory, and
+    a lookup by address is a dict lookup. The index is rescanned (only the folders that changed) when the
+    key directory itself changes, a key replaced in its folder by another process is picked up the next
+    time its name is looked up. Loaded keys are memoised by path and reloaded when their file changes.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+        self.index_path = self.path + '.index.json'
+        self.lock = threading.RLock()
+        self.index: Dict[str, dict] = None  # crypto_type -> {'mtime': dir mtime, 'keys': {name: [address, folder mtime]}}
+        self.addresses: Dict[str, Dict[str, str]] = {}  # crypto_type -> {address: name}
+        self.cache: Dict[tuple, tuple] = {}  # (path, crypto_type) -> (file mtime, key)
+
+    @staticmethod
+    def mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def folder(self, name: str, crypto_type: str) -> str:
+        return f'{self.path}/{name}/{crypto_type}'
+
+    def load(self):
+        if self.index is not None:
+            return
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+        self.addresses = {ct: {v[0]: k for k, v in entry['keys'].items()} for ct, entry in self.index.items()}
+
+    def save(self):
+        tmp_path = f'{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            # the index is a cache, the keys are still found without it
+            pass
+
+    def scan_folder(self, name: str, crypto_type: str) -> Optional[list]:
+        """
+        The [address, folder mtime] of the key of the name, None if there is no key
+        """
+        folder = self.folder(name, crypto_type)
+        mtime = self.mtime(folder)
+        if mtime is None:
+            return None
+        # a refreshed key is written next to the old one, the newest file wins
+        files = [f'{folder}/{filename}' for filename in os.listdir(folder)]
+        files = [f for f in files if os.path.isfile(f)]
+        if not files:
+            return None
+        return [max(files, key=os.path.getmtime).split('/')[-1].split('.')[0], mtime]
+
+    def set(self, name: str, crypto_type: str, entry: Optional[list]):
+        keys = self.index.setdefault(crypto_type, {'mtime': None, 'keys': {}})['keys']
+        addresses = self.addresses.setdefault(crypto_type, {})
+        old = keys.pop(name, None)
+        if old is not None and addresses.get(old[0]) == name:
+            addresses.pop(old[0])
+        if entry is not None:
+            keys[name] = entry
+            addresses[entry[0]] = name
+
+    def refresh(self, crypto_type: str) -> dict:
+        """
+        The index of the crypto type, rescanning the folders that changed when the key directory changed
+        """
+        with self.lock:
+            self.load()
+            entry = self.index.setdefault(crypto_type, {'mtime': None, 'keys': {}})
+            mtime = self.mtime(self.path)
+            if mtime != entry['mtime']:
+                names = set(os.listdir(self.path)) if mtime is not None else set()
+                for name in list(entry['keys']):
+                    if name not in names:
+                        self.set(name, crypto_type, None)
+                for name in names:
+                    old = entry['keys'].get(name)
+                    if old is None or old[1] != self.mtime(self.folder(name, crypto_type)):
+                        self.set(name, crypto_type, self.scan_folder(name, crypto_type))
+                entry['mtime'] = mtime
+                self.save()
+            return entry
+
+    def keys(self, crypto_type: str) -> Dict[str, str]:
+        """
+        The name -> address of the keys
+        """
+        with self.lock:
+            return {name: value[0] for name, value in self.refresh(crypto_type)['keys'].items()}
+
+    def address(self, name: str, crypto_type: str) -> Optional[str]:
+        """
+        The address of the key of the name, validated against the mtime of its folder
+        """
+        with self.lock:
+            self.load()
+            old = self.index.get(crypto_type, {'keys': {}})['keys'].get(name)
+            if old is None:
+                # a new key folder changes the key directory
+                old = self.refresh(crypto_type)['keys'].get(name)
+            if old is not None and old[1] == self.mtime(self.folder(name, crypto_type)):
+                return old[0]
+            new = self.scan_folder(name, crypto_type)
+            if new != old:
+                self.set(name, crypto_type, new)
+                self.save()
+            return new[0] if new else None
+
+    def key_path(self, name: str, crypto_type: str) -> Optional[str]:
+        address = self.address(name, crypto_type)
+        return f'{self.folder(name, crypto_type)}/{address}.json' if address else None
+
+    def name(self, address: str, crypto_type: str) -> Optional[str]:
+        """
+        The name of the key of the address without listing the key directory
+        """
+        with self.lock:
+            self.refresh(crypto_type)
+            name = self.addresses.get(crypto_type, {}).get(address)
+        if name is not None and self.address(name, crypto_type) != address:
+            # the key of the name was replaced since it was indexed
+            return None
+        return name
+
+    def update(self, name: str, crypto_type: str = None):
+        """
+        Reindexes the folder of the name (after a key is added, moved or removed), for every crypto type by default
+        """
+        with self.lock:
+            self.load()
+            for ct in ([crypto_type] if crypto_type else list(self.index)):
+                self.set(name, ct, self.scan_folder(name, ct))
+            self.save()
+
+    def get(self, path: str, crypto_type: str, load: Callable[[], Any]) -> Any:
+        """
+        The key of the file at path, memoised until the file changes (load returns the key and whether it can be cached)
+        """
+        mtime = self.mtime(path)
+        cached = self.cache.get((path, crypto_type))
+        if cached is not None and mtime is not None and cached[0] == mtime:
+            return cached[1]
+        key, cacheable = load()
+        if cacheable and mtime is not None:
+            self.cache[(path, crypto_type)] = (mtime, key)
+        else:
+            self.cache.pop((path, crypto_type), None)
+        return key
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.index = None
+            self.addresses = {}
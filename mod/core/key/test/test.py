@@ -124,4 +124,157 @@ class Test(Key):
         assert og_key.ss58_address == new_key.ss58_address
         self.rm_key('testto')
         assert not key.key_exists('testto')
-        return {'success':True, 'msg':'test_move_key passed', 'key':new_key.ss58_address}
\ No newline at end of file
+        return {'success':True, 'msg':'test_move_key passed', 'key':new_key.ss58_address}
+    def test_keyring(self, n=1000, calls=1000):
+        import tempfile
+        import time
+        storage_path = tempfile.mkdtemp()
+        TmpKey = type('Key', (Key,), {'storage_path': storage_path})
+        key = TmpKey()
+        names = [f'key{i}' for i in range(n)]
+        addresses = [key.add_key(name, private_key=os.urandom(32).hex()).address for name in names]
+        assert os.path.exists(storage_path + '.index.json'), 'the index is not persisted'
+
+        # without the keyring every lookup walked the key directory and rebuilt the keypair
+        t0 = time.time()
+        for i in range(20):
+            key.keyring.clear()
+            os.remove(key.keyring.index_path)
+            assert key.get_key(names[i]).address == addresses[i]
+        uncached = (time.time() - t0) / 20
+
+        key.keyring.clear() # loads the persisted index
+        for name in names:
+            key.get_key(name)
+        t0 = time.time()
+        for i in range(calls):
+            k = key.get_key(names[i % n])
+        cached = (time.time() - t0) / calls
+        assert k.address == addresses[(calls - 1) % n]
+
+        t0 = time.time()
+        for i in range(calls):
+            assert key.key_name(addresses[i % n]) == names[i % n]
+        address2key = (time.time() - t0) / calls
+
+        # a key replaced on disk is reloaded
+        old = key.get_key(names[0])
+        new = key.add_key(names[0], refresh=True)
+        assert key.get_key(names[0]).address == new.address != old.address
+        assert key.key_name(old.address) is None and key.key_name(new.address) == names[0]
+        key.rm_key(names[1])
+        assert not key.key_exists(names[1]) and key.key_name(addresses[1]) is None
+
+        import shutil
+        shutil.rmtree(storage_path)
+        os.remove(storage_path + '.index.json')
+        assert cached * 10 < uncached, f'cached get_key {cached:.6f}s is not faster than {uncached:.6f}s'
+        return {'success': True, 'keys': n, 'uncached_get_key': uncached, 'cached_get_key': cached, 'key_name': address2key, 'speedup': uncached / cached}
+
+    def test_signature_vectors(self, path=os.path.dirname(__file__) + '/vectors.json'):
+        import json
+        vectors = json.load(open(path))
+        key = Key()
+        value = lambda p: bytes.fromhex(p['value']) if p['type'] == 'bytes' else p['value']
+        payloads = {p['name']: value(p) for p in vectors['payloads']}
+        for p in vectors['payloads']:
+            for scheme in ['v0', 'v1']:
+                assert key.encode_signature_data(value(p), scheme=scheme).hex() == p[scheme], f'{scheme} encoding of {p["name"]} changed'
+        for v in vectors['signatures']:
+            data = payloads[v['payload']]
+            assert key.verify(data, v['signature'], address=v['address'], crypto_type=v['crypto_type'], scheme=v['scheme']), v
+            # the scheme is negotiated, a signature only verifies with the scheme it was made with
+            for scheme in set(key.signature_schemes) - {v['scheme']}:
+                assert not key.verify(data, v['signature'], address=v['address'], crypto_type=v['crypto_type'], scheme=scheme), v
+            if v['crypto_type'] == 'ecdsa': # deterministic signatures
+                signer = Key(private_key=v['private_key'], crypto_type=v['crypto_type'])
+                assert signer.sign(data, mode='str', scheme=v['scheme']) == v['signature'], v
+        # the wrapped signatures (of the polkadot-js extension) only verify when that scheme is given
+        wrapped = Key().sign({'a': [1, 2]}, mode='dict', scheme='wrapped')
+        assert key.verify(wrapped['data'], wrapped['signature'], address=wrapped['address'], scheme='wrapped')
+        assert not key.verify(wrapped['data'], wrapped['signature'], address=wrapped['address'])
+        signed = Key().sign({'a': [1, 2]}, mode='dict', scheme='v1')
+        assert key.verify(signed, crypto_type=signed['crypto_type'])
+        return {'success': True, 'payloads': len(payloads), 'signatures': len(vectors['signatures'])}
+
+    def write_random(self, path, n):
+        """
+        Writes n random bytes to path, returns their sha256
+        """
+        import hashlib
+        h = hashlib.sha256()
+        with open(path, 'wb') as f:
+            for i in range(0, n, 1 << 24):
+                chunk = os.urandom(min(1 << 24, n - i))
+                h.update(chunk)
+                f.write(chunk)
+        return h.digest()
+
+    def test_aes_stream(self, chunks=[0, 1, 1 << 20, (1 << 20) + 1, 3 << 20], password='1234'):
+        """
+        roundtrips files on and around the chunk boundaries, a flipped byte or a dropped chunk fails authentication
+        """
+        import shutil
+        import tempfile
+        import hashlib
+        from ..aes import AesKey
+        aes = AesKey(password)
+        # the tokens of the legacy format are still decrypted
+        legacy = 'DLcN9dsfKujWFgK5qOEUs1orJIjoFZqtunsu8MJTwRw='
+        assert AesKey('pw').decrypt(legacy) == {'a': [1, 'x']}
+        assert aes.decrypt(aes.encrypt({'a': 1})) == {'a': 1}
+        folder = tempfile.mkdtemp()
+        sizes = sorted(set(chunks + [(1 << 20) - 1]))
+        for n in sizes:
+            path = f'{folder}/data'
+            digest = self.write_random(path, n)
+            enc = aes.encrypt_file(path)
+            dec = aes.decrypt_file(enc['path'], target=f'{folder}/decrypted')
+            assert dec['size'] == n
+            with open(dec['path'], 'rb') as f:
+                assert hashlib.file_digest(f, 'sha256').digest() == digest, f'{n} bytes roundtrip failed'
+            # a flipped byte
+            with open(enc['path'], 'r+b') as f:
+                f.seek(-1, 2)
+                last = f.read(1)
+                f.seek(-1, 2)
+                f.write(bytes([last[0] ^ 1]))
+            corrupted = [enc['path']]
+            if n > aes.chunk_size:
+                # the chunks without the last one
+                enc = aes.encrypt_file(path, target=f'{folder}/truncated.enc')
+                last = n - (n - 1) // aes.chunk_size * aes.chunk_size
+                os.truncate(enc['path'], os.path.getsize(enc['path']) - last - aes.tag_size)
+                corrupted.append(enc['path'])
+            for p in corrupted:
+                try:
+                    aes.decrypt_file(p, target=f'{folder}/corrupted')
+                    raise AssertionError(f'tampered data of {n} bytes was decrypted')
+                except ValueError:
+                    assert not os.path.exists(f'{folder}/corrupted')
+        shutil.rmtree(folder)
+        return {'success': True, 'sizes': sizes}
+
+    def aes_stream_bench(self, size, password='1234'):
+        """
+        encrypts and decrypts a file of size bytes
+        """
+        import shutil
+        import tempfile
+        from ..aes import AesKey
+        aes = AesKey(password)
+        folder = tempfile.mkdtemp()
+        self.write_random(f'{folder}/data', size)
+        def fn():
+            enc = aes.encrypt_file(f'{folder}/data')
+            return aes.decrypt_file(enc['path'], target=f'{folder}/decrypted')
+        return fn, lambda: shutil.rmtree(folder)
+
+    def bench_aes_stream_1mb(self):
+        return self.aes_stream_bench(1 << 20)
+
+    def bench_aes_stream_100mb(self):
+        return self.aes_stream_bench(100 << 20)
+
+    def bench_aes_stream_1gb(self):
+        return self.aes_stream_bench(1 << 30)
@@ -282,6 +282,59 @@ def encode_pair(public_key: bytes, private_key: bytes, passphrase: str) -> bytes
 
 
 
+def legacy_signature_data(data) -> bytes:
+    """
+    The v0 signing payload: the python2str text of the data (hex strings as their bytes), without copying the data
+    """
+    if not isinstance(data, str):
+        input_type = type(data)
+        if input_type in [dict]:
+            data = json.dumps(data)
+        elif input_type in [bytes]:
+            data = data.hex()
+        elif input_type in [list, tuple, set]:
+            data = json.dumps(list(data))
+        elif input_type in [int, float, bool]:
+            data = str(data)
+    if isinstance(data, str):
+        if data[0:2] == '0x':
+            return bytes.fromhex(data[2:])
+        return data.encode()
+    if type(data) is ScaleBytes:
+        return bytes(data.data)
+    return data
+
+def _canonical_default(x):
+    if isinstance(x, (bytes, bytearray, memoryview)):
+        return '0x' + bytes(x).hex()
+    if isinstance(x, ScaleBytes):
+        return x.to_hex()
+    if isinstance(x, (set, frozenset)):
+        return sorted(x, key=lambda v: json.dumps(v, sort_keys=True, default=_canonical_default))
+    raise TypeError(f'{type(x).__name__} can not be signed')
+
+canonical_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'), ensure_ascii=True, allow_nan=False, default=_canonical_default)
+signature_domain = b'mod:sig:v1:'
+
+def canonical_signature_data(data) -> bytes:
+    """
+    The v1 signing payload: the domain tag and the blake2b-256 digest of the typed canonical encoding of the data
+    (raw bytes for bytes, utf-8 for strings, sorted compact ascii json for the rest), whatever the payload size
+    """
+    h = blake2b(digest_size=32)
+    if isinstance(data, ScaleBytes):
+        data = bytes(data.data)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        h.update(b'b:')
+        h.update(data)
+    elif isinstance(data, str):
+        h.update(b's:')
+        h.update(data.encode())
+    else:
+        h.update(b'j:')
+        h.update(canonical_encoder.encode(data).encode('ascii'))
+    return signature_domain + h.digest()
+
 def python2str(x):
     from copy import deepcopy
     import json
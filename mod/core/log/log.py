@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import threading
+from typing import *
+
+
+class Log:
+    """
+    The logging of mod (what m.print goes through).
+
+    There is one console per process instead of one per call. Records are written as rich text or as
+    json lines (MOD_LOG_FORMAT=json), in the calling thread or by a writer thread behind a bounded queue
+    (MOD_LOG_MODE=async) so a slow terminal drops records instead of stalling the caller. Every logger
+    can be sampled (a fraction of its records is kept) and rate limited (records per second with a burst).
+    """
+
+    levels = {'debug': 10, 'info': 20, 'success': 25, 'warning': 30, 'error': 40, 'critical': 50}
+    formats = ['rich', 'json']
+    modes = ['sync', 'async']
+
+    _default = None
+    _forking = None # the log whose write lock is held by a fork
+
+    def __init__(self,
+                 format: str = None,
+                 mode: str = None,
+                 level: str = None,
+                 stream: Optional[TextIO] = None,
+                 queue_size: int = 10000):
+        self.format = format or os.environ.get('MOD_LOG_FORMAT', 'rich')
+        self.mode = mode or os.environ.get('MOD_LOG_MODE', 'sync')
+        self.level = self.levels[level or os.environ.get('MOD_LOG_LEVEL', 'debug')]
+        assert self.format in self.formats, f'format {self.format} not in {self.formats}'
+        assert self.mode in self.modes, f'mode {self.mode} not in {self.modes}'
+        self.stream = stream # sys.stdout at the time of the write by default
+        self.queue_size = queue_size
+        self.sample_rates = {} # logger -> fraction of the records kept
+        self.rate_limits = {} # logger -> (records per second, burst)
+        self.buckets = {} # logger -> [tokens, time of the last refill]
+        self.reset()
+
+    @classmethod
+    def default(cls) -> 'Log':
+        """
+        The log of the process
+        """
+        if cls._default is None:
+            cls._default = cls()
+            # the queued records are written before the process exits
+            atexit.register(cls._default.flush)
+        return cls._default
+
+    def reset(self):
+        """
+        Forgets the console, the queue, the writer thread and the locks (the child of a fork has none of them)
+        """
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock() # held by a write, and by a fork so it never copies a write in progress
+        self.console = None
+        self.queue = queue.Queue(self.queue_size)
+        self.thread = None
+        self.counts = {'written': 0, 'sampled': 0, 'limited': 0, 'dropped': 0}
+
+    def get_console(self):
+        if self.console is None:
+            import logging
+            from rich.console import Console
+            from rich.logging import RichHandler
+            logging.basicConfig(handlers=[RichHandler()])
+            self.console = Console(file=self.stream)
+        return self.console
+
+    def sample(self, logger: str, rate: float = 1.0):
+        """
+        Keeps a fraction (rate) of the records of the logger
+        """
+        self.sample_rates[logger] = rate
+        return {'logger': logger, 'rate': rate}
+
+    def limit(self, logger: str, rate: Optional[float] = None, burst: Optional[int] = None):
+        """
+        Keeps at most rate records per second of the logger (with bursts of burst records), no limit if rate is None
+        """
+        with self.lock:
+            self.buckets.pop(logger, None)
+            if rate is None:
+                self.rate_limits.pop(logger, None)
+            else:
+                self.rate_limits[logger] = (rate, burst or max(int(rate), 1))
+        return {'logger': logger, 'rate': rate, 'burst': burst}
+
+    def admit(self, logger: str, level: int) -> bool:
+        if level < self.level:
+            return False
+        rate = self.sample_rates.get(logger)
+        if rate is not None and rate < 1 and random.random() >= rate:
+            self.counts['sampled'] += 1
+            return False
+        limit = self.rate_limits.get(logger)
+        if limit is not None:
+            rate, burst = limit
+            with self.lock:
+                now = time.monotonic()
+                bucket = self.buckets.setdefault(logger, [burst, now])
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+                if bucket[0] < 1:
+                    self.counts['limited'] += 1
+                    return False
+                bucket[0] -= 1
+        return True
+
+    def emit(self, *text: Any, logger: str = 'mod', level: str = 'info', fields: dict = None, console=None, **kwargs) -> bool:
+        """
+        Logs the text (with the fields of a structured record), returns whether the record was kept
+        the other kwargs (color, buffer, flush and those of rich's Console.print) only apply to rich output
+        """
+        level = self.levels[level]
+        if not self.admit(logger, level):
+            return False
+        record = {'time': time.time(), 'logger': logger, 'level': level, 'text': text, 'fields': fields, 'kwargs': kwargs, 'console': console}
+        if self.mode == 'async' and console is None:
+            if self.thread is None:
+                self.start()
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.counts['dropped'] += 1
+                return False
+        else:
+            self.write(record)
+        return True
+
+    def event(self, msg: str, logger: str = 'mod', level: str = 'info', **fields) -> bool:
+        """
+        Logs a structured record, msg and the fields are keys of the json line
+        """
+        return self.emit(msg, logger=logger, level=level, fields=fields)
+
+    def write(self, record: dict):
+        with self.write_lock:
+            try:
+                if self.format == 'json':
+                    self.write_json(record)
+                else:
+                    self.write_rich(record)
+                self.counts['written'] += 1
+            except Exception as e:
+                sys.stderr.write(f'log write failed: {e}\n')
+
+    def write_json(self, record: dict):
+        line = {'time': round(record['time'], 6),
+                'level': next(k for k, v in self.levels.items() if v == record['level']),
+                'logger': record['logger'],
+                'msg': ' '.join(map(str, record['text']))}
+        if record['fields']:
+            line.update(record['fields'])
+        stream = self.stream or sys.stdout
+        stream.write(json.dumps(line, default=str) + '\n')
+
+    def write_rich(self, record: dict):
+        kwargs = dict(record['kwargs'])
+        color, buffer, flush = kwargs.pop('color', None), kwargs.pop('buffer', None), kwargs.pop('flush', False)
+        text = list(record['text'])
+        if record['fields']:
+            text += [f'{k}={v}' for k, v in record['fields'].items()]
+        if color == 'random':
+            from ..utils import random_color
+            color = random_color()
+        if color:
+            kwargs['style'] = color
+            buffer = f'[{color}]'
+        if buffer != None:
+            text = [buffer] + text + [buffer]
+        console = record['console'] or self.get_console()
+        if flush:
+            console.print(**kwargs, end='\r')
+        console.print(*text, **kwargs)
+
+    @classmethod
+    def before_fork(cls):
+        cls._forking = cls._default
+        if cls._forking is not None:
+            cls._forking.write_lock.acquire()
+
+    @classmethod
+    def after_fork_in_parent(cls):
+        if cls._forking is not None:
+            cls._forking.write_lock.release()
+        cls._forking = None
+
+    @classmethod
+    def after_fork_in_child(cls):
+        if cls._default is not None:
+            cls._default.reset()
+        cls._forking = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            try:
+                self.write(record)
+            finally:
+                self.queue.task_done()
+
+    def flush(self, timeout: float = 5) -> dict:
+        """
+        Waits for the queued records to be written (at most timeout seconds)
+        """
+        t0 = time.time()
+        while self.thread is not None and self.queue.unfinished_tasks and time.time() - t0 < timeout:
+            time.sleep(0.001)
+        stream = self.stream or sys.stdout
+        if not stream.closed:
+            stream.flush()
+        return self.stats()
+
+    def stats(self) -> dict:
+        return {'format': self.format, 'mode': self.mode, 'queued': self.queue.qsize(), **self.counts}
+
+
+# a fork waits for the write in progress (a thread writing holds the lock of the stream), the child of a fork
+# (the cli daemon, the workers) gets a new console for its own terminal and environment
+os.register_at_fork(before=Log.before_fork, after_in_parent=Log.after_fork_in_parent, after_in_child=Log.after_fork_in_child)
@@ -0,0 +1,183 @@
+import io
+import os
+import json
+import time
+import mod as m
+from ..log import Log
+
+class Test:
+
+    def test_json(self):
+        stream = io.StringIO()
+        log = Log(format='json', mode='sync', stream=stream)
+        log.emit('hello', 'fam', logger='gate', level='warning', color='blue')
+        log.event('request', logger='gate', fn='info', params={'a': 1})
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        assert lines[0]['msg'] == 'hello fam' and lines[0]['level'] == 'warning' and lines[0]['logger'] == 'gate', lines
+        assert lines[1]['fn'] == 'info' and lines[1]['params'] == {'a': 1}, lines
+        return {'success': True, 'lines': lines}
+
+    def test_sampling(self, n=10000, rate=0.1):
+        log = Log(format='json', mode='sync', stream=io.StringIO())
+        log.sample('noisy', rate)
+        kept = sum(log.emit('x', logger='noisy') for _ in range(n))
+        assert abs(kept - n * rate) < n * rate * 0.3, kept
+        # the other loggers are not sampled
+        assert all(log.emit('x', logger='mod') for _ in range(100))
+        # rate limiting keeps the burst and then about rate records per second
+        log.limit('burst', rate=100, burst=10)
+        kept = sum(log.emit('x', logger='burst') for _ in range(1000))
+        assert 10 <= kept <= 12, kept
+        time.sleep(0.1)
+        kept = sum(log.emit('x', logger='burst') for _ in range(1000))
+        assert 8 <= kept <= 12, kept
+        log.limit('burst', rate=None)
+        assert log.emit('x', logger='burst')
+        return {'success': True, **log.stats()}
+
+    def test_async(self, n=1000):
+        stream = io.StringIO()
+        log = Log(format='json', mode='async', stream=stream, queue_size=n * 2)
+        for i in range(n):
+            log.emit(str(i))
+        stats = log.flush()
+        lines = stream.getvalue().splitlines()
+        # the records are written in order by one thread
+        assert [json.loads(line)['msg'] for line in lines] == [str(i) for i in range(n)]
+        assert stats['written'] == n and stats['dropped'] == 0, stats
+        # a full queue (a slow terminal) drops the records instead of blocking
+        class SlowStream(io.StringIO):
+            def write(self, data):
+                time.sleep(0.01)
+                return super().write(data)
+        log = Log(format='json', mode='async', stream=SlowStream(), queue_size=10)
+        t0 = time.time()
+        kept = sum(log.emit('x') for _ in range(1000))
+        assert time.time() - t0 < 1
+        log.flush()
+        assert log.counts['dropped'] == 1000 - kept and kept < 100, log.counts
+        return {'success': True, **stats}
+
+    def test_fork(self, forks=20):
+        """
+        A fork while the writer thread writes (and holds the lock of the stream): the child writes to the stream too
+        """
+        import threading
+        class LockedStream(io.StringIO):
+            lock = threading.Lock()
+            def write(self, text):
+                with self.lock:
+                    time.sleep(0.001)
+                    return super().write(text)
+        log = Log(format='json', mode='async', stream=LockedStream(), queue_size=10**6)
+        default, Log._default = Log._default, log
+        stop = threading.Event()
+        def emit():
+            while not stop.is_set():
+                log.event('parent')
+                time.sleep(0.0005)
+        threading.Thread(target=emit, daemon=True).start()
+        hangs, codes = 0, []
+        try:
+            for _ in range(forks):
+                time.sleep(0.005)
+                pid = os.fork()
+                if pid == 0:
+                    code = 1
+                    try:
+                        log.event('child')
+                        log.flush(timeout=2)
+                        code = 0 if '"child"' in log.stream.getvalue() else 1
+                    finally:
+                        os._exit(code)
+                t0 = time.time()
+                while True:
+                    done, status = os.waitpid(pid, os.WNOHANG)
+                    if done:
+                        codes.append(os.waitstatus_to_exitcode(status))
+                        break
+                    if time.time() - t0 > 5:
+                        hangs += 1
+                        os.kill(pid, 9)
+                        os.waitpid(pid, 0)
+                        break
+                    time.sleep(0.01)
+        finally:
+            stop.set()
+            Log._default = default
+        assert hangs == 0, f'{hangs} of {forks} children were stuck on a lock of the parent'
+        assert codes == [0] * forks, codes
+        return {'success': True, 'forks': forks}
+
+    def test_print(self):
+        # m.print keeps its signature and goes through the log of the process
+        log = m.get_log()
+        written = log.counts['written']
+        m.print('hello', color='green')
+        m.print('hidden', verbose=False)
+        assert log.counts['written'] == written + 1
+        assert m.get_console() is m.get_console()
+        return {'success': True}
+
+    def test_console(self, n=100):
+        # the console (and the rich handler) is made once per log, not per record
+        import logging
+        import rich.console
+        made = []
+        class Console(rich.console.Console):
+            def __init__(self, *args, **kwargs):
+                made.append(1)
+                super().__init__(*args, **kwargs)
+        basic_config, configured = logging.basicConfig, []
+        rich.console.Console, logging.basicConfig = Console, lambda **kwargs: configured.append(kwargs)
+        try:
+            with open(os.devnull, 'w') as devnull:
+                log = Log(format='rich', mode='sync', stream=devnull)
+                log.emit('first', color='blue')
+                console, first = log.get_console(), len(made)
+                for i in range(n):
+                    log.emit(f'request {i}', color='blue')
+        finally:
+            rich.console.Console, logging.basicConfig = Console.__bases__[0], basic_config
+        assert len(made) == first and len(configured) == 1, (made, configured)
+        assert console is log.get_console() and log.counts['written'] == n + 1, log.counts
+        return {'success': True}
+
+    def bench_legacy(self):
+        """
+        a record with a new rich Console and handler per call (what m.print did)
+        """
+        import logging
+        from rich.console import Console
+        from rich.logging import RichHandler
+        devnull = open(os.devnull, 'w')
+        def fn():
+            logging.basicConfig(handlers=[RichHandler()])
+            Console(file=devnull).print('[blue]', 'request', '[blue]', style='blue')
+        return fn, devnull.close
+
+    def log_bench(self, **params):
+        devnull = open(os.devnull, 'w')
+        log = Log(stream=devnull, **params)
+        def teardown():
+            log.flush(timeout=60)
+            devnull.close()
+        return (lambda: log.emit('request', color='blue')), teardown
+
+    def bench_rich(self):
+        """
+        a record through the cached rich console
+        """
+        return self.log_bench(format='rich', mode='sync')
+
+    def bench_json(self):
+        """
+        a json line written in the calling thread
+        """
+        return self.log_bench(format='json', mode='sync')
+
+    def bench_json_async(self, queue_size=10**6):
+        """
+        a json line queued for the writer thread
+        """
+        return self.log_bench(format='json', mode='async', queue_size=queue_size)
@@ -273,8 +273,13 @@ class Mod:
         import asyncio
         return asyncio.get_event_loop()
 
+    _key_cache = {} # the key class -> the instance that loads the keys (Key() generates a new keypair)
+
     def get_key(self,key:str = None , **kwargs) -> None:
-        return self.mod('key')().get_key(key, **kwargs)
+        Key = self.mod('key')
+        if Key not in self._key_cache:
+            self._key_cache[Key] = Key()
+        return self._key_cache[Key].get_key(key, **kwargs)
         
     def key(self,key:str = None , **kwargs) -> None:
         return self.get_key(key, **kwargs)
@@ -1630,6 +1635,14 @@ class Mod:
         from .cli.cli import Cli
         return Cli().forward()
 
+    def daemon(self, action:str = 'status', path:str = None) -> dict:
+        """
+        Manage the daemon that keeps mod warm for the cli (start, stop, restart, status)
+        """
+        from .cli.daemon import Daemon
+        assert action in ['start', 'stop', 'restart', 'status'], f'Invalid action {action}'
+        return getattr(Daemon(path), action)()
+
     def hasattr(self, mod, k):
         """
         Check if the mod has the attribute
@@ -1643,6 +1656,12 @@ class Mod:
     def test(self, mod = None,  **kwargs) ->  Dict[str, str]:
         return self.fn('tester/forward')( mod=mod,  **kwargs )
 
+    def bench(self, mod = 'bench', search = None, **kwargs) -> Dict[str, Any]:
+        """
+        Runs the bench_* functions of the mod that contain search (m bench <mod> [search]), the default is the suite of the core hot paths
+        """
+        return self.fn('bench/forward')( mod=mod, search=search, **kwargs )
+
     def mergemods(self, from_mod:Any, to_mod:Any, fns:list):
         """
         Share functions from one mod to another
@@ -0,0 +1,358 @@
+import os
+import math
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import weakref
+import tempfile
+import threading
+from typing import *
+
+
+class Rejected(Exception):
+    """
+    A request that is not admitted (429: rate limited or no free slot), with the seconds to wait before a retry
+    """
+
+    def __init__(self, msg: str, status: int = 429, retry_after: float = 1.0):
+        super().__init__(msg)
+        self.status = status
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Buckets:
+    """
+    Token buckets (rate tokens per second up to burst) in a fixed table of shared memory, so the workers forked
+    after it is created (Workers) share the rate limits. A slot holds the tag of its bucket and the limits it was
+    filled with: a bucket whose limits change starts again full, the others keep their tokens. Two buckets in
+    the same slot replace each other (it only gives tokens back), the callers hold the lock of the admission.
+    """
+
+    slot = struct.Struct('<16sdddd') # tag, rate, burst, tokens, time
+
+    def __init__(self, size: int = 2**14):
+        self.size = size
+        self.table = mmap.mmap(-1, self.slot.size * size)
+        self.locations = {} # name -> (tag, offset)
+
+    def locate(self, name: str) -> Tuple[bytes, int]:
+        location = self.locations.get(name)
+        if location is None:
+            if len(self.locations) >= self.size:
+                self.locations.clear()
+            digest = hashlib.blake2b(name.encode(), digest_size=24).digest()
+            location = self.locations[name] = digest[:16], int.from_bytes(digest[16:], 'little') % self.size * self.slot.size
+        return location
+
+    def take(self, name: str, rate: float, burst: float, amount: float = 1.0) -> float:
+        """
+        Takes amount tokens, returns 0 or the seconds until there are enough of them (nothing is taken then)
+        """
+        tag, offset = self.locate(name)
+        old_tag, old_rate, old_burst, tokens, last = self.slot.unpack_from(self.table, offset)
+        now = time.monotonic()
+        if old_tag != tag or old_rate != rate or old_burst != burst:
+            tokens, last = burst, now
+        tokens = min(burst, tokens + (now - last) * rate)
+        wait = 0.0
+        if tokens >= amount:
+            tokens -= amount
+        else:
+            wait = (amount - tokens) / rate if rate > 0 else float('inf')
+        self.slot.pack_into(self.table, offset, tag, rate, burst, tokens, now)
+        return wait
+
+    def give(self, name: str, amount: float = 1.0):
+        """
+        Gives back the tokens of a request that was not admitted
+        """
+        tag, offset = self.locate(name)
+        old_tag, rate, burst, tokens, last = self.slot.unpack_from(self.table, offset)
+        if old_tag == tag:
+            self.slot.pack_into(self.table, offset, tag, rate, burst, min(burst, tokens + amount), last)
+
+
+class Counters:
+    """
+    The running requests of every fn in shared memory: their total, and a column per process (pid, active) so the
+    requests of a worker that exits are forgotten (forget) instead of holding their slots. The callers hold the
+    lock of the admission.
+    """
+
+    def __init__(self, size: int = 256, processes: int = 128):
+        self.size = size
+        self.processes = processes
+        self.column = struct.Struct('<qq')
+        self.total = struct.Struct('<q')
+        self.slot_size = 16 + self.total.size + self.column.size * processes # tag, total, columns
+        self.table = mmap.mmap(-1, self.slot_size * size)
+        self.fn_offsets = {} # fn -> offset of its slot
+        self.offsets = {} # (fn, pid) -> offsets of the total and of the column of the process
+
+    def fn_offset(self, fn: str) -> int:
+        offset = self.fn_offsets.get(fn)
+        if offset is not None:
+            return offset
+        # open addressing, the fns are few and never removed
+        tag = hashlib.blake2b(fn.encode(), digest_size=16).digest()
+        start = int.from_bytes(tag[:8], 'little') % self.size
+        for i in range(self.size):
+            offset = (start + i) % self.size * self.slot_size
+            used = self.table[offset:offset + 16]
+            if used == bytes(16):
+                self.table[offset:offset + 16] = tag
+            if used in (tag, bytes(16)):
+                self.fn_offsets[fn] = offset
+                return offset
+        raise Exception(f'No room for the counters of {fn} ({self.size} fns)')
+
+    def offset(self, fn: str) -> Tuple[int, int]:
+        pid = os.getpid()
+        offsets = self.offsets.get((fn, pid))
+        if offsets is None:
+            total = self.fn_offset(fn) + 16
+            base = total + self.total.size
+            columns = [base + i * self.column.size for i in range(self.processes)]
+            offset = next((c for c in columns if self.column.unpack_from(self.table, c)[0] == pid), None)
+            if offset is None:
+                offset = next(c for c in columns if self.column.unpack_from(self.table, c)[0] == 0)
+                self.column.pack_into(self.table, offset, pid, 0)
+            offsets = self.offsets[(fn, pid)] = total, offset
+        return offsets
+
+    def active(self, fn: str) -> int:
+        """
+        The running requests of the fn in all the processes
+        """
+        return self.total.unpack_from(self.table, self.fn_offset(fn) + 16)[0]
+
+    def add(self, fn: str, active: int):
+        total, offset = self.offset(fn)
+        pid, a = self.column.unpack_from(self.table, offset)
+        self.column.pack_into(self.table, offset, pid, a + active)
+        self.total.pack_into(self.table, total, self.total.unpack_from(self.table, total)[0] + active)
+
+    def forget(self, pid: int):
+        """
+        Clears the columns of the process (that exited) and sums the totals again from the other columns, so a
+        process killed in the middle of an update doesn't leave a wrong total
+        """
+        for i in range(self.size):
+            base = i * self.slot_size
+            if self.table[base:base + 16] == bytes(16):
+                continue
+            total = 0
+            for j in range(self.processes):
+                offset = base + 16 + self.total.size + j * self.column.size
+                column_pid, active = self.column.unpack_from(self.table, offset)
+                if column_pid == pid:
+                    self.column.pack_into(self.table, offset, 0, 0)
+                elif column_pid:
+                    total += active
+            self.total.pack_into(self.table, base + 16, total)
+
+
+class Lock:
+    """
+    A lock of the threads of the processes forked after it is made. Between the processes it is a record lock
+    (lockf) of an anonymous file, which the kernel releases when its holder exits, so a worker killed while it
+    holds the lock (SIGKILL) doesn't block the others. Between the threads of a process it is a threading lock,
+    made again in a forked child (a thread that held it at the fork does not exist there).
+    """
+
+    locks = weakref.WeakSet()
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.thread_lock = threading.Lock()
+        self.locks.add(self)
+
+    @classmethod
+    def after_fork(cls):
+        for lock in list(cls.locks):
+            lock.thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            fcntl.lockf(self.file, fcntl.LOCK_EX)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        fcntl.lockf(self.file, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+
+os.register_at_fork(after_in_child=Lock.after_fork)
+
+
+class Slots:
+    """
+    The concurrency cap of a fn over all the workers: at most limit requests run, the last reserved slots only
+    run the requests of the roles with a priority. A request that finds no free slot is not queued in the server
+    (it would hold one of its threads while it waits), it is answered 429 with the seconds to wait before a retry.
+    """
+
+    def __init__(self, fn: str, counters: Counters, lock: Lock, limit: int, reserved: int = 0):
+        self.fn = fn
+        self.counters = counters
+        self.lock = lock
+        self.limit = limit
+        self.reserved = reserved
+
+    @property
+    def active(self) -> int:
+        return self.counters.active(self.fn)
+
+    def acquire(self, priority: int = 0, retry_after: float = 1.0):
+        limit = self.limit if priority > 0 else self.limit - self.reserved
+        with self.lock:
+            active = self.counters.active(self.fn)
+            if active < limit:
+                self.counters.add(self.fn, 1)
+                return
+        raise Rejected(f'Overloaded: {active} of {self.limit} requests of {self.fn} running', 429, retry_after)
+
+    def release(self):
+        with self.lock:
+            self.counters.add(self.fn, -1)
+
+
+class Admission:
+    """
+    The admission control of the gate. A request is charged (its cost, 1 by default) to the token buckets of its
+    key and of the role of its key, and then takes a slot of its fn, the reserved slots of a fn are only for the
+    roles with a priority. A request that is not admitted is answered 429 with Retry-After at once (no request
+    waits in the server). The limits come from the store of the gate and are read again when their files change:
+
+        role2data: {role: {'rate', 'burst' (per key), 'role_rate', 'role_burst' (all the keys of the role), 'priority'}}
+        role_registry: {key: role} (the owner is owner, the other keys have default_role)
+        fn2limits: {fn or *: {'concurrency', 'reserved', 'retry_after'}}
+
+    The buckets and the running requests of the fns are in shared memory (behind a lock made before the fork,
+    which a worker that dies holding it doesn't keep), so the limits hold for all the workers of a server together.
+    Every check is a few dict lookups, a bucket update and a counter update.
+    """
+
+    Rejected = Rejected
+
+    role2data_path = 'role2data'
+    role_registry_path = 'role_registry'
+    fn2limits_path = 'fn2limits'
+
+    def __init__(self, store: Any, owner: Optional[str] = None, default_role: str = 'user', refresh: float = 1.0):
+        self.store = store
+        self.refresh = refresh
+        self.owner = owner
+        self.default_role = default_role
+        self.lock = Lock() # shared by the workers
+        self.buckets = Buckets()
+        self.counters = Counters()
+        self.slots = {} # fn -> Slots
+        self.files = {} # path -> (time of the check, mtime, data)
+
+    def load(self, path: str) -> dict:
+        """
+        The data of the store file, read again when it changes (by this process or another worker), which is
+        checked at most every refresh seconds
+        """
+        now = time.monotonic()
+        cached = self.files.get(path)
+        if cached is not None and now - cached[0] < self.refresh:
+            return cached[2]
+        file = self.store.get_path(path, filetype=self.store.filetype)
+        mtime = os.stat(file).st_mtime_ns if os.path.exists(file) else None
+        if cached is None or cached[1] != mtime:
+            data = self.store.get(path, {}) if mtime is not None else {}
+        else:
+            data = cached[2]
+        self.files[path] = (now, mtime, data)
+        return data
+
+    def role(self, key: str) -> str:
+        if key == self.owner:
+            return 'owner'
+        return self.load(self.role_registry_path).get(key, self.default_role)
+
+    def role_data(self, role: str) -> dict:
+        return self.load(self.role2data_path).get(role, {})
+
+    def priority(self, key: str) -> int:
+        return int(self.role_data(self.role(key)).get('priority', 0))
+
+    def fn_limits(self, fn: str) -> dict:
+        limits = self.load(self.fn2limits_path)
+        return limits.get(fn, limits.get('*', {}))
+
+    def bucket_limits(self, key: str, role: str) -> List[Tuple[str, str, float, float]]:
+        """
+        The (scope, name, rate, burst) of the buckets of the key and of its role that have a rate
+        """
+        data = self.role_data(role)
+        return [(scope, name, float(data[rate]), float(data.get(burst) or max(data[rate], 1))) for scope, name, rate, burst in
+                [('key', key, 'rate', 'burst'), ('role', role, 'role_rate', 'role_burst')] if data.get(rate) is not None]
+
+    def charge(self, key: str, cost: float = 1.0) -> str:
+        """
+        Charges the request to the buckets of the key and of its role, returns the role (429 if a bucket is empty)
+        """
+        role = self.role(key)
+        limits = self.bucket_limits(key, role)
+        with self.lock:
+            for i, (scope, name, rate, burst) in enumerate(limits):
+                wait = self.buckets.take(f'{scope}/{name}', rate, burst, cost)
+                if wait > 0:
+                    for taken in limits[:i]: # the request is not admitted, its tokens are given back
+                        self.buckets.give(f'{taken[0]}/{taken[1]}', cost)
+                    raise Rejected(f'Rate limited: the {scope} {name} is over {rate:g} per second', 429, wait)
+        return role
+
+    def acquire(self, fn: str, priority: int = 0) -> Optional[Slots]:
+        """
+        Takes a slot of the fn (429 if there is none), returns the slots to release or None if the fn has no cap
+        """
+        limits = self.fn_limits(fn)
+        if limits.get('concurrency') is None:
+            return None
+        slots = self.slots.get(fn)
+        if slots is None:
+            slots = self.slots.setdefault(fn, Slots(fn, self.counters, self.lock, limits['concurrency']))
+        slots.limit, slots.reserved = limits['concurrency'], limits.get('reserved', 0)
+        slots.acquire(priority, retry_after=limits.get('retry_after', 1.0))
+        return slots
+
+    def admit(self, fn: str, key: str, cost: float = 1.0) -> Optional[Slots]:
+        """
+        Admits the request of the key for the fn, returns the slots to release when it is done
+        """
+        role = self.charge(key, cost)
+        try:
+            return self.acquire(fn, priority=int(self.role_data(role).get('priority', 0)))
+        except Rejected:
+            # a request that gets no slot doesn't spend the tokens of the key
+            with self.lock:
+                for scope, name, _, _ in self.bucket_limits(key, role):
+                    self.buckets.give(f'{scope}/{name}', cost)
+            raise
+
+    def forget(self, pid: int):
+        """
+        Frees the slots of the requests of a worker that exited (called by the master of the Workers)
+        """
+        with self.lock:
+            self.counters.forget(pid)
+
+    def stats(self) -> dict:
+        """
+        The running requests of the capped fns (of all the workers)
+        """
+        stats = {}
+        with self.lock:
+            for fn, s in self.slots.items():
+                stats[fn] = {'limit': s.limit, 'reserved': s.reserved, 'active': self.counters.active(fn)}
+        return stats
@@ -9,6 +9,7 @@ import hashlib
 class Auth:
 
     features = ['data', 'time', 'key', 'signature']
+    scheme = 'v1' # the signature scheme of the tokens (see Key.signature_schemes), sent and signed with them
     sig_features = ['data', 'time']
 
     def __init__(self, 
@@ -42,8 +43,9 @@ class Auth:
             'data': data,
             'time': str(time.time()),
             'key': key.address,
+            'scheme': self.scheme,
         }
-        result['signature'] = key.sign(self.sig_data(result), mode='str')
+        result['signature'] = key.sign(self.sig_data(result), mode='str', scheme=self.scheme)
         token = self._base64url_encode(result)
         return token
 
@@ -58,14 +60,22 @@ class Auth:
         provide the data if you want to verify the data hash
         """
         if 'token' in headers:
-            token = headers['token']
-            headers = json.loads(self._base64url_decode(token))
+            headers = self.decode(headers['token'])
         age = abs(time.time() - float(headers['time']))
         assert age < self.max_age, f'Token is stale {age} > {self.max_age}'
-        verified = self.key.verify(self.sig_data(headers), signature=headers['signature'], address=headers['key'])
+        # the tokens without a scheme are the legacy (v0) ones
+        scheme = headers.get('scheme', 'v0')
+        assert scheme in self.key.signature_schemes, f'Invalid signature scheme {scheme}'
+        verified = self.key.verify(self.sig_data(headers), signature=headers['signature'], address=headers['key'], scheme=scheme)
         assert verified, f'Invalid signature {headers}'
         return headers
 
+    def decode(self, token: str) -> dict:
+        """
+        Decode the token without verifying it
+        """
+        return json.loads(self._base64url_decode(token))
+
     def get_key(self, key=None):
         """
         Get the key to use for signing
@@ -91,7 +101,11 @@ class Auth:
         """
         get the signature data from the headers
         """
-        return json.dumps({k: headers[k] for k in self.sig_features}, separators=(',', ':'))
+        sig_data = {k: headers[k] for k in self.sig_features}
+        if 'scheme' in headers:
+            # the scheme is signed too, so it can't be swapped for another one
+            sig_data['scheme'] = headers['scheme']
+        return json.dumps(sig_data, separators=(',', ':'))
 
     def test(self, key='test.auth', crypto_type='sr25519'):
         data = {'fn': 'test', 'params': {'a': 1, 'b': 2}}
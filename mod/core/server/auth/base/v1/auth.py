@@ -9,6 +9,7 @@ import hashlib
 class Auth:
 
     features = ['data', 'time', 'cost', 'key', 'signature']
+    scheme = 'v1' # the signature scheme of the tokens (see Key.signature_schemes), sent and signed with them
     sig_features = ['data', 'time', 'cost']
 
     def __init__(self, 
@@ -43,8 +44,9 @@ class Auth:
             'time': str(time.time()),
             'cost': str(cost),
             'key': key.address,
+            'scheme': self.scheme,
         }
-        result['signature'] = key.sign(self.sig_data(result), mode='str')
+        result['signature'] = key.sign(self.sig_data(result), mode='str', scheme=self.scheme)
         token = self._base64url_encode(result)
         return token
 
@@ -63,7 +65,10 @@ class Auth:
             headers = json.loads(self._base64url_decode(token))
         age = abs(time.time() - float(headers['time']))
         assert age < self.max_age, f'Token is stale {age} > {self.max_age}'
-        verified = self.key.verify(self.sig_data(headers), signature=headers['signature'], address=headers['key'])
+        # the tokens without a scheme are the legacy (v0) ones
+        scheme = headers.get('scheme', 'v0')
+        assert scheme in self.key.signature_schemes, f'Invalid signature scheme {scheme}'
+        verified = self.key.verify(self.sig_data(headers), signature=headers['signature'], address=headers['key'], scheme=scheme)
         assert verified
         return headers
 
@@ -92,7 +97,11 @@ class Auth:
         """
         get the signature data from the headers
         """
-        return json.dumps({k: headers[k] for k in self.sig_features}, separators=(',', ':'))
+        sig_data = {k: headers[k] for k in self.sig_features}
+        if 'scheme' in headers:
+            # the scheme is signed too, so it can't be swapped for another one
+            sig_data['scheme'] = headers['scheme']
+        return json.dumps(sig_data, separators=(',', ':'))
 
     def test(self, key='test.auth', crypto_type='sr25519'):
         data = {'fn': 'test', 'params': {'a': 1, 'b': 2}}
@@ -3,6 +3,7 @@ from typing import *
 import asyncio
 import json
 import requests
+from requests.exceptions import ChunkedEncodingError
 import os
 import mod as m
 
@@ -24,6 +25,7 @@ class Client:
         self.timeout = timeout
         self.fn = fn
         self.namespace = m.namespace()
+        self.stream = m.mod('stream')()
         # ensure info from the server is fetched
 
     def call(self, 
@@ -37,6 +39,15 @@ class Client:
                 **extra_kwargs 
     ):
 
+        url, params, headers = self.prepare_request(fn, params, key=key, url=url, **extra_kwargs)
+        return self.send_request(url, params, headers, timeout=timeout, stream=stream)
+       
+    forward = call
+
+    def prepare_request(self, fn:str = 'info', params: Optional[dict] = None, key:str = None, url:str = None, **extra_kwargs):
+        """
+        the url, params and signed headers of the request of the fn
+        """
         url = url or self.url
         if '/' in str(fn):
             url, fn = '/'.join(fn.split('/')[:-1]), fn.split('/')[-1]
@@ -49,9 +60,9 @@ class Client:
         key = self.get_key(key)
         params = {**(params or {}), **extra_kwargs}
         headers = self.auth.headers('', key=key)
-        return self.send_request(url, params, headers, timeout=timeout, stream=stream)
-       
-    forward = call
+        url = f'{self.mode}://{url}' if not url.startswith(self.mode) else url
+        return url, params, headers
+
     def send_request(self, url:str, params:dict, headers:dict, timeout:int=10, stream:bool=True):
         """
         send the request to the server
@@ -59,7 +70,8 @@ class Client:
 
         url = f'{self.mode}://{url}' if not url.startswith(self.mode) else url
         headers.update({
-            "Accept": "application/json",
+            # a generator result is streamed in frames (coalesced items, binary arrays) if the server supports it
+            "Accept": f"application/json, {self.stream.media_type}" if stream else "application/json",
             "Content-Type": "application/json",
         })
         try:
@@ -71,7 +83,9 @@ class Client:
         # step 5: handle the response
         if response.status_code != 200:
             raise Exception(response.text)
-        if 'text/event-stream' in response.headers.get('Content-Type', ''):
+        if self.stream.media_type in response.headers.get('Content-Type', ''):
+            result = self.frame_generator(response)
+        elif 'text/event-stream' in response.headers.get('Content-Type', ''):
             print('Streaming response...')
             result = self.stream_generator(response)
         else:
@@ -129,6 +143,49 @@ class Client:
         except Exception as e:
             yield m.detailed_error(e)
 
+    def frame_generator(self, response):
+        """
+        the items of a framed stream, the response is closed when the generator is (the server then stops its generator)
+        """
+        try:
+            yield from self.stream.read(response.iter_content(chunk_size=None))
+        except Exception as e:
+            yield m.detailed_error(e)
+        finally:
+            response.close()
+
+    async def astream(self,
+                      fn = 'info',
+                      params: Optional[dict] = None,
+                      timeout:int = 10, # the timeout of every read
+                      key:str = None,
+                      url:str = None,
+                      **extra_kwargs) -> AsyncIterator:
+        """
+        the items of the result of the fn as they are streamed (an async iterator), a result that is not a stream is one item
+        """
+        import aiohttp
+        url, params, headers = self.prepare_request(fn, params, key=key, url=url, **extra_kwargs)
+        headers.update({"Accept": f"application/json, {self.stream.media_type}", "Content-Type": "application/json"})
+        client_timeout = aiohttp.ClientTimeout(total=None, sock_read=timeout)
+        async with aiohttp.ClientSession(timeout=client_timeout) as session:
+            async with session.post(url, json=params, headers=headers) as response:
+                if response.status != 200:
+                    raise Exception(await response.text())
+                content_type = response.headers.get('Content-Type', '')
+                if self.stream.media_type in content_type:
+                    async for item in self.stream.aread(response.content.iter_any()):
+                        yield item
+                elif 'text/event-stream' in content_type:
+                    async for line in response.content:
+                        line = line.rstrip(b'\r\n')
+                        if line:
+                            yield self.process_stream_line(line)
+                elif 'application/json' in content_type:
+                    yield await response.json()
+                else:
+                    yield await response.read()
+
     def is_url(self,  url:str) -> bool:
         if not isinstance(url, str):
             return False
@@ -24,6 +24,7 @@ class Executor:
     _counter = itertools.count().__next__
     # submit.__doc__ = _base.Executor.submit.__doc__
     threads_queues = weakref.WeakKeyDictionary()
+    executors = weakref.WeakSet() # the executors of the process, reset in the child of a fork
 
     def __init__(
         self,
@@ -46,13 +47,26 @@ class Executor:
             raise ValueError("max_workers must be greater than 0")
         self.mode = mode
         self.max_workers = max_workers
-        self.task_queue = queue.PriorityQueue(maxsize=maxsize)
-        self.idle_semaphore = threading.Semaphore(0)
-        self.threads = []
+        self.maxsize = maxsize
+        self.reset()
         self.broken = False
         self.shutdown = False
-        self.shutdown_lock = threading.Lock()
         self.thread_name_prefix = thread_name_prefix or ("Executor-%d" % self._counter() )
+        Executor.executors.add(self)
+
+    def reset(self):
+        """
+        Forgets the queue, the threads and the lock (the child of a fork has none of the threads, the queued tasks run in the parent)
+        """
+        self.task_queue = queue.PriorityQueue(maxsize=self.maxsize)
+        self.idle_semaphore = threading.Semaphore(0)
+        self.threads = []
+        self.shutdown_lock = threading.Lock()
+
+    @classmethod
+    def after_fork(cls):
+        for executor in list(cls.executors):
+            executor.reset()
 
     def key_address(self, key:Optional[str]=None):
         if isinstance(key, str ) and is_valid_ss58_address(key):
@@ -212,4 +226,5 @@ class Executor:
         return {'success': True, 'msg': 'thread pool test passed'}
 
 
-
+# the executors of the master of the workers (or any forking process) start new threads in the child
+os.register_at_fork(after_in_child=Executor.after_fork)
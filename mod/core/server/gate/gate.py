@@ -1,18 +1,48 @@
 from typing import *
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
 from sse_starlette.sse import EventSourceResponse
+import anyio
 import os
 import hashlib
 import os
-import pandas as pd
 import json
+import mmap
+import struct
 import inspect
 import time
 import mod as m
 
 print = m.print
 
+class TokenCache:
+    """
+    The tokens whose signature was verified, until they expire, in a fixed table of shared memory: the workers
+    forked after it is created (Workers) share it, so a token is verified once per server rather than per process.
+    A slot holds a tag and the expiry, the tag hashes the token with the expiry so a torn write never matches.
+    """
+
+    slot = struct.Struct('<16sd')
+
+    def __init__(self, size:int = 2**16):
+        self.size = size
+        self.table = mmap.mmap(-1, self.slot.size * size)
+
+    def tag(self, token:str, expiry:float) -> bytes:
+        return hashlib.blake2b(token.encode() + struct.pack('<d', expiry), digest_size=16).digest()
+
+    def index(self, token:str) -> int:
+        return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'little') % self.size
+
+    def get(self, token:str) -> bool:
+        tag, expiry = self.slot.unpack_from(self.table, self.index(token) * self.slot.size)
+        return expiry > time.time() and tag == self.tag(token, expiry)
+
+    def put(self, token:str, expiry:float):
+        self.slot.pack_into(self.table, self.index(token) * self.slot.size, self.tag(token, expiry), expiry)
+
 class Gate:
 
     def __init__(self, path = '~/.mod/server', auth='auth.v0',mod='api', **_kwargs):
@@ -25,6 +55,11 @@ class Gate:
         self.loop = m.loop()
         self.store = m.mod('store')(path)
         self.auth = m.mod(auth)()
+        self.metrics = m.mod('metrics').default()
+        self.stream = m.mod('stream')()
+        self.tokens = TokenCache()
+        self.acl = {} # mod -> (mtime of its users, users)
+        self.admission = m.mod('admission')(store=self.store, owner=self.owner_key())
         self.set_mod(mod=mod)
 
     def is_generator(self, obj):
@@ -32,9 +67,9 @@ class Gate:
         Is this shiz a generator dawg?
         """
         if not callable(obj):
-            result = inspect.isgenerator(obj)
+            result = inspect.isgenerator(obj) or inspect.isasyncgen(obj)
         else:
-            result =  inspect.isgeneratorfunction(obj)
+            result =  inspect.isgeneratorfunction(obj) or inspect.isasyncgenfunction(obj)
         return result
 
     def set_mod(self, mod:Any=None):
@@ -47,23 +82,41 @@ class Gate:
         self.mod = mod 
         return self.mod
 
-    def forward(self, fn:str, request, mod:Any=None) -> dict:
+    def forward(self, fn:str, request, mod:Any=None, info:dict=None) -> dict:
         """
         process the request
         """
         mod = mod or self.mod
         assert not isinstance(fn, str) or fn != '', "Function name cannot be empty"
-        info = mod.info()
-        headers = dict(request.headers)
-        headers = self.auth.verify(headers)
-        assert self.is_user(info['name'], headers['key']), f"User {headers['key']} for Mod {info['name']} is not a user"
-        assert fn in info['fns'], f"Function {fn} not in fns={info['fns']}"
-        params = self.loop.run_until_complete(request.json())
-        params = json.loads(params) if isinstance(params, str) else params
-        self.print_request(request)
-        fn_obj = self.get_fn_obj(fn, mod=mod)
-        result = fn_obj(**params) if callable(fn_obj) else fn_obj
+        info = info or mod.info()
+        name = self.metric_name(fn, info)
+        with self.metrics.timer(name, 'auth'):
+            headers = self.verify(dict(request.headers))
+            assert self.is_user(info['name'], headers['key']), f"User {headers['key']} for Mod {info['name']} is not a user"
+            assert fn in info['fns'], f"Function {fn} not in fns={info['fns']}"
+        # the rate limits of the key and its role, then a slot of the fn (a generator result holds it until it
+        # is returned, not while it streams)
+        with self.metrics.timer(name, 'admission'):
+            slots = self.admission.admit(name, headers['key'], cost=max(float(headers.get('cost') or 0), 1.0))
+        try:
+            with self.metrics.timer(name, 'deserialize'):
+                body = self.read_body(request)
+                self.metrics.observe_size(name, 'request', len(body))
+                params = json.loads(body)
+                params = json.loads(params) if isinstance(params, str) else params
+            self.print_request({'fn': fn, 'params': params, 'client': {'key': headers['key']}})
+            with self.metrics.timer(name, 'execute'):
+                fn_obj = self.get_fn_obj(fn, mod=mod)
+                result = fn_obj(**params) if callable(fn_obj) else fn_obj
+        finally:
+            if slots is not None:
+                slots.release()
         if self.is_generator(result):
+            # the clients that read the framed stream get it, the others get server sent events
+            if self.stream.accepts(request.headers):
+                return self.stream.response(result)
+            if inspect.isasyncgen(result):
+                return EventSourceResponse(result)
             def generator_wrapper(generator):
                 for item in generator:
                     yield item
@@ -71,6 +124,52 @@ class Gate:
         else:
             return result
 
+    def verify(self, headers:dict) -> dict:
+        """
+        verify the headers of the request, a token verified before (by any worker) is only decoded
+        """
+        token = headers.get('token')
+        if token is None or not hasattr(self.auth, 'decode'):
+            return self.auth.verify(headers)
+        if self.tokens.get(token):
+            return self.auth.decode(token)
+        headers = self.auth.verify(headers)
+        self.tokens.put(token, float(headers['time']) + self.auth.max_age)
+        return headers
+
+    def read_body(self, request) -> bytes:
+        # the fns run in the worker threads of the server, its event loop reads the body
+        try:
+            return anyio.from_thread.run(request.body)
+        except RuntimeError: # not in a worker thread of the server, the loop of the thread reads it
+            return m.get_event_loop().run_until_complete(request.body())
+
+    def respond(self, fn:str, request, mod:Any=None, info:Optional[dict]=None) -> Response:
+        """
+        process the request into the response of the server (errors are returned as detailed errors), with its metrics
+        info is the snapshot of the info of the mod (it is computed per request otherwise)
+        """
+        mod = mod or self.mod
+        info = info or mod.info()
+        name = self.metric_name(fn, info)
+        with self.metrics.track(name):
+            try:
+                result = self.forward(fn=fn, request=request, mod=mod, info=info)
+            except self.admission.Rejected as e:
+                # 429, the client can retry after retry_after seconds
+                return JSONResponse(m.detailed_error(e), status_code=e.status, headers={'Retry-After': str(e.retry_after)})
+            except Exception as e:
+                result =  m.detailed_error(e)
+            if isinstance(result, Response):
+                return result
+            with self.metrics.timer(name, 'serialize'):
+                response = JSONResponse(jsonable_encoder(result))
+            self.metrics.observe_size(name, 'response', len(response.body))
+            return response
+
+    def metric_name(self, fn:str, info:dict) -> str:
+        # the fns that are not served share one series, the callers can't create series
+        return fn if fn in info['fns'] else 'unknown'
 
     def print_request(self, request: dict):
         """
@@ -79,16 +178,8 @@ class Gate:
         fn = request.get('fn', '')
         params = request['params'] if 'params' in request else {}
         client = request['client']['key'] if 'client' in request and 'key' in request['client'] else ''
-        right_buffer = '>'*64
-        left_buffer = '<'*64
-        print(right_buffer, color='blue')
-        print(f"""Request\t""" , color='blue')
-        print(left_buffer)
-        print_params = {'fn': fn, 'params': params, 'client': client,'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}
-        # side ways dataframe where each param is a row
-        df = pd.DataFrame(print_params.items(), columns=['param', 'value'])
-        print(df.to_string(index=False), color='blue')
-        print(right_buffer, color='blue')
+        # one structured record (logger=gate) so it can be sampled, rate limited or written as json
+        print('Request', color='blue', logger='gate', fields={'fn': fn, 'params': params, 'client': client})
 
     def get_fn_obj(self, fn:str, mod:Any) -> Any:
         if not hasattr(self, '_obj_cache'):
@@ -96,7 +187,7 @@ class Gate:
         if '/' in fn:
             if fn in self._obj_cache:
                 fn_obj = self._obj_cache[fn]
-                print(f'Using cached function object for {fn}', color='green')
+                print(f'Using cached function object for {fn}', color='green', logger='gate', level='debug')
             else:
                 temp_mod = fn.split('/')[0]
                 fn = '/'.join(fn.split('/')[1:])
@@ -175,7 +266,15 @@ class Gate:
         """
         preprocess if the address is usersed
         """
-        return user in self.users(mod)
+        # the users are read again when their file changes (by this process or another worker)
+        path = self.store.get_path(self.users_path(mod), filetype=self.store.filetype)
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        cached = self.acl.get(mod)
+        if cached is None or cached[0] != mtime:
+            users = set(self.users(mod))
+            mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+            self.acl[mod] = cached = (mtime, users)
+        return user in cached[1]
 
     role2data_path = 'role2data'
 
@@ -207,6 +306,24 @@ class Gate:
         set the user role
         """
         registry = self.store.get(self.role_registry_path, {})
+        registry[user] = role
+        self.store.put(self.role_registry_path, registry)
+        return registry
+
+    fn2limits_path = 'fn2limits'
+
+    def set_fn_limits(self, fn:str = '*', concurrency:Optional[int] = None, reserved:int = 0, retry_after:float = 1.0):
+        """
+        cap the requests of the fn (* for every fn) that run at once, the last reserved slots are only for the roles
+        with a priority, the others are answered 429 (retry after retry_after seconds), no cap if concurrency is None
+        """
+        fn2limits = self.store.get(self.fn2limits_path, {})
+        if concurrency is None:
+            fn2limits.pop(fn, None)
+        else:
+            fn2limits[fn] = {'concurrency': concurrency, 'reserved': reserved, 'retry_after': retry_after}
+        self.store.put(self.fn2limits_path, fn2limits)
+        return fn2limits
 
     def role_registry(self):
         """
@@ -0,0 +1,265 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import *
+
+
+class Histogram:
+    """
+    A log-linear (HDR style) histogram of positive integer values: every power of 2 is split in 2**sub_bits
+    buckets, so a recorded value is known within 1/2**sub_bits of itself whatever its magnitude,
+    and recording is a couple of integer operations on a fixed list
+    """
+
+    def __init__(self, sub_bits: int = 4, max_bits: int = 40):
+        self.sub_bits = sub_bits
+        self.counts = [0] * ((max_bits - sub_bits + 2) << sub_bits)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def index(self, value: int) -> int:
+        shift = value.bit_length() - self.sub_bits - 1
+        if shift < 0:
+            return value
+        return ((shift + 1) << self.sub_bits) + (value >> shift) - (1 << self.sub_bits)
+
+    def upper(self, index: int) -> int:
+        """
+        The largest value of the bucket
+        """
+        if index < (1 << self.sub_bits) << 1:
+            return index
+        shift = (index >> self.sub_bits) - 1
+        return (((index & ((1 << self.sub_bits) - 1)) + (1 << self.sub_bits) + 1) << shift) - 1
+
+    def record(self, value: int):
+        index = min(self.index(value), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> int:
+        if self.count == 0:
+            return 0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.upper(index), self.max)
+        return self.max
+
+    def state(self) -> dict:
+        """
+        The (sparse) counts of the histogram, for merge
+        """
+        return {'counts': {i: c for i, c in enumerate(self.counts) if c}, 'count': self.count, 'total': self.total, 'max': self.max}
+
+    def merge(self, state: dict):
+        """
+        Adds the values of the state of a histogram with the same buckets
+        """
+        for index, count in state['counts'].items():
+            self.counts[int(index)] += count
+        self.count += state['count']
+        self.total += state['total']
+        self.max = max(self.max, state['max'])
+
+    def cumulative(self, bounds: List[int]) -> List[int]:
+        """
+        The number of values <= every bound (the buckets of a prometheus histogram)
+        """
+        result, seen, index = [], 0, 0
+        for bound in bounds:
+            while index < len(self.counts) and self.upper(index) <= bound:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+class Timer:
+    """
+    The context of Metrics.timer (a class rather than a generator, it runs several times per request)
+    """
+
+    __slots__ = ('metrics', 'fn', 'stage', 't0')
+
+    def __init__(self, metrics: 'Metrics', fn: str, stage: str):
+        self.metrics, self.fn, self.stage = metrics, fn, stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        value = int((time.perf_counter() - self.t0) * 1e6)
+        entry = self.metrics.get(self.fn)
+        with self.metrics.lock:
+            entry['latency'][self.stage].record(value)
+            if exc_type is not None:
+                entry['errors'][self.stage] += 1
+        return False
+
+
+class Metrics:
+    """
+    The request metrics of a server, per fn: latency histograms of the stages of a request (auth, admission,
+    deserialize, execute, serialize and the whole request), the requests in flight, the errors per stage and histograms of the
+    request and response sizes. Latencies are recorded in microseconds, snapshot gives the quantiles and
+    prometheus the text format of the /metrics route.
+    """
+
+    stages = ['auth', 'admission', 'deserialize', 'execute', 'serialize', 'request']
+    sizes = ['request', 'response']
+    # the le buckets of the prometheus histograms
+    latency_buckets = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+    size_buckets = [2**i for i in range(6, 27, 2)]
+
+    _default = None
+
+    def __init__(self, prefix: str = 'mod'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.fns = {}
+
+    @classmethod
+    def default(cls) -> 'Metrics':
+        """
+        The metrics of the process (what the gate records and the /metrics route exposes)
+        """
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def get(self, fn: str) -> dict:
+        entry = self.fns.get(fn)
+        if entry is None:
+            with self.lock:
+                entry = self.fns.setdefault(fn, {'latency': {stage: Histogram() for stage in self.stages},
+                                                 'size': {kind: Histogram() for kind in self.sizes},
+                                                 'errors': {stage: 0 for stage in self.stages},
+                                                 'inflight': 0})
+        return entry
+
+    def observe(self, fn: str, stage: str, seconds: float):
+        entry = self.get(fn)
+        with self.lock:
+            entry['latency'][stage].record(int(seconds * 1e6))
+
+    def observe_size(self, fn: str, kind: str, size: int):
+        entry = self.get(fn)
+        with self.lock:
+            entry['size'][kind].record(size)
+
+    def error(self, fn: str, stage: str):
+        entry = self.get(fn)
+        with self.lock:
+            entry['errors'][stage] += 1
+
+    def timer(self, fn: str, stage: str) -> 'Timer':
+        """
+        Records the time of the block (with) as the stage of the fn, or an error of the stage if it raises
+        """
+        return Timer(self, fn, stage)
+
+    @contextmanager
+    def track(self, fn: str):
+        """
+        Counts the request in flight while the block runs and records its total time as the request stage
+        """
+        entry = self.get(fn)
+        with self.lock:
+            entry['inflight'] += 1
+        try:
+            with Timer(self, fn, 'request'):
+                yield
+        finally:
+            with self.lock:
+                entry['inflight'] -= 1
+
+    def state(self) -> dict:
+        """
+        The raw state of the metrics (json), the metrics of several processes are merged from their states
+        """
+        with self.lock:
+            return {fn: {'latency': {k: h.state() for k, h in entry['latency'].items()},
+                         'size': {k: h.state() for k, h in entry['size'].items()},
+                         'errors': dict(entry['errors']),
+                         'inflight': entry['inflight']} for fn, entry in self.fns.items()}
+
+    def merge(self, state: dict, inflight: bool = True):
+        """
+        Adds the metrics of the state (the requests in flight too unless inflight is False)
+        """
+        for fn, other in state.items():
+            entry = self.get(fn)
+            with self.lock:
+                for group in ['latency', 'size']:
+                    for key, h in other[group].items():
+                        if key in entry[group]:
+                            entry[group][key].merge(h)
+                for stage, count in other['errors'].items():
+                    if stage in entry['errors']:
+                        entry['errors'][stage] += count
+                if inflight:
+                    entry['inflight'] += other['inflight']
+        return self
+
+    def snapshot(self, fn: Optional[str] = None) -> dict:
+        """
+        The count, mean, quantiles and max of every histogram (latencies in seconds), the in flight requests and the errors per fn
+        """
+        result = {}
+        with self.lock:
+            for name, entry in self.fns.items():
+                if fn is not None and name != fn:
+                    continue
+                result[name] = {'inflight': entry['inflight'], 'errors': dict(entry['errors'])}
+                for group, scale in [('latency', 1e-6), ('size', 1)]:
+                    result[name][group] = {}
+                    for key, h in entry[group].items():
+                        if h.count == 0:
+                            continue
+                        result[name][group][key] = {'count': h.count, 'mean': h.total / h.count * scale,
+                                                    **{f'p{int(q * 100)}': h.quantile(q) * scale for q in [0.5, 0.9, 0.99]},
+                                                    'max': h.max * scale}
+        return result
+
+    def prometheus(self) -> str:
+        """
+        The metrics in the prometheus text format (the samples of a metric are grouped under its TYPE line)
+        """
+        p = self.prefix
+        latency_bounds = [int(b * 1e6) for b in self.latency_buckets]
+        with self.lock:
+            fns = sorted(self.fns.items())
+            lines = [f'# TYPE {p}_request_seconds histogram']
+            for fn, entry in fns:
+                for stage, h in entry['latency'].items():
+                    lines += self.histogram_lines(f'{p}_request_seconds', f'fn="{fn}",stage="{stage}"', h,
+                                                  self.latency_buckets, latency_bounds, 1e-6)
+            lines.append(f'# TYPE {p}_payload_bytes histogram')
+            for fn, entry in fns:
+                for kind, h in entry['size'].items():
+                    lines += self.histogram_lines(f'{p}_payload_bytes', f'fn="{fn}",kind="{kind}"', h,
+                                                  self.size_buckets, self.size_buckets, 1)
+            lines.append(f'# TYPE {p}_requests_inflight gauge')
+            lines += [f'{p}_requests_inflight{{fn="{fn}"}} {entry["inflight"]}' for fn, entry in fns]
+            lines.append(f'# TYPE {p}_errors_total counter')
+            lines += [f'{p}_errors_total{{fn="{fn}",stage="{stage}"}} {count}' for fn, entry in fns for stage, count in entry['errors'].items()]
+        return '\n'.join(lines) + '\n'
+
+    def histogram_lines(self, name: str, labels: str, h: Histogram, buckets: list, bounds: list, scale: float) -> List[str]:
+        lines = [f'{name}_bucket{{{labels},le="{bucket}"}} {count}' for bucket, count in zip(buckets, h.cumulative(bounds))]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.count}')
+        lines.append(f'{name}_sum{{{labels}}} {h.total * scale}')
+        lines.append(f'{name}_count{{{labels}}} {h.count}')
+        return lines
+
+    def reset(self):
+        with self.lock:
+            self.fns = {}
@@ -1,9 +1,11 @@
 from typing import *
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from sse_starlette.sse import EventSourceResponse
 import os
 import hashlib
+import ipaddress
 import os
 import pandas as pd
 import json
@@ -47,6 +49,38 @@ class Server:
         """
         return self.gate.forwrd(**request)
 
+    def health(self, server:str) -> dict:
+        """
+        The health of the server (its /health route), with the state of every worker of a multi-worker server
+        """
+        import requests
+        url = self.namespace().get(server, server)
+        url = url if url.startswith('http') else 'http://' + url
+        return requests.get(url + '/health', timeout=10).json()
+
+    def restart(self, server:str) -> dict:
+        """
+        Restarts the workers of a local multi-worker server one by one (SIGHUP to its master)
+        """
+        import signal
+        health = self.health(server)
+        assert 'master' in health, f'{server} is not a multi-worker server {health}'
+        os.kill(health['master'], signal.SIGHUP)
+        return {'success': True, 'server': server, 'master': health['master'], 'workers': [w['pid'] for w in health['workers']]}
+
+    def metrics(self, server:Optional[str] = None, fn:Optional[str] = None) -> dict:
+        """
+        The request metrics (latency quantiles per stage, payload sizes, in flight requests and errors per fn)
+        of this process, or of the server (its /metrics route, the sum of its workers)
+        """
+        if server is None:
+            return m.mod('metrics').default().snapshot(fn=fn)
+        import requests
+        url = self.namespace().get(server, server)
+        url = url if url.startswith('http') else 'http://' + url
+        metrics = requests.get(url + '/metrics', params={'format': 'json'}, timeout=10).json()
+        return {fn: metrics[fn]} if fn in metrics else metrics if fn is None else {}
+
     def get_port(self, port:Optional[int]=None, mod:Union[str, 'Module', Any]=None) -> int:
         if port == None: 
             config = m.config(mod)
@@ -132,6 +166,8 @@ class Server:
               d = True, 
               run_mode = 'hypercorn', # the mode to run the api server
               pm = 'pm',
+              workers = 1, # the worker processes that share the port (workers > 1 runs a pre-fork master)
+              metrics_access = None, # who reads /metrics and the workers of /health (see metrics_access)
               **extra_params 
 
               ):
@@ -152,26 +188,18 @@ class Server:
         if remote:
             return m.fn(f'{pm}/forward')(mod=mod, params=params, port=port, key=key,  daemon=d)
         self.set_mod(mod=mod, key=key, params=params ,fns = fns)
+        self.metrics_access = metrics_access or self.metrics_access
+        assert self.metrics_access in self.metrics_accesses, f'metrics_access {self.metrics_access} not in {self.metrics_accesses}'
         self.gate = m.mod('gate')(mod=self.mod)
-        # setup the api server
-        self.app = FastAPI()
-        @self.app.options("/{fn}")
-        async def options_handler(fn: str):
-            return Response(status_code=204)
-        cors_params = {
-            "allow_origins": ["*"],
-            "allow_credentials": True,
-            "allow_methods": ["*"],
-            "allow_headers": ["*"],
-        }
-        self.app.add_middleware(CORSMiddleware, **cors_params)
-        def server_fn(fn: str, request: Request):
-            try:
-                result = self.gate.forward(fn=fn, request=request, mod=self.mod) # get the request
-            except Exception as e:
-                result =  m.detailed_error(e)
-            return result
-        self.app.post("/{fn}")(server_fn)
+        # the info is the same for every request (and every worker, it is taken before they are forked)
+        self.info = self.mod.info()
+        self.workers = None
+        self.app = self.get_app()
+        if workers > 1:
+            self.workers = m.mod('workers')(app=self.app, port=port, workers=workers, run_mode=run_mode, metrics=self.gate.metrics)
+            # the slots held by a worker that exits are freed
+            self.workers.on_exit.append(self.gate.admission.forget)
+            return self.workers.forward()
 
         # run the api server
         if run_mode == 'uvicorn':
@@ -186,6 +214,68 @@ class Server:
         else:
             raise Exception(f'Unknown mode {run_mode} for run_api')
 
+    # who reads /metrics (the fns and their traffic) and the pids of the workers in /health, the status of /health is public:
+    # local: the clients on the loopback (a reverse proxy on the same host is one of them), auth: those and the users of the
+    # mod (a request signed like the calls of its fns), public: everyone
+    metrics_access = 'local'
+    metrics_accesses = ['local', 'auth', 'public']
+
+    def can_read_metrics(self, request: Request) -> bool:
+        if self.metrics_access == 'public':
+            return True
+        try:
+            if request.client is not None and ipaddress.ip_address(request.client.host).is_loopback:
+                return True
+        except ValueError:
+            pass
+        if self.metrics_access == 'auth':
+            try:
+                headers = self.gate.verify(dict(request.headers))
+                info = getattr(self, 'info', None) or self.mod.info()
+                return self.gate.is_user(info['name'], headers['key'])
+            except Exception:
+                return False
+        return False
+
+    def get_app(self) -> FastAPI:
+        """
+        the api of the mod: its fns through the gate, /metrics and /health (see metrics_access)
+        """
+        app = FastAPI()
+        @app.options("/{fn}")
+        async def options_handler(fn: str):
+            return Response(status_code=204)
+        cors_params = {
+            "allow_origins": ["*"],
+            "allow_credentials": True,
+            "allow_methods": ["*"],
+            "allow_headers": ["*"],
+        }
+        app.add_middleware(CORSMiddleware, **cors_params)
+        @app.get("/metrics")
+        def metrics_fn(request: Request, format: str = 'prometheus'):
+            if not self.can_read_metrics(request):
+                return JSONResponse({'error': 'the metrics are not public'}, status_code=403)
+            # the metrics of every worker of a multi-worker server, not only of the one that answers
+            metrics = self.workers.aggregate() if getattr(self, 'workers', None) is not None else self.gate.metrics
+            if format == 'json':
+                return metrics.snapshot()
+            return PlainTextResponse(metrics.prometheus(), media_type='text/plain; version=0.0.4')
+        @app.get("/health")
+        def health_fn(request: Request):
+            health = {'healthy': True, 'pid': os.getpid()}
+            if getattr(self, 'workers', None) is not None:
+                health['master'] = os.getppid()
+                health['workers'] = self.workers.health()
+                health['healthy'] = all(w['healthy'] for w in health['workers'])
+            if not self.can_read_metrics(request):
+                return {'healthy': health['healthy']}
+            return health
+        def server_fn(fn: str, request: Request):
+            return self.gate.respond(fn=fn, request=request, mod=self.mod, info=getattr(self, 'info', None))
+        app.post("/{fn}")(server_fn)
+        return app
+
     def set_mod(self, mod, key=None, params=None ,fns = None) -> List[str]: 
         """
         get the public functions
@@ -0,0 +1,319 @@
+import json
+import time
+import struct
+import asyncio
+import collections
+import threading
+from typing import *
+import anyio
+from starlette.responses import StreamingResponse
+import mod as m
+
+
+class Decoder:
+    """
+    Decodes the frames of a stream from chunks of bytes that can split a frame anywhere
+    """
+
+    def __init__(self, stream: 'Stream'):
+        self.stream = stream
+        self.buffer = bytearray()
+        self.done = False
+
+    def feed(self, data: bytes) -> list:
+        """
+        The items of the frames completed by data
+        """
+        self.buffer += data
+        items, offset = [], 0
+        header = self.stream.header
+        while len(self.buffer) - offset >= header.size and not self.done:
+            kind, size = header.unpack_from(self.buffer, offset)
+            if len(self.buffer) - offset - header.size < size:
+                break
+            start = offset + header.size
+            payload = bytes(self.buffer[start:start + size])
+            offset = start + size
+            if kind == b'j':
+                items.extend(json.loads(payload))
+            elif kind == b'x':
+                self.done = True
+            else:
+                items.append(self.stream.decode(kind, payload))
+        del self.buffer[:offset]
+        return items
+
+
+class StreamResponse(StreamingResponse):
+    """
+    A streaming response that always listens for the disconnect of the client (the server can keep accepting
+    the chunks of a closed connection) and closes its body at the end, which stops the generator
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            async with anyio.create_task_group() as tg:
+                async def stream():
+                    await self.stream_response(send)
+                    tg.cancel_scope.cancel()
+                tg.start_soon(stream)
+                await self.listen_for_disconnect(receive)
+                tg.cancel_scope.cancel()
+        finally:
+            await self.body_iterator.aclose()
+
+
+class Source:
+    """
+    Runs a generator in the background (a worker thread for a sync generator, a task for an async one) into
+    a bounded queue of (kind, item), kind being item, end or error. The worker only wakes the event loop up
+    when it waits for an item, and it pauses while queue_size items are waiting to be taken.
+    """
+
+    def __init__(self, generator: Union[Iterator, AsyncIterator], queue_size: int = 256):
+        self.loop = asyncio.get_running_loop()
+        self.items = collections.deque()
+        self.ready = asyncio.Event()
+        self.waiting = False
+        self.stopped = threading.Event()
+        if hasattr(generator, '__anext__'):
+            self.slots = asyncio.Semaphore(queue_size)
+            self.task = self.loop.create_task(self.aproduce(generator))
+        else:
+            self.slots = threading.Semaphore(queue_size)
+            self.task = None
+            threading.Thread(target=self.produce, args=(generator,), daemon=True).start()
+
+    def put(self, kind: str, item: Any):
+        self.items.append((kind, item))
+        # the consumer sets waiting before it checks the items again, so one of them sees the other
+        if self.waiting:
+            self.waiting = False
+            if self.task is not None:
+                self.ready.set()
+                return
+            try:
+                self.loop.call_soon_threadsafe(self.ready.set)
+            except RuntimeError: # the loop is closed
+                self.stopped.set()
+
+    def produce(self, generator: Iterator):
+        try:
+            for item in generator:
+                while not self.slots.acquire(timeout=0.1):
+                    if self.stopped.is_set():
+                        return
+                if self.stopped.is_set():
+                    return
+                self.put('item', item)
+            self.put('end', None)
+        except Exception as e:
+            self.put('error', m.detailed_error(e))
+        finally:
+            # the generator is closed by the thread that runs it (an iterator has nothing to close)
+            if hasattr(generator, 'close'):
+                generator.close()
+
+    async def aproduce(self, generator: AsyncIterator):
+        try:
+            async for item in generator:
+                await self.slots.acquire()
+                self.put('item', item)
+            self.put('end', None)
+        except Exception as e:
+            self.put('error', m.detailed_error(e))
+        finally:
+            await generator.aclose()
+
+    def get_nowait(self) -> Optional[Tuple[str, Any]]:
+        if not self.items:
+            return None
+        kind, item = self.items.popleft()
+        if kind == 'item':
+            self.slots.release()
+        return kind, item
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Tuple[str, Any]]:
+        """
+        The next (kind, item), None if there is none within timeout
+        """
+        while not self.items:
+            if timeout is not None and timeout <= 0:
+                return None
+            self.ready.clear()
+            self.waiting = True
+            if not self.items:
+                try:
+                    await asyncio.wait_for(self.ready.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self.waiting = False
+            if timeout is not None and not self.items:
+                return None
+        return self.get_nowait()
+
+    def stop(self):
+        """
+        Stops the generator (the worker closes it after its current item)
+        """
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+
+class Stream:
+    """
+    The streaming protocol of the gate and the client for generator results.
+
+    Items are sent as binary frames (a kind byte, a 4 byte length and the payload): the small json items
+    that a generator yields within latency_budget are coalesced in one frame and one chunk, bytes and arrays
+    (numpy or torch) get a frame of their own without being encoded as text. Sync generators run in a worker
+    thread behind a bounded queue (a slow client pauses the generator instead of buffering its output) and
+    a client that disconnects closes the generator. The clients that don't ask for it (Accept) get server sent events.
+    """
+
+    media_type = 'application/x-mod-stream'
+    header = struct.Struct('>cI')
+    kinds = {'json': b'j', 'bytes': b'b', 'array': b'n', 'error': b'e', 'end': b'x'}
+
+    def __init__(self,
+                 latency_budget: float = 0.01, # the seconds an item can wait for others to share its chunk
+                 max_bytes: int = 65536, # the size of a chunk that is sent without waiting
+                 queue_size: int = 256): # the items of a generator that can wait to be sent
+        self.latency_budget = latency_budget
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+
+    def accepts(self, headers: Mapping[str, str]) -> bool:
+        """
+        Does the client of the request (its headers) read this protocol
+        """
+        return self.media_type in (headers.get('accept') or headers.get('Accept') or '')
+
+    # ---- FRAMES ----
+
+    def frame(self, kind: bytes, payload: bytes) -> bytes:
+        return self.header.pack(kind, len(payload)) + payload
+
+    def is_array(self, item: Any) -> bool:
+        return type(item).__module__ in ('numpy', 'torch') and hasattr(item, 'shape')
+
+    def encode_array(self, item: Any) -> bytes:
+        import numpy as np
+        if type(item).__module__ == 'torch':
+            item = item.detach().cpu().numpy()
+        item = np.ascontiguousarray(item)
+        meta = json.dumps({'dtype': item.dtype.str, 'shape': list(item.shape)}).encode()
+        return struct.pack('>I', len(meta)) + meta + item.tobytes()
+
+    def encode_json(self, item: Any) -> bytes:
+        try:
+            return json.dumps(item).encode()
+        except TypeError:
+            from fastapi.encoders import jsonable_encoder
+            return json.dumps(jsonable_encoder(item)).encode()
+
+    def encode(self, items: Iterable) -> bytes:
+        """
+        The frames of the items (the consecutive json items share a frame)
+        """
+        data, batch = [], []
+        for item in items:
+            if isinstance(item, (bytes, bytearray, memoryview)) or self.is_array(item):
+                if batch:
+                    data.append(self.frame(b'j', b'[' + b','.join(batch) + b']'))
+                    batch = []
+                if self.is_array(item):
+                    data.append(self.frame(b'n', self.encode_array(item)))
+                else:
+                    data.append(self.frame(b'b', bytes(item)))
+            else:
+                batch.append(self.encode_json(item))
+        if batch:
+            data.append(self.frame(b'j', b'[' + b','.join(batch) + b']'))
+        return b''.join(data)
+
+    def size(self, item: Any) -> int:
+        """
+        The (estimated) size of the item in a frame, without encoding it
+        """
+        if isinstance(item, (bytes, bytearray, memoryview, str)):
+            return len(item)
+        return getattr(item, 'nbytes', 64)
+
+    def decode(self, kind: bytes, payload: bytes) -> Any:
+        if kind == b'b':
+            return payload
+        if kind == b'n':
+            import numpy as np
+            size = struct.unpack_from('>I', payload)[0]
+            meta = json.loads(payload[4:4 + size])
+            return np.frombuffer(payload, dtype=np.dtype(meta['dtype']), offset=4 + size).reshape(meta['shape'])
+        if kind == b'e':
+            return json.loads(payload)
+        raise ValueError(f'Unknown frame kind {kind}')
+
+    def decoder(self) -> Decoder:
+        return Decoder(self)
+
+    def read(self, chunks: Iterable[bytes]) -> Iterator[Any]:
+        """
+        The items of a stream from its chunks
+        """
+        decoder = self.decoder()
+        for chunk in chunks:
+            yield from decoder.feed(chunk)
+            if decoder.done:
+                return
+
+    async def aread(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[Any]:
+        decoder = self.decoder()
+        async for chunk in chunks:
+            for item in decoder.feed(chunk):
+                yield item
+            if decoder.done:
+                return
+
+    # ---- SERVER ----
+
+    def response(self, generator: Union[Iterator, AsyncIterator], **kwargs) -> StreamResponse:
+        """
+        The response of the server that streams the items of the generator
+        """
+        return StreamResponse(self.body(generator, **kwargs), media_type=self.media_type)
+
+    async def body(self,
+                   generator: Union[Iterator, AsyncIterator],
+                   latency_budget: Optional[float] = None,
+                   max_bytes: Optional[int] = None,
+                   queue_size: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        The chunks of the stream: the items that the generator yields within latency_budget of the first one
+        (up to max_bytes) are sent together, the stream ends with an end frame or an error frame
+        """
+        latency_budget = self.latency_budget if latency_budget is None else latency_budget
+        max_bytes = max_bytes or self.max_bytes
+        source = Source(generator, queue_size=queue_size or self.queue_size)
+        try:
+            done = False
+            while not done:
+                kind, item = await source.get()
+                deadline = time.monotonic() + latency_budget
+                items, size, data = [], 0, b''
+                while True:
+                    if kind == 'item':
+                        items.append(item)
+                        size += self.size(item)
+                    else:
+                        done = True
+                        data = self.frame(self.kinds[kind], b'' if item is None else self.encode_json(item))
+                        break
+                    if size >= max_bytes:
+                        break
+                    next_item = source.get_nowait() or await source.get(timeout=deadline - time.monotonic())
+                    if next_item is None:
+                        break
+                    kind, item = next_item
+                yield self.encode(items) + data
+        finally:
+            source.stop()
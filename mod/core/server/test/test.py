@@ -1,3 +1,4 @@
+import time
  
 import mod as m
 
@@ -46,3 +47,518 @@ class ServerTestMixin(Server):
         gate.rm_user(mod, user, update=update)
         assert user not in gate.users(mod) and not gate.is_user(mod, user), f"Failed to remove {user}"
         return {'user': user , 'users': gate.users(mod)}
+
+    def test_metrics(self, n=1000):
+        import json
+        import tempfile
+        class Stand:
+            def info(self):
+                return {'name': 'stand', 'fns': ['add']}
+            def add(self, a=1, b=1):
+                return a + b
+        class Request:
+            def __init__(self, headers, body):
+                self.headers, self._body = headers, body
+            async def body(self):
+                return self._body
+        gate = m.mod('gate')(path=tempfile.mkdtemp(), mod=Stand())
+        gate.print_request = lambda request: None
+        metrics = gate.metrics = m.mod('metrics')()
+        headers = gate.auth.headers('')
+        for i in range(n):
+            response = gate.respond('add', Request(headers, json.dumps({'a': i, 'b': 1}).encode()))
+            assert json.loads(response.body) == i + 1
+        # a bad token and an unknown fn are errors of the auth stage, the unknown fn gets no series of its own
+        gate.respond('add', Request({'token': 'bad'}, b'{}'))
+        gate.respond('sub', Request(headers, b'{}'))
+        snapshot = metrics.snapshot()
+        assert set(snapshot) == {'add', 'unknown'}, snapshot.keys()
+        add = snapshot['add']
+        assert add['latency']['request']['count'] == n + 1 and add['latency']['execute']['count'] == n, add
+        assert add['errors']['auth'] == 1 and snapshot['unknown']['errors']['auth'] == 1, add['errors']
+        assert add['inflight'] == 0 and add['size']['request']['count'] == n
+        assert add['latency']['execute']['p50'] <= add['latency']['request']['p50']
+        text = metrics.prometheus()
+        assert 'mod_request_seconds_count{fn="add",stage="execute"} %d' % n in text, text
+        assert 'mod_errors_total{fn="add",stage="auth"} 1' in text
+        # the metrics of several workers are merged from their (json) states
+        merged = m.mod('metrics')().merge(json.loads(json.dumps(metrics.state()))).merge(metrics.state())
+        twice = merged.snapshot()['add']
+        assert twice['latency']['request']['count'] == 2 * (n + 1) and twice['errors']['auth'] == 2, twice
+        assert twice['latency']['execute']['p50'] == add['latency']['execute']['p50']
+        # the overhead of the metrics of a request (the timers of its stages, the sizes and the gauge)
+        t0 = time.time()
+        for _ in range(n):
+            with metrics.track('add'):
+                for stage in ['auth', 'deserialize', 'execute', 'serialize']:
+                    with metrics.timer('add', stage):
+                        pass
+                metrics.observe_size('add', 'request', 100)
+                metrics.observe_size('add', 'response', 100)
+        overhead = (time.time() - t0) / n
+        assert overhead < 1e-4, overhead
+        return {'success': True, 'overhead': overhead, 'latency': add['latency']['request']}
+
+    def test_metrics_access(self):
+        """
+        /metrics and the workers of /health are for the clients on the loopback by default, for the users of the mod
+        too with metrics_access='auth' and for everyone with metrics_access='public', the status of /health is public
+        """
+        import json
+        import tempfile
+        from starlette.requests import Request
+        class Stand:
+            def info(self):
+                return {'name': 'stand', 'fns': ['work']}
+        self.mod = Stand()
+        self.gate = m.mod('gate')(path=tempfile.mkdtemp(), mod=self.mod)
+        self.info = self.mod.info()
+        self.workers = None
+        user, other = m.key('test'), m.key('test').new_key()
+        self.gate.add_user('stand', user.ss58_address)
+        routes = {route.path: route.endpoint for route in self.get_app().routes if hasattr(route, 'endpoint')}
+        def request(host, key=None):
+            headers = self.gate.auth.headers('', key=key) if key is not None else {}
+            headers = [(k.lower().encode(), str(v).encode()) for k, v in headers.items()]
+            return Request({'type': 'http', 'method': 'GET', 'path': '/metrics', 'headers': headers, 'client': (host, 50000)})
+        def reads(req):
+            metrics = routes['/metrics'](req, format='json')
+            health = routes['/health'](req)
+            assert health['healthy'], health
+            can_read = getattr(metrics, 'status_code', 200) != 403
+            assert can_read == ('pid' in health), (metrics, health)
+            return can_read
+        access = {}
+        for self.metrics_access in self.metrics_accesses:
+            access[self.metrics_access] = [reads(request('127.0.0.1')), reads(request('::1')), reads(request('10.1.2.3')),
+                                           reads(request('10.1.2.3', key=user)), reads(request('10.1.2.3', key=other))]
+        del self.metrics_access
+        assert access == {'local': [True, True, False, False, False],
+                          'auth': [True, True, False, True, False],
+                          'public': [True, True, True, True, True]}, access
+        return {'success': True, 'access': access}
+
+    def test_token_cache(self):
+        import os
+        import tempfile
+        gate = m.mod('gate')(path=tempfile.mkdtemp(), mod=m)
+        headers = gate.auth.headers('')
+        verify, calls = gate.auth.verify, []
+        gate.auth.verify = lambda headers: calls.append(1) or verify(headers)
+        assert gate.verify(headers) == gate.verify(dict(headers)) and len(calls) == 1, calls
+        # an expired token is verified again, a forked worker sees the tokens of the others
+        gate.tokens.put(headers['token'], time.time() - 1)
+        gate.verify(headers)
+        assert len(calls) == 2, calls
+        pid = os.fork()
+        if pid == 0:
+            gate.tokens.put('token', time.time() + 60)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        assert gate.tokens.get('token') and not gate.tokens.get('other')
+        return {'success': True}
+
+    def test_auth_scheme(self):
+        auth = m.mod('auth')()
+        key = auth.get_key()
+        headers = auth.decode(auth.headers('')['token'])
+        assert headers['scheme'] == 'v1' and auth.verify({'token': auth._base64url_encode(headers)})
+        def token(scheme, changes={}):
+            headers = {'data': '', 'time': str(time.time()), 'key': key.address}
+            if scheme:
+                headers['scheme'] = scheme
+            headers['signature'] = key.sign(auth.sig_data(headers), mode='str', scheme=scheme or 'v0')
+            return {'token': auth._base64url_encode({**headers, **changes})}
+        # the legacy tokens (without a scheme) are v0, the wrapped ones only verify when they say so
+        assert auth.verify(token(None)) and auth.verify(token('wrapped'))
+        for headers in [token('wrapped', {'scheme': 'v0'}), token('v1', {'scheme': 'v0'}), token(None, {'scheme': 'wrapped'})]:
+            try:
+                auth.verify(headers)
+                assert False, 'the scheme of a token can not be changed'
+            except AssertionError as e:
+                assert 'Invalid signature' in str(e), e
+        return {'success': True}
+
+    def test_stream(self, n=10000):
+        import asyncio
+        import numpy as np
+        stream = m.mod('stream')()
+        async def chunks(generator, **kwargs):
+            return [chunk async for chunk in stream.body(generator, **kwargs)]
+        # json items are coalesced, bytes and arrays keep their type, frames can be split anywhere
+        items = ['a', {'b': 1}, b'\x00\x01', np.arange(6, dtype='float32').reshape(2, 3), 3]
+        data = b''.join(asyncio.run(chunks(iter(items))))
+        decoder, decoded = stream.decoder(), []
+        for i in range(len(data)):
+            decoded += decoder.feed(data[i:i + 1])
+        assert decoded[:3] == items[:3] and decoded[4] == 3 and decoder.done, decoded
+        assert decoded[3].dtype == np.float32 and (decoded[3] == items[3]).all()
+        # the small items of a fast generator share chunks, sync and async generators alike
+        async def agen(n):
+            for i in range(n):
+                yield i
+        for generator in [iter(range(n)), agen(n)]:
+            result = asyncio.run(chunks(generator))
+            assert list(stream.read(result)) == list(range(n)) and len(result) < n / 100, len(result)
+        # a slow generator is not held back for more than the latency budget
+        def slow(n, delay):
+            for i in range(n):
+                time.sleep(delay)
+                yield i
+        result = asyncio.run(chunks(slow(10, 0.02), latency_budget=0.005))
+        assert len(result) >= 9, len(result)
+        # an error of the generator ends the stream with the error
+        def fails():
+            yield 1
+            raise ValueError('boom')
+        result = list(stream.read(asyncio.run(chunks(fails()))))
+        assert result[0] == 1 and result[1]['error'] == 'boom', result
+        # a consumer that stops (a client that disconnects) closes the generator, which waits for the consumer
+        produced, closed, taken = [], [], []
+        def endless():
+            try:
+                while True:
+                    produced.append(1)
+                    yield 'token'
+            finally:
+                closed.append(1)
+        async def take(k):
+            body = stream.body(endless(), queue_size=16)
+            for _ in range(k):
+                taken.append(await body.__anext__())
+                await asyncio.sleep(0.05)
+            await body.aclose()
+        asyncio.run(take(3))
+        t0 = time.time()
+        while not closed and time.time() - t0 < 5:
+            time.sleep(0.01)
+        assert closed, 'the generator was not closed'
+        consumed = len(list(stream.read(taken)))
+        assert len(produced) <= consumed + 16 + 1, (len(produced), consumed)
+        return {'success': True, 'chunks': len(result), 'produced': len(produced), 'consumed': consumed}
+
+    def serve_stand(self, mod):
+        """
+        Serves the mod through a gate like Server.serve does (uvicorn in a thread), returns the url and the server
+        """
+        import tempfile
+        import threading
+        import uvicorn
+        from fastapi import FastAPI, Request
+        gate = m.mod('gate')(path=tempfile.mkdtemp(), mod=mod)
+        gate.print_request = lambda request: None
+        app = FastAPI()
+        def server_fn(fn: str, request: Request):
+            return gate.respond(fn=fn, request=request, mod=gate.mod)
+        app.post('/{fn}')(server_fn)
+        port = m.free_port()
+        server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='error'))
+        threading.Thread(target=server.run, daemon=True).start()
+        t0 = time.time()
+        while not server.started and time.time() - t0 < 10:
+            time.sleep(0.01)
+        return f'127.0.0.1:{port}', server
+
+    def test_stream_server(self, n=20000):
+        """
+        The token rate of a generator through the server with framed streaming and with server sent events,
+        the disconnect of a client and the async iterator of the client
+        """
+        import asyncio
+        closed = []
+        class Stand:
+            def info(self):
+                return {'name': 'stand', 'fns': ['tokens']}
+            def tokens(self, n=10, delay=0.0):
+                try:
+                    for i in range(n):
+                        if delay:
+                            time.sleep(delay)
+                        yield f'token{i} '
+                finally:
+                    closed.append(1)
+        url, server = self.serve_stand(Stand())
+        client = m.mod('client')()
+        try:
+            rates = {}
+            for name, stream in [('frames', True), ('sse', False)]:
+                headers = client.auth.headers('', key=client.key)
+                t0 = time.time()
+                tokens = [t for t in client.send_request(url + '/tokens', {'n': n}, headers, timeout=60, stream=stream) if t]
+                rates[name] = n / (time.time() - t0)
+                assert tokens == [f'token{i} ' for i in range(n)], tokens[:3]
+            assert rates['frames'] > rates['sse'], rates
+            # a client that stops reading stops the generator of the server
+            n_closed = len(closed)
+            tokens = client.call('tokens', {'n': 10**9, 'delay': 0.001}, url=url)
+            assert [next(tokens) for _ in range(3)] == ['token0 ', 'token1 ', 'token2 ']
+            tokens.close()
+            t0 = time.time()
+            while len(closed) == n_closed and time.time() - t0 < 5:
+                time.sleep(0.01)
+            assert len(closed) == n_closed + 1, 'the generator was not stopped'
+            async def astream():
+                return [t async for t in client.astream('tokens', {'n': 100}, url=url)]
+            assert asyncio.run(astream()) == [f'token{i} ' for i in range(100)]
+        finally:
+            server.should_exit = True
+        return {'success': True, 'tokens_per_second': rates}
+
+    def test_workers(self, workers=4, n=400, clients=8, work=20000):
+        """
+        The throughput of a cpu bound fn served by one worker and by several (up to the cpus), the health of the
+        workers, the metrics summed over the workers, the replacement of a killed worker, a restart that is aborted
+        when a new worker fails and a rolling restart without failed requests
+        """
+        import os
+        import signal
+        import tempfile
+        import threading
+        import requests
+        class Stand:
+            def info(self):
+                return {'name': 'stand', 'fns': ['work']}
+            def work(self, n=1000):
+                return sum(i * i for i in range(n))
+        self.mod = Stand()
+        self.gate = m.mod('gate')(path=tempfile.mkdtemp(), mod=self.mod)
+        self.gate.print_request = lambda request: None
+        self.info = self.mod.info()
+        headers = self.gate.auth.headers('')
+        broken = tempfile.mkdtemp() + '/broken' # the new workers fail while it exists
+
+        def start(k):
+            port = m.free_port()
+            self.workers = m.mod('workers')(app=self.get_app(), port=port, host='127.0.0.1', workers=k, heartbeat=0.2, timeout=5)
+            run_worker = self.workers.run_worker
+            self.workers.run_worker = lambda slot: os._exit(1) if os.path.exists(broken) else run_worker(slot)
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    self.workers.forward()
+                finally:
+                    os._exit(0)
+            url = f'http://127.0.0.1:{port}'
+            t0 = time.time()
+            while time.time() - t0 < 30:
+                try:
+                    health = requests.get(url + '/health', timeout=1).json()
+                    if len(health['workers']) == k and health['healthy']:
+                        return pid, url
+                except requests.exceptions.ConnectionError:
+                    pass
+                time.sleep(0.1)
+            raise Exception(f'{k} workers did not start')
+
+        def requests_count(url):
+            time.sleep(0.5) # the heartbeats of the other workers
+            counts = set()
+            for _ in range(8): # whichever worker answers
+                metrics = requests.get(url + '/metrics', params={'format': 'json'}).json()
+                counts.add(metrics['work']['latency']['request']['count'])
+            return counts
+
+        def stop(pid):
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+        def load(url, n, errors):
+            def run(k):
+                # a connection per request like the Client (a worker that stops closes its idle connections)
+                for _ in range(k):
+                    try:
+                        response = requests.post(url + '/work', json={'n': work}, headers=headers, timeout=30)
+                        assert response.json() == sum(i * i for i in range(work)), response.text
+                    except Exception as e:
+                        errors.append(str(e))
+            threads = [threading.Thread(target=run, args=(n // clients,)) for _ in range(clients)]
+            t0 = time.time()
+            [t.start() for t in threads]
+            [t.join() for t in threads]
+            return n / (time.time() - t0)
+
+        rates = {}
+        for k in [1, workers]:
+            pid, url = start(k)
+            errors = []
+            try:
+                rates[k] = load(url, n, errors)
+                assert not errors, errors[:3]
+            finally:
+                if k == 1:
+                    stop(pid)
+        # a killed worker is replaced, SIGHUP replaces every worker while the requests keep being served
+        try:
+            served = n // clients * clients
+            assert requests_count(url) == {served}, requests_count(url)
+            health = requests.get(url + '/health').json()
+            os.kill(health['workers'][0]['pid'], signal.SIGKILL)
+            t0 = time.time()
+            while time.time() - t0 < 10:
+                after = requests.get(url + '/health').json()
+                if health['workers'][0]['pid'] not in [w['pid'] for w in after['workers']] and len(after['workers']) == workers and after['healthy']:
+                    break
+                time.sleep(0.1)
+            assert len(after['workers']) == workers and after['healthy'], after
+            # a restart is aborted when its first new worker fails, the workers keep running
+            open(broken, 'w').close()
+            os.kill(after['master'], signal.SIGHUP)
+            time.sleep(self.workers.timeout + 1) # past the wait for the new worker
+            os.remove(broken)
+            aborted = requests.get(url + '/health').json()
+            assert {w['pid'] for w in aborted['workers']} == {w['pid'] for w in after['workers']} and aborted['healthy'], aborted
+            errors = []
+            loader = threading.Thread(target=load, args=(url, n, errors))
+            loader.start()
+            before = {w['pid'] for w in after['workers']}
+            os.kill(after['master'], signal.SIGHUP)
+            loader.join()
+            t0 = time.time()
+            while time.time() - t0 < 30:
+                restarted = requests.get(url + '/health').json()
+                if not before & {w['pid'] for w in restarted['workers']} and len(restarted['workers']) == workers:
+                    break
+                time.sleep(0.1)
+            assert not before & {w['pid'] for w in restarted['workers']}, (before, restarted)
+            assert not errors, errors[:3]
+            # the metrics of the workers that were killed or restarted are kept
+            assert requests_count(url) == {2 * served}, requests_count(url)
+        finally:
+            stop(pid)
+        scaling = rates[workers] / rates[1]
+        cpus = len(os.sched_getaffinity(0))
+        # the workers share a single cpu, there is no scaling to check
+        if cpus >= 2:
+            assert scaling > 0.5 * min(workers, cpus), rates
+        return {'success': True, 'requests_per_second': rates, 'scaling': scaling, 'cpus': cpus, 'scaling_checked': cpus >= 2}
+
+    def test_fork(self):
+        """
+        The executor of a process that forks (like the master of the workers) still runs the tasks of the child
+        """
+        import os
+        executor = m.mod('executor')(max_workers=1)
+        assert executor.submit(fn=lambda: 1).result(timeout=5) == 1 # its thread is started
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = 0 if executor.submit(fn=lambda: 2).result(timeout=5) == 2 else 1
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0, 'the task of the child did not run'
+        assert executor.submit(fn=lambda: 3).result(timeout=5) == 3
+        return {'success': True}
+
+    def test_admission(self, n=1000):
+        """
+        The rate limits per key and role and the concurrency cap of a fn (429), the slots reserved for the roles
+        with a priority, the limits shared with forked workers and the overhead of the admission of a request
+        """
+        import json
+        import tempfile
+        import threading
+        running = threading.Event()
+        done = threading.Event()
+        class Stand:
+            def info(self):
+                return {'name': 'stand', 'fns': ['add', 'slow']}
+            def add(self, a=1, b=1):
+                return a + b
+            def slow(self):
+                running.set()
+                done.wait(10)
+                return 'done'
+        class Request:
+            def __init__(self, headers, body=b'{}'):
+                self.headers, self._body = headers, body
+            async def body(self):
+                return self._body
+        gate = m.mod('gate')(path=tempfile.mkdtemp(), mod=Stand())
+        gate.print_request = lambda request: None
+        gate.admission.refresh = 0
+        keys = {name: m.key(f'test.admission.{name}') for name in ['a', 'b', 'vip']}
+        for key in keys.values():
+            gate.add_user('stand', key.address)
+        headers = lambda name: gate.auth.headers('', key=keys[name])
+        call = lambda fn, name: gate.respond(fn, Request(headers(name)))
+        # 3 requests per key, 4 for the role: the third key of the role is limited by the role
+        gate.add_role('user', {'fns': ['*'], 'rate': 1, 'burst': 3, 'role_rate': 1, 'role_burst': 4})
+        gate.add_role('vip', {'fns': ['*'], 'priority': 5})
+        gate.set_user_role('vip', keys['vip'].address)
+        statuses = [call('add', 'a').status_code for _ in range(4)]
+        assert statuses == [200, 200, 200, 429], statuses
+        response = call('add', 'b')
+        assert response.status_code == 200 and call('add', 'b').status_code == 429
+        assert int(response.headers.get('retry-after', 1)) >= 1
+        assert all(call('add', 'vip').status_code == 200 for _ in range(10))
+        # a new role for a key only starts again the buckets whose limits changed
+        gate.set_user_role('vip', keys['b'].address)
+        assert call('add', 'a').status_code == 429 and call('add', 'b').status_code == 200
+        gate.set_user_role('user', keys['b'].address)
+        # one slow request runs, the next one is answered 429 at once (it doesn't wait in a thread of the server)
+        # without spending the tokens of its key
+        gate.add_role('user', {'fns': ['*'], 'rate': 0.001, 'burst': 2})
+        gate.set_fn_limits('slow', concurrency=1, retry_after=2)
+        results = {}
+        def run(name, tag):
+            results[tag] = call('slow', name)
+        first = threading.Thread(target=run, args=('vip', 'first'))
+        first.start()
+        assert running.wait(5)
+        t0 = time.time()
+        statuses = [call('slow', 'a') for _ in range(3)]
+        assert time.time() - t0 < 1 and all(r.status_code == 429 and r.headers['retry-after'] == '2' for r in statuses), statuses
+        assert gate.admission.stats()['slow'] == {'limit': 1, 'reserved': 0, 'active': 1}
+        done.set()
+        first.join(5)
+        assert results['first'].status_code == 200 and gate.admission.stats()['slow']['active'] == 0
+        assert [call('add', 'a').status_code for _ in range(3)] == [200, 200, 429]
+        # the reserved slots only run the requests of the roles with a priority
+        gate.add_role('user', {'fns': ['*']})
+        gate.set_fn_limits('add', concurrency=2, reserved=1)
+        held = gate.admission.acquire('add')
+        assert call('add', 'a').status_code == 429 and call('add', 'vip').status_code == 200
+        held.release()
+        assert call('add', 'a').status_code == 200
+        gate.set_fn_limits('add')
+        # the buckets and the slots are shared with the forked workers, the slots of a worker that exits are freed
+        import os
+        import signal
+        gate.add_role('user', {'fns': ['*'], 'rate': 1, 'burst': 2})
+        gate.set_fn_limits('slow', concurrency=1)
+        pid = os.fork()
+        if pid == 0:
+            gate.admission.charge(keys['a'].address)
+            gate.admission.charge(keys['a'].address)
+            gate.admission.acquire('slow') # not released
+            os._exit(0)
+        os.waitpid(pid, 0)
+        assert call('add', 'a').status_code == 429
+        assert call('slow', 'b').status_code == 429 and gate.admission.stats()['slow']['active'] == 1
+        gate.admission.forget(pid)
+        assert call('slow', 'b').status_code == 200 and gate.admission.stats()['slow']['active'] == 0
+        # a worker killed while it holds the lock doesn't keep it
+        pid = os.fork()
+        if pid == 0:
+            gate.admission.lock.__enter__()
+            os.kill(os.getpid(), signal.SIGKILL)
+        os.waitpid(pid, 0)
+        locked = threading.Thread(target=lambda: gate.admission.lock.__enter__() and gate.admission.lock.__exit__())
+        locked.start()
+        locked.join(5)
+        assert not locked.is_alive(), 'the lock of a killed worker was not released'
+        # the admission of a request: the role of its key, its buckets and the slot of its fn
+        gate.add_role('user', {'fns': ['*'], 'rate': 10**9, 'burst': 10**9, 'role_rate': 10**9, 'role_burst': 10**9})
+        gate.set_fn_limits('add', concurrency=100)
+        key = keys['a'].address
+        gate.admission.admit('add', key).release()
+        gate.admission.refresh = 1
+        t0 = time.time()
+        for _ in range(n):
+            slots = gate.admission.admit('add', key)
+            slots.release()
+        overhead = (time.time() - t0) / n
+        assert overhead < 1e-4, overhead
+        return {'success': True, 'overhead': overhead}
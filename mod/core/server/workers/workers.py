@@ -0,0 +1,347 @@
+import os
+import sys
+import json
+import time
+import mmap
+import shutil
+import tempfile
+import struct
+import signal
+import socket
+import asyncio
+from typing import *
+import mod as m
+
+print = m.print
+
+
+class Workers:
+    """
+    Pre-fork serving of an app by several worker processes on one socket.
+
+    The master binds the socket and builds the app (with its gate, the info snapshot and the token cache) before
+    it forks, so the workers share that state (copy on write, the token cache is shared memory) and the kernel
+    spreads the connections over them. The master may run threads when it forks (the async writer of the log, the
+    executor pools), the mods that own them reset them in the child with os.register_at_fork so a worker never waits
+    on a lock held by a thread it does not have. Every worker writes a heartbeat (its pid, the time and its request
+    count) in a shared slot: a worker that exits or stops beating (a blocked event loop) is replaced. SIGHUP restarts the
+    workers one by one (a new worker is healthy before the old one is stopped, a restart is aborted when it is not),
+    SIGTERM and SIGINT stop them gracefully. Every worker also writes the state of its metrics in a file with its
+    heartbeat, so the /metrics of any worker is the sum of all of them (the other workers as of their last heartbeat,
+    the workers that exited included).
+    """
+
+    slot = struct.Struct('<qddq') # pid, started, heartbeat, requests
+
+    def __init__(self,
+                 app: Any,
+                 port: int,
+                 host: str = '0.0.0.0',
+                 workers: Optional[int] = None, # the number of worker processes (the cpus by default)
+                 run_mode: str = 'uvicorn',
+                 heartbeat: float = 1.0, # the seconds between the heartbeats of a worker
+                 timeout: float = 10.0, # the seconds without a heartbeat after which a worker is replaced
+                 grace: float = 30.0, # the seconds a stopped worker has to finish its requests
+                 drain: float = 0.5, # the seconds a stopped worker keeps reading the requests of its connections
+                 metrics: Any = None): # the metrics the gate of the app records (the default metrics)
+        self.app = app
+        self.host = host
+        self.port = port
+        self.n = workers or os.cpu_count() or 1
+        self.run_mode = run_mode
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.grace = grace
+        self.drain = drain
+        self.metrics = metrics or m.mod('metrics').default()
+        self.metrics_path = None # the directory of the metrics of the workers, made by forward
+        # a replacement worker gets a slot of its own while the old one finishes, hence twice the slots
+        self.slots = mmap.mmap(-1, self.slot.size * self.n * 2)
+        self.pids = {} # pid -> slot
+        self.on_exit = [] # called with the pid of every worker that exits (in the master)
+        self.stopping = False
+        self.restarting = False
+        self.sock = None
+
+    def forward(self) -> dict:
+        """
+        Runs the master until it is stopped
+        """
+        self.sock = self.bind()
+        self.metrics_path = tempfile.mkdtemp(prefix='mod-workers-')
+        for slot in range(self.n):
+            self.spawn(slot)
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, 'restarting', True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, 'stopping', True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, 'stopping', True))
+        print(f'Serving on {self.host}:{self.port} with {self.n} workers (master={os.getpid()})', color='green')
+        while not self.stopping:
+            self.check()
+            if self.restarting:
+                self.restarting = False
+                self.restart()
+            time.sleep(self.heartbeat / 4)
+        return self.stop()
+
+    def bind(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    # ---- WORKERS ----
+
+    def spawn(self, slot: int) -> int:
+        """
+        Forks a worker into the slot, returns its pid
+        """
+        self.write(slot, 0, time.time(), 0.0, 0)
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                for sig in [signal.SIGHUP, signal.SIGTERM, signal.SIGINT]:
+                    signal.signal(sig, signal.SIG_DFL)
+                # the requests of the master are not the ones of the worker
+                self.metrics.reset()
+                self.run_worker(slot)
+                self.save_metrics()
+            except BaseException as e:
+                code = 1
+                sys.stderr.write(f'worker {os.getpid()} failed: {e}\n')
+            finally:
+                os._exit(code)
+        self.pids[pid] = slot
+        return pid
+
+    def run_worker(self, slot: int):
+        if self.run_mode == 'uvicorn':
+            import uvicorn
+            server = uvicorn.Server(uvicorn.Config(self.app, log_level='warning', timeout_graceful_shutdown=self.grace))
+            async def stop():
+                # the worker stops accepting (the others take the new connections) before it shuts down, which
+                # closes the connections without a request yet, so the ones it just accepted get theirs in
+                for s in server.servers:
+                    s.close()
+                await asyncio.sleep(self.drain)
+                server.should_exit = True
+            async def serve():
+                beat = asyncio.create_task(self.beat(slot))
+                async def on_start():
+                    while not server.started:
+                        await asyncio.sleep(0.01)
+                    loop = asyncio.get_running_loop()
+                    loop.add_signal_handler(signal.SIGTERM, lambda: loop.create_task(stop()))
+                started = asyncio.create_task(on_start())
+                try:
+                    await server.serve(sockets=[self.sock])
+                finally:
+                    beat.cancel()
+                    started.cancel()
+                    await asyncio.gather(beat, started, return_exceptions=True)
+            self.run(serve())
+        elif self.run_mode == 'hypercorn':
+            from hypercorn.config import Config
+            from hypercorn.asyncio import serve
+            config = Config()
+            config.bind = [f'fd://{self.sock.fileno()}']
+            config.graceful_timeout = self.grace
+            async def run():
+                stop = asyncio.Event()
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+                beat = asyncio.create_task(self.beat(slot))
+                try:
+                    await serve(self.app, config, shutdown_trigger=stop.wait)
+                finally:
+                    beat.cancel()
+                    await asyncio.gather(beat, return_exceptions=True)
+            self.run(run())
+        else:
+            raise Exception(f'Unknown mode {self.run_mode} for workers')
+
+    def run(self, coro: Awaitable):
+        # a new loop, the loop inherited from the master shares its epoll with the other workers
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    async def beat(self, slot: int):
+        """
+        The heartbeat of the worker, from its event loop (a blocked loop stops beating)
+        """
+        pid, started = os.getpid(), time.time()
+        while True:
+            requests = sum(entry['latency']['request'].count for entry in list(self.metrics.fns.values()))
+            self.write(slot, pid, started, time.time(), requests)
+            self.save_metrics()
+            await asyncio.sleep(self.heartbeat)
+
+    def write(self, slot: int, pid: int, started: float, heartbeat: float, requests: int):
+        self.slot.pack_into(self.slots, slot * self.slot.size, pid, started, heartbeat, requests)
+
+    def read(self, slot: int) -> dict:
+        pid, started, heartbeat, requests = self.slot.unpack_from(self.slots, slot * self.slot.size)
+        return {'slot': slot, 'pid': pid, 'started': started, 'heartbeat': heartbeat, 'requests': requests}
+
+    # ---- METRICS ----
+
+    def metrics_file(self, name: Union[int, str]) -> str:
+        return os.path.join(self.metrics_path, f'{name}.json')
+
+    def save_metrics(self):
+        """
+        Writes the state of the metrics of the worker in its file
+        """
+        path = self.metrics_file(os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.metrics.state(), f)
+        os.replace(path + '.tmp', path)
+
+    def archive_metrics(self, pid: int):
+        """
+        Adds the metrics of the worker that exited to the archive of the master (without its requests in flight)
+        """
+        path = self.metrics_file(pid)
+        if self.metrics_path is None or not os.path.exists(path):
+            return
+        archive = m.mod('metrics')()
+        for p, inflight in [(self.metrics_file('archive'), True), (path, False)]:
+            if os.path.exists(p):
+                with open(p) as f:
+                    archive.merge(json.load(f), inflight=inflight)
+        with open(self.metrics_file('archive') + '.tmp', 'w') as f:
+            json.dump(archive.state(), f)
+        os.replace(self.metrics_file('archive') + '.tmp', self.metrics_file('archive'))
+        os.remove(path)
+
+    def aggregate(self) -> Any:
+        """
+        The metrics of all the workers: the ones of this worker and the files of the others and of the archive
+        """
+        metrics = m.mod('metrics')(prefix=self.metrics.prefix).merge(self.metrics.state())
+        own = os.path.basename(self.metrics_file(os.getpid()))
+        for name in os.listdir(self.metrics_path):
+            if name.endswith('.json') and name != own:
+                try:
+                    with open(os.path.join(self.metrics_path, name)) as f:
+                        metrics.merge(json.load(f))
+                except (OSError, ValueError): # the worker exited and its file was archived
+                    pass
+        return metrics
+
+    def free_slot(self) -> int:
+        used = set(self.pids.values())
+        return next(slot for slot in range(self.n * 2) if slot not in used)
+
+    def reap(self, pid: int) -> Optional[int]:
+        """
+        Forgets the worker that exited and clears its slot, returns the slot
+        """
+        slot = self.pids.pop(pid, None)
+        if slot is not None:
+            self.write(slot, 0, 0.0, 0.0, 0)
+            self.archive_metrics(pid)
+            for fn in self.on_exit:
+                fn(pid)
+        return slot
+
+    def check(self):
+        """
+        Reaps the workers that exited and replaces them, kills the ones without a recent heartbeat
+        """
+        while self.pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            slot = self.reap(pid)
+            if slot is not None and not self.stopping:
+                print(f'Worker {pid} exited ({status}), replacing it', color='yellow')
+                self.spawn(slot)
+        now = time.time()
+        for pid, slot in list(self.pids.items()):
+            state = self.read(slot)
+            last = state['heartbeat'] if state['pid'] == pid else state['started']
+            if now - last > self.timeout:
+                print(f'Worker {pid} has no heartbeat for {now - last:.1f}s, killing it', color='red')
+                self.kill(pid, signal.SIGKILL)
+
+    def kill(self, pid: int, sig: int = signal.SIGTERM):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def wait(self, pid: int, timeout: float) -> bool:
+        """
+        Waits for the worker to exit (and reaps it), returns whether it did
+        """
+        t0 = time.time()
+        while time.time() - t0 < timeout:
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done == pid:
+                self.reap(pid)
+                return True
+            time.sleep(0.01)
+        return False
+
+    def restart(self) -> List[int]:
+        """
+        Replaces the workers one by one, a worker is stopped once its replacement beats. The restart is aborted
+        (the remaining workers keep running) when a replacement does not beat within timeout.
+        """
+        pids = []
+        for pid in list(self.pids):
+            new = self.spawn(self.free_slot())
+            t0 = time.time()
+            while self.read(self.pids[new])['pid'] != new and time.time() - t0 < self.timeout:
+                if self.wait(new, 0.01): # it exited
+                    break
+                time.sleep(0.01)
+            if new not in self.pids or self.read(self.pids[new])['pid'] != new:
+                print(f'Worker {new} did not start, aborting the restart ({len(pids)} workers restarted)', color='red')
+                if new in self.pids:
+                    self.kill(new, signal.SIGKILL)
+                    self.wait(new, 1)
+                return pids
+            self.kill(pid)
+            if not self.wait(pid, self.grace):
+                self.kill(pid, signal.SIGKILL)
+                self.wait(pid, 1)
+            pids.append(new)
+        print(f'Restarted {len(pids)} workers', color='green')
+        return pids
+
+    def stop(self) -> dict:
+        for pid in list(self.pids):
+            self.kill(pid)
+        t0 = time.time()
+        for pid in list(self.pids):
+            if not self.wait(pid, max(self.grace - (time.time() - t0), 0.1)):
+                self.kill(pid, signal.SIGKILL)
+                self.wait(pid, 1)
+        self.sock.close()
+        shutil.rmtree(self.metrics_path, ignore_errors=True)
+        return {'success': True, 'workers': self.n}
+
+    def health(self) -> List[dict]:
+        """
+        The state of the workers (from their slots): pid, uptime, age of the heartbeat, requests and health
+        """
+        now = time.time()
+        result = []
+        for slot in range(self.n * 2):
+            state = self.read(slot)
+            if state['pid'] == 0:
+                continue
+            age = now - state['heartbeat']
+            result.append({'slot': slot, 'pid': state['pid'], 'uptime': now - state['started'], 'heartbeat_age': age,
+                           'requests': state['requests'], 'healthy': age < self.timeout})
+        return result
@@ -1,4 +1,5 @@
 
+import io
 import json
 import os
 import time
@@ -9,6 +10,7 @@ import mod as m
 class Store:
 
     expose=['get', 'put', 'ls']
+    chunked_size = 1 << 20 # the encrypted payloads from this size are written in the chunked format of the aes key
 
     def __init__(self, path='~/.mod/store',  password = None , filetype='json', private=False):
 
@@ -44,10 +46,41 @@ class Store:
             yaml.dump(data, f)
         
     def put(self, path, data, password=None):
-        self.put_json(path, data)
         if self.private or password != None:
-            self.encrypt(path, password=password)
+            # encrypted in memory (small payloads) or one chunk at a time into the file, never written in clear
+            payload = json.dumps(data).encode()
+            if len(payload) >= self.chunked_size:
+                self.put_chunked(path, payload, password=password)
+            else:
+                self.put_json(path, {'data': self.encrypt_data(data, password=password)})
+            return {'path': path, 'encrypted': True}
+        self.put_json(path, data)
         return {'path': path, 'encrypted': self.is_encrypted(path)}
+
+    def put_chunked(self, path, payload: bytes, password=None) -> str:
+        """
+        Writes the payload encrypted in authenticated chunks (see AesKey.encrypt_stream)
+        """
+        path = self.get_path(path, filetype=self.filetype)
+        self.ensure_path(path)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            self.get_key(password).encrypt_stream(io.BytesIO(payload), f)
+        os.replace(tmp_path, path)
+        return path
+
+    def get_chunked(self, path, password=None):
+        """
+        Reads a payload written by put_chunked
+        """
+        path = self.get_path(path, filetype=self.filetype)
+        payload = io.BytesIO()
+        with open(path, 'rb') as f:
+            self.get_key(password).decrypt_stream(f, payload)
+        return json.loads(payload.getbuffer().tobytes())
+
+    def is_chunked(self, path) -> bool:
+        return self.key.is_encrypted_file(self.get_path(path, filetype=self.filetype))
     
     def shorten_item_path(self, path):
         return path.replace(self.path+'/', '').replace(f'.{self.filetype}', '')
@@ -75,12 +108,14 @@ class Store:
         path = self.get_path(path, filetype=self.filetype)
         if not os.path.exists(path):
             return default
+        if bool(max_age != None and self.get_age(path) > max_age) or update:
+            return default 
+        if self.is_chunked(path):
+            return self.get_chunked(path, password=password)
         if self.filetype == 'json':
             data = self.get_json(path)
         else:
             raise NotImplementedError(f'File type {self.filetype} not implemented')
-        if bool(max_age != None and self.get_age(path) > max_age) or update:
-            return default 
         data = self.validate_data(data)
 
 
@@ -299,18 +334,36 @@ class Store:
         """
         Decrypt a file using the given key
         """
-        obj = self.get_json(path)
-        result = self.decrypt_data(obj, password=password)
+        if self.is_chunked(path):
+            result = self.get_chunked(path, password=password)
+        else:
+            result = self.decrypt_data(self.get_json(path), password=password)
         assert not self.is_encrypted(result), f'Failed to decrypt {path}'
         if save:
             self.put(path, result)
         return result
 
+    def encrypt_file(self, path: str, target: str = None, password=None) -> dict:
+        """
+        Encrypt a file of any size into target (path + '.enc') in authenticated chunks, without loading it in memory
+        """
+        path = self.get_path(path)
+        return self.get_key(password).encrypt_file(path, target=self.get_path(target) if target else None)
+
+    def decrypt_file(self, path: str, target: str = None, password=None) -> dict:
+        """
+        Decrypt a file encrypted with encrypt_file into target (path without '.enc')
+        """
+        path = self.get_path(path)
+        return self.get_key(password).decrypt_file(path, target=self.get_path(target) if target else None)
+
     def is_encrypted(self, path: str= 'test/a') -> bool:
         """
         Check if the file is encrypted using the given key
         """
         if isinstance(path, str):
+            if self.is_chunked(path):
+                return True
             obj = self.get_json(path) 
         else:
             obj = path
@@ -64,6 +64,35 @@ class TestStore:
         store.rm_all()
         return {'success': True, 'msg': 'Passed all tests in private store'}        
 
+    def test_chunked(self, size=3 << 20, key='test_key'):
+        """
+        Test that the large private payloads are written in the chunked format and never in clear
+        """
+        store = m.mod('store')(path='~/.commune/store/test_chunked', password=key, private=True)
+        store.rm_all()
+        large, small = {'text': 'secret' * (size // 6)}, {'text': 'secret'}
+        store.put('large', large)
+        store.put('small', small)
+        assert store.is_chunked('large') and not store.is_chunked('small'), 'only the large payload is chunked'
+        assert store.is_encrypted('large') and store.is_encrypted('small')
+        with open(store.get_path('large', filetype=store.filetype), 'rb') as f:
+            assert b'secret' not in f.read(), 'the payload was written in clear'
+        assert store.get('large') == large and store.get('small') == small
+        # a corrupted chunk is not returned
+        path = store.get_path('large', filetype=store.filetype)
+        with open(path, 'r+b') as f:
+            f.seek(size // 2)
+            byte = f.read(1)
+            f.seek(size // 2)
+            f.write(bytes([byte[0] ^ 1]))
+        try:
+            store.get('large')
+            assert False, 'a corrupted payload was decrypted'
+        except ValueError:
+            pass
+        store.rm_all()
+        return {'success': True, 'size': size}
+
     def test_encrypt_all(self, data={'test': "test", 'fam': 1, "bro": [1,"fam"] }, key='test_key'):
         """
         Test the encrypt all function
@@ -0,0 +1,60 @@
+import os
+import json
+import time
+import tempfile
+import mod as m
+
+class Test:
+
+    def test_run(self, mod='log'):
+        tester = m.mod('tester')()
+        folder = tempfile.mkdtemp()
+        tester.cache_path = folder + '/cache.json'
+        # a slow test is killed at the timeout and the rest of the mod still runs
+        test_fns = tester.test_fns
+        def slow_test_fns(mod):
+            fns = test_fns(mod)
+            def test_slow():
+                time.sleep(60)
+                return {'success': True}
+            fns[0].__self__.test_slow = test_slow
+            return fns[:1] + [test_slow] + fns[1:]
+        tester.test_fns = slow_test_fns
+        t0 = time.time()
+        report = tester.run(mods=[mod], timeout=2, output=folder + '/report.xml', verbose=False)
+        tests = report['mods'][mod]['tests']
+        assert time.time() - t0 < 30
+        assert not tests['test_slow']['success'] and 'timeout' in tests['test_slow']['result']['msg'], tests['test_slow']
+        assert len(tests) > 2 and all(t['success'] for fn, t in tests.items() if fn != 'test_slow'), tests
+        tester.test_fns = test_fns
+        assert '<testcase classname="log" name="test_json"' in open(folder + '/report.xml').read()
+        # a failed mod runs again, a passing one is skipped until it changes
+        report = tester.run(mods=[mod], timeout=60, output=folder + '/report.json', verbose=False)
+        assert report['success'] and not report['mods'][mod]['cached'], report
+        report = tester.run(mods=[mod], timeout=60, verbose=False)
+        assert report['mods'][mod]['cached'] and report['duration'] < 1, report
+        cache = json.load(open(tester.cache_path))
+        cache[mod]['hash'] = 'changed'
+        json.dump(cache, open(tester.cache_path, 'w'))
+        assert not tester.run(mods=[mod], timeout=60, verbose=False)['mods'][mod]['cached']
+        assert json.load(open(folder + '/report.json'))['mods'][mod]['success']
+        return {'success': True, 'tests': {fn: t['duration'] for fn, t in tests.items()}}
+
+    def test_worker_exit(self, mod='log'):
+        tester = m.mod('tester')()
+        tester.cache_path = tempfile.mkdtemp() + '/cache.json'
+        # a worker that exits after its first test, and one that exits before listing its tests
+        def worker(mod, fns, conn):
+            conn.send(('fns', ['test_a', 'test_b']))
+            conn.send(('start', 'test_a'))
+            conn.send(('result', 'test_a', {'success': True, 'duration': 0, 'result': {}}))
+            os._exit(0)
+        tester.worker = worker
+        report = tester.run(mods=[mod], verbose=False)
+        tests = report['mods'][mod]['tests']
+        assert not report['success'] and tests['test_a']['success'] and not tests['test_b']['success'], report
+        tester.worker = lambda mod, fns, conn: os._exit(0)
+        report = tester.run(mods=[mod], verbose=False)
+        assert not report['success'] and not report['mods'][mod]['cached'] and 'error' in report['mods'][mod], report
+        assert not tester.run(mods=[mod], verbose=False)['mods'][mod]['cached']
+        return {'success': True}
@@ -1,5 +1,15 @@
     
+import os
+import sys
+import json
+import time
+import hashlib
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+from typing import *
 import mod as m
+
 class Test:
     description = """
     i test stuff
@@ -9,12 +19,9 @@ class Test:
         Test the mod 
         """
         if mod == None:
-            test_results ={}
             print(f'Testing modules: {modules}')
-            for mod in modules:
-                print(f'Testing mod: {mod}')
-                test_results[mod] = self.forward(mod=mod, timeout=timeout)
-            return test_results
+            report = self.run(mods=modules, timeout=timeout, cache=False)
+            return {mod: {fn: t['result'] for fn, t in r['tests'].items()} for mod, r in report['mods'].items()}
         else:
             fn2result = {}
             fns = self.test_fns(mod)
@@ -40,17 +47,9 @@ class Test:
         return bool('test' in m.fns(mod))
     def test_module(self, mod='mod', timeout=50):
         """
-        Test the mod
+        Test the mod in a worker process (see run)
         """
-        for fn in self.test_fns(test):
-            print(f'Testing({fn})')
-            future = self.submit(getattr(test, fn), timeout=timeout)
-            futures += [future]
-        results = []
-        for future in self.as_completed(futures, timeout=timeout):
-            print(future.result())
-            results += [future.result()]
-        return results
+        return self.run(mods=[mod], timeout=timeout, cache=False)['mods'][mod]
 
     testmod = test_module
 
@@ -86,4 +85,185 @@ class Test:
                 m.print(f'Checking mod: {mod}')
             if self.has_test(mod, verbose=verbose):
                 test_mods.append(mod)
-        return test_mods
\ No newline at end of file
+        return test_mods
+    # ---- RUNNER ----
+
+    cache_path = '~/.mod/tester/cache.json'
+    core_files = ['mod.py', 'utils.py']
+
+    def mod_hash(self, mod:str) -> str:
+        """
+        The sha256 of the files of the mod and of the core files every mod runs on
+        """
+        path = m.dirpath(mod)
+        paths = [os.path.join(m.core_path, f) for f in self.core_files]
+        if path != m.lib_path:
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__pycache__')
+                paths += [os.path.join(root, f) for f in sorted(files) if not f.endswith('.pyc')]
+        h = hashlib.sha256()
+        for p in paths:
+            h.update(os.path.relpath(p, m.lib_path).encode() + b'\0')
+            with open(p, 'rb') as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        return h.hexdigest()
+
+    def worker(self, mod:str, fns:Optional[List[str]], conn):
+        """
+        Runs the tests of the mod (all of them or the fns) in a worker process and sends
+        ('fns', names), ('start', fn) and ('result', fn, result) to the runner
+        """
+        # a test that prompts fails instead of waiting for input
+        sys.stdin = open(os.devnull)
+        try:
+            fn_objs = self.test_fns(mod)
+            obj = fn_objs[0].__self__ if fn_objs else None
+            if fns is None:
+                fns = [fn.__name__ for fn in fn_objs]
+                conn.send(('fns', fns))
+            for fn in fns:
+                conn.send(('start', fn))
+                t0 = time.time()
+                try:
+                    result = getattr(obj, fn)()
+                    success = not m.is_error(result)
+                except Exception as e:
+                    result, success = m.detailed_error(e), False
+                    result['traceback'] = traceback.format_exc()
+                result = json.loads(json.dumps(result, default=str))
+                conn.send(('result', fn, {'success': success, 'duration': time.time() - t0, 'result': result}))
+        except Exception as e:
+            conn.send(('error', m.detailed_error(e)))
+        finally:
+            conn.close()
+
+    def spawn(self, ctx, mod:str, fns:Optional[List[str]]) -> dict:
+        recv_conn, send_conn = ctx.Pipe(duplex=False)
+        process = ctx.Process(target=self.worker, args=(mod, fns, send_conn), daemon=True)
+        process.start()
+        send_conn.close()
+        return {'mod': mod, 'process': process, 'conn': recv_conn, 'fns': fns, 'fn': None, 'start': None}
+
+    def run(self,
+            mods:Optional[List[str]] = None,
+            workers:int = None,
+            timeout:float = 60,
+            cache:bool = True,
+            output:str = None,
+            search:str = None,
+            verbose:bool = True) -> dict:
+        """
+        Runs the tests of the mods in parallel, one worker process per mod (at most workers at a time)
+        timeout: seconds per test, the worker of a test that runs longer is killed and the rest of its mod
+            runs in a new worker
+        cache: skip the mods whose content (mod_hash) did not change since their last passing run
+        output: write the results there, as junit xml if it ends with .xml else as json
+        """
+        mods = mods or self.test_mods(search=search)
+        if isinstance(mods, str):
+            mods = mods.split(',')
+        workers = workers or os.cpu_count() or 1
+        cache_path = os.path.expanduser(self.cache_path)
+        past = m.get_json(cache_path, {}) if cache else {}
+        results = {}
+        pending = []
+        for mod in mods:
+            h = self.mod_hash(mod)
+            if cache and past.get(mod, {}).get('hash') == h and past[mod].get('success'):
+                results[mod] = {**past[mod], 'cached': True}
+                if verbose:
+                    m.print(f'TestCached({mod})', color='yellow')
+            else:
+                results[mod] = {'hash': h, 'cached': False, 'success': False, 'duration': 0, 'tests': {}}
+                pending.append((mod, None))
+        ctx = multiprocessing.get_context('fork')
+        running = []
+        t0 = time.time()
+        while pending or running:
+            while pending and len(running) < workers:
+                running.append(self.spawn(ctx, *pending.pop(0)))
+            ready = wait([w['conn'] for w in running], timeout=0.1)
+            for w in list(running):
+                mod, tests = w['mod'], results[w['mod']]['tests']
+                if w['conn'] in ready:
+                    try:
+                        msg = w['conn'].recv()
+                    except EOFError:
+                        msg = None
+                    if msg is None or msg[0] == 'error':
+                        if w['fn'] is not None:
+                            # the worker died in the test
+                            tests[w['fn']] = {'success': False, 'duration': time.time() - w['start'], 'result': {'error': True, 'msg': 'worker exited'}}
+                        if msg is not None:
+                            results[mod]['error'] = msg[1]
+                        elif w['fns'] is None:
+                            results[mod]['error'] = {'error': True, 'msg': 'worker exited before listing the tests'}
+                        # the tests the worker did not get to fail too, so the mod is not cached as passing
+                        for fn in w['fns'] or []:
+                            if fn not in tests:
+                                tests[fn] = {'success': False, 'duration': 0, 'result': {'error': True, 'msg': 'not run, the worker exited'}}
+                        w['process'].join()
+                        running.remove(w)
+                        continue
+                    if msg[0] == 'fns':
+                        w['fns'] = msg[1]
+                    elif msg[0] == 'start':
+                        w['fn'], w['start'] = msg[1], time.time()
+                    elif msg[0] == 'result':
+                        tests[msg[1]] = msg[2]
+                        w['fn'] = None
+                        if verbose:
+                            m.print(f'TestResult({mod}/{msg[1]} success={msg[2]["success"]} duration={msg[2]["duration"]:.3f}s)', color='green' if msg[2]['success'] else 'red')
+                elif w['fn'] is not None and time.time() - w['start'] > timeout:
+                    w['process'].kill()
+                    w['process'].join()
+                    tests[w['fn']] = {'success': False, 'duration': time.time() - w['start'], 'result': {'error': True, 'msg': f'timeout after {timeout}s'}}
+                    if verbose:
+                        m.print(f'TestTimeout({mod}/{w["fn"]})', color='red')
+                    running.remove(w)
+                    rest = [fn for fn in w['fns'] if fn not in tests]
+                    if rest:
+                        pending.insert(0, (mod, rest))
+        for mod, result in results.items():
+            if not result['cached']:
+                result['success'] = 'error' not in result and all(t['success'] for t in result['tests'].values())
+                result['duration'] = sum(t['duration'] for t in result['tests'].values())
+                past[mod] = result
+        m.put_json(cache_path, past)
+        report = {'success': all(r['success'] for r in results.values()),
+                  'duration': time.time() - t0,
+                  'passed': sum(r['success'] for r in results.values()),
+                  'failed': sum(not r['success'] for r in results.values()),
+                  'cached': sum(r['cached'] for r in results.values()),
+                  'mods': results}
+        if output:
+            self.write_report(report, output)
+        return report
+
+    def write_report(self, report:dict, path:str) -> str:
+        """
+        Writes the report of run as junit xml (path ends with .xml) or json
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if path.endswith('.xml'):
+            import xml.etree.ElementTree as ET
+            suites = ET.Element('testsuites', time=f"{report['duration']:.3f}")
+            for mod, result in report['mods'].items():
+                tests = result['tests']
+                suite = ET.SubElement(suites, 'testsuite', name=mod, tests=str(len(tests)),
+                                      failures=str(sum(not t['success'] for t in tests.values())),
+                                      skipped=str(len(tests) if result['cached'] else 0),
+                                      time=f"{result['duration']:.3f}")
+                for fn, test in tests.items():
+                    case = ET.SubElement(suite, 'testcase', classname=mod, name=fn, time=f"{test['duration']:.3f}")
+                    if result['cached']:
+                        ET.SubElement(case, 'skipped', message='unchanged since the last passing run')
+                    elif not test['success']:
+                        failure = ET.SubElement(case, 'failure', message=str(test['result'].get('msg', test['result']) if isinstance(test['result'], dict) else test['result']))
+                        failure.text = json.dumps(test['result'], indent=2, default=str)
+            ET.ElementTree(suites).write(path, encoding='utf-8', xml_declaration=True)
+        else:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, default=str)
+        return path
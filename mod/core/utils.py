@@ -16,7 +16,7 @@ import requests
 import psutil
 import netaddr
 from loguru import logger
-from typing import Any, Optional, List, Dict, Tuple, Union
+from typing import Any, Optional, List, Dict, Tuple, Union, Callable, Iterable
 import gc
 import asyncio
 import time
@@ -110,12 +110,15 @@ def test_loading_animation():
     with print_load("Testing", duration=3):
         time.sleep(3)
 
+def get_log():
+    from .log.log import Log
+    return Log.default()
+
 def get_console( console = None, **kwargs):
-    import logging
-    from rich.logging import RichHandler
-    from rich.console import Console
-    logging.basicConfig( handlers=[RichHandler()])   
-    return Console()
+    """
+    The console of the process (one rich Console instead of one per call)
+    """
+    return console or get_log().get_console()
 
 def print_console( *text:str, 
             color:str=None, 
@@ -124,28 +127,12 @@ def print_console( *text:str,
             flush:bool = False,
             buffer:str = None,
             **kwargs):
-            
+    """
+    Prints through the log of the process (see Log), kwargs can set the logger and level of the record
+    """
     if not verbose:
         return 
-    if color == 'random':
-        color = random_color()
-    if color:
-        kwargs['style'] = color
-
-    # add the color buffer
-    if color:
-        buffer = f'[{color}]'
-    
-    if buffer != None:
-        text = [buffer] + list(text) + [buffer]
-
-    console = get_console(console)
-    try:
-        if flush:
-            console.print(**kwargs, end='\r')
-        console.print(*text, **kwargs)
-    except Exception as e:
-        print(e)
+    get_log().emit(*text, color=color, console=console, flush=flush, buffer=buffer, **kwargs)
 
 def success( *args, **kwargs):
     logger = resolve_logger()
@@ -2140,14 +2127,85 @@ def get_env(key:str):
     return os.environ.get(key)
 
 def proc(command:str,  *extra_commands, verbose:bool = False, **kwargs):
-    process = subprocess.Popen(re.split(command, *extra_commands), 
-                                stdout=subprocess.PIPE, 
-                                stderr=subprocess.PIPE, 
-                                universal_newlines=True, **kwargs)
-    streamer = stream_output(process, verbose=verbose)
-    return streamer
-
+    return cmd(command, *extra_commands, verbose=verbose, stream=True, **kwargs)
+
+def stream_process(process: 'subprocess.Popen',
+                   chunk_size: int = 1 << 16,
+                   timeout: float = None,
+                   lines: bool = False,
+                   callback: Callable[[str], Any] = None,
+                   verbose: bool = False):
+    """
+    Yields the output of the process as it arrives: os.read of what the pipe holds (up to chunk_size bytes),
+    decoded incrementally so a utf-8 character split between chunks is kept whole.
+    lines: yield whole lines instead of chunks
+    timeout: seconds for the whole command, the process is killed and subprocess.TimeoutExpired raised after it
+    callback: called with every chunk (live output), verbose writes the chunks to stdout
+    """
+    import codecs
+    import selectors
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pipe = process.stdout
+    fd = pipe.fileno()
+    deadline = None if timeout is None else time.time() + timeout
+    selector = selectors.DefaultSelector()
+    selector.register(fd, selectors.EVENT_READ)
+    partial = ''
+    try:
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not selector.select(remaining):
+                    raise subprocess.TimeoutExpired(process.args, timeout)
+            data = os.read(fd, chunk_size)
+            text = decoder.decode(data, final=not data)
+            if text:
+                if callback is not None:
+                    callback(text)
+                if verbose:
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+                if lines:
+                    text = partial + text
+                    cut = text.rfind('\n') + 1
+                    partial = text[cut:]
+                    yield from text[:cut].splitlines(keepends=True)
+                else:
+                    yield text
+            if not data:
+                break
+        if partial:
+            yield partial
+    finally:
+        selector.close()
+        if process.poll() is None:
+            kill_process(process)
+        else:
+            pipe.close()
+            process.wait()
 
+def cmd_args(command: Union[str, list], *args, sudo: bool = False, password: str = None, bash: bool = False,
+             cwd: str = None, env: Dict[str, str] = None) -> Tuple[List[str], str, Dict[str, str]]:
+    """
+    The argv, cwd and env of a command of cmd
+    """
+    if isinstance(command, list):
+        command = ' '.join(command)
+    if args:
+        command = ' '.join([command] + list(map(str, args)))
+    # Handle sudo
+    if password is not None:
+        sudo = True
+    if sudo:
+        command = f'sudo {command}'
+    # Handle bash execution
+    if bash:
+        command = f'bash -"{command}"'
+    # Handle working directory
+    cwd = os.getcwd() if cwd is None else abspath(cwd)
+    # Handle environment variables
+    env = {**os.environ, **(env or {})}
+    return shlex_split(command), cwd, env
 
 def cmd(
     command: Union[str, list],
@@ -2161,63 +2219,24 @@ def cmd(
     stream: bool = False,
     color: str = 'white',
     cwd: str = None,
+    timeout: float = None,
+    lines: bool = False,
+    callback: Callable[[str], Any] = None,
+    max_output: int = None,
+    chunk_size: int = 1 << 16,
     **kwargs
 ) -> 'subprocess.Popen':
     """
     Execute a shell command with various options and handle edge cases.
+    stdout and stderr are merged in the order the process writes them. stream returns the generator of
+    the output (chunks, or lines with lines=True), otherwise the output is returned as text, only the
+    last max_output characters of it if max_output is set. See stream_process for timeout and callback.
     """
-    import mod as m
-    def stream_output(process, verbose=verbose):
-        """Stream output from process pipes."""
-        try:
-            modes = ['stdout', 'stderr']
-            for mode in modes:
-                pipe = getattr(process, mode)
-                if pipe is None:
-                    continue
-                
-                # Read bytewise
-                while True:
-                    ch = pipe.read(1)
-                    if not ch:
-                        break
-                    try:
-                        ch_decoded = ch.decode('utf-8')
-                        if verbose:
-                            print(ch_decoded, end='', flush=True)
-                        yield ch_decoded
-                    except UnicodeDecodeError:
-                        continue
-        finally:
-            kill_process(process)
-
     try:
-        # Handle command construction
-        if isinstance(command, list):
-            command = ' '.join(command)
-        
-        if args:
-            command = ' '.join([command] + list(map(str, args)))
-
-        # Handle sudo
-        if password is not None:
-            sudo = True
-        if sudo:
-            command = f'sudo {command}'
-        # Handle bash execution
-        if bash:
-            command = f'bash -"{command}"'
-        # Handle working directory
-        cwd = os.getcwd() if cwd is None else abspath(cwd)
-        # Handle environment variables
-        if env is None:
-            env = {}
-        env = {**os.environ, **env}
-
-
+        argv, cwd, env = cmd_args(command, *args, sudo=sudo, password=password, bash=bash, cwd=cwd, env=env)
         # Create process
         process = subprocess.Popen(
-            shlex_split(command),
+            argv,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             cwd=cwd,
@@ -2229,22 +2248,92 @@ def cmd(
             return process
 
         # Handle output streaming
-        streamer = stream_output(process)
+        streamer = stream_process(process, chunk_size=chunk_size, timeout=timeout, lines=lines, callback=callback, verbose=verbose)
 
         if stream:
             return streamer
         else:
             # Collect all output
-            text = ''
-            for ch in streamer:
-                text += ch
-            return text
+            return collect_output(streamer, max_output=max_output)
 
     except Exception as e:
         if verbose:
             print(f"Error executing command: {str(e)}")
         raise
 
+def collect_output(chunks: Iterable[str], max_output: int = None) -> str:
+    """
+    Joins the chunks, keeping only the last max_output characters (bounded memory) if it is set
+    """
+    if max_output is None:
+        return ''.join(chunks)
+    from collections import deque
+    kept, size = deque(), 0
+    for chunk in chunks:
+        kept.append(chunk)
+        size += len(chunk)
+        while len(kept) > 1 and size - len(kept[0]) >= max_output:
+            size -= len(kept.popleft())
+    return ''.join(kept)[-max_output:] if max_output > 0 else ''
+
+async def acmd(
+    command: Union[str, list],
+    *args,
+    verbose: bool = False,
+    env: Dict[str, str] = None,
+    sudo: bool = False,
+    password: str = None,
+    bash: bool = False,
+    cwd: str = None,
+    timeout: float = None,
+    callback: Callable[[str], Any] = None,
+    max_output: int = None,
+    chunk_size: int = 1 << 16,
+    **kwargs
+) -> str:
+    """
+    The asyncio version of cmd, to run commands concurrently (asyncio.gather(acmd(a), acmd(b)))
+    """
+    import codecs
+    argv, cwd, env = cmd_args(command, *args, sudo=sudo, password=password, bash=bash, cwd=cwd, env=env)
+    process = await asyncio.create_subprocess_exec(*argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd, env=env, **kwargs)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    async def chunks():
+        while True:
+            data = await process.stdout.read(chunk_size)
+            text = decoder.decode(data, final=not data)
+            if text:
+                if callback is not None:
+                    callback(text)
+                if verbose:
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+                yield text
+            if not data:
+                break
+
+    async def collect():
+        from collections import deque
+        kept, size = deque(), 0
+        async for chunk in chunks():
+            kept.append(chunk)
+            size += len(chunk)
+            while max_output is not None and len(kept) > 1 and size - len(kept[0]) >= max_output:
+                size -= len(kept.popleft())
+        await process.wait()
+        text = ''.join(kept)
+        return text if max_output is None else text[-max_output:] if max_output > 0 else ''
+
+    try:
+        return await asyncio.wait_for(collect(), timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(argv, timeout)
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
 
     
 def loadenv():